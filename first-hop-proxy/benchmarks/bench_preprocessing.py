@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+"""Benchmark the fused message preprocessing pass against the old multi-pass sequence
+
+Builds recap-style requests (a large system prompt full of <setting_lore>
+entries, an ST_METADATA block and a long chat history) and times both
+pipelines, including the character/chat info lookup done per request. It
+also times the next request of the same chat (history plus one new message)
+with the per-message transform cache warmed by the previous request.
+
+Usage:
+    python benchmarks/bench_preprocessing.py [--prompt-chars 150000] [--messages 200] [--rounds 20] [--no-rules]
+"""
+
+import argparse
+import copy
+import json
+import os
+import random
+import sys
+import time
+
+# Add src to path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from first_hop_proxy.preprocessing import preprocess_messages, MessageTransformCache
+from first_hop_proxy.utils import (
+    compile_regex_rules,
+    RegexRuleSet,
+    process_messages_with_regex,
+    extract_character_chat_info,
+    extract_st_metadata_from_messages,
+    extract_lorebook_entries_from_messages,
+    strip_lorebook_attributes_from_messages,
+    resolve_character_chat_info
+)
+
+WORDS = "the captain watched harbor lantern storm rope deck quietly whispered ancient map north tide".split()
+
+RULES = [
+    {"pattern": r"\{\{user\}\}", "replacement": "Anon", "apply_to": "all"},
+    {"pattern": r"[ \t]+$", "replacement": "", "flags": "m", "apply_to": "all"},
+    {"pattern": r"\*\*", "replacement": "", "apply_to": "assistant"},
+]
+
+
+def _prose(rng, length):
+    """Random prose of roughly the given length"""
+    words = []
+    size = 0
+    while size < length:
+        word = rng.choice(WORDS)
+        words.append(word)
+        size += len(word) + 1
+    return " ".join(words)
+
+
+def build_recap_request(prompt_chars, message_count, seed=0):
+    """Build a recap-style chat completion body"""
+    rng = random.Random(seed)
+    metadata = {"version": "1.0", "character": "Senta", "chat": "Senta - 2025-11-01@20h29m24s",
+                "operation": "scene_recap"}
+
+    lore = []
+    size = 0
+    uid = 0
+    while size < prompt_chars:
+        entry = (f'<setting_lore name="entry-{uid}" uid="{uid}" world="z-AutoLB-Senta" position="4" '
+                 f'order="{900 + uid}" depth="4" role="0" keys="key{uid}">\n{_prose(rng, 600)}\n</setting_lore>\n')
+        lore.append(entry)
+        size += len(entry)
+        uid += 1
+
+    messages = [{"role": "system", "content": "<ST_METADATA>\n" + json.dumps(metadata, indent=2) +
+                 "\n</ST_METADATA>\n" + "".join(lore)}]
+    for i in range(message_count):
+        role = "user" if i % 2 == 0 else "assistant"
+        messages.append({"role": role, "content": "{{user}} " + _prose(rng, 800) + "  \n**" + _prose(rng, 200) + "**"})
+    messages.append({"role": "user", "content": "<ST_METADATA>\n" + json.dumps(dict(metadata, operation="chat")) +
+                     "\n</ST_METADATA>\nWrite a recap of the scene."})
+    return {"model": "recap-model", "messages": messages}
+
+
+def legacy_pipeline(request_data, rules):
+    """The sequence chat_completions ran before the fused pass"""
+    original_request_data = copy.deepcopy(request_data)
+    request_data = request_data.copy()
+    request_data["messages"] = process_messages_with_regex(request_data["messages"], rules)
+    lorebook_entries = extract_lorebook_entries_from_messages(original_request_data["messages"])
+    all_metadata, _ = extract_st_metadata_from_messages(original_request_data["messages"])
+    if all_metadata:
+        _, request_data["messages"] = extract_st_metadata_from_messages(request_data["messages"])
+    if lorebook_entries:
+        request_data["messages"] = strip_lorebook_attributes_from_messages(request_data["messages"])
+    character_chat_info = extract_character_chat_info({}, original_request_data)
+    return request_data["messages"], all_metadata, lorebook_entries, character_chat_info
+
+
+def fused_pipeline(request_data, rules):
+    """The fused single-pass preprocessing"""
+    result = preprocess_messages(request_data["messages"], rules)
+    return result.messages, result.metadata, result.lorebook_entries, resolve_character_chat_info(result.metadata)
+
+
+def cached_next_turn(request_data, rules, rounds):
+    """Best and mean time for the next chat turn with a warm MessageTransformCache"""
+    rule_set = RegexRuleSet(rules)
+    timings = []
+    for _ in range(rounds):
+        cache = MessageTransformCache()
+        preprocess_messages(request_data["messages"], rule_set, cache=cache)
+        # Every request is parsed from JSON, so the history arrives as new string objects
+        next_turn = json.loads(json.dumps(request_data))
+        next_turn["messages"].append({"role": "user", "content": "Continue the recap with the next scene."})
+        start = time.perf_counter()
+        preprocess_messages(next_turn["messages"], rule_set, cache=cache)
+        timings.append(time.perf_counter() - start)
+    return min(timings), sum(timings) / len(timings)
+
+
+def _time(func, request_data, rules, rounds):
+    """Best and mean wall time over rounds"""
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func(request_data, rules)
+        timings.append(time.perf_counter() - start)
+    return min(timings), sum(timings) / len(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--prompt-chars", type=int, default=150000, help="size of the lorebook system prompt")
+    parser.add_argument("--messages", type=int, default=200, help="number of chat history messages")
+    parser.add_argument("--rounds", type=int, default=20, help="timed rounds per pipeline")
+    parser.add_argument("--no-rules", action="store_true", help="benchmark without regex replacement rules")
+    args = parser.parse_args()
+
+    rules = () if args.no_rules else compile_regex_rules(RULES)
+    request_data = build_recap_request(args.prompt_chars, args.messages)
+    total_chars = sum(len(m["content"]) for m in request_data["messages"])
+
+    if legacy_pipeline(request_data, rules) != fused_pipeline(request_data, rules):
+        print("ERROR: fused pipeline output differs from the legacy pipeline")
+        return 1
+
+    print("=" * 80)
+    print(f"Preprocessing benchmark: {len(request_data['messages'])} messages, {total_chars:,} characters, "
+          f"{len(rules)} regex rules")
+    print("=" * 80)
+    legacy_best, legacy_mean = _time(legacy_pipeline, request_data, rules, args.rounds)
+    fused_best, fused_mean = _time(fused_pipeline, request_data, rules, args.rounds)
+    print(f"legacy multi-pass: best {legacy_best * 1000:8.2f}ms  mean {legacy_mean * 1000:8.2f}ms")
+    print(f"fused single-pass: best {fused_best * 1000:8.2f}ms  mean {fused_mean * 1000:8.2f}ms")
+    print(f"speedup (best): {legacy_best / fused_best:.2f}x")
+    cached_best, cached_mean = cached_next_turn(request_data, rules, args.rounds)
+    print(f"fused + cache, next turn: best {cached_best * 1000:8.2f}ms  mean {cached_mean * 1000:8.2f}ms")
+    print(f"speedup vs legacy (best): {legacy_best / cached_best:.2f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
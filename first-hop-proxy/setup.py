@@ -42,6 +42,10 @@ setup(
             "pytest-timeout>=2.0",
             "pytest-cov>=3.0",
         ],
+        "async": [
+            "httpx>=0.24",
+            "uvicorn>=0.22",
+        ],
     },
     entry_points={
         "console_scripts": [
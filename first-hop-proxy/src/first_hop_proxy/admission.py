@@ -0,0 +1,478 @@
+"""
+Admission control for upstream calls
+
+Every chat completion holds an admission slot from just before its first
+upstream attempt until its last one ends, including retry backoff and, for
+event streams, until the stream is fully relayed. Slots are limited
+globally (admission.max_in_flight) and per config file (that config's
+admission.per_config_max_in_flight). Requests that find no free slot wait
+in a bounded queue; when the queue is full, or a request has waited
+max_queue_time seconds, it is rejected with AdmissionRejected, which the
+endpoints answer with 503 and Retry-After.
+
+Waiting requests are scheduled by the ST_METADATA operation they carry.
+Each operation maps to a priority class (admission.priority_classes) with
+its own queue and weight. Freed slots go to classes by stride scheduling,
+so with both queues busy an interactive class of weight 16 gets 16 slots
+for every one of a background class of weight 1, and a class that was idle
+does not bank credit. A request that has waited starvation_timeout seconds
+is served before any class share is considered.
+
+Within a class, waiters are grouped per chat, the (character, chat) pair of
+their ST_METADATA, and the chats take turns: each grant moves the chat to the
+back of the rotation, so a recap pipeline that queued fifty requests gets
+one slot per turn like every other waiting chat. This is deficit round robin
+with every request costing one slot. admission.per_chat_max_in_flight also
+caps how many slots one chat may hold at once.
+
+The queue is shared by both serving engines: threads block on an Event,
+coroutines on a future resolved through their event loop.
+"""
+import time
+import fnmatch
+import asyncio
+import threading
+import logging
+from collections import deque, OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+
+from .metrics import get_metrics, config_label
+
+logger = logging.getLogger(__name__)
+
+REJECT_QUEUE_FULL = "queue_full"
+REJECT_QUEUE_TIMEOUT = "queue_timeout"
+
+# Interactive generations ahead of background recap and lorebook work. The
+# extension suffixes operations (e.g. detect_scene_break_FORCED), hence the globs
+DEFAULT_PRIORITY_CLASSES = {
+    "interactive": {"weight": 16, "operations": ["chat"]},
+    "standard": {"weight": 4, "operations": []},
+    "background": {"weight": 1, "operations": [
+        "detect_scene_break*", "validate_recap*", "*scene_recap*", "*running*", "recap_merge*", "*lorebook*",
+        "populate_registries*", "bulk_populate*",
+    ]},
+}
+DEFAULT_PRIORITY_CLASS = "standard"
+
+# Distinct operation strings remembered by the class lookup cache
+MAX_CACHED_OPERATIONS = 1024
+
+# (character, chat) of a request; None for requests without ST_METADATA
+ChatKey = Optional[Tuple[str, str]]
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot get an upstream slot"""
+
+    def __init__(self, reason: str, retry_after: float, queue_depth: int):
+        super().__init__(f"Proxy is overloaded ({reason}, {queue_depth} requests queued)")
+        self.reason = reason
+        self.retry_after = retry_after
+        self.queue_depth = queue_depth
+
+
+class _Waiter:
+    """A queued request; woken by the releasing thread once it holds a slot"""
+
+    __slots__ = ("scope", "scope_limit", "chat", "priority_class", "enqueued_at", "granted", "_event", "_loop",
+                 "_future")
+
+    def __init__(self, scope: Optional[str], scope_limit: Optional[int], chat: ChatKey,
+                 priority_class: "_PriorityClass", loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.scope = scope
+        self.scope_limit = scope_limit
+        self.chat = chat
+        self.priority_class = priority_class
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+        self._loop = loop
+        if loop is None:
+            self._event = threading.Event()
+            self._future = None
+        else:
+            self._event = None
+            self._future = loop.create_future()
+
+    def wake(self) -> None:
+        """Tell the waiting thread or coroutine it was granted a slot (called with the lock held)"""
+        if self._event is not None:
+            self._event.set()
+        else:
+            self._loop.call_soon_threadsafe(_resolve, self._future)
+
+
+def _resolve(future: "asyncio.Future") -> None:
+    if not future.done():
+        future.set_result(True)
+
+
+class _PriorityClass:
+    """Per-chat queues and stride-scheduling state of one priority class"""
+
+    __slots__ = ("name", "weight", "chats", "queued", "pass_value", "admitted", "total_wait")
+
+    def __init__(self, name: str, weight: float):
+        if weight <= 0:
+            raise ValueError(f"Priority class {name!r} needs a positive weight, got {weight!r}")
+        self.name = name
+        self.weight = float(weight)
+        # Chat -> its waiters in arrival order; iteration order is the round-robin rotation
+        self.chats: "OrderedDict[ChatKey, deque]" = OrderedDict()
+        self.queued = 0
+        # Virtual time of this class's next grant; advances by 1/weight per grant
+        self.pass_value = 0.0
+        self.admitted = 0
+        self.total_wait = 0.0
+
+    def append(self, waiter: _Waiter) -> None:
+        """Queue a waiter behind earlier waiters of its chat"""
+        waiters = self.chats.get(waiter.chat)
+        if waiters is None:
+            waiters = self.chats[waiter.chat] = deque()
+        waiters.append(waiter)
+        self.queued += 1
+
+    def remove(self, waiter: _Waiter, granted: bool = False) -> bool:
+        """Drop a waiter; a granted one also sends its chat to the back of the rotation"""
+        waiters = self.chats.get(waiter.chat)
+        if waiters is None or waiter not in waiters:
+            return False
+        waiters.remove(waiter)
+        self.queued -= 1
+        if not waiters:
+            del self.chats[waiter.chat]
+        elif granted:
+            self.chats.move_to_end(waiter.chat)
+        return True
+
+    def oldest(self) -> Optional[float]:
+        """Enqueue time of the longest-waiting request"""
+        return min((waiters[0].enqueued_at for waiters in self.chats.values()), default=None)
+
+    def fitting_heads(self, fits) -> List[_Waiter]:
+        """Each chat's oldest waiter that can take a slot now, in rotation order"""
+        heads = []
+        for waiters in self.chats.values():
+            for waiter in waiters:
+                if fits(waiter.scope, waiter.scope_limit, waiter.chat):
+                    heads.append(waiter)
+                    break
+        return heads
+
+
+class AdmissionTicket:
+    """A granted slot; release() once the request's upstream work is over (repeat calls are ignored)"""
+
+    __slots__ = ("controller", "scope", "chat", "priority_class", "waited", "_released")
+
+    def __init__(self, controller: "AdmissionController", scope: Optional[str], chat: ChatKey,
+                 priority_class: str, waited: float):
+        self.controller = controller
+        self.scope = scope
+        self.chat = chat
+        self.priority_class = priority_class
+        self.waited = waited
+        self._released = False
+
+    def release(self) -> None:
+        """Return the slot and admit the next queued request that fits"""
+        if self._released:
+            return
+        self._released = True
+        self.controller._release(self.scope, self.chat)
+
+
+class AdmissionController:
+    """Limits in-flight upstream work globally and per config, queueing the overflow"""
+
+    def __init__(self, max_in_flight: int = 64, max_queue: int = 256, max_queue_time: float = 30.0,
+                 retry_after: float = 5.0, priority_classes: Optional[Dict[str, Dict[str, Any]]] = None,
+                 default_priority_class: str = DEFAULT_PRIORITY_CLASS, starvation_timeout: float = 20.0,
+                 per_chat_max_in_flight: Optional[int] = None):
+        """
+        Initialize controller.
+
+        Args:
+            max_in_flight: Requests allowed upstream at once across all configs
+            max_queue: Requests allowed to wait for a slot (0 rejects immediately when full)
+            max_queue_time: Seconds a request may wait before it is rejected
+            retry_after: Seconds suggested to rejected clients (Retry-After header)
+            priority_classes: {class: {"weight": w, "operations": [names or glob patterns]}}
+            default_priority_class: Class of operations not listed (and requests without ST_METADATA)
+            starvation_timeout: Seconds after which a waiter is served regardless of class shares
+            per_chat_max_in_flight: Slots one chat may hold at once (None or 0 for no limit)
+        """
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.max_queue_time = max_queue_time
+        self.retry_after = retry_after
+        self.starvation_timeout = starvation_timeout
+        self.per_chat_max_in_flight = per_chat_max_in_flight
+
+        priority_classes = priority_classes if priority_classes is not None else DEFAULT_PRIORITY_CLASSES
+        self._classes: Dict[str, _PriorityClass] = {
+            name: _PriorityClass(name, (spec or {}).get("weight", 1)) for name, spec in priority_classes.items()
+        }
+        if default_priority_class not in self._classes:
+            self._classes[default_priority_class] = _PriorityClass(default_priority_class, 1)
+        self.default_priority_class = default_priority_class
+        self._operation_patterns: List[tuple] = [
+            (pattern, name) for name, spec in priority_classes.items()
+            for pattern in (spec or {}).get("operations", []) or []
+        ]
+        self._operation_classes: Dict[Optional[str], _PriorityClass] = {}
+        self._virtual_time = 0.0
+
+        self._lock = threading.Lock()
+        self._queued_now = 0
+        self._in_flight = 0
+        self._scope_in_flight: Dict[Optional[str], int] = {}
+        self._chat_in_flight: Dict[ChatKey, int] = {}
+
+        self._admitted = 0
+        self._queued = 0
+        self._rejected = {REJECT_QUEUE_FULL: 0, REJECT_QUEUE_TIMEOUT: 0}
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    @classmethod
+    def from_config(cls, admission_config: Optional[Dict[str, Any]]) -> "AdmissionController":
+        """Build a controller from the admission configuration section"""
+        admission_config = admission_config or {}
+        return cls(
+            max_in_flight=admission_config.get("max_in_flight", 64),
+            max_queue=admission_config.get("max_queue", 256),
+            max_queue_time=admission_config.get("max_queue_time", 30.0),
+            retry_after=admission_config.get("retry_after", 5.0),
+            priority_classes=admission_config.get("priority_classes"),
+            default_priority_class=admission_config.get("default_priority_class", DEFAULT_PRIORITY_CLASS),
+            starvation_timeout=admission_config.get("starvation_timeout", 20.0),
+            per_chat_max_in_flight=admission_config.get("per_chat_max_in_flight"),
+        )
+
+    def class_for(self, operation: Optional[str]) -> str:
+        """Name of the priority class an ST_METADATA operation is scheduled in"""
+        return self._class_for(operation).name
+
+    def _class_for(self, operation: Optional[str]) -> _PriorityClass:
+        priority_class = self._operation_classes.get(operation)
+        if priority_class is None:
+            name = self.default_priority_class
+            if operation:
+                for pattern, class_name in self._operation_patterns:
+                    if operation == pattern or fnmatch.fnmatchcase(operation, pattern):
+                        name = class_name
+                        break
+            priority_class = self._classes[name]
+            if len(self._operation_classes) >= MAX_CACHED_OPERATIONS:
+                self._operation_classes.clear()
+            self._operation_classes[operation] = priority_class
+        return priority_class
+
+    def _fits(self, scope: Optional[str], scope_limit: Optional[int], chat: ChatKey = None) -> bool:
+        """Whether a request for scope and chat can take a slot now (lock held)"""
+        if self._in_flight >= self.max_in_flight:
+            return False
+        if scope_limit and self._scope_in_flight.get(scope, 0) >= scope_limit:
+            return False
+        return (chat is None or not self.per_chat_max_in_flight
+                or self._chat_in_flight.get(chat, 0) < self.per_chat_max_in_flight)
+
+    def _take(self, scope: Optional[str], chat: ChatKey, priority_class: _PriorityClass,
+              waited: float) -> AdmissionTicket:
+        """Occupy a slot and record the wait (lock held)"""
+        self._in_flight += 1
+        self._scope_in_flight[scope] = self._scope_in_flight.get(scope, 0) + 1
+        self._chat_in_flight[chat] = self._chat_in_flight.get(chat, 0) + 1
+        self._admitted += 1
+        self._total_wait += waited
+        self._max_wait = max(self._max_wait, waited)
+        priority_class.admitted += 1
+        priority_class.total_wait += waited
+        return AdmissionTicket(self, scope, chat, priority_class.name, waited)
+
+    def _enqueue(self, scope: Optional[str], scope_limit: Optional[int], operation: Optional[str],
+                 chat: ChatKey = None, loop: Optional[asyncio.AbstractEventLoop] = None):
+        """Admit immediately, queue, or reject (lock held); returns a ticket or a waiter"""
+        priority_class = self._class_for(operation)
+        # Queued requests are only left waiting when their config or chat is at its
+        # limit, so a request that fits now does not overtake anyone it competes with
+        if self._fits(scope, scope_limit, chat):
+            return self._take(scope, chat, priority_class, 0.0)
+        if self._queued_now >= self.max_queue:
+            raise self._reject(REJECT_QUEUE_FULL, scope)
+        if not priority_class.queued:
+            # A class that was idle rejoins at the current virtual time instead of with banked credit
+            priority_class.pass_value = max(priority_class.pass_value, self._virtual_time)
+        waiter = _Waiter(scope, scope_limit, chat, priority_class, loop)
+        priority_class.append(waiter)
+        self._queued_now += 1
+        self._queued += 1
+        return waiter
+
+    def _dequeue(self, waiter: _Waiter, granted: bool = False) -> bool:
+        """Remove a waiter from its class queue (lock held); False if it was not queued"""
+        if not waiter.priority_class.remove(waiter, granted):
+            return False
+        self._queued_now -= 1
+        return True
+
+    def _pick_next(self, now: float) -> Optional[_Waiter]:
+        """Choose the waiter that gets the next free slot (lock held)"""
+        candidates = []
+        starving = []
+        for priority_class in self._classes.values():
+            heads = priority_class.fitting_heads(self._fits)
+            if heads:
+                # The chat at the front of the class's rotation
+                candidates.append(heads[0])
+                starving.extend(waiter for waiter in heads if now - waiter.enqueued_at >= self.starvation_timeout)
+        if starving:
+            return min(starving, key=lambda waiter: waiter.enqueued_at)
+        if not candidates:
+            return None
+        return min(candidates, key=lambda waiter: (waiter.priority_class.pass_value,
+                                                   -waiter.priority_class.weight, waiter.enqueued_at))
+
+    def _reject(self, reason: str, scope: Optional[str]) -> AdmissionRejected:
+        """Count a rejection and build the exception (lock held)"""
+        self._rejected[reason] += 1
+        get_metrics().record_admission_rejection(reason)
+        logger.warning(f"Admission rejected ({reason}) for config {config_label(scope)}: "
+                       f"{self._in_flight} in flight, {self._queued_now} queued")
+        return AdmissionRejected(reason, self.retry_after, self._queued_now)
+
+    def _finish_wait(self, waiter: _Waiter) -> AdmissionTicket:
+        """Resolve a wait that ended by wake-up or timeout"""
+        with self._lock:
+            if waiter.granted:
+                return AdmissionTicket(self, waiter.scope, waiter.chat, waiter.priority_class.name,
+                                       time.monotonic() - waiter.enqueued_at)
+            self._dequeue(waiter)
+            raise self._reject(REJECT_QUEUE_TIMEOUT, waiter.scope)
+
+    def _abandon(self, waiter: _Waiter) -> None:
+        """Drop a waiter whose caller went away, returning its slot if it had one"""
+        with self._lock:
+            if not waiter.granted:
+                self._dequeue(waiter)
+                return
+        self._release(waiter.scope, waiter.chat)
+
+    def acquire(self, scope: Optional[str] = None, scope_limit: Optional[int] = None,
+                operation: Optional[str] = None, chat: ChatKey = None) -> AdmissionTicket:
+        """
+        Wait for a slot in the calling thread.
+
+        Args:
+            scope: Config file of the request (None for the default config)
+            scope_limit: Slots allowed for that config (None or 0 for no per-config limit)
+            operation: ST_METADATA operation, which selects the priority class
+            chat: (character, chat) of the request, for per-chat turns and limits
+
+        Returns:
+            AdmissionTicket to release when the request's upstream work ends
+
+        Raises:
+            AdmissionRejected: If the queue is full or the wait exceeds max_queue_time
+        """
+        with self._lock:
+            entry = self._enqueue(scope, scope_limit, operation, chat)
+        if isinstance(entry, AdmissionTicket):
+            return entry
+        entry._event.wait(self.max_queue_time)
+        return self._finish_wait(entry)
+
+    async def acquire_async(self, scope: Optional[str] = None, scope_limit: Optional[int] = None,
+                            operation: Optional[str] = None, chat: ChatKey = None) -> AdmissionTicket:
+        """Coroutine variant of acquire() that waits without blocking the event loop"""
+        with self._lock:
+            entry = self._enqueue(scope, scope_limit, operation, chat, asyncio.get_running_loop())
+        if isinstance(entry, AdmissionTicket):
+            return entry
+        try:
+            await asyncio.wait_for(asyncio.shield(entry._future), self.max_queue_time)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            self._abandon(entry)
+            raise
+        return self._finish_wait(entry)
+
+    def _release(self, scope: Optional[str], chat: ChatKey = None) -> None:
+        """Free a slot and hand freed capacity to queued requests by class share and chat turn"""
+        with self._lock:
+            self._in_flight -= 1
+            for counts, key in ((self._scope_in_flight, scope), (self._chat_in_flight, chat)):
+                remaining = counts.get(key, 1) - 1
+                if remaining:
+                    counts[key] = remaining
+                else:
+                    counts.pop(key, None)
+
+            now = time.monotonic()
+            while self._in_flight < self.max_in_flight:
+                waiter = self._pick_next(now)
+                if waiter is None:
+                    break
+                priority_class = waiter.priority_class
+                self._virtual_time = max(self._virtual_time, priority_class.pass_value)
+                priority_class.pass_value += 1.0 / priority_class.weight
+                self._dequeue(waiter, granted=True)
+                self._take(waiter.scope, waiter.chat, priority_class, now - waiter.enqueued_at)
+                waiter.granted = True
+                waiter.wake()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return slot usage, queue depth and wait times for health reporting"""
+        with self._lock:
+            oldest = min((priority_class.oldest() for priority_class in self._classes.values()
+                          if priority_class.queued), default=None)
+            return {
+                "enabled": True,
+                "in_flight": self._in_flight,
+                "max_in_flight": self.max_in_flight,
+                "in_flight_by_config": {config_label(scope): count
+                                        for scope, count in self._scope_in_flight.items()},
+                "chats_in_flight": sum(1 for chat in self._chat_in_flight if chat is not None),
+                "queue_depth": self._queued_now,
+                "max_queue": self.max_queue,
+                "oldest_wait": round(time.monotonic() - oldest, 3) if oldest is not None else 0.0,
+                "admitted": self._admitted,
+                "queued": self._queued,
+                "rejected": dict(self._rejected),
+                "avg_wait": round(self._total_wait / self._admitted, 3) if self._admitted else 0.0,
+                "max_wait": round(self._max_wait, 3),
+                "priority_classes": {
+                    name: {
+                        "weight": priority_class.weight,
+                        "queue_depth": priority_class.queued,
+                        "chats_waiting": len(priority_class.chats),
+                        "admitted": priority_class.admitted,
+                        "avg_wait": round(priority_class.total_wait / priority_class.admitted, 3)
+                        if priority_class.admitted else 0.0,
+                    }
+                    for name, priority_class in self._classes.items()
+                },
+            }
+
+
+# Process-wide controller shared by both serving engines (None when admission control is off)
+_admission_lock = threading.Lock()
+_admission: Optional[AdmissionController] = None
+
+
+def get_admission_controller() -> Optional[AdmissionController]:
+    """Return the process-wide admission controller, or None if admission control is disabled"""
+    return _admission
+
+
+def configure_admission(admission_config: Optional[Dict[str, Any]]) -> Optional[AdmissionController]:
+    """Replace the process-wide admission controller (None when admission.enabled is false)"""
+    global _admission
+    admission_config = admission_config or {}
+    new_controller = AdmissionController.from_config(admission_config) if admission_config.get("enabled") else None
+    with _admission_lock:
+        _admission = new_controller
+    return new_controller
@@ -0,0 +1,828 @@
+"""
+Asyncio/ASGI serving engine for First Hop Proxy
+
+Serves the same routes as the Flask app (/health, /health/detailed, /metrics,
+/logs/query, /models, /<config>/models, /chat/completions, /<config>/chat/completions) without holding
+an OS thread per in-flight request: upstream calls go through httpx.AsyncClient,
+retry backoff uses asyncio.sleep and log file writes run in the default executor.
+
+Run with ``server.engine: asyncio`` in config.yaml, or directly:
+``uvicorn first_hop_proxy.asgi:app`` (lifespan startup then sets up the
+process-wide state from config.yaml, as run_server does otherwise)
+"""
+import re
+import json
+import time
+import uuid
+import asyncio
+import logging
+import functools
+from typing import Dict, Any, Optional, List, Tuple, Callable
+from urllib.parse import unquote, parse_qsl
+
+from .config import Config
+from .async_client import create_async_http_client, require_httpx, httpx
+from .streaming import AsyncSSEStreamRelay, SSE_RESPONSE_HEADERS
+from .preprocessing import get_message_cache
+from .log_writer import get_log_writer
+from .log_sequence import get_log_sequence
+from .log_index import get_log_index, run_log_query
+from .metrics import get_metrics, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from .tracing import get_tracer
+from .admission import AdmissionRejected, get_admission_controller
+from .circuit_breaker import CircuitOpenError, get_circuit_breakers
+from .rate_limit import RateLimitExceeded, get_rate_limiter
+from .concurrency_limit import get_concurrency_limits
+from .hedging import get_hedger
+from .singleflight import get_singleflight
+from .response_cache import cache_control, get_response_cache, is_cacheable_reply
+from .models_cache import etag_matches
+from .upstream_pool import UpstreamSelection
+from .utils import extract_character_chat_info, resolve_character_chat_info
+from .constants import DEFAULT_MODELS
+from .main import (
+    config as default_config,
+    get_loggers_for_config,
+    get_config_name_from_path,
+    load_config_for_request,
+    get_execution_plan,
+    models_url_for,
+    print_incoming_request,
+    print_outgoing_response,
+    prepare_chat_request,
+    overloaded_error,
+    upstream_unavailable_error,
+    rate_limited_error,
+    retry_after_header,
+    configure_process,
+    process_configured,
+    shutdown_process,
+)
+
+logger = logging.getLogger(__name__)
+
+# Route patterns mirroring the Flask app (config path may contain slashes)
+_MODELS_ROUTE = re.compile(r"^/(?:(?P<config_path>.+)/)?models/?$")
+_CHAT_ROUTE = re.compile(r"^/(?:(?P<config_path>.+)/)?chat/completions/?$")
+
+# Permissive CORS headers matching flask_cors defaults
+_CORS_HEADERS = {
+    "Access-Control-Allow-Origin": "*",
+}
+
+
+async def run_blocking(func: Callable, *args, **kwargs) -> Any:
+    """Run a blocking call (file I/O, config parsing) in the default executor"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(func, *args, **kwargs))
+
+
+class ProxyASGIApp:
+    """ASGI application serving the proxy routes on an asyncio event loop"""
+
+    def __init__(self, config: Optional[Config] = None, http_client=None):
+        """
+        Initialize the ASGI app.
+
+        Args:
+            config: Default config (defaults to the config loaded by main)
+            http_client: Optional httpx.AsyncClient; created on first use when omitted
+        """
+        self._config = config
+        self._http_client = http_client
+        self._owns_http_client = http_client is None
+        # Whether lifespan startup configured the process (direct uvicorn runs)
+        self._configured_process = False
+        self.in_flight = 0
+
+    @property
+    def config(self) -> Config:
+        """Default config for requests without a config path"""
+        return self._config if self._config is not None else default_config
+
+    def get_http_client(self):
+        """Return the shared httpx.AsyncClient, creating it inside the running loop"""
+        if self._http_client is None:
+            require_httpx()
+            self._http_client = create_async_http_client(self.config.get_connection_pool_config())
+        return self._http_client
+
+    async def close(self) -> None:
+        """Close the upstream client if this app created it"""
+        if self._http_client is not None and self._owns_http_client:
+            await self._http_client.aclose()
+            self._http_client = None
+
+    async def __call__(self, scope, receive, send):
+        """ASGI entry point"""
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+        receive, send = _count_body_bytes(receive, send)
+
+        method = scope["method"]
+        path = unquote(scope["path"])
+
+        if method == "OPTIONS":
+            await self._send_preflight(scope, send)
+            return
+
+        self.in_flight += 1
+        try:
+            if path == "/health" and method == "GET":
+                await send_json(send, 200, {"status": "healthy"})
+                return
+            if path == "/health/detailed" and method == "GET":
+                await self.detailed_health_check(send)
+                return
+            if path == "/metrics" and method == "GET":
+                await self.metrics_endpoint(send)
+                return
+            if path == "/logs/query" and method == "GET":
+                await self.logs_query(scope, send)
+                return
+
+            models_match = _MODELS_ROUTE.match(path)
+            if models_match and method == "GET":
+                await self.models_endpoint(models_match.group("config_path"), scope, send)
+                return
+
+            chat_match = _CHAT_ROUTE.match(path)
+            if chat_match and method == "POST":
+                await self.chat_completions(chat_match.group("config_path"), scope, receive, send)
+                return
+
+            status = 405 if (models_match or chat_match) else 404
+            await send_json(send, status, {"error": {"message": "Method not allowed" if status == 405 else "Not found"}})
+        finally:
+            self.in_flight -= 1
+
+    async def _lifespan(self, receive, send) -> None:
+        """Handle ASGI lifespan startup/shutdown events"""
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                if not process_configured():
+                    # Loaded directly by uvicorn rather than through run_server
+                    await run_blocking(configure_process, False)
+                    self._configured_process = True
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.close()
+                log_writer = get_log_writer()
+                if log_writer is not None:
+                    # Write out logs of the requests that just finished
+                    await run_blocking(log_writer.flush, log_writer.shutdown_timeout)
+                if self._configured_process:
+                    await run_blocking(shutdown_process)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def _send_preflight(self, scope, send) -> None:
+        """Answer CORS preflight requests"""
+        request_headers = _headers_from_scope(scope)
+        headers = dict(_CORS_HEADERS)
+        headers["Access-Control-Allow-Methods"] = "GET, POST, OPTIONS"
+        if request_headers.get("Access-Control-Request-Headers"):
+            headers["Access-Control-Allow-Headers"] = request_headers["Access-Control-Request-Headers"]
+        await send({"type": "http.response.start", "status": 200, "headers": _encode_headers(headers)})
+        await send({"type": "http.response.body", "body": b""})
+
+    async def detailed_health_check(self, send) -> None:
+        """Detailed health check with retry configuration and engine state"""
+        try:
+            error_config = self.config.get_error_handling_config()
+            message_cache = get_message_cache()
+            log_writer = get_log_writer()
+            log_index = get_log_index()
+            admission = get_admission_controller()
+            breakers = get_circuit_breakers()
+            rate_limiter = get_rate_limiter()
+            concurrency_limits = get_concurrency_limits()
+            hedger = get_hedger()
+            singleflight = get_singleflight()
+            response_cache = get_response_cache()
+            default_plan = get_execution_plan(self.config)
+            upstream_pool = default_plan.upstream_pool
+            models_cache = default_plan.models_cache
+            await send_json(send, 200, {
+                "status": "healthy",
+                "engine": "asyncio",
+                "in_flight": self.in_flight,
+                "retry_config": {
+                    "max_retries": error_config.get("max_retries", 10),
+                    "base_delay": error_config.get("base_delay", 1.0),
+                    "max_delay": error_config.get("max_delay", 60.0)
+                },
+                "preprocessing_cache": message_cache.get_stats() if message_cache else {"enabled": False},
+                "log_writer": log_writer.get_stats() if log_writer else {"enabled": False},
+                "log_sequence": get_log_sequence().get_stats(),
+                "log_index": log_index.get_stats() if log_index else {"enabled": False},
+                "tracing": get_tracer().get_stats(),
+                "admission": admission.get_stats() if admission else {"enabled": False},
+                "circuit_breakers": breakers.get_stats() if breakers else {"enabled": False},
+                "rate_limit": rate_limiter.get_stats() if rate_limiter else {"enabled": False},
+                "concurrency_limit": concurrency_limits.get_stats() if concurrency_limits else {"enabled": False},
+                "hedging": hedger.get_stats() if hedger else {"enabled": False},
+                "singleflight": singleflight.get_stats() if singleflight else {"enabled": False},
+                "response_cache": response_cache.get_stats() if response_cache else {"enabled": False},
+                "upstream_pool": upstream_pool.get_stats() if upstream_pool else {"enabled": False},
+                "models_cache": models_cache.get_stats() if models_cache else {"enabled": False}
+            })
+        except Exception as e:
+            logger.error(f"Error in detailed health check: {e}")
+            await send_json(send, 500, {"status": "unhealthy", "error": str(e)})
+
+    async def metrics_endpoint(self, send) -> None:
+        """Request, upstream, retry and traffic metrics in Prometheus text format"""
+        metrics = get_metrics()
+        if not metrics.enabled:
+            await send_json(send, 404, {"error": {"message": "Metrics are disabled", "type": "metrics_disabled"}})
+            return
+        body = metrics.render().encode("utf-8")
+        headers = dict(_CORS_HEADERS)
+        headers["Content-Type"] = METRICS_CONTENT_TYPE
+        headers["Content-Length"] = str(len(body))
+        await send({"type": "http.response.start", "status": 200, "headers": _encode_headers(headers)})
+        await send({"type": "http.response.body", "body": body})
+
+    async def logs_query(self, scope, send) -> None:
+        """Filter or aggregate indexed request logs (see log_index.run_log_query)"""
+        args = dict(parse_qsl(scope.get("query_string", b"").decode("latin-1")))
+        try:
+            await send_json(send, 200, await run_blocking(run_log_query, args))
+        except LookupError as e:
+            await send_json(send, 404, {"error": {"message": str(e), "type": "log_index_disabled"}})
+        except ValueError as e:
+            await send_json(send, 400, {"error": {"message": str(e), "type": "invalid_query"}})
+
+    async def _resolve_config(self, config_path: Optional[str]) -> Tuple[Optional[Config], Optional[Dict[str, Any]]]:
+        """
+        Load the config for a path parameter.
+
+        Returns:
+            Tuple of (request_config or None for the default, error body when the file is missing)
+        """
+        if not config_path:
+            return None, None
+
+        config_name = get_config_name_from_path(config_path)
+        try:
+            request_config = await run_blocking(load_config_for_request, config_name)
+            logger.info(f"Using config: {config_name} for path: {config_path}")
+            return request_config, None
+        except FileNotFoundError:
+            error_msg = f"Config file not found for path '{config_path}': {config_name}"
+            logger.error(error_msg)
+            return None, {"error": {"message": error_msg, "type": "config_not_found",
+                                    "config_path": config_path, "expected_file": config_name}}
+
+    async def models_endpoint(self, config_path: Optional[str], scope, send) -> None:
+        """Models endpoint that forwards to target proxy, falling back to DEFAULT_MODELS"""
+        headers = _headers_from_scope(scope)
+        try:
+            character_chat_info = extract_character_chat_info(headers, {})
+            request_config, not_found = await self._resolve_config(config_path)
+            if not_found:
+                await send_json(send, 404, not_found)
+                return
+
+            active_config = request_config if request_config is not None else self.config
+            _request_logger_for_models, active_error_logger = await run_blocking(
+                get_loggers_for_config, active_config
+            )
+
+            plan = get_execution_plan(active_config)
+            upstream_pool = plan.upstream_pool
+            target_url = active_config.get_target_proxy_config().get("url")
+            if not target_url and upstream_pool is None:
+                raise ValueError("target_proxy.url is not configured")
+
+            # With an upstream pool each listing request goes to the upstream the pool picks
+            models_url = models_url_for(target_url) if upstream_pool is None else "upstream_pool"
+            models_error_handler = plan.get_error_handler(active_error_logger)
+
+            async def send_models(proxy_client):
+                return await proxy_client.forward_request(
+                    request_data={},
+                    headers=headers,
+                    method="GET",
+                    endpoint=""
+                )
+
+            async def make_models_request():
+                if upstream_pool is None:
+                    return await send_models(
+                        plan.get_async_proxy_client(models_url, self.get_http_client(), active_error_logger))
+                # A listing says nothing about chat health: counted in flight only
+                upstream = upstream_pool.acquire(set())
+                try:
+                    return await send_models(plan.get_async_proxy_client(
+                        models_url_for(upstream.url), self.get_http_client(), active_error_logger, upstream.apikey))
+                finally:
+                    upstream_pool.release(upstream, None)
+
+            context = {
+                "request_type": "models_request",
+                "models_url": models_url,
+                "timestamp": time.time(),
+                "character_chat_info": character_chat_info
+            }
+
+            models_cache = plan.models_cache
+            if models_cache is None:
+                response_data = await models_error_handler.retry_with_backoff_async(make_models_request, context)
+                await send_json(send, 200, response_data)
+                return
+
+            # Short retries: a cold cache falls back to DEFAULT_MODELS soon when upstream is down
+            listing_error_handler = plan.get_models_error_handler(active_error_logger)
+
+            async def fetch_models():
+                data = await listing_error_handler.retry_with_backoff_async(make_models_request, context)
+                if not isinstance(data, dict) or data.get("_proxy_error"):
+                    raise ValueError(f"Upstream did not return a models listing: {data}")
+                return data
+
+            # Answer from the config's listing; stale listings are refreshed in the background
+            entry, cache_state = await models_cache.get_async(models_cache.key_for(models_url, headers), fetch_models,
+                                                              {"object": "list", "data": DEFAULT_MODELS})
+            cache_headers = {"ETag": entry.etag, "X-Proxy-Cache": cache_state.upper()}
+            if etag_matches(headers.get("If-None-Match"), entry.etag):
+                models_cache.record_not_modified()
+                await send_empty(send, 304, cache_headers)
+                return
+            await send_json(send, 200, entry.data, headers=cache_headers)
+
+        except Exception as e:
+            logger.error(f"Error in models endpoint: {e}")
+            await send_json(send, 200, {"object": "list", "data": DEFAULT_MODELS})
+
+    async def chat_completions(self, config_path: Optional[str], scope, receive, send) -> None:
+        """Chat completions endpoint with optional config path parameter"""
+        # Root span of the request's trace; stages below it become child spans
+        with get_tracer().span("chat_completions", config_path=config_path or "default"):
+            await self._chat_completions(config_path, scope, receive, send)
+
+    async def _chat_completions(self, config_path: Optional[str], scope, receive, send) -> None:
+        """Handle a chat completions request (see chat_completions)"""
+        tracer = get_tracer()
+        headers = _headers_from_scope(scope)
+        try:
+            request_config, not_found = await self._resolve_config(config_path)
+            if not_found:
+                await send_json(send, 404, not_found)
+                return
+
+            active_config = request_config if request_config is not None else self.config
+
+            content_type = headers.get("Content-Type", "")
+            if "json" not in content_type.lower():
+                await send_json(send, 400, {"error": {"message": "Content-Type must be application/json"}})
+                return
+
+            with tracer.span("read_body"):
+                body = await read_body(receive)
+            try:
+                with tracer.span("parse_json", bytes=len(body)):
+                    request_data = json.loads(body) if body else None
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                await send_json(send, 400, {"error": {"message": "Invalid JSON in request body"}})
+                return
+
+            if not request_data:
+                await send_json(send, 400, {"error": {"message": "No JSON data provided"}})
+                return
+
+            if not isinstance(request_data, dict) or "messages" not in request_data:
+                await send_json(send, 400, {"error": {"message": "Missing required field: messages"}})
+                return
+
+            with tracer.span("preprocess"):
+                # Copying and rewriting a long chat history would stall the event loop
+                request_data, original_request_data, stripped_metadata, lorebook_entries = await run_blocking(
+                    prepare_chat_request, request_data, active_config
+                )
+
+            status_code, result = await self.forward_request(
+                request_data,
+                headers,
+                request_config=request_config,
+                original_request_data=original_request_data,
+                stripped_metadata=stripped_metadata,
+                lorebook_entries=lorebook_entries
+            )
+            if isinstance(result, AsyncSSEStreamRelay):
+                await send_stream(send, result)
+                return
+            await send_json(send, status_code, result)
+
+        except AdmissionRejected as e:
+            await send_json(send, 503, overloaded_error(e), headers={"Retry-After": retry_after_header(e)})
+        except CircuitOpenError as e:
+            await send_json(send, 503, upstream_unavailable_error(e), headers={"Retry-After": retry_after_header(e)})
+        except RateLimitExceeded as e:
+            await send_json(send, 429, rate_limited_error(e), headers={"Retry-After": retry_after_header(e)})
+        except ValueError as e:
+            logger.error(f"Validation error in chat completions: {e}")
+            await send_json(send, 400, {"error": {"message": str(e), "type": "validation_error"}})
+        except Exception as e:
+            logger.error(f"Error in chat completions: {e}")
+            await send_json(send, 500, {"error": {"message": str(e)}})
+
+    async def forward_request(self, request_data: Dict[str, Any], headers: Optional[Dict[str, str]] = None,
+                              request_config: Optional[Config] = None,
+                              original_request_data: Optional[Dict[str, Any]] = None,
+                              stripped_metadata: Optional[List[Dict[str, Any]]] = None,
+                              lorebook_entries: Optional[List[Dict[str, Any]]] = None) -> Tuple[int, Any]:
+        """
+        Forward request to target proxy with error handling and retry logic.
+
+        Async counterpart of main.forward_request; log writes run in the executor.
+
+        Returns:
+            Tuple of (status_code, response_data or AsyncSSEStreamRelay)
+        """
+        request_id = str(uuid.uuid4())[:8]
+        start_time = time.time()
+        response_data = None
+        error = None
+        character_chat_info = None
+        streaming_handoff = False
+        active_config = request_config if request_config is not None else self.config
+        active_request_logger, active_error_logger = await run_blocking(
+            get_loggers_for_config, active_config
+        )
+        log_state = {"filepath": None, "attempt_start_time": start_time}
+        plan = get_execution_plan(active_config)
+        # Spans wrap the awaits below: the executor does not carry the trace context into log writes
+        tracer = get_tracer()
+
+        # Malformed ST_METADATA is raised inside the try below so it is logged like other errors
+        metadata_error = None
+        try:
+            if original_request_data is not None:
+                character_chat_info = resolve_character_chat_info(stripped_metadata)
+            else:
+                character_chat_info = extract_character_chat_info(headers or {}, request_data)
+        except ValueError as e:
+            metadata_error = e
+
+        operation = character_chat_info[2] if character_chat_info else None
+
+        # Deterministic requests may be answered from the response cache, without waiting for an upstream slot
+        response_cache = get_response_cache()
+        cache_key = None
+        cache_store = False
+        cached_response = None
+        if response_cache is not None and metadata_error is None:
+            cache_key = response_cache.key_for(operation, request_data, headers, plan.fingerprint)
+            if cache_key:
+                cache_lookup, cache_store = cache_control(headers)
+                if cache_lookup:
+                    with tracer.span("response_cache"):
+                        cached_response = await run_blocking(response_cache.get, cache_key)
+                else:
+                    response_cache.bypass()
+
+        # Identical in-flight requests of allowlisted operations share one upstream call
+        singleflight = get_singleflight()
+        coalesce_key = None
+        if singleflight is not None and metadata_error is None and cached_response is None:
+            coalesce_key = singleflight.key_for(operation, request_data, headers, plan.fingerprint)
+
+        # Wait for an upstream slot; raises AdmissionRejected when the proxy is overloaded.
+        # Coalesced requests take it inside the shared call (run_admitted), so duplicates waiting for it hold none
+        admission = get_admission_controller()
+        admission_ticket = None
+        chat = character_chat_info[:2] if character_chat_info else None
+        if admission is not None and cached_response is None and not coalesce_key:
+            with tracer.span("admission_wait"):
+                admission_ticket = await admission.acquire_async(plan.source, plan.admission_limit, operation, chat)
+
+        metrics = get_metrics()
+        metrics.request_started()
+        metrics_status = "error"
+
+        try:
+            if metadata_error is not None:
+                raise metadata_error
+
+            if active_request_logger:
+                try:
+                    with tracer.span("log_start"):
+                        log_state["filepath"] = await run_blocking(
+                            active_request_logger.start_request_log,
+                            request_id=request_id,
+                            endpoint="/chat/completions",
+                            request_data=request_data,
+                            headers=headers or {},
+                            start_time=start_time,
+                            character_chat_info=character_chat_info,
+                            original_request_data=original_request_data,
+                            stripped_metadata=stripped_metadata,
+                            lorebook_entries=lorebook_entries,
+                            config_path=plan.source
+                        )
+                except Exception as log_error:
+                    logger.error(f"Failed to start request log: {log_error}")
+
+            await run_blocking(print_incoming_request, request_id, request_data, headers, original_request_data,
+                               stripped_metadata)
+
+            if cached_response is not None:
+                response_data = cached_response
+                # Pretty-printing a large reply would stall the event loop
+                await run_blocking(print_outgoing_response, request_id, "Cache hit", response_data,
+                                   time.time() - start_time)
+                metrics_status = "200"
+                return 200, response_data
+
+            target_url = active_config.get_target_proxy_config().get("url")
+            if not target_url and plan.upstream_pool is None:
+                raise ValueError("target_proxy.url is not configured")
+
+            error_handler = plan.get_error_handler(active_error_logger)
+            # An upstream pool picks the upstream per attempt instead
+            proxy_client = (plan.get_async_proxy_client(target_url, self.get_http_client(), active_error_logger)
+                            if plan.upstream_pool is None else None)
+
+            async def send_to(client):
+                return await client.forward_request(
+                    request_data,
+                    headers=headers,
+                    endpoint="",
+                    log_filepath=log_state.get("filepath"),
+                    request_logger=active_request_logger,
+                    request_id=request_id
+                )
+
+            # Balance over the config's upstream pool; upstreams that fail this request are skipped by its retries
+            upstream_selection = (UpstreamSelection(plan.upstream_pool, error_handler.should_retry_exception)
+                                  if plan.upstream_pool else None)
+
+            async def send_attempt(alternate_url: Optional[str] = None):
+                if alternate_url:
+                    return await send_to(
+                        plan.get_async_proxy_client(alternate_url, self.get_http_client(), active_error_logger))
+                if upstream_selection:
+                    return await upstream_selection.call_async(lambda upstream: send_to(
+                        plan.get_async_proxy_client(upstream.url, self.get_http_client(), active_error_logger,
+                                                    upstream.apikey)))
+                return await send_to(proxy_client)
+
+            # Latency-critical operations race a second copy of slow attempts
+            hedger = get_hedger()
+            hedge_policy = (hedger.policy_for(character_chat_info[2] if character_chat_info else None)
+                            if hedger else None)
+
+            async def make_request():
+                if hedge_policy:
+                    return await hedger.run_async(hedge_policy, send_attempt)
+                return await send_attempt()
+
+            context = {
+                "request_type": "forward_request",
+                "target_url": target_url,
+                "timestamp": time.time(),
+                "character_chat_info": character_chat_info
+            }
+
+            def rotate_log(attempt_number: int, exception: Exception) -> None:
+                """Finalize the failed attempt's log and start one for the retry"""
+                attempt_duration = time.time() - log_state["attempt_start_time"]
+                finalized_path = active_request_logger.finalize_log_with_error(
+                    filepath=log_state["filepath"],
+                    error=exception,
+                    end_time=time.time(),
+                    duration=attempt_duration
+                )
+                new_start_time = time.time()
+                log_state["attempt_start_time"] = new_start_time
+                log_state["filepath"] = active_request_logger.start_request_log(
+                    request_id=f"{request_id}-retry{attempt_number}",
+                    endpoint="/chat/completions",
+                    request_data=request_data,
+                    headers=headers or {},
+                    start_time=new_start_time,
+                    character_chat_info=character_chat_info,
+                    original_request_data=original_request_data,
+                    stripped_metadata=stripped_metadata,
+                    lorebook_entries=lorebook_entries,
+                    is_proxy_retry=True,
+                    previous_filepath=finalized_path,
+                    config_path=plan.source
+                )
+
+            async def on_retry_callback(attempt_number: int, exception: Exception, delay: float):
+                """Handle log finalization and new log creation for retry attempts"""
+                if active_request_logger and log_state["filepath"]:
+                    try:
+                        with tracer.span("log_rotate", attempt=attempt_number):
+                            await run_blocking(rotate_log, attempt_number, exception)
+                    except Exception as log_error:
+                        logger.error(f"Failed to manage logs during retry: {log_error}")
+
+            def run_with_retries():
+                return error_handler.retry_with_backoff_async(
+                    make_request, context, on_retry=on_retry_callback,
+                    failover=upstream_selection.failover_available if upstream_selection else None
+                )
+
+            async def run_admitted():
+                nonlocal admission_ticket
+                if admission is not None:
+                    with tracer.span("admission_wait"):
+                        admission_ticket = await admission.acquire_async(plan.source, plan.admission_limit,
+                                                                         operation, chat)
+                return await run_with_retries()
+
+            if coalesce_key:
+                with tracer.span("singleflight"):
+                    response_data = await singleflight.do_async(coalesce_key, operation, run_admitted)
+            else:
+                response_data = await run_with_retries()
+
+            # Relay event streams chunk-by-chunk; the log is completed when the stream ends
+            if httpx is not None and isinstance(response_data, httpx.Response):
+                upstream_response = response_data
+                # Stages up to the first byte; the stream itself is covered by the root span
+                stream_trace_summary = tracer.summary()
+
+                def on_stream_complete(assembled_response, stream_error, stream_stats):
+                    """Complete the request log from the chunks assembled during relay"""
+                    stream_end_time = stream_stats.get("end_time", time.time())
+                    if active_request_logger and log_state["filepath"]:
+                        active_request_logger.complete_request_log(
+                            filepath=log_state["filepath"],
+                            response_data=assembled_response,
+                            response_headers=dict(upstream_response.headers),
+                            end_time=stream_end_time,
+                            duration=stream_end_time - log_state["attempt_start_time"],
+                            error=stream_error,
+                            trace_summary=stream_trace_summary
+                        )
+                    if stream_error and active_error_logger:
+                        active_error_logger.log_error(stream_error, {
+                            "context": "stream_relay",
+                            "error_type": "stream_relay_error",
+                            "events": stream_stats.get("events"),
+                            "bytes": stream_stats.get("bytes")
+                        }, character_chat_info=character_chat_info)
+                    metrics.request_finished(character_chat_info, plan.source,
+                                             "stream_error" if stream_error else "200", stream_end_time - start_time)
+                    if admission_ticket:
+                        admission_ticket.release()
+
+                streaming_handoff = True
+                return 200, AsyncSSEStreamRelay(upstream_response, request_id, on_complete=on_stream_complete,
+                                                start_time=start_time)
+
+            if isinstance(response_data, dict) and response_data.get('_proxy_error'):
+                response_data = dict(response_data)
+                status_code = response_data.pop('_status_code')
+                response_data.pop('_proxy_error')
+                metrics_status = str(status_code)
+                await run_blocking(print_outgoing_response, request_id, f"Client Error {status_code}", response_data,
+                                   time.time() - start_time, data_label="Error Response")
+                return status_code, response_data
+
+            if cache_key and cache_store and is_cacheable_reply(response_data):
+                await run_blocking(response_cache.put, cache_key, operation, response_data)
+
+            await run_blocking(print_outgoing_response, request_id, "Success", response_data,
+                               time.time() - start_time)
+
+            metrics_status = "200"
+            return 200, response_data
+
+        except Exception as e:
+            error = e
+
+            print("=" * 80, flush=True)
+            print(f"OUTGOING RESPONSE [{request_id}] - ERROR", flush=True)
+            print(f"Error Type: {type(e).__name__}", flush=True)
+            print(f"Error Message: {str(e)}", flush=True)
+            print(f"Duration: {time.time() - start_time:.3f}s", flush=True)
+            print("=" * 80, flush=True)
+
+            if active_error_logger:
+                await run_blocking(active_error_logger.log_error, e, {
+                    "context": "forward_request",
+                    "error_type": "forward_request_error"
+                }, character_chat_info=character_chat_info)
+
+            raise
+
+        finally:
+            end_time = time.time()
+            attempt_duration = end_time - log_state.get("attempt_start_time", start_time)
+            if not streaming_handoff:
+                # Streams are recorded and release their slot when they end (on_stream_complete)
+                metrics.request_finished(character_chat_info, plan.source, metrics_status, end_time - start_time)
+                if admission_ticket:
+                    admission_ticket.release()
+
+            if active_request_logger and log_state["filepath"] and not streaming_handoff:
+                try:
+                    trace_summary = tracer.summary()
+                    with tracer.span("log_complete"):
+                        await run_blocking(
+                            active_request_logger.complete_request_log,
+                            filepath=log_state["filepath"],
+                            response_data=response_data,
+                            response_headers={"X-Proxy-Cache": "HIT"} if cached_response is not None else {},
+                            end_time=end_time,
+                            duration=attempt_duration,
+                            error=error,
+                            trace_summary=trace_summary
+                        )
+                except Exception as log_error:
+                    logger.error(f"Failed to complete request log: {log_error}")
+
+
+def _headers_from_scope(scope) -> Dict[str, str]:
+    """Decode ASGI request headers into a dict with canonical capitalization"""
+    headers = {}
+    for raw_name, raw_value in scope.get("headers", []):
+        name = "-".join(part.capitalize() for part in raw_name.decode("latin-1").split("-"))
+        headers[name] = raw_value.decode("latin-1")
+    return headers
+
+
+def _encode_headers(headers: Dict[str, str]) -> List[Tuple[bytes, bytes]]:
+    """Encode response headers for ASGI"""
+    return [(name.lower().encode("latin-1"), str(value).encode("latin-1")) for name, value in headers.items()]
+
+
+def _count_body_bytes(receive, send) -> Tuple[Callable, Callable]:
+    """Wrap ASGI receive/send so request and response body bytes are counted for /metrics"""
+    metrics = get_metrics()
+
+    async def counting_receive():
+        message = await receive()
+        if message["type"] == "http.request":
+            metrics.record_bytes("in", len(message.get("body", b"")))
+        return message
+
+    async def counting_send(message):
+        if message["type"] == "http.response.body":
+            metrics.record_bytes("out", len(message.get("body", b"")))
+        await send(message)
+
+    return counting_receive, counting_send
+
+
+async def read_body(receive) -> bytes:
+    """Read the full request body from ASGI receive events"""
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            break
+    return b"".join(chunks)
+
+
+async def send_json(send, status: int, data: Any, headers: Optional[Dict[str, str]] = None) -> None:
+    """Send a complete JSON response (with optional extra headers)"""
+    body = json.dumps(data).encode("utf-8")
+    headers = dict(_CORS_HEADERS, **(headers or {}))
+    headers["Content-Type"] = "application/json"
+    headers["Content-Length"] = str(len(body))
+    await send({"type": "http.response.start", "status": status, "headers": _encode_headers(headers)})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def send_empty(send, status: int, headers: Optional[Dict[str, str]] = None) -> None:
+    """Send a response without a body (e.g. 304 Not Modified)"""
+    headers = dict(_CORS_HEADERS, **(headers or {}))
+    await send({"type": "http.response.start", "status": status, "headers": _encode_headers(headers)})
+    await send({"type": "http.response.body", "body": b""})
+
+
+async def send_stream(send, relay: AsyncSSEStreamRelay) -> None:
+    """Relay an upstream event stream to the client chunk-by-chunk"""
+    headers = dict(_CORS_HEADERS)
+    headers.update(SSE_RESPONSE_HEADERS)
+    headers["Content-Type"] = relay.content_type
+    stream = relay.__aiter__()
+    try:
+        await send({"type": "http.response.start", "status": 200, "headers": _encode_headers(headers)})
+        async for chunk in stream:
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+    except Exception as e:
+        # Headers are already sent, so the stream can only be cut short
+        logger.error(f"[{relay.request_id}] Stream relay ended early: {e}")
+    finally:
+        await stream.aclose()
+        await relay.aclose()
+
+
+# Module-level app for `uvicorn first_hop_proxy.asgi:app`
+app = ProxyASGIApp()
@@ -0,0 +1,214 @@
+"""
+Async upstream client used by the asyncio serving engine
+"""
+import time
+import logging
+from typing import Dict, Any, Optional
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from .proxy_client import ProxyClient, BlankResponseRetry
+from .metrics import get_metrics
+from .tracing import get_tracer
+from .circuit_breaker import get_circuit_breakers, is_failure_exception
+from .rate_limit import get_rate_limiter
+from .concurrency_limit import get_concurrency_limits
+
+try:
+    import httpx
+except ImportError:  # pragma: no cover - optional dependency
+    httpx = None
+
+logger = logging.getLogger(__name__)
+
+
+def require_httpx() -> None:
+    """Raise a helpful error when the async engine is used without httpx installed"""
+    if httpx is None:
+        raise ImportError("The asyncio engine requires httpx: pip install first-hop-proxy[async]")
+
+
+def create_async_http_client(pool_config: Optional[Dict[str, Any]] = None, **kwargs) -> "httpx.AsyncClient":
+    """
+    Create a keep-alive httpx.AsyncClient sized from the connection_pool config section.
+
+    Args:
+        pool_config: connection_pool config section
+        **kwargs: Extra httpx.AsyncClient arguments (e.g. transport for tests)
+
+    Returns:
+        httpx.AsyncClient with no client-level timeout (matching requests' default)
+    """
+    require_httpx()
+    pool_config = pool_config or {}
+    keep_alive = pool_config.get("keep_alive", True)
+    limits = httpx.Limits(
+        max_connections=None,
+        max_keepalive_connections=pool_config.get("pool_maxsize", 32) if keep_alive else 0,
+        keepalive_expiry=pool_config.get("idle_timeout", 300),
+    )
+    return httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(None), **kwargs)
+
+
+def to_requests_response(response: "httpx.Response") -> requests.Response:
+    """
+    Convert a fully read httpx.Response into a requests.Response.
+
+    ProxyClient.handle_response, ResponseParser and ErrorHandler all work with
+    requests responses and requests exceptions, so the async path converts once
+    and reuses them unchanged.
+    """
+    converted = requests.Response()
+    converted.status_code = response.status_code
+    converted.headers = CaseInsensitiveDict(response.headers)
+    converted._content = response.content
+    converted.encoding = response.encoding
+    converted.reason = response.reason_phrase
+    converted.url = str(response.url)
+    return converted
+
+
+def to_requests_exception(error: Exception) -> Exception:
+    """Map httpx transport errors onto the requests exceptions ErrorHandler retries"""
+    if httpx is not None:
+        if isinstance(error, httpx.TimeoutException):
+            return requests.exceptions.Timeout(str(error) or type(error).__name__)
+        if isinstance(error, httpx.TransportError):
+            return requests.exceptions.ConnectionError(str(error) or type(error).__name__)
+    return error
+
+
+class AsyncProxyClient(ProxyClient):
+    """ProxyClient that sends requests with httpx.AsyncClient"""
+
+    def __init__(self, target_url: str, http_client: "httpx.AsyncClient", error_logger=None, config=None,
+                 response_parser=None, api_key: Optional[str] = None):
+        """Initialize async proxy client with a shared httpx.AsyncClient"""
+        super().__init__(target_url, error_logger=error_logger, config=config, response_parser=response_parser,
+                         api_key=api_key)
+        self.http_client = http_client
+
+    async def forward_request(self, request_data: Dict[str, Any],
+                              headers: Optional[Dict[str, str]] = None,
+                              timeout: Optional[int] = None,
+                              retry_count: Optional[int] = None,
+                              endpoint: str = "/chat/completions",
+                              method: str = "POST",
+                              log_filepath: Optional[str] = None,
+                              request_logger: Optional[Any] = None,
+                              request_id: Optional[str] = None) -> Any:
+        """Forward request to target proxy
+
+        Returns:
+            Parsed response data, or an unread httpx.Response for event streams
+        """
+        target_url, request_params, is_streaming = self.prepare_request(
+            request_data, headers=headers, timeout=timeout, retry_count=retry_count,
+            endpoint=endpoint, method=method
+        )
+
+        request_kwargs = {
+            "headers": request_params["headers"],
+            "json": request_params["json"],
+        }
+        if "timeout" in request_params:
+            request_kwargs["timeout"] = request_params["timeout"]
+
+        tracer = get_tracer()
+        # Wait out the shared pace and 429 cooldown of this origin and API key
+        rate_limiter = get_rate_limiter()
+        gate = rate_limiter.gate_for(target_url, request_params["headers"]) if rate_limiter else None
+        if gate:
+            with tracer.span("rate_limit_wait"):
+                await gate.wait_async()
+
+        # Fail fast (CircuitOpenError) while the origin's breaker is open
+        breakers = get_circuit_breakers()
+        breaker = breakers.for_url(target_url) if breakers else None
+        probe = breaker.before_request() if breaker else False
+
+        # Wait for a slot under the origin's adaptive concurrency limit
+        limits = get_concurrency_limits()
+        limit = limits.for_url(target_url) if limits else None
+        if limit:
+            try:
+                with tracer.span("concurrency_wait"):
+                    slot = await limit.acquire_async()
+            except BaseException:
+                if breaker:
+                    breaker.abandon(probe)
+                raise
+
+        metrics = get_metrics()
+        metrics.upstream_started()
+        attempt_start = time.time()
+        response = None
+        upstream_error = None
+        try:
+            with tracer.span("upstream_request", url=target_url) as span:
+                try:
+                    upstream_request = self.http_client.build_request(request_params["method"], target_url,
+                                                                      **request_kwargs)
+                    response = await self.http_client.send(upstream_request, stream=True)
+                except Exception as e:
+                    upstream_error = to_requests_exception(e)
+                    if breaker:
+                        breaker.record(is_failure_exception(upstream_error), probe)
+                    raise upstream_error from e
+                except BaseException:
+                    # Cancelled (client went away): hand back a probe slot without an outcome
+                    if breaker:
+                        breaker.abandon(probe)
+                    raise
+                span.set_attribute("status", response.status_code)
+
+            # Hand event streams over unread; everything else is buffered and handled like the sync client
+            if is_streaming and response.status_code == 200:
+                content_type = response.headers.get("Content-Type", "") or ""
+                if "application/json" not in content_type.lower():
+                    logger.info(f"=== HTTP RESPONSE ===")
+                    logger.info(f"Status code: {response.status_code}")
+                    logger.info("Handling streaming response")
+                    return response
+
+            with tracer.span("read_response"):
+                try:
+                    await response.aread()
+                except Exception as e:
+                    upstream_error = to_requests_exception(e)
+                    raise upstream_error from e
+                finally:
+                    await response.aclose()
+
+            # Converted first so the recorded status reflects recategorization
+            response = to_requests_response(response)
+            with tracer.span("handle_response"):
+                result = self.handle_response(
+                    response, target_url, is_streaming=False, retry_count=retry_count,
+                    log_filepath=log_filepath, request_logger=request_logger, request_id=request_id
+                )
+        finally:
+            metrics.upstream_finished(str(response.status_code) if response is not None else "error",
+                                      time.time() - attempt_start)
+            if breaker and response is not None:
+                breaker.record(breakers.is_failure_status(response.status_code), probe)
+            if gate and response is not None:
+                # Read by ErrorHandler: a held cooldown replaces the retry backoff
+                response.rate_limit_cooldown = gate.observe(response.status_code, response.headers)
+            if limit:
+                limit.release(slot, response.status_code if response is not None else None, upstream_error)
+        if isinstance(result, BlankResponseRetry):
+            logger.info(f"Retrying request due to blank content (attempt {result.retry_count})")
+            return await self.forward_request(
+                request_data,
+                headers=headers,
+                timeout=timeout,
+                retry_count=result.retry_count,
+                endpoint=endpoint,
+                method=method,
+                log_filepath=log_filepath,
+                request_logger=request_logger,
+                request_id=request_id
+            )
+        return result
@@ -0,0 +1,298 @@
+"""
+Per-origin circuit breakers for upstream calls
+
+Every upstream attempt is checked against the breaker of its target origin
+(scheme://host[:port]) before it is sent, and its outcome is recorded after.
+Connection errors, timeouts and responses with a status in failure_codes
+count as failures; anything else the origin answered counts as a success.
+
+    closed     requests flow; outcomes are kept in a rolling window of
+               window seconds. Once it holds min_requests outcomes and the
+               failure rate reaches failure_rate_threshold, the breaker opens.
+    open       requests fail immediately with CircuitOpenError (answered with
+               503 and Retry-After) until open_duration has passed.
+    half_open  up to half_open_max_calls probe requests are let through; if
+               they all succeed the breaker closes with an empty window, a
+               failed probe opens it again.
+
+CircuitOpenError is not retryable, so retry loops that are backing off
+against a dead origin end at their next attempt instead of running through
+all their retries. State is kept per process.
+"""
+import time
+import threading
+import logging
+from collections import deque
+from typing import Dict, Any, Iterable, Optional
+
+from requests.exceptions import Timeout, ConnectionError
+
+from .session_pool import get_origin
+from .metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+STATES = (CLOSED, HALF_OPEN, OPEN)
+
+DEFAULT_FAILURE_CODES = (500, 502, 503, 504)
+
+# Retry-After for requests turned away while a probe is in flight
+HALF_OPEN_RETRY_AFTER = 1.0
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of sending a request to an origin whose breaker is open"""
+
+    def __init__(self, origin: str, retry_after: float):
+        super().__init__(f"Upstream {origin} is unavailable (circuit open, retry in {retry_after:.0f}s)")
+        self.origin = origin
+        self.retry_after = retry_after
+
+
+def is_failure_exception(exception: Exception) -> bool:
+    """Whether an exception from sending a request means the origin is unreachable"""
+    return isinstance(exception, (Timeout, ConnectionError))
+
+
+class CircuitBreaker:
+    """Closed/open/half-open breaker over a rolling failure rate for one origin"""
+
+    def __init__(self, origin: str, failure_rate_threshold: float = 0.5, min_requests: int = 10,
+                 window: float = 30.0, open_duration: float = 15.0, half_open_max_calls: int = 1):
+        """
+        Initialize breaker.
+
+        Args:
+            origin: Upstream origin this breaker guards
+            failure_rate_threshold: Failure fraction of the window that opens the breaker
+            min_requests: Outcomes the window must hold before the breaker can open
+            window: Seconds of outcomes the failure rate is computed over
+            open_duration: Seconds the breaker stays open before probing
+            half_open_max_calls: Probe requests allowed (and needed to succeed) while half-open
+        """
+        self.origin = origin
+        self.failure_rate_threshold = failure_rate_threshold
+        self.min_requests = max(1, min_requests)
+        self.window = window
+        self.open_duration = open_duration
+        self.half_open_max_calls = max(1, half_open_max_calls)
+
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        # One [second, requests, failures] bucket per second that saw an outcome
+        self._buckets: deque = deque()
+        self._requests = 0
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self._probe_successes = 0
+        self.rejected = 0
+        self.opened = 0
+
+    def _set_state(self, state: str) -> None:
+        """Switch state and publish it (lock held)"""
+        if state != self.state:
+            logger.warning(f"Circuit for {self.origin}: {self.state} -> {state}")
+        self.state = state
+        get_metrics().set_circuit_state(self.origin, STATES.index(state))
+
+    def _trim(self, now: float) -> None:
+        """Drop window buckets older than window seconds (lock held)"""
+        cutoff = int(now - self.window)
+        while self._buckets and self._buckets[0][0] <= cutoff:
+            _, requests, failures = self._buckets.popleft()
+            self._requests -= requests
+            self._failures -= failures
+
+    def _trip(self, now: float) -> None:
+        """Open the breaker (lock held)"""
+        self._opened_at = now
+        self._probes = 0
+        self._probe_successes = 0
+        self.opened += 1
+        self._set_state(OPEN)
+
+    def _reset(self) -> None:
+        """Close the breaker with an empty window (lock held)"""
+        self._buckets.clear()
+        self._requests = 0
+        self._failures = 0
+        self._set_state(CLOSED)
+
+    def before_request(self) -> bool:
+        """
+        Admit a request to the origin.
+
+        Returns:
+            True if the request is a half-open probe (pass it back to record())
+
+        Raises:
+            CircuitOpenError: If the breaker is open or its probes are all in flight
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return False
+            now = time.monotonic()
+            if self.state == OPEN:
+                remaining = self._opened_at + self.open_duration - now
+                if remaining > 0:
+                    self.rejected += 1
+                    get_metrics().record_circuit_rejection(self.origin)
+                    raise CircuitOpenError(self.origin, remaining)
+                self._set_state(HALF_OPEN)
+            if self._probes + self._probe_successes >= self.half_open_max_calls:
+                self.rejected += 1
+                get_metrics().record_circuit_rejection(self.origin)
+                raise CircuitOpenError(self.origin, HALF_OPEN_RETRY_AFTER)
+            self._probes += 1
+            return True
+
+    def record(self, failed: bool, probe: bool = False) -> None:
+        """
+        Record the outcome of an admitted request.
+
+        Args:
+            failed: Whether the origin failed (see is_failure_exception and failure_codes)
+            probe: The value before_request() returned for this request
+        """
+        with self._lock:
+            now = time.monotonic()
+            if probe:
+                if self.state != HALF_OPEN:
+                    return
+                self._probes = max(0, self._probes - 1)
+                if failed:
+                    self._trip(now)
+                else:
+                    self._probe_successes += 1
+                    if self._probe_successes >= self.half_open_max_calls:
+                        self._reset()
+                return
+            if self.state != CLOSED:
+                # Requests sent before the breaker opened do not affect probing
+                return
+
+            second = int(now)
+            if self._buckets and self._buckets[-1][0] == second:
+                bucket = self._buckets[-1]
+            else:
+                bucket = [second, 0, 0]
+                self._buckets.append(bucket)
+            bucket[1] += 1
+            self._requests += 1
+            if failed:
+                bucket[2] += 1
+                self._failures += 1
+            self._trim(now)
+            if (failed and self._requests >= self.min_requests
+                    and self._failures / self._requests >= self.failure_rate_threshold):
+                self._trip(now)
+
+    def abandon(self, probe: bool) -> None:
+        """Forget an admitted request that ended without an outcome (e.g. cancelled)"""
+        if not probe:
+            return
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probes = max(0, self._probes - 1)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return state, window counts and rejections for health reporting"""
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            stats = {
+                "state": self.state,
+                "window_requests": self._requests,
+                "window_failures": self._failures,
+                "failure_rate": round(self._failures / self._requests, 3) if self._requests else 0.0,
+                "opened": self.opened,
+                "rejected": self.rejected,
+            }
+            if self.state == OPEN:
+                stats["retry_in"] = round(max(0.0, self._opened_at + self.open_duration - now), 3)
+            return stats
+
+
+class CircuitBreakers:
+    """Breakers created on first use for each upstream origin"""
+
+    def __init__(self, failure_rate_threshold: float = 0.5, min_requests: int = 10, window: float = 30.0,
+                 open_duration: float = 15.0, half_open_max_calls: int = 1,
+                 failure_codes: Iterable[int] = DEFAULT_FAILURE_CODES):
+        """
+        Initialize breakers (see CircuitBreaker for the settings).
+
+        Args:
+            failure_codes: Upstream response statuses that count as failures
+        """
+        self.settings = {
+            "failure_rate_threshold": failure_rate_threshold,
+            "min_requests": min_requests,
+            "window": window,
+            "open_duration": open_duration,
+            "half_open_max_calls": half_open_max_calls,
+        }
+        self.failure_codes = frozenset(failure_codes)
+        self._lock = threading.Lock()
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    @classmethod
+    def from_config(cls, breaker_config: Optional[Dict[str, Any]]) -> "CircuitBreakers":
+        """Build breakers from the circuit_breaker configuration section"""
+        breaker_config = breaker_config or {}
+        return cls(
+            failure_rate_threshold=breaker_config.get("failure_rate_threshold", 0.5),
+            min_requests=breaker_config.get("min_requests", 10),
+            window=breaker_config.get("window", 30.0),
+            open_duration=breaker_config.get("open_duration", 15.0),
+            half_open_max_calls=breaker_config.get("half_open_max_calls", 1),
+            failure_codes=breaker_config.get("failure_codes") or DEFAULT_FAILURE_CODES,
+        )
+
+    def for_url(self, url: str) -> CircuitBreaker:
+        """Return the breaker of url's origin"""
+        origin = get_origin(url)
+        breaker = self._breakers.get(origin)
+        if breaker is None:
+            with self._lock:
+                breaker = self._breakers.get(origin)
+                if breaker is None:
+                    breaker = self._breakers[origin] = CircuitBreaker(origin, **self.settings)
+        return breaker
+
+    def is_failure_status(self, status_code: int) -> bool:
+        """Whether an upstream response status counts against its origin"""
+        return status_code in self.failure_codes
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return the state of every origin's breaker"""
+        with self._lock:
+            breakers = list(self._breakers.values())
+        return {
+            "enabled": True,
+            "origins": {breaker.origin: breaker.get_stats() for breaker in breakers},
+        }
+
+
+# Process-wide breakers shared by both serving engines (None when disabled)
+_breakers_lock = threading.Lock()
+_breakers: Optional[CircuitBreakers] = None
+
+
+def get_circuit_breakers() -> Optional[CircuitBreakers]:
+    """Return the process-wide circuit breakers, or None if circuit breaking is disabled"""
+    return _breakers
+
+
+def configure_circuit_breakers(breaker_config: Optional[Dict[str, Any]]) -> Optional[CircuitBreakers]:
+    """Replace the process-wide circuit breakers (None when circuit_breaker.enabled is false)"""
+    global _breakers
+    breaker_config = breaker_config or {}
+    new_breakers = CircuitBreakers.from_config(breaker_config) if breaker_config.get("enabled") else None
+    with _breakers_lock:
+        _breakers = new_breakers
+    return new_breakers
@@ -0,0 +1,311 @@
+"""
+Adaptive (AIMD) concurrency limits for upstream calls
+
+Every upstream attempt takes a slot from the limit of its target origin
+(scheme://host[:port]) before it is sent and gives it back when the attempt
+ends. Attempts beyond the limit wait in arrival order; one that would wait
+longer than max_wait is rejected with AdmissionRejected (answered with 503).
+
+The limit moves with the outcome of each attempt:
+
+- Overload - a status in overload_codes (after response_parsing
+  recategorization, so "The model is overloaded" replies count as the 429
+  they were rewritten to) or a timeout - multiplies the limit by
+  decrease_factor. Attempts started before the last decrease do not cut it
+  again, so a burst of overload replies to one cohort counts once.
+- A healthy success - status below 400 with latency within
+  latency_tolerance times the origin's usual latency - while at least half
+  the limit is in use raises it by increase / limit, i.e. about increase per
+  limit's worth of successful attempts.
+- Anything else (other errors, cancelled attempts) leaves it unchanged.
+
+The usual latency is a moving average over successful attempts. For event
+streams the slot is held until the upstream starts answering, so their
+latency is the time to the first byte. Limits are kept per process.
+"""
+import time
+import asyncio
+import threading
+import logging
+from collections import deque
+from typing import Dict, Any, Iterable, Optional
+
+from requests.exceptions import Timeout
+
+from .admission import AdmissionRejected
+from .session_pool import get_origin
+from .metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OVERLOAD_CODES = (429, 503, 504)
+
+REJECT_UPSTREAM_LIMIT = "upstream_limit"
+
+# Weight of each successful attempt in the moving average of an origin's latency
+LATENCY_SMOOTHING = 0.1
+
+
+class _SlotWaiter:
+    """An attempt waiting for a slot; woken by the releasing thread once it holds one"""
+
+    __slots__ = ("enqueued_at", "granted", "_event", "_loop", "_future")
+
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+        self._loop = loop
+        if loop is None:
+            self._event = threading.Event()
+            self._future = None
+        else:
+            self._event = None
+            self._future = loop.create_future()
+
+    def wake(self) -> None:
+        """Tell the waiting thread or coroutine it was granted a slot (called with the lock held)"""
+        if self._event is not None:
+            self._event.set()
+        else:
+            self._loop.call_soon_threadsafe(_resolve, self._future)
+
+
+def _resolve(future: "asyncio.Future") -> None:
+    if not future.done():
+        future.set_result(True)
+
+
+class AdaptiveLimit:
+    """Additive-increase/multiplicative-decrease limit on in-flight attempts to one origin"""
+
+    def __init__(self, origin: str, initial_limit: int = 4, min_limit: int = 1, max_limit: int = 64,
+                 increase: float = 1.0, decrease_factor: float = 0.5, latency_tolerance: float = 2.0,
+                 max_wait: float = 30.0, overload_codes: Iterable[int] = DEFAULT_OVERLOAD_CODES):
+        """
+        Initialize limit.
+
+        Args:
+            origin: Upstream origin this limit applies to
+            initial_limit: In-flight attempts allowed before anything has been learned
+            min_limit: Floor the limit never drops below
+            max_limit: Ceiling the limit never grows above
+            increase: Slots added per limit's worth of healthy attempts made while the limit was in use
+            decrease_factor: Factor the limit is multiplied by on overload
+            latency_tolerance: Multiple of the usual latency an attempt may take and still count as healthy
+            max_wait: Longest an attempt waits for a slot before AdmissionRejected is raised
+            overload_codes: Upstream statuses that mean the origin is overloaded
+        """
+        self.origin = origin
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self.max_wait = max_wait
+        self.overload_codes = frozenset(overload_codes)
+
+        self._lock = threading.Lock()
+        self._limit = float(min(self.max_limit, max(self.min_limit, initial_limit)))
+        self._in_flight = 0
+        self._waiters: deque = deque()
+        self._latency: Optional[float] = None
+        self._last_decrease = float("-inf")
+        self.increased = 0
+        self.decreased = 0
+        self.rejected = 0
+        self._publish()
+
+    @property
+    def limit(self) -> int:
+        """In-flight attempts currently allowed"""
+        return int(self._limit)
+
+    def _publish(self) -> None:
+        """Publish the current limit (lock held)"""
+        get_metrics().set_concurrency_limit(self.origin, int(self._limit))
+
+    def _try_take(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        """Take a slot now, or queue a waiter for one (lock held)"""
+        if not self._waiters and self._in_flight < int(self._limit):
+            self._in_flight += 1
+            return time.monotonic()
+        waiter = _SlotWaiter(loop)
+        self._waiters.append(waiter)
+        return waiter
+
+    def _finish_wait(self, waiter: _SlotWaiter) -> float:
+        """Resolve a wait that ended by wake-up or timeout"""
+        with self._lock:
+            if waiter.granted:
+                return time.monotonic()
+            self._waiters.remove(waiter)
+            self.rejected += 1
+            queued = len(self._waiters)
+        get_metrics().record_admission_rejection(REJECT_UPSTREAM_LIMIT)
+        raise AdmissionRejected(REJECT_UPSTREAM_LIMIT, self.max_wait, queued)
+
+    def acquire(self) -> float:
+        """
+        Wait for a slot in the calling thread.
+
+        Returns:
+            Start time of the attempt, to pass back to release()
+
+        Raises:
+            AdmissionRejected: If no slot frees up within max_wait
+        """
+        with self._lock:
+            entry = self._try_take()
+        if not isinstance(entry, _SlotWaiter):
+            return entry
+        entry._event.wait(self.max_wait)
+        return self._finish_wait(entry)
+
+    async def acquire_async(self) -> float:
+        """Coroutine variant of acquire() that waits without blocking the event loop"""
+        with self._lock:
+            entry = self._try_take(asyncio.get_running_loop())
+        if not isinstance(entry, _SlotWaiter):
+            return entry
+        try:
+            await asyncio.wait_for(asyncio.shield(entry._future), self.max_wait)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            with self._lock:
+                if not entry.granted:
+                    self._waiters.remove(entry)
+                    raise
+            self.release(time.monotonic())
+            raise
+        return self._finish_wait(entry)
+
+    def is_overload(self, status_code: Optional[int], error: Optional[Exception] = None) -> bool:
+        """Whether an attempt's outcome means the origin is overloaded"""
+        if error is not None:
+            return isinstance(error, Timeout)
+        return status_code in self.overload_codes
+
+    def release(self, started_at: float, status_code: Optional[int] = None,
+                error: Optional[Exception] = None) -> None:
+        """
+        Give back a slot and adjust the limit by the attempt's outcome.
+
+        Args:
+            started_at: Value acquire() returned for this attempt
+            status_code: Upstream status after recategorization (None if no response arrived)
+            error: Exception that ended the attempt before it was read in full, if any
+        """
+        with self._lock:
+            now = time.monotonic()
+            latency = now - started_at
+            # Growth needs demand: at least half the limit in use when the attempt ends
+            saturated = self._in_flight * 2 >= self._limit
+            self._in_flight -= 1
+
+            if self.is_overload(status_code, error):
+                if started_at >= self._last_decrease:
+                    self._last_decrease = now
+                    self._set_limit(self._limit * self.decrease_factor)
+                    self.decreased += 1
+            elif error is None and status_code is not None and status_code < 400:
+                healthy = self._latency is None or latency <= self._latency * self.latency_tolerance
+                self._latency = (latency if self._latency is None
+                                 else self._latency + LATENCY_SMOOTHING * (latency - self._latency))
+                if healthy and saturated and self._limit < self.max_limit:
+                    self._set_limit(self._limit + self.increase / self._limit)
+                    self.increased += 1
+
+            while self._waiters and self._in_flight < int(self._limit):
+                waiter = self._waiters.popleft()
+                self._in_flight += 1
+                waiter.granted = True
+                waiter.wake()
+
+    def _set_limit(self, limit: float) -> None:
+        """Clamp and publish a new limit (lock held)"""
+        previous = int(self._limit)
+        self._limit = min(float(self.max_limit), max(float(self.min_limit), limit))
+        if int(self._limit) != previous:
+            logger.info(f"Concurrency limit for {self.origin}: {previous} -> {int(self._limit)}")
+            self._publish()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return limit, usage and adjustment counts for health reporting"""
+        with self._lock:
+            return {
+                "limit": int(self._limit),
+                "in_flight": self._in_flight,
+                "waiting": len(self._waiters),
+                "latency": round(self._latency, 3) if self._latency is not None else None,
+                "increased": self.increased,
+                "decreased": self.decreased,
+                "rejected": self.rejected,
+            }
+
+
+class ConcurrencyLimits:
+    """Adaptive limits created on first use for each upstream origin"""
+
+    def __init__(self, **limit_settings: Any):
+        """
+        Initialize limits.
+
+        Args:
+            **limit_settings: AdaptiveLimit keyword arguments applied to every origin
+        """
+        self.limit_settings = limit_settings
+        self._lock = threading.Lock()
+        self._limits: Dict[str, AdaptiveLimit] = {}
+
+    @classmethod
+    def from_config(cls, limit_config: Optional[Dict[str, Any]]) -> "ConcurrencyLimits":
+        """Build limits from the concurrency_limit configuration section"""
+        limit_config = limit_config or {}
+        return cls(
+            initial_limit=limit_config.get("initial_limit", 4),
+            min_limit=limit_config.get("min_limit", 1),
+            max_limit=limit_config.get("max_limit", 64),
+            increase=limit_config.get("increase", 1.0),
+            decrease_factor=limit_config.get("decrease_factor", 0.5),
+            latency_tolerance=limit_config.get("latency_tolerance", 2.0),
+            max_wait=limit_config.get("max_wait", 30.0),
+            overload_codes=limit_config.get("overload_codes") or DEFAULT_OVERLOAD_CODES,
+        )
+
+    def for_url(self, url: str) -> AdaptiveLimit:
+        """Return the limit of url's origin"""
+        origin = get_origin(url)
+        limit = self._limits.get(origin)
+        if limit is None:
+            with self._lock:
+                limit = self._limits.get(origin)
+                if limit is None:
+                    limit = self._limits[origin] = AdaptiveLimit(origin, **self.limit_settings)
+        return limit
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return every origin's limit"""
+        with self._lock:
+            limits = list(self._limits.values())
+        return {"enabled": True, "origins": {limit.origin: limit.get_stats() for limit in limits}}
+
+
+# Process-wide limits shared by both serving engines (None when disabled)
+_limits_lock = threading.Lock()
+_limits: Optional[ConcurrencyLimits] = None
+
+
+def get_concurrency_limits() -> Optional[ConcurrencyLimits]:
+    """Return the process-wide adaptive concurrency limits, or None if they are disabled"""
+    return _limits
+
+
+def configure_concurrency_limits(limit_config: Optional[Dict[str, Any]]) -> Optional[ConcurrencyLimits]:
+    """Replace the process-wide concurrency limits (None when concurrency_limit.enabled is false)"""
+    global _limits
+    limit_config = limit_config or {}
+    new_limits = ConcurrencyLimits.from_config(limit_config) if limit_config.get("enabled") else None
+    with _limits_lock:
+        _limits = new_limits
+    return new_limits
@@ -56,22 +56,37 @@ class Config:
         except yaml.YAMLError:
             # Use default values if YAML is invalid
             pass
+
+    def load_from_string(self, text: str) -> None:
+        """Load configuration from YAML text (same merge rules as load_from_file)"""
+        try:
+            file_config = yaml.safe_load(text)
+            if file_config:
+                self._config.update(file_config)
+        except yaml.YAMLError:
+            # Use default values if YAML is invalid
+            pass
     
     def validate(self) -> bool:
         """Validate configuration"""
-        # Validate target proxy URL is required
+        # Validate target proxy URL is required, unless an upstream pool supplies the upstreams
+        pool_config = self._config.get("upstream_pool", {})
+        pooled = bool(pool_config.get("enabled", False) and pool_config.get("upstreams"))
         target_proxy = self._config.get("target_proxy")
-        if not target_proxy:
+        if not target_proxy and not pooled:
             raise ValueError("target_proxy configuration section is required")
+        target_proxy = target_proxy or {}
         
         target_url = target_proxy.get("url")
-        if not target_url:
-            raise ValueError("target_proxy.url is required - must be set in config.yaml or PROXY_TARGET_URL environment variable")
+        if not target_url and not pooled:
+            raise ValueError("target_proxy.url is required - must be set in config.yaml or PROXY_TARGET_URL environment variable "
+                             "(or list upstream_pool.upstreams)")
         
-        try:
-            urlparse(target_url)
-        except Exception:
-            raise ValueError(f"Invalid target proxy URL: {target_url}")
+        if target_url:
+            try:
+                urlparse(target_url)
+            except Exception:
+                raise ValueError(f"Invalid target proxy URL: {target_url}")
         
         # Validate timeout if provided
         timeout = target_proxy.get("timeout", 30)
@@ -122,6 +137,18 @@ class Config:
             if not isinstance(max_files, int) or max_files <= 0:
                 raise ValueError("error_logging.max_files must be a positive integer")
         
+        # Validate upstream pool configuration
+        if pool_config.get("enabled", False):
+            if pool_config.get("strategy", "least_outstanding") not in (
+                    "least_outstanding", "ewma_latency", "weighted_round_robin"):
+                raise ValueError("upstream_pool.strategy must be least_outstanding, ewma_latency or weighted_round_robin")
+            for upstream in pool_config.get("upstreams") or []:
+                if not isinstance(upstream, dict) or not upstream.get("url"):
+                    raise ValueError("every upstream_pool.upstreams entry needs a url")
+                weight = upstream.get("weight", 1)
+                if not isinstance(weight, (int, float)) or weight <= 0:
+                    raise ValueError("upstream_pool.upstreams weight must be a positive number")
+
         # Validate regex replacement configuration
         regex_config = self._config.get("regex_replacement", {})
         if regex_config:
@@ -203,6 +230,70 @@ class Config:
     def get_error_handling_config(self) -> Dict[str, Any]:
         """Get error handling configuration"""
         return self._config.get("error_handling", {})
+
+    def get_connection_pool_config(self) -> Dict[str, Any]:
+        """Get upstream connection pool configuration"""
+        return self._config.get("connection_pool", {})
+
+    def get_preprocessing_cache_config(self) -> Dict[str, Any]:
+        """Get per-message preprocessing cache configuration"""
+        return self._config.get("preprocessing_cache", {})
+
+    def get_log_writer_config(self) -> Dict[str, Any]:
+        """Get background request log writer configuration"""
+        return self._config.get("log_writer", {})
+
+    def get_log_sequence_config(self) -> Dict[str, Any]:
+        """Get log file sequence numbering configuration"""
+        return self._config.get("log_sequence", {})
+
+    def get_log_index_config(self) -> Dict[str, Any]:
+        """Get SQLite log index configuration"""
+        return self._config.get("log_index", {})
+
+    def get_metrics_config(self) -> Dict[str, Any]:
+        """Get /metrics configuration"""
+        return self._config.get("metrics", {})
+
+    def get_tracing_config(self) -> Dict[str, Any]:
+        """Get request tracing configuration"""
+        return self._config.get("tracing", {})
+
+    def get_admission_config(self) -> Dict[str, Any]:
+        """Get admission control configuration"""
+        return self._config.get("admission", {})
+
+    def get_circuit_breaker_config(self) -> Dict[str, Any]:
+        """Get upstream circuit breaker configuration"""
+        return self._config.get("circuit_breaker", {})
+
+    def get_rate_limit_config(self) -> Dict[str, Any]:
+        """Get shared upstream rate-limit configuration"""
+        return self._config.get("rate_limit", {})
+
+    def get_concurrency_limit_config(self) -> Dict[str, Any]:
+        """Get adaptive upstream concurrency limit configuration"""
+        return self._config.get("concurrency_limit", {})
+
+    def get_hedging_config(self) -> Dict[str, Any]:
+        """Get request hedging configuration"""
+        return self._config.get("hedging", {})
+
+    def get_singleflight_config(self) -> Dict[str, Any]:
+        """Get in-flight request coalescing configuration"""
+        return self._config.get("singleflight", {})
+
+    def get_response_cache_config(self) -> Dict[str, Any]:
+        """Get deterministic response cache configuration"""
+        return self._config.get("response_cache", {})
+
+    def get_models_cache_config(self) -> Dict[str, Any]:
+        """Get /models listing cache configuration"""
+        return self._config.get("models_cache", {})
+
+    def get_upstream_pool_config(self) -> Dict[str, Any]:
+        """Get multi-upstream pool configuration"""
+        return self._config.get("upstream_pool", {})
     
 
     
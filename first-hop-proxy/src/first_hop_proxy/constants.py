@@ -44,10 +44,146 @@ DEFAULT_CONFIG = {
         "base_delay": 1,
         "max_delay": 60
     },
+    "connection_pool": {
+        "pool_connections": 10,
+        "pool_maxsize": 32,
+        "keep_alive": True,
+        "tcp_keepalive": True,
+        "idle_timeout": 300
+    },
+    "preprocessing_cache": {
+        "enabled": True,
+        "max_entries": 4096,
+        "max_chars": 32000000
+    },
+    "log_writer": {
+        "enabled": True,
+        "max_queue": 1024,
+        "backpressure": "block",
+        "high_watermark": 0.8,
+        "sample_every": 10,
+        "fsync": "never",
+        "fsync_interval": 1.0,
+        "batch_size": 64,
+        "max_open_logs": 256,
+        "shutdown_timeout": 10.0
+    },
+    "log_sequence": {
+        "cross_process": False,
+        "lock_timeout": 5.0,
+        "stale_lock_seconds": 30.0
+    },
+    "log_index": {
+        "enabled": False,
+        "path": "logs/index.sqlite3",
+        "busy_timeout": 5.0
+    },
+    "metrics": {
+        "enabled": True,
+        "latency_buckets": [0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0],
+        "worker_snapshot_dir": "logs/.metrics",
+        "snapshot_interval": 1.0
+    },
+    "admission": {
+        "enabled": False,
+        "max_in_flight": 64,
+        "max_queue": 256,
+        "max_queue_time": 30.0,
+        "retry_after": 5,
+        "per_config_max_in_flight": None,
+        # None uses admission.DEFAULT_PRIORITY_CLASSES; a configured mapping replaces it whole
+        "priority_classes": None,
+        "default_priority_class": "standard",
+        "starvation_timeout": 20.0,
+        "per_chat_max_in_flight": None
+    },
+    "circuit_breaker": {
+        "enabled": False,
+        "failure_rate_threshold": 0.5,
+        "min_requests": 10,
+        "window": 30.0,
+        "open_duration": 15.0,
+        "half_open_max_calls": 1,
+        "failure_codes": [500, 502, 503, 504]
+    },
+    "rate_limit": {
+        "enabled": False,
+        "requests_per_second": None,
+        "burst": 1,
+        "default_cooldown": 5.0,
+        "max_cooldown": 60.0,
+        "resume_interval": 0.25,
+        "max_wait": 120.0
+    },
+    "concurrency_limit": {
+        "enabled": False,
+        "initial_limit": 4,
+        "min_limit": 1,
+        "max_limit": 64,
+        "increase": 1.0,
+        "decrease_factor": 0.5,
+        "latency_tolerance": 2.0,
+        "max_wait": 30.0,
+        "overload_codes": [429, 503, 504]
+    },
+    "hedging": {
+        "enabled": False,
+        "budget_ratio": 0.05,
+        "budget_burst": 10.0,
+        "window": 500,
+        "min_samples": 20,
+        # ST_METADATA operation (or glob pattern) -> {delay | percentile, min_delay, target_url}
+        "operations": {}
+    },
+    "singleflight": {
+        "enabled": False,
+        # ST_METADATA operations (or glob patterns) whose identical in-flight requests share one upstream call
+        "operations": []
+    },
+    "response_cache": {
+        "enabled": False,
+        # ST_METADATA operations (or glob patterns) whose replies are cached
+        "operations": [],
+        "deterministic_only": True,
+        "ttl": 86400.0,
+        "max_entries": 1024,
+        "max_bytes": 64000000,
+        "path": "logs/response_cache.sqlite3",
+        "max_disk_bytes": 512000000,
+        "busy_timeout": 5.0
+    },
+    "models_cache": {
+        "enabled": False,
+        "ttl": 300.0,
+        "stale_ttl": 3600.0,
+        "error_ttl": 30.0,
+        "max_retries": 1
+    },
+    "upstream_pool": {
+        "enabled": False,
+        "strategy": "least_outstanding",
+        "health_smoothing": 0.3,
+        "unhealthy_score": 0.5,
+        "ejection_time": 30.0,
+        # [{url, apikey, weight, priority, name}]
+        "upstreams": []
+    },
+    "tracing": {
+        "enabled": False,
+        "path": "logs/traces.jsonl",
+        "format": "jsonl",
+        "sample_rate": 1.0
+    },
     "server": {
         "host": "0.0.0.0",
         "port": 8765,
-        "debug": False
+        "debug": False,
+        "engine": "flask",
+        "threads": 32,
+        "connection_limit": 100,
+        "channel_timeout": 120,
+        "backlog": 1024,
+        "workers": 1
     },
     "logging": {
         "enabled": True,
@@ -55,7 +191,8 @@ DEFAULT_CONFIG = {
         "include_request_data": True,
         "include_response_data": True,
         "include_headers": True,
-        "include_timing": True
+        "include_timing": True,
+        "format": "markdown"
     },
     "error_logging": {
         "enabled": True,
@@ -1,11 +1,13 @@
 import time
 import random
+import asyncio
+import inspect
 import logging
 import socket
 import ssl
 import json
 import re
-from typing import Callable, Any, Dict, List, Optional
+from typing import Callable, Any, Awaitable, Dict, List, Optional, Pattern, Tuple
 from requests.exceptions import (
     RequestException, Timeout, ConnectionError, HTTPError,
     ProxyError, URLRequired, InvalidURL, ContentDecodingError,
@@ -16,9 +18,34 @@ from urllib3.exceptions import (
     DecodeError, ReadTimeoutError, ConnectTimeoutError
 )
 
+from .metrics import get_metrics, retry_reason
+from .tracing import get_tracer
+
 logger = logging.getLogger(__name__)
 
 
+def compile_hard_stop_rules(rules: List[Dict[str, Any]]) -> List[Tuple[Pattern, Dict[str, Any]]]:
+    """Compile hard stop rule patterns (case-insensitive), skipping empty or invalid ones"""
+    compiled = []
+    for rule in rules or []:
+        pattern = rule.get('pattern', '')
+        if not pattern:
+            continue
+        try:
+            compiled.append((re.compile(pattern, re.IGNORECASE), rule))
+        except re.error as e:
+            logger.warning(f"Invalid hard stop pattern {pattern!r}: {e}")
+    return compiled
+
+
+def match_hard_stop_rule(compiled_rules: List[Tuple[Pattern, Dict[str, Any]]], text: str) -> Optional[Dict[str, Any]]:
+    """Return the first hard stop rule whose pattern matches text"""
+    for regex, rule in compiled_rules:
+        if regex.search(text):
+            return rule
+    return None
+
+
 class ErrorHandler:
     """Error handling and retry logic for the proxy middleware"""
     
@@ -32,9 +59,9 @@ class ErrorHandler:
         
         # Use provided codes or defaults from constants
         from .constants import RETRY_CODES, FAIL_CODES, CONDITIONAL_RETRY_CODES
-        self.retry_codes = retry_codes or RETRY_CODES
-        self.fail_codes = fail_codes or FAIL_CODES
-        self.conditional_retry_codes = conditional_retry_codes or CONDITIONAL_RETRY_CODES
+        self.retry_codes = frozenset(retry_codes or RETRY_CODES)
+        self.fail_codes = frozenset(fail_codes or FAIL_CODES)
+        self.conditional_retry_codes = frozenset(conditional_retry_codes or CONDITIONAL_RETRY_CODES)
         
         # Conditional retry settings
         self.conditional_retry_enabled = True
@@ -45,6 +72,7 @@ class ErrorHandler:
         self.hard_stop_config = hard_stop_config or {}
         self.hard_stop_enabled = self.hard_stop_config.get('enabled', False)
         self.hard_stop_rules = self.hard_stop_config.get('rules', [])
+        self.hard_stop_patterns = compile_hard_stop_rules(self.hard_stop_rules)
     
     def check_hard_stop_conditions(self, response) -> Optional[Dict[str, Any]]:
         """Check if response matches any hard stop conditions"""
@@ -59,13 +87,10 @@ class ErrorHandler:
             response_text = response.content.decode('utf-8', errors='ignore')
         
         # Check each hard stop rule
-        for rule in self.hard_stop_rules:
-            pattern = rule.get('pattern', '')
-            if pattern and re.search(pattern, response_text, re.IGNORECASE):
-                logger.warning(f"Hard stop condition matched: {rule.get('description', 'Unknown')}")
-                return rule
-        
-        return None
+        rule = match_hard_stop_rule(self.hard_stop_patterns, response_text)
+        if rule:
+            logger.warning(f"Hard stop condition matched: {rule.get('description', 'Unknown')}")
+        return rule
     
     def format_hard_stop_response(self, response, hard_stop_rule: Dict[str, Any]) -> Dict[str, Any]:
         """Format response with hard stop user message in OpenAI-compatible format"""
@@ -194,7 +219,7 @@ class ErrorHandler:
     
     def retry_with_backoff(self, func: Callable, context: Optional[Dict[str, Any]] = None,
                           on_retry: Optional[Callable[[int, Exception, float], None]] = None,
-                          *args, **kwargs) -> Any:
+                          *args, failover: Optional[Callable[[], bool]] = None, **kwargs) -> Any:
         """Retry a function with exponential backoff
 
         Args:
@@ -203,6 +228,8 @@ class ErrorHandler:
             on_retry: Optional callback called before each retry with (attempt_number, exception, delay)
                      This is used to finalize the previous log and create a new one for the retry
             *args: Arguments to pass to func
+            failover: Optional check (keyword-only) whether the next attempt can go to another
+                     healthy upstream; if so it is sent without backing off
             **kwargs: Keyword arguments to pass to func
 
         Returns:
@@ -210,10 +237,12 @@ class ErrorHandler:
         """
         last_exception = None
         context = context or {}
+        tracer = get_tracer()
 
         for attempt in range(1, self.max_retries + 2):  # +2 because we start at 1 and include the initial attempt
             try:
-                result = func(*args, **kwargs)
+                with tracer.span("attempt", attempt=attempt):
+                    result = func(*args, **kwargs)
 
                 # If we get here, the function succeeded
                 if attempt > 1:
@@ -222,47 +251,113 @@ class ErrorHandler:
 
             except Exception as e:
                 last_exception = e
+                delay = self._next_retry_delay(e, attempt, context, failover)
 
-                # Extract character/chat info from context for organized logging
-                character_chat_info = context.get("character_chat_info") if context else None
+                # Call retry callback if provided (for log management)
+                if on_retry:
+                    try:
+                        on_retry(attempt, e, delay)
+                    except Exception as callback_error:
+                        logger.error(f"Error in retry callback: {callback_error}")
 
+                with tracer.span("backoff", attempt=attempt, delay=round(delay, 3)):
+                    time.sleep(delay)
 
-                # Check if we should retry this exception
-                if not self.should_retry_exception(e):
-                    logger.error(f"Non-retryable error: {e}")
-                    if self.error_logger:
-                        self.error_logger.log_final_error(e, attempt, context,
-                                                        character_chat_info=character_chat_info)
-                    raise e
+        # This should never be reached, but just in case
+        raise last_exception
 
-                # Check if we've exceeded max retries
-                if attempt > self.max_retries:
-                    logger.error(f"Max retries ({self.max_retries}) exceeded. Last error: {e}")
-                    if self.error_logger:
-                        self.error_logger.log_final_error(e, attempt, context,
-                                                        character_chat_info=character_chat_info)
-                    raise e
+    async def retry_with_backoff_async(self, func: Callable[..., Awaitable[Any]],
+                                       context: Optional[Dict[str, Any]] = None,
+                                       on_retry: Optional[Callable[[int, Exception, float], Any]] = None,
+                                       *args, failover: Optional[Callable[[], bool]] = None,
+                                       **kwargs) -> Any:
+        """Async variant of retry_with_backoff that waits with asyncio.sleep
 
-                # Calculate delay and wait
-                delay = self.calculate_retry_delay(attempt)
-                logger.warning(f"Attempt {attempt} failed: {e}. Retrying in {delay:.2f} seconds...")
+        Args:
+            func: Coroutine function to retry
+            context: Context dictionary for error logging
+            on_retry: Optional callback (plain or coroutine function) called before each
+                     retry with (attempt_number, exception, delay)
+            *args: Arguments to pass to func
+            failover: Optional check (keyword-only) whether the next attempt can go to another healthy upstream
+            **kwargs: Keyword arguments to pass to func
+
+        Returns:
+            Result from successful function call
+        """
+        last_exception = None
+        context = context or {}
+        tracer = get_tracer()
 
-                # Log retry attempt if error logger is available
-                if self.error_logger:
-                    self.error_logger.log_retry_attempt(e, attempt, delay, context,
-                                                      character_chat_info=character_chat_info)
+        for attempt in range(1, self.max_retries + 2):
+            try:
+                with tracer.span("attempt", attempt=attempt):
+                    result = await func(*args, **kwargs)
+
+                if attempt > 1:
+                    logger.info(f"Function succeeded after {attempt} attempts")
+                return result
+
+            except Exception as e:
+                last_exception = e
+                delay = self._next_retry_delay(e, attempt, context, failover)
 
-                # Call retry callback if provided (for log management)
                 if on_retry:
                     try:
-                        on_retry(attempt, e, delay)
+                        callback_result = on_retry(attempt, e, delay)
+                        if inspect.isawaitable(callback_result):
+                            await callback_result
                     except Exception as callback_error:
                         logger.error(f"Error in retry callback: {callback_error}")
 
-                time.sleep(delay)
+                with tracer.span("backoff", attempt=attempt, delay=round(delay, 3)):
+                    await asyncio.sleep(delay)
 
-        # This should never be reached, but just in case
         raise last_exception
+
+    def _next_retry_delay(self, e: Exception, attempt: int, context: Dict[str, Any],
+                          failover: Optional[Callable[[], bool]] = None) -> float:
+        """Decide whether a failed attempt is retried and return the backoff delay
+
+        Raises the exception when it is not retryable or retries are exhausted.
+        """
+        # Extract character/chat info from context for organized logging
+        character_chat_info = context.get("character_chat_info") if context else None
+
+        # Check if we should retry this exception
+        if not self.should_retry_exception(e):
+            logger.error(f"Non-retryable error: {e}")
+            if self.error_logger:
+                self.error_logger.log_final_error(e, attempt, context,
+                                                character_chat_info=character_chat_info)
+            raise e
+
+        # Check if we've exceeded max retries
+        if attempt > self.max_retries:
+            logger.error(f"Max retries ({self.max_retries}) exceeded. Last error: {e}")
+            if self.error_logger:
+                self.error_logger.log_final_error(e, attempt, context,
+                                                character_chat_info=character_chat_info)
+            raise e
+
+        # Calculate delay and wait
+        delay = self.calculate_retry_delay(attempt)
+        response = getattr(e, 'response', None)
+        if getattr(response, 'status_code', None) == 429 and getattr(response, 'rate_limit_cooldown', 0.0) > 0:
+            # The shared rate-limit gate holds the next attempt until the cooldown ends
+            delay = 0.0
+        if failover is not None and failover():
+            # The next attempt goes to another healthy upstream right away
+            delay = 0.0
+        logger.warning(f"Attempt {attempt} failed: {e}. Retrying in {delay:.2f} seconds...")
+
+        # Log retry attempt if error logger is available
+        if self.error_logger:
+            self.error_logger.log_retry_attempt(e, attempt, delay, context,
+                                              character_chat_info=character_chat_info)
+        get_metrics().record_retry(retry_reason(e))
+
+        return delay
     
     def retry_with_conditional_logic(self, func: Callable, context: Dict[str, Any] = None, *args, **kwargs) -> Any:
         """Retry a function with conditional logic based on context"""
@@ -1,14 +1,15 @@
 import os
 import json
 import time
-import re
-import threading
 from datetime import datetime
 from typing import Dict, Any, Optional, Union, Tuple
 import logging
 from requests import Response
 from requests.exceptions import RequestException
 
+from .log_sequence import get_log_sequence
+from .log_index import get_log_index
+
 logger = logging.getLogger(__name__)
 
 
@@ -30,9 +31,6 @@ class ErrorLogger:
         self.max_file_size_mb = self.config.get("max_file_size_mb", 10)
         self.max_files = self.config.get("max_files", 100)
 
-        # Thread-safe log number generation
-        self._log_number_lock = threading.Lock()
-
         # Create base error logs directory if enabled
         if self.enabled:
             os.makedirs(self.error_logs_folder, exist_ok=True)
@@ -59,10 +57,10 @@ class ErrorLogger:
 
     def _get_next_error_log_number(self, folder: str, operation: str) -> int:
         """
-        Get the next sequential log number for the given folder.
+        Get the next sequential log number for the given folder without reserving it.
 
-        Scans ALL log files (both regular and error logs) regardless of operation type
-        to maintain sequential numbering across all logs.
+        Numbering is shared by ALL logs in a folder (both regular and error logs,
+        through the process-wide LogSequenceAllocator).
 
         Args:
             folder: Log folder path
@@ -71,30 +69,12 @@ class ErrorLogger:
         Returns:
             Next sequential log number (1-based)
         """
-        if not os.path.exists(folder):
-            return 1
-
-        # Find all log files matching the pattern: <number>-<anything>.md
-        # This includes both regular logs and error logs
-        max_num = 0
-        pattern = re.compile(r'^(\d+)-.+\.md$')
-
-        try:
-            for filename in os.listdir(folder):
-                match = pattern.match(filename)
-                if match:
-                    num = int(match.group(1))
-                    max_num = max(max_num, num)
-        except Exception as e:
-            logger.error(f"Error scanning log folder {folder}: {e}")
-
-        return max_num + 1
+        return get_log_sequence().peek(folder)
 
     def _get_sequenced_error_filename(self, operation: str, folder: str, retry_attempt: Optional[int] = None) -> Tuple[str, str]:
         """
         Generate filename with sequential numbering, operation type, and ERROR suffix.
-        Thread-safe: Uses lock to prevent race conditions in log numbering.
-        Creates an empty file immediately to claim the number.
+        Thread-safe: the number is reserved by the process-wide LogSequenceAllocator.
 
         Args:
             operation: Operation type (e.g., 'chat', 'lorebook')
@@ -107,23 +87,13 @@ class ErrorLogger:
             - Original request: <number>-<operation>-ERROR.md (e.g., 00019-chat-ERROR.md)
             - Proxy retry: <number>-<operation>-PROXY-ERROR.md (e.g., 00019-chat-PROXY-ERROR.md)
         """
-        with self._log_number_lock:
-            log_number = self._get_next_error_log_number(folder, operation)
-            if retry_attempt is not None and retry_attempt > 0:
-                filename = f"{log_number:05d}-{operation}-attempt{retry_attempt}-PROXY-ERROR.md"
-            else:
-                filename = f"{log_number:05d}-{operation}-ERROR.md"
-            filepath = os.path.join(folder, filename)
-
-            # Create empty file immediately to claim this log number
-            try:
-                with open(filepath, 'w', encoding='utf-8') as f:
-                    f.write(f"# Error Log - {datetime.now().isoformat()}\n\n")
-                    f.write("**Status:** Logging error...\n\n")
-            except Exception as e:
-                logger.error(f"Failed to create initial error log file {filepath}: {e}")
-
-            return filename, filepath
+        log_number = get_log_sequence().allocate(folder)
+        if retry_attempt is not None and retry_attempt > 0:
+            filename = f"{log_number:05d}-{operation}-attempt{retry_attempt}-PROXY-ERROR.md"
+        else:
+            filename = f"{log_number:05d}-{operation}-ERROR.md"
+        filepath = os.path.join(folder, filename)
+        return filename, filepath
 
     def _get_error_filename(self, error_code: Union[int, str], timestamp: Optional[float] = None) -> str:
         """Generate filename for error log based on error code and timestamp (legacy/unsorted)"""
@@ -292,6 +262,11 @@ class ErrorLogger:
                 f.write('\n'.join(log_content))
             
             logger.info(f"Error logged to: {filepath}")
+            index = get_log_index()
+            if index is not None:
+                index.record_error(filepath, error_code, error, time.time(),
+                                   character_chat_info=character_chat_info,
+                                   request_id=(context or {}).get("request_id"), retry_count=retry_attempt)
             return filepath
         except Exception as e:
             logger.error(f"Failed to write error log to {filepath}: {e}")
@@ -0,0 +1,298 @@
+"""
+Compiled per-config execution plans
+
+A plan bundles everything a request needs from one config (compiled regex
+rules and rewrite programs, ResponseParser, ErrorHandler and ProxyClient objects) so that the
+per-request setup cost is a dictionary lookup. Plans for config files are
+cached and rebuilt only when the file's mtime/size change and its content
+hash differs.
+"""
+import os
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+from .config import Config
+from .error_handler import ErrorHandler
+from .models_cache import ModelsCache
+from .proxy_client import ProxyClient
+from .response_parser import ResponseParser
+from .upstream_pool import UpstreamPool
+from .utils import compile_regex_rules, RegexRuleSet
+
+logger = logging.getLogger(__name__)
+
+
+def config_fingerprint(config: Config) -> str:
+    """SHA-256 of a Config's canonical JSON, stable across restarts and worker processes"""
+    canonical = json.dumps(config.get_all_config(), sort_keys=True, separators=(",", ":"),
+                           ensure_ascii=False, default=repr)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def create_error_handler(active_config: Config, active_error_logger: Optional[Any] = None,
+                         max_retries: Optional[int] = None) -> ErrorHandler:
+    """Build an ErrorHandler from a config's error_handling section
+
+    max_retries, when given, overrides error_handling.max_retries.
+    """
+    error_config = active_config.get_error_handling_config()
+    if max_retries is None:
+        max_retries = error_config.get("max_retries", 10)
+    base_delay = error_config.get("base_delay", 1.0)
+    max_delay = error_config.get("max_delay", 60.0)
+    retry_codes = error_config.get("retry_codes", [429, 502, 503, 504])
+    fail_codes = error_config.get("fail_codes", [400, 401, 403])
+    conditional_retry_codes = error_config.get("conditional_retry_codes", [404, 411, 412])
+
+    # Get hard stop configuration
+    hard_stop_config = error_config.get("hard_stop_conditions", {})
+
+    return ErrorHandler(
+        max_retries=max_retries,
+        base_delay=base_delay,
+        max_delay=max_delay,
+        error_logger=active_error_logger,
+        hard_stop_config=hard_stop_config,
+        retry_codes=retry_codes,
+        fail_codes=fail_codes,
+        conditional_retry_codes=conditional_retry_codes
+    )
+
+
+class ExecutionPlan:
+    """Compiled, reusable view of one config; treat as read-only once built"""
+
+    def __init__(self, config: Config, source: Optional[str] = None, fingerprint: Optional[str] = None):
+        """
+        Compile a config into a plan.
+
+        Args:
+            config: Loaded Config (must not be mutated afterwards)
+            source: Absolute path of the config file, or None for an in-memory config
+            fingerprint: SHA-256 of the config file contents (config_fingerprint() for in-memory configs)
+        """
+        self.config = config
+        self.source = source
+        self.fingerprint = fingerprint
+
+        regex_config = config.get_regex_replacement_config()
+        if regex_config.get("enabled", False):
+            self.request_rules = tuple(compile_regex_rules(regex_config.get("rules", []) or []))
+        else:
+            self.request_rules = ()
+        # Literal rules are fused into one pass per message role
+        self.request_rule_set = RegexRuleSet(self.request_rules)
+
+        # Upstream slots for requests using this config (None: only the global limit applies)
+        self.admission_limit = config.get_admission_config().get("per_config_max_in_flight")
+
+        # Upstreams chat completions are balanced over (None: target_proxy.url only)
+        self.upstream_pool = UpstreamPool.from_config(config.get_upstream_pool_config())
+
+        # /models listings with stale-while-revalidate refreshes (None: every request goes upstream)
+        self.models_cache = ModelsCache.from_config(config.get_models_cache_config())
+
+        try:
+            self.response_parser = ResponseParser(config)
+        except Exception as e:
+            logger.error(f"Failed to initialize ResponseParser for plan: {e}")
+            self.response_parser = None
+
+        # Client objects depend on the (cached) error logger and target URL, so they
+        # are built on first use and then reused
+        self._error_handlers: Dict[Any, ErrorHandler] = {}
+        self._models_error_handlers: Dict[Any, ErrorHandler] = {}
+        self._proxy_clients: Dict[Tuple[Any, ...], ProxyClient] = {}
+        self._lock = threading.Lock()
+
+    def get_error_handler(self, error_logger: Optional[Any] = None) -> ErrorHandler:
+        """Return the ErrorHandler for this config and error logger"""
+        handler = self._error_handlers.get(error_logger)
+        if handler is None:
+            with self._lock:
+                handler = self._error_handlers.get(error_logger)
+                if handler is None:
+                    handler = create_error_handler(self.config, error_logger)
+                    self._error_handlers[error_logger] = handler
+        return handler
+
+    def get_models_error_handler(self, error_logger: Optional[Any] = None) -> ErrorHandler:
+        """Return the ErrorHandler for cached /models fetches, limited to models_cache.max_retries"""
+        handler = self._models_error_handlers.get(error_logger)
+        if handler is None:
+            with self._lock:
+                handler = self._models_error_handlers.get(error_logger)
+                if handler is None:
+                    handler = create_error_handler(self.config, error_logger, max_retries=self.models_cache.max_retries)
+                    self._models_error_handlers[error_logger] = handler
+        return handler
+
+    def get_proxy_client(self, target_url: str, error_logger: Optional[Any] = None,
+                         api_key: Optional[str] = None) -> ProxyClient:
+        """Return the ProxyClient for a target URL (and upstream API key), sharing this plan's ResponseParser"""
+        key = (target_url, error_logger, api_key)
+        client = self._proxy_clients.get(key)
+        if client is None:
+            with self._lock:
+                client = self._proxy_clients.get(key)
+                if client is None:
+                    client = ProxyClient(target_url, error_logger=error_logger, config=self.config,
+                                         response_parser=self.response_parser, api_key=api_key)
+                    self._proxy_clients[key] = client
+        return client
+
+    def get_async_proxy_client(self, target_url: str, http_client: Any, error_logger: Optional[Any] = None,
+                               api_key: Optional[str] = None):
+        """Return the AsyncProxyClient for a target URL, httpx client and upstream API key"""
+        from .async_client import AsyncProxyClient
+
+        key = (target_url, error_logger, http_client, api_key)
+        client = self._proxy_clients.get(key)
+        if client is None:
+            with self._lock:
+                client = self._proxy_clients.get(key)
+                if client is None:
+                    client = AsyncProxyClient(target_url, http_client, error_logger=error_logger,
+                                              config=self.config, response_parser=self.response_parser,
+                                              api_key=api_key)
+                    self._proxy_clients[key] = client
+        return client
+
+
+class _FilePlanEntry:
+    """Cached plan plus the file stamp it was validated against"""
+
+    def __init__(self, plan: ExecutionPlan, stamp: Tuple[int, int]):
+        self.plan = plan
+        self.stamp = stamp
+
+
+class ExecutionPlanCache:
+    """Thread-safe cache of execution plans for config files and in-memory configs"""
+
+    def __init__(self, max_config_plans: int = 64):
+        """
+        Initialize empty cache.
+
+        Args:
+            max_config_plans: Bound on plans kept for in-memory Config objects
+                              (keyed by identity, since Config is unhashable)
+        """
+        self.max_config_plans = max_config_plans
+        self._file_plans: Dict[str, _FilePlanEntry] = {}
+        # File plans indexed by their Config's identity so get_for_config finds them
+        self._file_plans_by_config: Dict[int, ExecutionPlan] = {}
+        self._config_plans: "OrderedDict[int, Tuple[Config, ExecutionPlan]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.builds = 0
+        self.hits = 0
+
+    def get_for_config(self, config: Config) -> ExecutionPlan:
+        """Return the plan for a Config (the default config, or one returned by get_for_file)"""
+        plan = self._file_plans_by_config.get(id(config))
+        if plan is not None and plan.config is config:
+            self.hits += 1
+            return plan
+
+        entry = self._config_plans.get(id(config))
+        if entry is not None and entry[0] is config:
+            self.hits += 1
+            return entry[1]
+
+        with self._lock:
+            entry = self._config_plans.get(id(config))
+            if entry is None or entry[0] is not config:
+                entry = (config, ExecutionPlan(config, fingerprint=config_fingerprint(config)))
+                self._remember_config_plan(entry[1])
+                self.builds += 1
+        return entry[1]
+
+    def _remember_config_plan(self, plan: ExecutionPlan) -> None:
+        """Index a plan by its Config identity, evicting the oldest beyond the bound (lock held)"""
+        self._config_plans[id(plan.config)] = (plan.config, plan)
+        self._config_plans.move_to_end(id(plan.config))
+        while len(self._config_plans) > self.max_config_plans:
+            self._config_plans.popitem(last=False)
+
+    def get_for_file(self, filename: str) -> ExecutionPlan:
+        """
+        Return the plan for a config file, rebuilding it only when the file changed.
+
+        Args:
+            filename: Config filename (relative paths resolve against the working directory)
+
+        Raises:
+            FileNotFoundError: If config file doesn't exist
+        """
+        path = os.path.abspath(filename)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            raise FileNotFoundError(f"Config file not found: {filename}")
+        stamp = (stat.st_mtime_ns, stat.st_size)
+
+        entry = self._file_plans.get(path)
+        if entry is not None and entry.stamp == stamp:
+            self.hits += 1
+            return entry.plan
+
+        with self._lock:
+            entry = self._file_plans.get(path)
+            if entry is not None and entry.stamp == stamp:
+                self.hits += 1
+                return entry.plan
+
+            with open(path, "rb") as f:
+                raw = f.read()
+            fingerprint = hashlib.sha256(raw).hexdigest()
+
+            # Touched but unchanged files keep their plan
+            if entry is not None and entry.plan.fingerprint == fingerprint:
+                entry.stamp = stamp
+                self.hits += 1
+                return entry.plan
+
+            config = Config()
+            config.load_from_string(raw.decode("utf-8"))
+            plan = ExecutionPlan(config, source=path, fingerprint=fingerprint)
+            if entry is not None:
+                self._file_plans_by_config.pop(id(entry.plan.config), None)
+            self._file_plans[path] = _FilePlanEntry(plan, stamp)
+            self._file_plans_by_config[id(config)] = plan
+            self.builds += 1
+            logger.info(f"Compiled execution plan for {path} ({fingerprint[:12]})")
+            return plan
+
+    def invalidate(self, filename: Optional[str] = None) -> None:
+        """Drop one cached file plan, or every cached plan when filename is None"""
+        with self._lock:
+            if filename is None:
+                self._file_plans.clear()
+                self._file_plans_by_config.clear()
+                self._config_plans.clear()
+            else:
+                entry = self._file_plans.pop(os.path.abspath(filename), None)
+                if entry is not None:
+                    self._file_plans_by_config.pop(id(entry.plan.config), None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return cache counters for health reporting"""
+        return {
+            "file_plans": len(self._file_plans),
+            "config_plans": len(self._config_plans),
+            "builds": self.builds,
+            "hits": self.hits,
+        }
+
+
+# Process-wide plan cache shared by all serving engines
+_plan_cache = ExecutionPlanCache()
+
+
+def get_plan_cache() -> ExecutionPlanCache:
+    """Return the process-wide execution plan cache"""
+    return _plan_cache
@@ -0,0 +1,373 @@
+"""
+Request hedging for latency-critical operations
+
+Requests whose ST_METADATA operation matches a hedging policy (exact name or
+glob pattern, e.g. "chat" or "detect_scene_break*") send each upstream
+attempt as a race. If the first copy has not returned within the policy's
+delay, a second identical copy is sent, to the same target or to the
+policy's target_url. The first success is returned and the other copy is
+dropped: the asyncio engine cancels it, the threaded engine (whose blocking
+requests cannot be interrupted) lets it finish in the background and closes
+its response. If both copies fail, the first copy's error goes to
+ErrorHandler, which retries the attempt as usual.
+
+The delay is either fixed (delay) or a live percentile of the policy's
+recent successful attempt latencies (percentile, used once min_samples have
+been seen and never below min_delay). Until enough samples exist a
+percentile policy does not hedge. Hedges draw on one global budget: every
+hedgeable attempt adds budget_ratio tokens, up to budget_burst, and a hedge
+spends one, so hedges stay within budget_ratio extra attempts overall.
+"""
+import math
+import time
+import fnmatch
+import asyncio
+import threading
+import contextvars
+import logging
+from collections import deque
+from typing import Dict, Any, Awaitable, Callable, List, Optional, Tuple
+
+from .metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+HEDGE_PRIMARY_WON = "primary_won"
+HEDGE_WON = "hedge_won"
+HEDGE_BOTH_FAILED = "both_failed"
+HEDGE_BUDGET_EXHAUSTED = "budget_exhausted"
+
+# Operations whose policy lookups are remembered before the cache is reset
+MAX_CACHED_OPERATIONS = 1024
+
+# Sends one copy of an upstream attempt; called with the alternate target URL or None for the request's own
+Attempt = Callable[[Optional[str]], Any]
+
+
+class HedgePolicy:
+    """When and where the operations matching one pattern are hedged"""
+
+    def __init__(self, name: str, delay: Optional[float] = None, percentile: Optional[float] = None,
+                 min_delay: float = 0.0, target_url: Optional[str] = None, window: int = 500,
+                 min_samples: int = 20):
+        """
+        Initialize policy.
+
+        Args:
+            name: Operation name or glob pattern the policy applies to
+            delay: Fixed seconds before the hedge is sent
+            percentile: Latency percentile (0-1) of recent attempts used as the delay instead
+            min_delay: Lowest delay a percentile may produce
+            target_url: Alternate target for the hedge (None sends it to the request's own target)
+            window: Recent successful attempt latencies kept for the percentile
+            min_samples: Latencies needed before the percentile is trusted
+        """
+        if delay is None and percentile is None:
+            raise ValueError(f"Hedging policy {name!r} needs a delay or a percentile")
+        if percentile is not None and not 0 < percentile < 1:
+            raise ValueError(f"Hedging policy {name!r} percentile must be between 0 and 1, got {percentile!r}")
+        self.name = name
+        self.delay = delay
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.target_url = target_url
+        self.min_samples = max(1, min_samples)
+        self._latencies: deque = deque(maxlen=max(1, window))
+        self._lock = threading.Lock()
+        self.counts: Dict[str, int] = {}
+
+    def record_latency(self, seconds: float) -> None:
+        """Add the latency of a successful attempt"""
+        with self._lock:
+            self._latencies.append(seconds)
+
+    def current_delay(self) -> Optional[float]:
+        """Seconds to wait before hedging, or None if the policy cannot hedge yet"""
+        if self.delay is not None:
+            return self.delay
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            ordered = sorted(self._latencies)
+        index = min(len(ordered) - 1, max(0, math.ceil(self.percentile * len(ordered)) - 1))
+        return max(self.min_delay, ordered[index])
+
+    def count(self, result: str) -> None:
+        """Count a race result (see the HEDGE_* constants)"""
+        with self._lock:
+            self.counts[result] = self.counts.get(result, 0) + 1
+        get_metrics().record_hedge(self.name, result)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return the current delay, sample count and race results"""
+        delay = self.current_delay()
+        with self._lock:
+            return {
+                "delay": round(delay, 3) if delay is not None else None,
+                "samples": len(self._latencies),
+                "target_url": self.target_url,
+                **self.counts,
+            }
+
+
+class HedgeBudget:
+    """Token bucket that keeps hedges to a fraction of attempts"""
+
+    def __init__(self, ratio: float = 0.05, burst: float = 10.0):
+        """
+        Initialize budget.
+
+        Args:
+            ratio: Tokens earned per hedgeable attempt (the share of extra attempts allowed)
+            burst: Most tokens that can be saved up
+        """
+        self.ratio = ratio
+        self.burst = max(1.0, burst)
+        self._lock = threading.Lock()
+        self._tokens = 0.0
+
+    def record_attempt(self) -> None:
+        """Earn tokens for a hedgeable attempt"""
+        with self._lock:
+            self._tokens = min(self.burst, self._tokens + self.ratio)
+
+    def try_spend(self) -> bool:
+        """Take one token for a hedge; False if the budget is used up"""
+        with self._lock:
+            if self._tokens < 1.0:
+                return False
+            self._tokens -= 1.0
+            return True
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return the tokens available"""
+        with self._lock:
+            return {"ratio": self.ratio, "tokens": round(self._tokens, 3)}
+
+
+def _discard(value: Any) -> None:
+    """Close a losing copy's response (unread event streams hold a connection)"""
+    close = getattr(value, "close", None)
+    if callable(close):
+        try:
+            close()
+        except Exception as close_error:
+            logger.debug(f"Failed to close hedged response: {close_error}")
+
+
+class _Race:
+    """Copies of one attempt running in threads; the first success wins"""
+
+    def __init__(self, policy: HedgePolicy):
+        self.policy = policy
+        self._cond = threading.Condition()
+        self.started = 0
+        self.failures: List[Tuple[int, Exception]] = []
+        self.winner: Optional[Tuple[int, Any]] = None
+
+    def start(self, attempt: Attempt, target_url: Optional[str]) -> None:
+        """Send one more copy in its own thread, carrying the trace context along"""
+        with self._cond:
+            index = self.started
+            self.started += 1
+        context = contextvars.copy_context()
+        threading.Thread(target=context.run, args=(self._run, index, attempt, target_url),
+                         name=f"hedge-{self.policy.name}-{index}", daemon=True).start()
+
+    def _run(self, index: int, attempt: Attempt, target_url: Optional[str]) -> None:
+        started = time.monotonic()
+        try:
+            value = attempt(target_url)
+        except Exception as e:
+            with self._cond:
+                self.failures.append((index, e))
+                self._cond.notify_all()
+            return
+        self.policy.record_latency(time.monotonic() - started)
+        with self._cond:
+            if self.winner is None:
+                self.winner = (index, value)
+                self._cond.notify_all()
+                return
+        _discard(value)
+
+    def wait(self, timeout: Optional[float]) -> bool:
+        """Wait until a copy succeeded or all failed; False if timeout passed first"""
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: self.winner is not None or len(self.failures) == self.started, timeout)
+
+    def result(self) -> Any:
+        """Return the winning copy's result, or raise the first copy's error"""
+        with self._cond:
+            if self.winner is not None:
+                index, value = self.winner
+                if self.started > 1:
+                    self.policy.count(HEDGE_WON if index else HEDGE_PRIMARY_WON)
+                return value
+            if self.started > 1:
+                self.policy.count(HEDGE_BOTH_FAILED)
+            raise min(self.failures, key=lambda failure: failure[0])[1]
+
+
+class Hedger:
+    """Hedging policies by operation plus the shared hedge budget"""
+
+    def __init__(self, policies: Optional[Dict[str, Dict[str, Any]]] = None, budget_ratio: float = 0.05,
+                 budget_burst: float = 10.0, window: int = 500, min_samples: int = 20):
+        """
+        Initialize hedger.
+
+        Args:
+            policies: Operation name or glob pattern -> HedgePolicy settings (delay, percentile,
+                      min_delay, target_url)
+            budget_ratio: Extra attempts allowed as a share of hedgeable attempts
+            budget_burst: Hedges that may be saved up while traffic is calm
+            window: Latencies kept per policy for percentile delays
+            min_samples: Latencies a percentile policy needs before it hedges
+        """
+        self.policies = [
+            HedgePolicy(name, delay=settings.get("delay"), percentile=settings.get("percentile"),
+                        min_delay=settings.get("min_delay", 0.0), target_url=settings.get("target_url"),
+                        window=window, min_samples=min_samples)
+            for name, settings in (policies or {}).items()
+        ]
+        self.budget = HedgeBudget(budget_ratio, budget_burst)
+        self._operation_policies: Dict[Optional[str], Optional[HedgePolicy]] = {}
+
+    @classmethod
+    def from_config(cls, hedging_config: Optional[Dict[str, Any]]) -> "Hedger":
+        """Build a hedger from the hedging configuration section"""
+        hedging_config = hedging_config or {}
+        return cls(
+            policies=hedging_config.get("operations") or {},
+            budget_ratio=hedging_config.get("budget_ratio", 0.05),
+            budget_burst=hedging_config.get("budget_burst", 10.0),
+            window=hedging_config.get("window", 500),
+            min_samples=hedging_config.get("min_samples", 20),
+        )
+
+    def policy_for(self, operation: Optional[str]) -> Optional[HedgePolicy]:
+        """Hedging policy of an ST_METADATA operation (None if it is not hedged)"""
+        if not operation:
+            return None
+        try:
+            return self._operation_policies[operation]
+        except KeyError:
+            pass
+        policy = next((policy for policy in self.policies
+                       if operation == policy.name or fnmatch.fnmatchcase(operation, policy.name)), None)
+        if len(self._operation_policies) >= MAX_CACHED_OPERATIONS:
+            self._operation_policies.clear()
+        self._operation_policies[operation] = policy
+        return policy
+
+    def run(self, policy: HedgePolicy, attempt: Attempt) -> Any:
+        """
+        Send an attempt in the calling thread, hedged by a second copy if it is slow.
+
+        Args:
+            policy: Policy of the request's operation
+            attempt: Sends one copy (see Attempt)
+
+        Returns:
+            The first successful copy's result
+
+        Raises:
+            Exception: The first copy's error if no copy succeeded
+        """
+        self.budget.record_attempt()
+        delay = policy.current_delay()
+        if delay is None:
+            started = time.monotonic()
+            result = attempt(None)
+            policy.record_latency(time.monotonic() - started)
+            return result
+
+        race = _Race(policy)
+        race.start(attempt, None)
+        if not race.wait(delay):
+            if self.budget.try_spend():
+                logger.info(f"Hedging {policy.name} attempt after {delay:.2f}s")
+                race.start(attempt, policy.target_url)
+            else:
+                policy.count(HEDGE_BUDGET_EXHAUSTED)
+            race.wait(None)
+        return race.result()
+
+    async def run_async(self, policy: HedgePolicy, attempt: Callable[[Optional[str]], Awaitable[Any]]) -> Any:
+        """Coroutine variant of run(); the losing copy is cancelled"""
+        self.budget.record_attempt()
+        delay = policy.current_delay()
+
+        async def timed(target_url: Optional[str]) -> Any:
+            started = time.monotonic()
+            result = await attempt(target_url)
+            policy.record_latency(time.monotonic() - started)
+            return result
+
+        if delay is None:
+            return await timed(None)
+
+        tasks = [asyncio.ensure_future(timed(None))]
+        winner = None
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=delay)
+            if not done and not self.budget.try_spend():
+                policy.count(HEDGE_BUDGET_EXHAUSTED)
+                await asyncio.wait(tasks)
+            if tasks[0].done():
+                winner = tasks[0]
+                return tasks[0].result()
+            logger.info(f"Hedging {policy.name} attempt after {delay:.2f}s")
+            tasks.append(asyncio.ensure_future(timed(policy.target_url)))
+
+            pending = set(tasks)
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winner = next((task for task in tasks if task in done and task.exception() is None), None)
+            if winner is not None:
+                policy.count(HEDGE_WON if winner is tasks[1] else HEDGE_PRIMARY_WON)
+                return winner.result()
+            policy.count(HEDGE_BOTH_FAILED)
+            raise tasks[0].exception()
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+                elif task is not winner and not task.cancelled() and task.exception() is None:
+                    # Both finished in the same wake-up: release the loser's response
+                    aclose = getattr(task.result(), "aclose", None)
+                    if aclose is not None:
+                        try:
+                            await aclose()
+                        except Exception as close_error:
+                            logger.debug(f"Failed to close hedged response: {close_error}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return the budget and every policy's delay and race results"""
+        return {
+            "enabled": True,
+            "budget": self.budget.get_stats(),
+            "operations": {policy.name: policy.get_stats() for policy in self.policies},
+        }
+
+
+# Process-wide hedger shared by both serving engines (None when disabled)
+_hedger_lock = threading.Lock()
+_hedger: Optional[Hedger] = None
+
+
+def get_hedger() -> Optional[Hedger]:
+    """Return the process-wide hedger, or None if hedging is disabled"""
+    return _hedger
+
+
+def configure_hedging(hedging_config: Optional[Dict[str, Any]]) -> Optional[Hedger]:
+    """Replace the process-wide hedger (None when hedging.enabled is false)"""
+    global _hedger
+    hedging_config = hedging_config or {}
+    new_hedger = Hedger.from_config(hedging_config) if hedging_config.get("enabled") else None
+    with _hedger_lock:
+        _hedger = new_hedger
+    return new_hedger
@@ -0,0 +1,403 @@
+"""
+SQLite index of request and error logs
+
+The markdown logs are the record of what was sent and received, but finding
+slow or failed calls in them means walking logs/characters/<char>/<chat>/
+and scraping every file. When enabled, RequestLogger adds one row per
+attempt (updated when the attempt ends) and ErrorLogger one row per error
+log to a local SQLite database, which /logs/query and the command line
+filter and aggregate without reading the log files.
+
+Usage:
+    python -m first_hop_proxy.log_index --character Senta --status ratelimit
+    python -m first_hop_proxy.log_index --group-by operation --since 2025-11-01
+"""
+import os
+import sys
+import json
+import sqlite3
+import argparse
+import threading
+import logging
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INDEX_PATH = os.path.join("logs", "index.sqlite3")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS log_entries (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    request_id TEXT,
+    character TEXT,
+    chat TEXT,
+    operation TEXT,
+    config_path TEXT,
+    endpoint TEXT,
+    status TEXT NOT NULL,
+    retry_count INTEGER NOT NULL DEFAULT 0,
+    start_time REAL,
+    end_time REAL,
+    duration REAL,
+    prompt_tokens INTEGER,
+    completion_tokens INTEGER,
+    error_type TEXT,
+    error_message TEXT,
+    file_path TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_log_entries_start ON log_entries (start_time);
+CREATE INDEX IF NOT EXISTS idx_log_entries_chat ON log_entries (character, chat, start_time);
+CREATE INDEX IF NOT EXISTS idx_log_entries_file ON log_entries (file_path);
+"""
+
+# Columns returned by query() and accepted as exact-match filters
+COLUMNS = ("id", "kind", "request_id", "character", "chat", "operation", "config_path", "endpoint", "status",
+           "retry_count", "start_time", "end_time", "duration", "prompt_tokens", "completion_tokens",
+           "error_type", "error_message", "file_path")
+FILTER_COLUMNS = ("kind", "request_id", "character", "chat", "operation", "config_path", "endpoint", "status",
+                  "error_type")
+GROUP_COLUMNS = ("character", "chat", "operation", "config_path", "endpoint", "status", "error_type", "kind")
+
+# Attempt statuses (failures use the same categories as the log filename suffixes)
+STATUS_IN_PROGRESS = "in_progress"
+STATUS_SUCCESS = "success"
+
+# Error messages are kept short; the log file has the full text
+MAX_ERROR_MESSAGE_LENGTH = 500
+
+
+def parse_time(value: Any) -> Optional[float]:
+    """
+    Convert an epoch number or ISO date/datetime string to an epoch timestamp.
+
+    Args:
+        value: Epoch seconds, "2025-11-01", "2025-11-01T20:29:24" or None
+
+    Returns:
+        Epoch seconds, or None for empty values
+
+    Raises:
+        ValueError: If the value is neither a number nor an ISO date
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(str(value)).timestamp()
+
+
+class LogIndex:
+    """Local SQLite index with one row per request attempt or error log"""
+
+    def __init__(self, path: str = DEFAULT_INDEX_PATH, busy_timeout: float = 5.0):
+        """
+        Open (and create if needed) the index database.
+
+        Args:
+            path: SQLite database file
+            busy_timeout: Seconds to wait for another process's write lock
+        """
+        self.path = os.path.abspath(path)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        self._lock = threading.Lock()
+        # One connection shared by all threads, serialized by _lock
+        self._conn = sqlite3.connect(self.path, timeout=busy_timeout, check_same_thread=False,
+                                     isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        # WAL lets readers (the CLI, /logs/query) run alongside writes; NORMAL skips the fsync per commit
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+
+        # Row of the attempt currently open in each log file
+        self._open_rows: Dict[str, int] = {}
+        self._writes = 0
+        self._write_errors = 0
+
+    @classmethod
+    def from_config(cls, index_config: Optional[Dict[str, Any]]) -> Optional["LogIndex"]:
+        """Build an index from the log_index configuration section (None when disabled)"""
+        index_config = index_config or {}
+        if not index_config.get("enabled", False):
+            return None
+        return cls(
+            path=index_config.get("path", DEFAULT_INDEX_PATH),
+            busy_timeout=index_config.get("busy_timeout", 5.0),
+        )
+
+    def _execute(self, sql: str, params: Tuple = ()) -> Optional[sqlite3.Cursor]:
+        """Run one write statement; index failures are logged, never raised to the request"""
+        try:
+            with self._lock:
+                cursor = self._conn.execute(sql, params)
+                self._writes += 1
+                return cursor
+        except Exception as e:
+            with self._lock:
+                self._write_errors += 1
+            logger.error(f"Failed to update log index {self.path}: {e}")
+            return None
+
+    def record_start(self, file_path: str, request_id: str, start_time: float,
+                     character_chat_info: Optional[Tuple[str, str, str]] = None,
+                     config_path: Optional[str] = None, endpoint: Optional[str] = None,
+                     retry_count: int = 0) -> None:
+        """
+        Add an in-progress row for a request attempt.
+
+        Args:
+            file_path: Log file the attempt is written to
+            request_id: Request identifier
+            start_time: Attempt start timestamp
+            character_chat_info: Optional tuple of (character, chat, operation)
+            config_path: Config file used for the request (None for the default config)
+            endpoint: API endpoint
+            retry_count: Number of proxy retries before this attempt
+        """
+        character, chat, operation = character_chat_info or (None, None, None)
+        cursor = self._execute(
+            "INSERT INTO log_entries (kind, request_id, character, chat, operation, config_path, endpoint, "
+            "status, retry_count, start_time, file_path) VALUES ('request', ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (request_id, character, chat, operation, config_path, endpoint, STATUS_IN_PROGRESS, retry_count,
+             start_time, file_path)
+        )
+        if cursor is not None:
+            with self._lock:
+                self._open_rows[file_path] = cursor.lastrowid
+
+    def record_end(self, file_path: str, status: str, end_time: Optional[float] = None,
+                   duration: Optional[float] = None, usage: Optional[Dict[str, Any]] = None,
+                   error: Optional[Exception] = None, new_file_path: Optional[str] = None) -> None:
+        """
+        Complete the open row of the attempt logged in a file.
+
+        Args:
+            file_path: Log file of the attempt
+            status: "success" or a failure category ("ratelimit", "timeout", "unavailable", "failed")
+            end_time: Attempt end timestamp
+            duration: Attempt duration in seconds
+            usage: Response usage block (prompt_tokens/completion_tokens)
+            error: Exception if the attempt failed
+            new_file_path: Path the log was renamed to, if it was
+        """
+        with self._lock:
+            row_id = self._open_rows.pop(file_path, None)
+        if row_id is None:
+            # Started before this process (or this index) was configured
+            return
+
+        usage = usage if isinstance(usage, dict) else {}
+        error_message = str(error)[:MAX_ERROR_MESSAGE_LENGTH] if error else None
+        self._execute(
+            "UPDATE log_entries SET status = ?, end_time = ?, duration = ?, prompt_tokens = ?, "
+            "completion_tokens = ?, error_type = ?, error_message = ?, file_path = ? WHERE id = ?",
+            (status, end_time, duration, usage.get("prompt_tokens"), usage.get("completion_tokens"),
+             type(error).__name__ if error else None, error_message, new_file_path or file_path, row_id)
+        )
+
+    def record_error(self, file_path: str, error_code: Any, error: Any, timestamp: float,
+                     character_chat_info: Optional[Tuple[str, str, str]] = None,
+                     request_id: Optional[str] = None, retry_count: Optional[int] = None) -> None:
+        """
+        Add a row for an error log.
+
+        Args:
+            file_path: Error log file
+            error_code: HTTP status or error code from ErrorLogger
+            error: Exception, response or code that was logged
+            timestamp: When the error was logged
+            character_chat_info: Optional tuple of (character, chat, operation)
+            request_id: Request identifier, if known
+            retry_count: Retry attempt the error belongs to, if any
+        """
+        character, chat, operation = character_chat_info or (None, None, None)
+        error_type = type(error).__name__ if isinstance(error, Exception) else str(error_code)
+        self._execute(
+            "INSERT INTO log_entries (kind, request_id, character, chat, operation, status, retry_count, "
+            "start_time, error_type, error_message, file_path) VALUES ('error', ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (request_id, character, chat, operation, str(error_code), retry_count or 0, timestamp, error_type,
+             str(error)[:MAX_ERROR_MESSAGE_LENGTH], file_path)
+        )
+
+    def _where(self, filters: Dict[str, Any]) -> Tuple[str, List[Any]]:
+        """Build a WHERE clause from exact-match, time and duration filters"""
+        clauses = []
+        params: List[Any] = []
+        for column in FILTER_COLUMNS:
+            value = filters.get(column)
+            if value is not None and value != "":
+                clauses.append(f"{column} = ?")
+                params.append(value)
+        bounds = (("since", "start_time >= ?", parse_time), ("until", "start_time < ?", parse_time),
+                  ("min_duration", "duration >= ?", float), ("max_duration", "duration <= ?", float))
+        for name, clause, convert in bounds:
+            value = filters.get(name)
+            if value is not None and value != "":
+                clauses.append(clause)
+                params.append(convert(value))
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def query(self, filters: Optional[Dict[str, Any]] = None, limit: int = 100,
+              order: str = "-start_time") -> List[Dict[str, Any]]:
+        """
+        Return matching rows.
+
+        Args:
+            filters: Column values (see FILTER_COLUMNS) plus since/until (epoch or ISO)
+                     and min_duration/max_duration (seconds); kind defaults to "request"
+            limit: Maximum rows returned
+            order: Column to sort by, prefixed with "-" for descending
+
+        Returns:
+            List of row dicts
+
+        Raises:
+            ValueError: For an unknown sort column or malformed filter value
+        """
+        filters = dict(filters or {})
+        filters.setdefault("kind", "request")
+        column = order.lstrip("-")
+        if column not in COLUMNS:
+            raise ValueError(f"Cannot sort by {column!r}")
+        where, params = self._where(filters)
+        direction = "DESC" if order.startswith("-") else "ASC"
+        sql = f"SELECT {', '.join(COLUMNS)} FROM log_entries{where} ORDER BY {column} {direction}, id {direction} LIMIT ?"
+        with self._lock:
+            rows = self._conn.execute(sql, params + [int(limit)]).fetchall()
+        return [dict(row) for row in rows]
+
+    def aggregate(self, group_by: str, filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        Return counts, failure counts, durations and token totals per group.
+
+        Args:
+            group_by: Column to group by (see GROUP_COLUMNS)
+            filters: Same filters as query()
+
+        Returns:
+            List of group dicts, largest groups first
+
+        Raises:
+            ValueError: For an unknown group column or malformed filter value
+        """
+        if group_by not in GROUP_COLUMNS:
+            raise ValueError(f"Cannot group by {group_by!r}")
+        filters = dict(filters or {})
+        filters.setdefault("kind", "request")
+        where, params = self._where(filters)
+        sql = (
+            f"SELECT {group_by}, COUNT(*) AS count, "
+            f"SUM(CASE WHEN status NOT IN ('{STATUS_SUCCESS}', '{STATUS_IN_PROGRESS}') THEN 1 ELSE 0 END) AS failures, "
+            "SUM(CASE WHEN retry_count > 0 THEN 1 ELSE 0 END) AS retries, "
+            "AVG(duration) AS avg_duration, MIN(duration) AS min_duration, MAX(duration) AS max_duration, "
+            "SUM(prompt_tokens) AS prompt_tokens, SUM(completion_tokens) AS completion_tokens "
+            f"FROM log_entries{where} GROUP BY {group_by} ORDER BY count DESC"
+        )
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [dict(row) for row in rows]
+
+    def close(self) -> None:
+        """Close the database connection"""
+        with self._lock:
+            self._conn.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return index counters for health reporting"""
+        with self._lock:
+            return {
+                "enabled": True,
+                "path": self.path,
+                "open_attempts": len(self._open_rows),
+                "writes": self._writes,
+                "write_errors": self._write_errors,
+            }
+
+
+# Process-wide index shared by all request and error loggers; None means disabled
+_log_index_lock = threading.Lock()
+_log_index: Optional[LogIndex] = None
+
+
+def get_log_index() -> Optional[LogIndex]:
+    """Return the process-wide log index, or None when indexing is disabled"""
+    return _log_index
+
+
+def configure_log_index(index_config: Optional[Dict[str, Any]]) -> Optional[LogIndex]:
+    """Replace the process-wide log index with one built from configuration"""
+    global _log_index
+    new_index = LogIndex.from_config(index_config)
+    with _log_index_lock:
+        old_index, _log_index = _log_index, new_index
+    if old_index is not None:
+        old_index.close()
+    return new_index
+
+
+def run_log_query(args: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Turn /logs/query parameters into a query or aggregate result.
+
+    Args:
+        args: Request parameters (filters plus optional group_by, limit and order)
+
+    Returns:
+        {"rows": [...]} or {"group_by": column, "groups": [...]}
+
+    Raises:
+        ValueError: For unknown columns or malformed values
+    """
+    index = get_log_index()
+    if index is None:
+        raise LookupError("Log index is not enabled (set log_index.enabled in config.yaml)")
+    filters = {name: args.get(name) for name in FILTER_COLUMNS + ("since", "until", "min_duration", "max_duration")}
+    if args.get("group_by"):
+        return {"group_by": args["group_by"], "groups": index.aggregate(args["group_by"], filters)}
+    return {"rows": index.query(filters, limit=int(args.get("limit") or 100), order=args.get("order") or "-start_time")}
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Query the request log index")
+    parser.add_argument("--db", default=DEFAULT_INDEX_PATH, help="Index database (default: %(default)s)")
+    for column in FILTER_COLUMNS:
+        parser.add_argument(f"--{column.replace('_', '-')}", dest=column)
+    parser.add_argument("--since", help="Start time lower bound (epoch or ISO date)")
+    parser.add_argument("--until", help="Start time upper bound (epoch or ISO date)")
+    parser.add_argument("--min-duration", dest="min_duration", type=float)
+    parser.add_argument("--max-duration", dest="max_duration", type=float)
+    parser.add_argument("--group-by", dest="group_by", choices=GROUP_COLUMNS)
+    parser.add_argument("--order", default="-start_time")
+    parser.add_argument("--limit", type=int, default=100)
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.db):
+        print(f"No log index at {args.db}", file=sys.stderr)
+        return 1
+
+    index = LogIndex(args.db)
+    try:
+        filters = {name: getattr(args, name) for name in FILTER_COLUMNS + ("since", "until", "min_duration", "max_duration")}
+        if args.group_by:
+            result = index.aggregate(args.group_by, filters)
+        else:
+            result = index.query(filters, limit=args.limit, order=args.order)
+    except ValueError as e:
+        print(str(e), file=sys.stderr)
+        return 2
+    finally:
+        index.close()
+
+    print(json.dumps(result, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,148 @@
+"""
+Render records-format request logs as markdown
+
+With logging.format set to "records" each request gets one .jsonl file of
+append-only records: a "start" record with the request, an "attempt" record
+for each proxy retry, "retry_note" records, and an "end" record per attempt.
+This module turns those records back into the same markdown the default
+format writes, so the analysis scripts and human readers can use either.
+
+Usage:
+    python -m first_hop_proxy.log_records logs/characters/Senta/chat1/00001-chat.jsonl
+    python -m first_hop_proxy.log_records logs/ --write
+"""
+import os
+import sys
+import json
+import argparse
+import logging
+from typing import Dict, Any, Iterable, List, Optional
+
+from .request_logger import RequestLogger, LOG_RECORDS_EXTENSION
+
+logger = logging.getLogger(__name__)
+
+# Fields of a start record passed through to RequestLogger._render_start_log
+START_FIELDS = ("request_id", "endpoint", "request_data", "headers", "start_time", "original_request_data",
+                "stripped_metadata", "lorebook_entries", "logged_at", "payload_dropped")
+RETRY_NOTE_FIELDS = ("reason", "retry_attempt", "matched_pattern", "content_preview", "request_id", "logged_at")
+END_FIELDS = ("response_data", "response_headers", "end_time", "duration", "error_type", "error_message",
+              "usage", "completed_at", "trace_summary", "payload_dropped")
+
+
+def read_log_records(path: str) -> List[Dict[str, Any]]:
+    """
+    Read the records of a .jsonl log, skipping lines that are not valid JSON.
+
+    A process killed mid-write can leave a partial last line; everything
+    before it is still returned.
+
+    Args:
+        path: Path to a records-format log
+
+    Returns:
+        List of record dicts in file order
+    """
+    records = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                logger.warning(f"Skipping unreadable record at {path}:{line_number}")
+                continue
+            if isinstance(record, dict):
+                records.append(record)
+    return records
+
+
+def _pick(record: Dict[str, Any], names: Iterable[str]) -> Dict[str, Any]:
+    """Return the named fields of a record (missing ones as None, payload_dropped as a bool)"""
+    fields = {name: record.get(name) for name in names}
+    if "payload_dropped" in fields:
+        fields["payload_dropped"] = bool(fields["payload_dropped"])
+    return fields
+
+
+def render_log_records(records: List[Dict[str, Any]], request_logger: Optional[RequestLogger] = None) -> str:
+    """
+    Render a request's records as markdown, one section per attempt.
+
+    Args:
+        records: Records as returned by read_log_records
+        request_logger: Logger whose include_* settings control rendering
+                        (defaults to one with default settings)
+
+    Returns:
+        Markdown matching what the markdown log format writes for each attempt
+    """
+    request_logger = request_logger or RequestLogger({})
+    attempts: List[Optional[str]] = []
+    start: Dict[str, Any] = {}
+
+    for record in records:
+        record_type = record.get("type")
+        if record_type == "start":
+            start = _pick(record, START_FIELDS)
+            attempts.append(request_logger._render_start_log(None, **start))
+        elif record_type == "attempt":
+            # Proxy retries resend the first attempt's request, so only its timing is recorded
+            fields = dict(start, request_data=None, original_request_data=None, stripped_metadata=None,
+                          lorebook_entries=None, payload_dropped=False)
+            fields.update(_pick(record, ("request_id", "endpoint", "start_time", "logged_at")))
+            attempts.append(request_logger._render_start_log(None, **fields))
+        elif record_type == "retry_note" and attempts:
+            attempts[-1] = request_logger._render_retry_note(attempts[-1], **_pick(record, RETRY_NOTE_FIELDS))
+        elif record_type == "end" and attempts:
+            attempts[-1] = request_logger._render_completion(attempts[-1], **_pick(record, END_FIELDS))
+        else:
+            logger.warning(f"Skipping unexpected log record type {record_type!r}")
+
+    return "\n\n".join(content for content in attempts if content)
+
+
+def _find_record_logs(paths: Iterable[str]) -> List[str]:
+    """Expand directories into the records-format logs they contain"""
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _dirs, files in os.walk(path):
+                found.extend(os.path.join(root, name) for name in sorted(files)
+                             if name.endswith(LOG_RECORDS_EXTENSION))
+        else:
+            found.append(path)
+    return found
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Render records-format request logs (.jsonl) as markdown")
+    parser.add_argument("paths", nargs="+", help="Log files or folders to search for .jsonl logs")
+    parser.add_argument("--write", action="store_true",
+                        help="Write a .md file next to each log instead of printing to stdout")
+    args = parser.parse_args(argv)
+
+    failures = 0
+    for path in _find_record_logs(args.paths):
+        try:
+            markdown = render_log_records(read_log_records(path))
+        except Exception as e:
+            print(f"Failed to render {path}: {e}", file=sys.stderr)
+            failures += 1
+            continue
+
+        if args.write:
+            md_path = path[:-len(LOG_RECORDS_EXTENSION)] + ".md" if path.endswith(LOG_RECORDS_EXTENSION) else path + ".md"
+            with open(md_path, 'w', encoding='utf-8') as f:
+                f.write(markdown)
+            print(md_path)
+        else:
+            print(markdown)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,270 @@
+"""
+Per-folder sequence numbers for log filenames
+
+Log files are named <number>-<operation>[-suffixes].md (or .jsonl) with numbers shared
+by every operation in a folder. Finding the next number used to mean
+listing the folder and matching every filename under one global lock, on
+every request; long roleplays accumulate thousands of files per chat
+folder. LogSequenceAllocator scans a folder once, the first time it is
+seen, and then hands out numbers from an in-memory counter under a
+per-folder lock.
+
+With cross_process enabled the counter is kept in a small file in each
+folder, updated under an O_EXCL lock file, so several worker processes can
+log into the same tree without reusing numbers.
+"""
+import os
+import re
+import threading
+import time
+import logging
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+# Matches numbered log files of every operation type (markdown, records and error logs)
+LOG_FILENAME_PATTERN = re.compile(r'^(\d+)-.+\.(?:md|jsonl)$')
+
+# Counter and lock files used in cross-process mode (not matched by the pattern above)
+SEQUENCE_FILENAME = ".log-sequence"
+SEQUENCE_LOCK_FILENAME = ".log-sequence.lock"
+
+
+def scan_max_log_number(folder: str) -> int:
+    """
+    Return the highest log number among the folder's files (0 if none).
+
+    Args:
+        folder: Log folder path
+
+    Returns:
+        Highest <number> prefix of files matching LOG_FILENAME_PATTERN
+    """
+    max_num = 0
+    try:
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                match = LOG_FILENAME_PATTERN.match(entry.name)
+                if match:
+                    max_num = max(max_num, int(match.group(1)))
+    except FileNotFoundError:
+        return 0
+    except Exception as e:
+        logger.error(f"Error scanning log folder {folder}: {e}")
+    return max_num
+
+
+class _FolderSequence:
+    """Counter state for one folder"""
+
+    __slots__ = ("lock", "last_number")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.last_number: Optional[int] = None
+
+
+class LogSequenceAllocator:
+    """Hands out log numbers per folder without rescanning the folder"""
+
+    def __init__(self, cross_process: bool = False, lock_timeout: float = 5.0, stale_lock_seconds: float = 30.0):
+        """
+        Initialize allocator.
+
+        Args:
+            cross_process: Share counters with other processes through per-folder files
+            lock_timeout: Seconds to wait for another process's lock file before
+                          falling back to the in-memory counter
+            stale_lock_seconds: Age after which a lock file left by a dead process is removed
+        """
+        self.cross_process = cross_process
+        self.lock_timeout = lock_timeout
+        self.stale_lock_seconds = stale_lock_seconds
+
+        self._lock = threading.Lock()
+        self._folders: Dict[str, _FolderSequence] = {}
+        self._scans = 0
+        self._allocated = 0
+        self._lock_timeouts = 0
+
+    @classmethod
+    def from_config(cls, sequence_config: Optional[Dict[str, Any]]) -> "LogSequenceAllocator":
+        """Build an allocator from the log_sequence configuration section"""
+        sequence_config = sequence_config or {}
+        return cls(
+            cross_process=sequence_config.get("cross_process", False),
+            lock_timeout=sequence_config.get("lock_timeout", 5.0),
+            stale_lock_seconds=sequence_config.get("stale_lock_seconds", 30.0),
+        )
+
+    def _get_folder(self, folder: str) -> _FolderSequence:
+        """Return the counter state for a folder, creating it on first use"""
+        key = os.path.normcase(os.path.abspath(folder))
+        state = self._folders.get(key)
+        if state is None:
+            with self._lock:
+                state = self._folders.setdefault(key, _FolderSequence())
+        return state
+
+    def _seed(self, folder: str) -> int:
+        """Scan the folder once for its highest existing number"""
+        with self._lock:
+            self._scans += 1
+        return scan_max_log_number(folder)
+
+    def peek(self, folder: str) -> int:
+        """
+        Return the number the next allocation in a folder will get, without using it.
+
+        Args:
+            folder: Log folder path
+
+        Returns:
+            Next sequential log number (1-based)
+        """
+        state = self._get_folder(folder)
+        with state.lock:
+            if self.cross_process:
+                return self._read_counter(folder) + 1
+            if state.last_number is None:
+                state.last_number = self._seed(folder)
+            return state.last_number + 1
+
+    def allocate(self, folder: str) -> int:
+        """
+        Reserve the next log number in a folder.
+
+        Args:
+            folder: Log folder path
+
+        Returns:
+            Reserved log number (1-based, unique within the folder)
+        """
+        state = self._get_folder(folder)
+        with state.lock:
+            if self.cross_process:
+                number = self._allocate_shared(folder, state)
+            else:
+                if state.last_number is None:
+                    state.last_number = self._seed(folder)
+                state.last_number += 1
+                number = state.last_number
+        with self._lock:
+            self._allocated += 1
+        return number
+
+    def _allocate_shared(self, folder: str, state: _FolderSequence) -> int:
+        """Reserve a number through the folder's counter file (caller holds state.lock)"""
+        if not self._acquire_file_lock(folder):
+            # Keep logging rather than fail the request; numbers may collide with another process
+            with self._lock:
+                self._lock_timeouts += 1
+            logger.error(f"Timed out waiting for log sequence lock in {folder}; using local counter")
+            if state.last_number is None:
+                state.last_number = self._seed(folder)
+            state.last_number += 1
+            return state.last_number
+
+        try:
+            # Never go backwards, even if the counter file was removed
+            number = max(self._read_counter(folder), state.last_number or 0) + 1
+            self._write_counter(folder, number)
+            state.last_number = number
+            return number
+        finally:
+            self._release_file_lock(folder)
+
+    def _read_counter(self, folder: str) -> int:
+        """Read the shared counter, seeding it from a scan if missing or unreadable"""
+        try:
+            with open(os.path.join(folder, SEQUENCE_FILENAME), 'r', encoding='utf-8') as f:
+                return int(f.read().strip() or 0)
+        except (FileNotFoundError, ValueError):
+            return self._seed(folder)
+
+    def _write_counter(self, folder: str, number: int) -> None:
+        """Atomically replace the shared counter"""
+        path = os.path.join(folder, SEQUENCE_FILENAME)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            f.write(str(number))
+        os.replace(temp_path, path)
+
+    def _acquire_file_lock(self, folder: str) -> bool:
+        """Create the folder's lock file with O_EXCL, waiting up to lock_timeout"""
+        lock_path = os.path.join(folder, SEQUENCE_LOCK_FILENAME)
+        deadline = time.monotonic() + self.lock_timeout
+        delay = 0.001
+        while True:
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.write(fd, str(os.getpid()).encode())
+                os.close(fd)
+                return True
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(lock_path) > self.stale_lock_seconds:
+                        logger.warning(f"Removing stale log sequence lock {lock_path}")
+                        os.remove(lock_path)
+                        continue
+                except FileNotFoundError:
+                    continue
+            except FileNotFoundError:
+                os.makedirs(folder, exist_ok=True)
+                continue
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(delay)
+            delay = min(delay * 2, 0.05)
+
+    def _release_file_lock(self, folder: str) -> None:
+        """Remove the folder's lock file"""
+        try:
+            os.remove(os.path.join(folder, SEQUENCE_LOCK_FILENAME))
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.error(f"Failed to release log sequence lock in {folder}: {e}")
+
+    def reset(self, folder: Optional[str] = None) -> None:
+        """Forget counters (for one folder or all) so they are re-seeded on next use"""
+        with self._lock:
+            if folder is None:
+                self._folders.clear()
+            else:
+                self._folders.pop(os.path.normcase(os.path.abspath(folder)), None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return allocator counters for health reporting"""
+        with self._lock:
+            return {
+                "folders": len(self._folders),
+                "folder_scans": self._scans,
+                "allocated": self._allocated,
+                "cross_process": self.cross_process,
+                "lock_timeouts": self._lock_timeouts,
+            }
+
+
+# Process-wide allocator shared by request and error loggers, so a folder
+# used by both still gets one sequence
+_log_sequence_lock = threading.Lock()
+_log_sequence: Optional[LogSequenceAllocator] = None
+
+
+def get_log_sequence() -> LogSequenceAllocator:
+    """Return the process-wide log sequence allocator, creating one with defaults if needed"""
+    global _log_sequence
+    with _log_sequence_lock:
+        if _log_sequence is None:
+            _log_sequence = LogSequenceAllocator()
+        return _log_sequence
+
+
+def configure_log_sequence(sequence_config: Optional[Dict[str, Any]]) -> LogSequenceAllocator:
+    """Replace the process-wide log sequence allocator with one built from configuration"""
+    global _log_sequence
+    new_allocator = LogSequenceAllocator.from_config(sequence_config)
+    with _log_sequence_lock:
+        _log_sequence = new_allocator
+    return new_allocator
@@ -0,0 +1,447 @@
+"""
+Background writer for request log files
+
+Request logs used to be rendered and written on the request thread, and
+completing or annotating a log read the whole file back and rewrote it.
+AsyncLogWriter takes log events from a bounded queue and renders and writes
+them on a single background thread. Logs that are still in progress are
+kept in memory, so completing one does not re-read the file, and events for
+the same file that arrive together are written once.
+"""
+import atexit
+import os
+import queue
+import threading
+import time
+import logging
+from collections import OrderedDict
+from typing import Dict, Any, Callable, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+BACKPRESSURE_POLICIES = ("block", "drop_payload", "sample")
+FSYNC_POLICIES = ("never", "interval", "always")
+
+# Queue marker that stops the writer thread
+_STOP = object()
+
+
+class LogEvent:
+    """One update to a log file, rendered on the writer thread"""
+
+    __slots__ = ("path", "render", "fields", "payload_fields", "update", "append", "rename_to", "final",
+                 "error_logger", "context")
+
+    def __init__(self, path: str, render: Callable[..., Optional[str]], fields: Optional[Dict[str, Any]] = None,
+                 payload_fields: Iterable[str] = (), update: bool = False, append: bool = False,
+                 rename_to: Optional[str] = None, final: bool = False, error_logger=None,
+                 context: str = "request_logger_write_error"):
+        """
+        Describe a log file update.
+
+        Args:
+            path: Log file path
+            render: Called as render(existing_content, **fields); returns the new
+                    file content, or None to leave the file untouched
+            fields: Structured log data passed to render
+            payload_fields: Fields holding request/response bodies that may be
+                            dropped under backpressure
+            update: True if render needs the current content (read from disk when
+                    the log is not held in memory)
+            append: render returns text to append to the file (records format);
+                    appended files are never held in memory
+            rename_to: Move the log to this path after rendering
+            final: The log is complete and can be released from memory once written
+            error_logger: Optional ErrorLogger for write failures
+            context: Error context reported to the error logger
+        """
+        self.path = path
+        self.render = render
+        self.fields = fields or {}
+        self.payload_fields = tuple(payload_fields)
+        self.update = update
+        self.append = append
+        self.rename_to = rename_to
+        self.final = final
+        self.error_logger = error_logger
+        self.context = context
+
+    def drop_payload(self) -> None:
+        """Replace request/response bodies with None and mark the event"""
+        for name in self.payload_fields:
+            self.fields[name] = None
+        self.fields["payload_dropped"] = True
+        self.payload_fields = ()
+
+
+class AsyncLogWriter:
+    """Bounded queue of log events drained by a single background thread"""
+
+    def __init__(self, max_queue: int = 1024, backpressure: str = "block", high_watermark: float = 0.8,
+                 sample_every: int = 10, fsync: str = "never", fsync_interval: float = 1.0,
+                 batch_size: int = 64, max_open_logs: int = 256, shutdown_timeout: float = 10.0):
+        """
+        Initialize writer and start its thread.
+
+        Args:
+            max_queue: Maximum number of queued events
+            backpressure: What to do once the queue passes high_watermark:
+                          "block" (keep payloads; callers wait only when the queue is full),
+                          "drop_payload" (omit request/response bodies; drop events when full),
+                          "sample" (keep bodies for one event in sample_every; drop events when full)
+            high_watermark: Fraction of max_queue at which drop_payload/sample start shedding payloads
+            sample_every: Keep the payload of one in this many events under "sample"
+            fsync: "never" (leave it to the OS), "interval" (fsync written files at most
+                   every fsync_interval seconds) or "always" (fsync every write)
+            fsync_interval: Seconds between fsyncs under "interval"
+            batch_size: Maximum events rendered before their files are written
+            max_open_logs: In-progress logs kept in memory (older ones are re-read from disk)
+            shutdown_timeout: Seconds close() waits for the queue to drain
+        """
+        if backpressure not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"log_writer.backpressure must be one of {BACKPRESSURE_POLICIES}, got {backpressure!r}")
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"log_writer.fsync must be one of {FSYNC_POLICIES}, got {fsync!r}")
+
+        self.max_queue = max_queue
+        self.backpressure = backpressure
+        self.high_watermark = high_watermark
+        self.sample_every = max(1, int(sample_every))
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.batch_size = max(1, int(batch_size))
+        self.max_open_logs = max_open_logs
+        self.shutdown_timeout = shutdown_timeout
+
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_queue)
+        self._watermark = max(1, int(max_queue * high_watermark))
+        self._open_logs: "OrderedDict[str, str]" = OrderedDict()
+        self._fsync_pending: set = set()
+        self._last_fsync = time.monotonic()
+        self._inline_lock = threading.Lock()
+        self._closed = False
+
+        # Counters; _done is signalled whenever processed catches up
+        self._done = threading.Condition()
+        self._submitted = 0
+        self._processed = 0
+        self._written = 0
+        self._sampled = 0
+        self._payloads_dropped = 0
+        self._events_dropped = 0
+        self._errors = 0
+        self._max_depth = 0
+
+        self._thread = threading.Thread(target=self._run, name="request-log-writer", daemon=True)
+        self._thread.start()
+
+    @classmethod
+    def from_config(cls, writer_config: Optional[Dict[str, Any]]) -> Optional["AsyncLogWriter"]:
+        """Build a writer from the log_writer config section (None when disabled)"""
+        writer_config = writer_config or {}
+        if not writer_config.get("enabled", True):
+            return None
+        return cls(
+            max_queue=writer_config.get("max_queue", 1024),
+            backpressure=writer_config.get("backpressure", "block"),
+            high_watermark=writer_config.get("high_watermark", 0.8),
+            sample_every=writer_config.get("sample_every", 10),
+            fsync=writer_config.get("fsync", "never"),
+            fsync_interval=writer_config.get("fsync_interval", 1.0),
+            batch_size=writer_config.get("batch_size", 64),
+            max_open_logs=writer_config.get("max_open_logs", 256),
+            shutdown_timeout=writer_config.get("shutdown_timeout", 10.0),
+        )
+
+    def submit(self, event: LogEvent) -> bool:
+        """
+        Queue an event for the writer thread.
+
+        Args:
+            event: Log event to render and write
+
+        Returns:
+            True if the event was queued (or written inline after close), False if dropped
+        """
+        if self._closed:
+            # Late events (e.g. a stream finishing during shutdown) are written inline
+            with self._inline_lock:
+                self._process([event])
+            return True
+
+        depth = self._queue.qsize()
+        if self.backpressure != "block" and event.payload_fields and depth >= self._watermark:
+            with self._done:
+                self._sampled += 1
+                keep = self.backpressure == "sample" and self._sampled % self.sample_every == 0
+                if not keep:
+                    self._payloads_dropped += 1
+            if not keep:
+                event.drop_payload()
+
+        with self._done:
+            self._submitted += 1
+            self._max_depth = max(self._max_depth, depth + 1)
+
+        if self.backpressure == "block":
+            self._queue.put(event)
+            return True
+
+        try:
+            self._queue.put_nowait(event)
+            return True
+        except queue.Full:
+            with self._done:
+                self._submitted -= 1
+                self._events_dropped += 1
+            logger.warning(f"Request log queue full, dropped event for {event.path}")
+            return False
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until every event submitted so far has been written.
+
+        Args:
+            timeout: Maximum seconds to wait (None waits indefinitely)
+
+        Returns:
+            True if the writer caught up, False on timeout
+        """
+        with self._done:
+            target = self._submitted
+            return self._done.wait_for(lambda: self._processed >= target, timeout)
+
+    def close(self, timeout: Optional[float] = None) -> bool:
+        """
+        Drain the queue and stop the writer thread.
+
+        Args:
+            timeout: Maximum seconds to wait (defaults to shutdown_timeout)
+
+        Returns:
+            True if every queued event was written
+        """
+        if self._closed:
+            return True
+        timeout = self.shutdown_timeout if timeout is None else timeout
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        drained = not self._thread.is_alive()
+        self._closed = True
+
+        if drained:
+            # Events queued behind the stop marker are written inline
+            leftover = []
+            while True:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not _STOP:
+                    leftover.append(item)
+            with self._inline_lock:
+                if leftover:
+                    self._process(leftover)
+                self._fsync_files(force=self.fsync != "never")
+        else:
+            logger.error(f"Request log writer did not drain within {timeout}s; "
+                         f"{self._queue.qsize()} events were not written")
+        return drained
+
+    def _run(self) -> None:
+        """Writer thread: drain events in batches until stopped"""
+        while True:
+            wait = self.fsync_interval if self._fsync_pending else None
+            try:
+                item = self._queue.get(timeout=wait)
+            except queue.Empty:
+                self._fsync_files(force=True)
+                continue
+
+            batch = [item]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = any(item is _STOP for item in batch)
+            self._process([item for item in batch if item is not _STOP])
+            if stop:
+                return
+
+    def _process(self, events: List[LogEvent]) -> None:
+        """Render a batch of events and write each touched file once"""
+        dirty: "OrderedDict[str, LogEvent]" = OrderedDict()
+        appends: "OrderedDict[str, List[str]]" = OrderedDict()
+        append_events: Dict[str, LogEvent] = {}
+        released = set()
+
+        for event in events:
+            try:
+                if event.append:
+                    text = event.render(None, **event.fields)
+                    if text:
+                        appends.setdefault(event.path, []).append(text)
+                        append_events[event.path] = event
+                    continue
+                path = self._apply(event, dirty)
+                if event.final:
+                    released.add(path)
+            except Exception as e:
+                self._report(event, event.path, e)
+
+        for path, event in dirty.items():
+            try:
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(self._open_logs[path])
+                    if self.fsync == "always":
+                        f.flush()
+                        os.fsync(f.fileno())
+                if self.fsync == "interval":
+                    self._fsync_pending.add(path)
+                self._written += 1
+                logger.debug(f"Wrote request log: {path}")
+            except Exception as e:
+                self._report(event, path, e)
+
+        for path, texts in appends.items():
+            try:
+                with open(path, 'a', encoding='utf-8') as f:
+                    f.write(''.join(texts))
+                    if self.fsync == "always":
+                        f.flush()
+                        os.fsync(f.fileno())
+                if self.fsync == "interval":
+                    self._fsync_pending.add(path)
+                self._written += 1
+            except Exception as e:
+                self._report(append_events[path], path, e)
+
+        for path in released:
+            self._open_logs.pop(path, None)
+        while len(self._open_logs) > self.max_open_logs:
+            self._open_logs.popitem(last=False)
+
+        self._fsync_files()
+        with self._done:
+            self._processed += len(events)
+            self._done.notify_all()
+
+    def _apply(self, event: LogEvent, dirty: "OrderedDict[str, LogEvent]") -> str:
+        """Render one event into the in-memory log content; returns the log's final path"""
+        path = event.path
+        existing = self._open_logs.get(path)
+        if existing is None and event.update:
+            if not os.path.exists(path):
+                return path
+            with open(path, 'r', encoding='utf-8') as f:
+                existing = f.read()
+
+        content = event.render(existing, **event.fields)
+        if content is not None:
+            self._open_logs[path] = content
+            self._open_logs.move_to_end(path)
+            dirty[path] = event
+
+        if event.rename_to and event.rename_to != path:
+            if os.path.exists(path):
+                os.replace(path, event.rename_to)
+            if path in self._fsync_pending:
+                self._fsync_pending.discard(path)
+                self._fsync_pending.add(event.rename_to)
+            content = self._open_logs.pop(path, None)
+            dirty.pop(path, None)
+            path = event.rename_to
+            if content is not None:
+                self._open_logs[path] = content
+                dirty[path] = event
+        return path
+
+    def _fsync_files(self, force: bool = False) -> None:
+        """fsync files written since the last fsync under the "interval" policy"""
+        if not self._fsync_pending:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_fsync < self.fsync_interval:
+            return
+        for path in self._fsync_pending:
+            try:
+                fd = os.open(path, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            except OSError as e:
+                logger.error(f"Failed to fsync request log {path}: {e}")
+        self._fsync_pending.clear()
+        self._last_fsync = now
+
+    def _report(self, event: LogEvent, path: str, error: Exception) -> None:
+        """Record a failed event the way the request logger reports write errors"""
+        self._errors += 1
+        logger.error(f"Failed to write request log {path}: {error}")
+        if event.error_logger:
+            try:
+                event.error_logger.log_error(error, {
+                    "context": event.context,
+                    "filepath": path,
+                    "log_type": "log_writer"
+                })
+            except Exception as e:
+                logger.error(f"Failed to report log writer error: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return writer counters for health reporting"""
+        with self._done:
+            return {
+                "queue_depth": self._queue.qsize(),
+                "max_queue": self.max_queue,
+                "max_depth": self._max_depth,
+                "backpressure": self.backpressure,
+                "fsync": self.fsync,
+                "submitted": self._submitted,
+                "processed": self._processed,
+                "files_written": self._written,
+                "payloads_dropped": self._payloads_dropped,
+                "events_dropped": self._events_dropped,
+                "errors": self._errors,
+                "open_logs": len(self._open_logs),
+                "running": self._thread.is_alive(),
+            }
+
+
+# Process-wide writer shared by every RequestLogger (None writes synchronously)
+_log_writer_lock = threading.Lock()
+_log_writer: Optional[AsyncLogWriter] = None
+
+
+def get_log_writer() -> Optional[AsyncLogWriter]:
+    """Return the process-wide log writer, or None when logs are written on the request thread"""
+    return _log_writer
+
+
+def configure_log_writer(writer_config: Optional[Dict[str, Any]]) -> Optional[AsyncLogWriter]:
+    """Replace the process-wide log writer with one built from configuration, draining the old one"""
+    global _log_writer
+    new_writer = AsyncLogWriter.from_config(writer_config)
+    with _log_writer_lock:
+        old_writer = _log_writer
+        _log_writer = new_writer
+    if old_writer is not None:
+        old_writer.close()
+    return new_writer
+
+
+def shutdown_log_writer(timeout: Optional[float] = None) -> bool:
+    """Drain and stop the process-wide log writer (registered to run at exit)"""
+    global _log_writer
+    with _log_writer_lock:
+        writer = _log_writer
+        _log_writer = None
+    if writer is None:
+        return True
+    return writer.close(timeout)
+
+
+atexit.register(shutdown_log_writer)
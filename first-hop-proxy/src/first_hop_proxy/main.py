@@ -3,15 +3,17 @@ Main application module for First Hop Proxy
 """
 import copy
 import json
+import math
 import logging
 import threading
 import uuid
 import time
 import sys
 import os
-from typing import Dict, Any, Optional, List, Tuple
+from typing import Dict, Any, Optional, List, Tuple, Union
 from flask import Flask, request, jsonify, Response, make_response
 from flask_cors import CORS
+import requests
 from requests.exceptions import HTTPError
 
 from .config import Config
@@ -19,13 +21,31 @@ from .proxy_client import ProxyClient
 from .error_handler import ErrorHandler
 from .request_logger import RequestLogger
 from .error_logger import ErrorLogger
+from .session_pool import configure_session_pool, get_session_pool
+from .execution_plan import ExecutionPlan, get_plan_cache
+from .streaming import SSEStreamRelay, SSE_RESPONSE_HEADERS
+from .preprocessing import preprocess_messages, configure_message_cache, get_message_cache
+from .log_writer import configure_log_writer, get_log_writer, shutdown_log_writer
+from .log_sequence import configure_log_sequence, get_log_sequence
+from .log_index import configure_log_index, get_log_index, run_log_query
+from .metrics import (
+    configure_metrics, get_metrics, clear_snapshots, WSGIByteCounter, CONTENT_TYPE as METRICS_CONTENT_TYPE
+)
+from .tracing import configure_tracer, get_tracer
+from .server import run_server, resolve_engine, resolve_worker_count
+from .admission import AdmissionRejected, configure_admission, get_admission_controller
+from .circuit_breaker import CircuitOpenError, configure_circuit_breakers, get_circuit_breakers
+from .rate_limit import RateLimitExceeded, configure_rate_limiter, get_rate_limiter
+from .concurrency_limit import configure_concurrency_limits, get_concurrency_limits
+from .hedging import configure_hedging, get_hedger
+from .singleflight import configure_singleflight, get_singleflight
+from .response_cache import cache_control, configure_response_cache, get_response_cache, is_cacheable_reply
+from .models_cache import etag_matches
+from .upstream_pool import UpstreamSelection
 from .utils import (
     sanitize_headers_for_logging,
-    process_messages_with_regex,
     extract_character_chat_info,
-    extract_st_metadata_from_messages,
-    extract_lorebook_entries_from_messages,
-    strip_lorebook_attributes_from_messages
+    resolve_character_chat_info
 )
 from .constants import DEFAULT_MODELS
 
@@ -34,6 +54,8 @@ logger = logging.getLogger(__name__)
 # Initialize Flask app
 app = Flask(__name__)
 CORS(app)
+# Count client request/response body bytes for /metrics (streamed bodies included)
+app.wsgi_app = WSGIByteCounter(app.wsgi_app)
 
 # Initialize components
 config = Config()
@@ -75,6 +97,24 @@ def _build_logger_config(active_config: Any) -> Dict[str, Any]:
     return base_config
 
 
+def _resolve_log_folders(active_config: Any) -> Tuple[str, str]:
+    """
+    Return the absolute (log_root, error_root) folders for a config without copying it.
+    """
+    try:
+        if isinstance(active_config, dict):
+            logging_cfg = active_config.get("logging", {}) or {}
+            error_logging_cfg = active_config.get("error_logging", {}) or {}
+        else:
+            logging_cfg = active_config.get_logging_config() or {}
+            error_logging_cfg = active_config.get_error_logging_config() or {}
+        log_root = logging_cfg.get("folder", "logs")
+        error_root = error_logging_cfg.get("folder", os.path.join(log_root, "errors"))
+        return os.path.abspath(log_root), os.path.abspath(error_root)
+    except Exception:
+        return os.path.abspath("logs"), os.path.abspath(os.path.join("logs", "errors"))
+
+
 def get_loggers_for_config(active_config: Any) -> Tuple[RequestLogger, ErrorLogger]:
     """
     Return (RequestLogger, ErrorLogger) instances for the given config, creating them if needed.
@@ -82,23 +122,23 @@ def get_loggers_for_config(active_config: Any) -> Tuple[RequestLogger, ErrorLogg
     Loggers are cached by their resolved absolute log folders so that config-specific log paths
     are respected for each request without recreating loggers on every call.
     """
+    log_root_abs, error_root_abs = _resolve_log_folders(active_config)
+    cache_key = (log_root_abs, error_root_abs)
+
+    # Fast path: the config is only copied when loggers are first created for its folders
+    cached = _logger_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
     base_config = _build_logger_config(active_config)
     logging_cfg = base_config.get("logging", {}) or {}
     error_logging_cfg = base_config.get("error_logging", {}) or {}
 
-    log_root = logging_cfg.get("folder", "logs")
-    error_root = error_logging_cfg.get("folder", os.path.join(log_root, "errors"))
-
-    log_root_abs = os.path.abspath(log_root)
-    error_root_abs = os.path.abspath(error_root)
-
     logging_cfg["folder"] = log_root_abs
     error_logging_cfg["folder"] = error_root_abs
     base_config["logging"] = logging_cfg
     base_config["error_logging"] = error_logging_cfg
 
-    cache_key = (log_root_abs, error_root_abs)
-
     with _logger_cache_lock:
         if cache_key not in _logger_cache:
             os.makedirs(os.path.join(log_root_abs, "characters"), exist_ok=True)
@@ -143,28 +183,116 @@ def load_config_for_request(config_name: str) -> Config:
     """
     Load a specific config file for a request.
 
+    The file is only re-read and re-parsed when its mtime/size (and content hash)
+    change; otherwise the Config from the cached execution plan is returned.
+
     Args:
         config_name: Config filename (e.g., "config-aboba-gemini.yaml")
 
     Returns:
-        Config object loaded from the specified file
+        Config object loaded from the specified file (shared; do not modify)
 
     Raises:
         FileNotFoundError: If config file doesn't exist
     """
-    request_config = Config()
+    plan = get_plan_cache().get_for_file(config_name)
+    logger.info(f"Loaded config from: {config_name}")
 
-    # Check if config file exists
-    if not os.path.exists(config_name):
-        raise FileNotFoundError(f"Config file not found: {config_name}")
+    return plan.config
+
+
+def get_execution_plan(active_config: Config) -> ExecutionPlan:
+    """Return the compiled execution plan for the default or a request-specific config"""
+    return get_plan_cache().get_for_config(active_config)
+
+
+def overloaded_error(rejection: AdmissionRejected) -> Dict[str, Any]:
+    """Error body for a request rejected by admission control (sent with status 503)"""
+    return {"error": {"message": str(rejection), "type": "overloaded", "reason": rejection.reason}}
 
-    # Load the config file
-    request_config.load_from_file(config_name)
-    logger.info(f"Loaded config from: {config_name}")
 
-    return request_config
+def upstream_unavailable_error(error: CircuitOpenError) -> Dict[str, Any]:
+    """Error body for a request failed fast by an open circuit breaker (sent with status 503)"""
+    return {"error": {"message": str(error), "type": "upstream_unavailable", "origin": error.origin}}
 
 
+def rate_limited_error(error: RateLimitExceeded) -> Dict[str, Any]:
+    """Error body for a request held back by a rate-limit gate (sent with status 429)"""
+    return {"error": {"message": str(error), "type": "rate_limit", "retry_after": error.retry_after}}
+
+
+def models_url_for(target_url: str) -> str:
+    """Models listing URL of an upstream, from its chat completions URL"""
+    base_url = target_url.replace("/chat/completions", "")
+    return f"{base_url}/models"
+
+
+def retry_after_header(rejection: Union[AdmissionRejected, CircuitOpenError, RateLimitExceeded]) -> str:
+    """Retry-After value (whole seconds, at least 1) for a rejected request"""
+    return str(max(1, int(math.ceil(rejection.retry_after))))
+
+
+def print_incoming_request(request_id: str, request_data: Dict[str, Any], headers: Optional[Dict[str, str]] = None,
+                           original_request_data: Optional[Dict[str, Any]] = None,
+                           stripped_metadata: Optional[List[Dict[str, Any]]] = None) -> None:
+    """Print the incoming request banner to the console"""
+    print("=" * 80, flush=True)
+    print(f"INCOMING REQUEST [{request_id}]", flush=True)
+    if stripped_metadata:
+        print(f"ST_METADATA: {json.dumps(stripped_metadata, indent=2)}", flush=True)
+        print("--- ORIGINAL (AS RECEIVED) ---", flush=True)
+        print(f"Request Data: {json.dumps(original_request_data, indent=2)}", flush=True)
+        print("--- FORWARDED (AFTER STRIPPING) ---", flush=True)
+        print(f"Request Data: {json.dumps(request_data, indent=2)}", flush=True)
+    else:
+        print(f"Request Data: {json.dumps(request_data, indent=2)}", flush=True)
+    print(f"Headers: {json.dumps(sanitize_headers_for_logging(headers or {}), indent=2)}", flush=True)
+    print("=" * 80, flush=True)
+
+
+def print_outgoing_response(request_id: str, outcome: str, response_data: Any, duration: float,
+                            data_label: str = "Response Data") -> None:
+    """Print the outgoing response banner to the console"""
+    print("=" * 80, flush=True)
+    print(f"OUTGOING RESPONSE [{request_id}] - {outcome}", flush=True)
+    print(f"{data_label}: {json.dumps(response_data, indent=2)}", flush=True)
+    print(f"Duration: {duration:.3f}s", flush=True)
+    print("=" * 80, flush=True)
+
+
+def prepare_chat_request(request_data: Dict[str, Any], active_config: Config) -> Tuple[Dict[str, Any], Dict[str, Any], Optional[List[Dict[str, Any]]], Optional[List[Dict[str, Any]]]]:
+    """
+    Apply regex rules and strip ST_METADATA/lorebook markup before forwarding.
+
+    Args:
+        request_data: Chat completion body as received (must contain "messages")
+        active_config: Config for this request
+
+    Returns:
+        Tuple of (forwarded_request_data, original_request_data, stripped_metadata, lorebook_entries)
+    """
+    # The original body is kept for logging; preprocess_messages never modifies
+    # its input and copies only the messages it changes, so no deep copy is needed
+    original_request_data = request_data
+    if not isinstance(request_data.get("messages"), list):
+        return request_data, original_request_data, None, None
+
+    # Regex rules are pre-compiled in the execution plan. Metadata and lorebook
+    # entries are extracted from the original content to avoid regex interference.
+    rules = get_execution_plan(active_config).request_rule_set
+    result = preprocess_messages(request_data["messages"], rules, cache=get_message_cache())
+
+    if result.lorebook_entries:
+        logger.info(f"Extracted {len(result.lorebook_entries)} lorebook entries and stripped their attributes")
+    if result.metadata:
+        for i, metadata in enumerate(result.metadata):
+            logger.info(f"Stripped ST_METADATA block {i+1} - Chat: {metadata.get('chat')}, Operation: {metadata.get('operation')}")
+
+    request_data = request_data.copy()
+    request_data["messages"] = result.messages
+    return request_data, original_request_data, result.metadata, result.lorebook_entries
+
+
 def forward_request(request_data: Dict[str, Any], headers: Optional[Dict[str, str]] = None, request_config: Optional[Config] = None, original_request_data: Optional[Dict[str, Any]] = None, stripped_metadata: Optional[List[Dict[str, Any]]] = None, lorebook_entries: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
     """Forward request to target proxy with error handling and retry logic"""
     # Generate request ID for logging
@@ -174,92 +302,109 @@ def forward_request(request_data: Dict[str, Any], headers: Optional[Dict[str, st
     error = None
     character_chat_info = None
     log_filepath = None
+    streaming_handoff = False
     active_config = request_config if request_config is not None else config
     active_request_logger, active_error_logger = get_loggers_for_config(active_config)
+    plan = get_execution_plan(active_config)
+    tracer = get_tracer()
+
+    # Extract character/chat info for organized logging and admission priority
+    # Prepared requests carry their already-extracted metadata; otherwise scan request_data.
+    # Malformed ST_METADATA is raised inside the try below so it is logged like other errors
+    metadata_error = None
+    try:
+        if original_request_data is not None:
+            character_chat_info = resolve_character_chat_info(stripped_metadata)
+        else:
+            character_chat_info = extract_character_chat_info(headers or {}, request_data)
+    except ValueError as e:
+        metadata_error = e
+
+    operation = character_chat_info[2] if character_chat_info else None
+
+    # Deterministic requests may be answered from the response cache, without waiting for an upstream slot
+    response_cache = get_response_cache()
+    cache_key = None
+    cache_store = False
+    cached_response = None
+    if response_cache is not None and metadata_error is None:
+        cache_key = response_cache.key_for(operation, request_data, headers, plan.fingerprint)
+        if cache_key:
+            cache_lookup, cache_store = cache_control(headers)
+            if cache_lookup:
+                with tracer.span("response_cache"):
+                    cached_response = response_cache.get(cache_key)
+            else:
+                response_cache.bypass()
+
+    # Identical in-flight requests of allowlisted operations share one upstream call
+    singleflight = get_singleflight()
+    coalesce_key = None
+    if singleflight is not None and metadata_error is None and cached_response is None:
+        coalesce_key = singleflight.key_for(operation, request_data, headers, plan.fingerprint)
+
+    # Wait for an upstream slot; raises AdmissionRejected when the proxy is overloaded.
+    # Coalesced requests take it inside the shared call (run_admitted), so duplicates waiting for it hold none
+    admission = get_admission_controller()
+    admission_ticket = None
+    chat = character_chat_info[:2] if character_chat_info else None
+    if admission is not None and cached_response is None and not coalesce_key:
+        with tracer.span("admission_wait"):
+            admission_ticket = admission.acquire(plan.source, plan.admission_limit, operation, chat)
+
+    metrics = get_metrics()
+    metrics.request_started()
+    metrics_status = "error"
 
     try:
-        # Extract character/chat info for organized logging
-        # Use original_request_data if provided, otherwise use cleaned request_data
-        # This will raise ValueError if ST_METADATA is present but malformed
-        character_chat_info = extract_character_chat_info(headers or {}, original_request_data or request_data)
+        if metadata_error is not None:
+            raise metadata_error
 
         # Start request log immediately
         if active_request_logger:
             try:
-                log_filepath = active_request_logger.start_request_log(
-                    request_id=request_id,
-                    endpoint="/chat/completions",
-                    request_data=request_data,
-                    headers=headers or {},
-                    start_time=start_time,
-                    character_chat_info=character_chat_info,
-                    original_request_data=original_request_data,
-                    stripped_metadata=stripped_metadata,
-                    lorebook_entries=lorebook_entries
-                )
+                with tracer.span("log_start"):
+                    log_filepath = active_request_logger.start_request_log(
+                        request_id=request_id,
+                        endpoint="/chat/completions",
+                        request_data=request_data,
+                        headers=headers or {},
+                        start_time=start_time,
+                        character_chat_info=character_chat_info,
+                        original_request_data=original_request_data,
+                        stripped_metadata=stripped_metadata,
+                        lorebook_entries=lorebook_entries,
+                        config_path=plan.source
+                    )
             except Exception as log_error:
                 logger.error(f"Failed to start request log: {log_error}")
 
         # Log incoming request to console
-        print("=" * 80, flush=True)
-        print(f"INCOMING REQUEST [{request_id}]", flush=True)
-        if stripped_metadata:
-            print(f"ST_METADATA: {json.dumps(stripped_metadata, indent=2)}", flush=True)
-            print("--- ORIGINAL (AS RECEIVED) ---", flush=True)
-            print(f"Request Data: {json.dumps(original_request_data, indent=2)}", flush=True)
-            print("--- FORWARDED (AFTER STRIPPING) ---", flush=True)
-            print(f"Request Data: {json.dumps(request_data, indent=2)}", flush=True)
-        else:
-            print(f"Request Data: {json.dumps(request_data, indent=2)}", flush=True)
-        print(f"Headers: {json.dumps(sanitize_headers_for_logging(headers or {}), indent=2)}", flush=True)
-        print("=" * 80, flush=True)
-        # Use request-specific config if provided, otherwise use global config
-        # Get target proxy configuration
-        proxy_config = active_config.get_target_proxy_config()
-        target_url = proxy_config.get("url")
-        if not target_url:
-            raise ValueError("target_proxy.url is not configured")
-
-        # Get error handling configuration
-        error_config = active_config.get_error_handling_config()
-        max_retries = error_config.get("max_retries", 10)
-        base_delay = error_config.get("base_delay", 1.0)
-        max_delay = error_config.get("max_delay", 60.0)
-        retry_codes = error_config.get("retry_codes", [429, 502, 503, 504])
-        fail_codes = error_config.get("fail_codes", [400, 401, 403])
-        conditional_retry_codes = error_config.get("conditional_retry_codes", [404, 411, 412])
-
-        # Get hard stop configuration
-        hard_stop_config = error_config.get("hard_stop_conditions", {})
-
-        # Create error handler with configuration and error logger
-        error_handler = ErrorHandler(
-            max_retries=max_retries,
-            base_delay=base_delay,
-            max_delay=max_delay,
-            error_logger=active_error_logger,
-            hard_stop_config=hard_stop_config,
-            retry_codes=retry_codes,
-            fail_codes=fail_codes,
-            conditional_retry_codes=conditional_retry_codes
-        )
-
-        # Create proxy client with error logger
-        logger.warning(f"DEBUG: Creating ProxyClient with config type: {type(active_config)}")
-        logger.warning(f"DEBUG: Config is global config? {active_config is config}")
-        logger.warning(f"DEBUG: Config is request_config? {active_config is request_config if request_config else 'N/A'}")
-        if active_config:
-            response_parsing_cfg = active_config.get_response_parsing_config()
-            logger.warning(f"DEBUG: response_parsing enabled? {response_parsing_cfg.get('enabled')}")
-            logger.warning(f"DEBUG: status_recategorization enabled? {response_parsing_cfg.get('status_recategorization', {}).get('enabled')}")
-        proxy_client = ProxyClient(target_url, error_logger=active_error_logger, config=active_config)
+        print_incoming_request(request_id, request_data, headers, original_request_data, stripped_metadata)
+        # Use request-specific config if provided, otherwise use global config
+        # Get target proxy configuration
+        proxy_config = active_config.get_target_proxy_config()
+        target_url = proxy_config.get("url")
+        if not target_url and plan.upstream_pool is None:
+            raise ValueError("target_proxy.url is not configured")
+
+        # Reuse the plan's error handler for this config and error logger
+        error_handler = plan.get_error_handler(active_error_logger)
+
+        # Create proxy client with error logger (an upstream pool picks the upstream per attempt instead)
+        proxy_client = plan.get_proxy_client(target_url, active_error_logger) if plan.upstream_pool is None else None
 
         # Use a mutable container to track the current log filepath across retries
         log_state = {"filepath": log_filepath, "attempt_start_time": start_time}
 
-        # Define the request function that will be retried
-        def make_request():
-            return proxy_client.forward_request(
+        if cached_response is not None:
+            response_data = cached_response
+            print_outgoing_response(request_id, "Cache hit", response_data, time.time() - start_time)
+            metrics_status = "200"
+            return response_data
+
+        def send_to(client: ProxyClient):
+            return client.forward_request(
                 request_data,
                 headers=headers,
                 endpoint="",
@@ -267,6 +412,28 @@ def forward_request(request_data: Dict[str, Any], headers: Optional[Dict[str, st
                 request_logger=active_request_logger,
                 request_id=request_id
             )
+
+        # Balance over the config's upstream pool; upstreams that fail this request are skipped by its retries
+        upstream_selection = (UpstreamSelection(plan.upstream_pool, error_handler.should_retry_exception)
+                              if plan.upstream_pool else None)
+
+        def send_attempt(alternate_url: Optional[str] = None):
+            if alternate_url:
+                return send_to(plan.get_proxy_client(alternate_url, active_error_logger))
+            if upstream_selection:
+                return upstream_selection.call(lambda upstream: send_to(
+                    plan.get_proxy_client(upstream.url, active_error_logger, upstream.apikey)))
+            return send_to(proxy_client)
+
+        # Latency-critical operations race a second copy of slow attempts
+        hedger = get_hedger()
+        hedge_policy = hedger.policy_for(character_chat_info[2] if character_chat_info else None) if hedger else None
+
+        # Define the request function that will be retried
+        def make_request():
+            if hedge_policy:
+                return hedger.run(hedge_policy, send_attempt)
+            return send_attempt()
 
         # Create context for error handling
         context = {
@@ -283,49 +450,105 @@ def forward_request(request_data: Dict[str, Any], headers: Optional[Dict[str, st
 
             if active_request_logger and log_state["filepath"]:
                 try:
-                    # Finalize current log with error suffix
-                    attempt_duration = time.time() - log_state["attempt_start_time"]
-                    finalized_path = active_request_logger.finalize_log_with_error(
-                        filepath=log_state["filepath"],
-                        error=exception,
-                        end_time=time.time(),
-                        duration=attempt_duration
-                    )
-                    logger.info(f"Finalized log for failed attempt {attempt_number}: {os.path.basename(finalized_path)}")
-
-                    # Create new log file for the retry attempt
-                    new_start_time = time.time()
-                    log_state["attempt_start_time"] = new_start_time
-
-                    new_log_filepath = active_request_logger.start_request_log(
-                        request_id=f"{request_id}-retry{attempt_number}",
-                        endpoint="/chat/completions",
-                        request_data=request_data,
-                        headers=headers or {},
-                        start_time=new_start_time,
-                        character_chat_info=character_chat_info,
-                        original_request_data=original_request_data,
-                        stripped_metadata=stripped_metadata,
-                        lorebook_entries=lorebook_entries,
-                        is_proxy_retry=True
-                    )
-
-                    # Update both the state container and outer variable
-                    log_state["filepath"] = new_log_filepath
-                    log_filepath = new_log_filepath
-
-                    logger.info(f"Created new log for retry attempt {attempt_number + 1}: {os.path.basename(new_log_filepath)}")
+                    with tracer.span("log_rotate", attempt=attempt_number):
+                        # Finalize current log with error suffix
+                        attempt_duration = time.time() - log_state["attempt_start_time"]
+                        finalized_path = active_request_logger.finalize_log_with_error(
+                            filepath=log_state["filepath"],
+                            error=exception,
+                            end_time=time.time(),
+                            duration=attempt_duration
+                        )
+                        logger.info(f"Finalized log for failed attempt {attempt_number}: {os.path.basename(finalized_path)}")
+
+                        # Create new log file for the retry attempt
+                        new_start_time = time.time()
+                        log_state["attempt_start_time"] = new_start_time
+
+                        new_log_filepath = active_request_logger.start_request_log(
+                            request_id=f"{request_id}-retry{attempt_number}",
+                            endpoint="/chat/completions",
+                            request_data=request_data,
+                            headers=headers or {},
+                            start_time=new_start_time,
+                            character_chat_info=character_chat_info,
+                            original_request_data=original_request_data,
+                            stripped_metadata=stripped_metadata,
+                            lorebook_entries=lorebook_entries,
+                            is_proxy_retry=True,
+                            previous_filepath=finalized_path,
+                            config_path=plan.source
+                        )
+
+                        # Update both the state container and outer variable
+                        log_state["filepath"] = new_log_filepath
+                        log_filepath = new_log_filepath
+
+                        logger.info(f"Created new log for retry attempt {attempt_number + 1}: {os.path.basename(new_log_filepath)}")
 
                 except Exception as log_error:
                     logger.error(f"Failed to manage logs during retry: {log_error}")
 
         # Use error handler for retries with callback
-        response_data = error_handler.retry_with_backoff(make_request, context, on_retry=on_retry_callback)
+        def run_with_retries():
+            return error_handler.retry_with_backoff(
+                make_request, context, on_retry=on_retry_callback,
+                failover=upstream_selection.failover_available if upstream_selection else None
+            )
+
+        def run_admitted():
+            nonlocal admission_ticket
+            if admission is not None:
+                with tracer.span("admission_wait"):
+                    admission_ticket = admission.acquire(plan.source, plan.admission_limit, operation, chat)
+            return run_with_retries()
+
+        if coalesce_key:
+            with tracer.span("singleflight"):
+                response_data = singleflight.do(coalesce_key, operation, run_admitted)
+        else:
+            response_data = run_with_retries()
+
+        # Relay event streams chunk-by-chunk; the log is completed when the stream ends
+        if isinstance(response_data, requests.Response):
+            upstream_response = response_data
+            # Stages up to the first byte; the trace has ended by the time the stream does
+            stream_trace_summary = tracer.summary()
+
+            def on_stream_complete(assembled_response, stream_error, stream_stats):
+                """Complete the request log from the chunks assembled during relay"""
+                stream_end_time = stream_stats.get("end_time", time.time())
+                if active_request_logger and log_state["filepath"]:
+                    active_request_logger.complete_request_log(
+                        filepath=log_state["filepath"],
+                        response_data=assembled_response,
+                        response_headers=dict(upstream_response.headers),
+                        end_time=stream_end_time,
+                        duration=stream_end_time - log_state["attempt_start_time"],
+                        error=stream_error,
+                        trace_summary=stream_trace_summary
+                    )
+                if stream_error and active_error_logger:
+                    active_error_logger.log_error(stream_error, {
+                        "context": "stream_relay",
+                        "error_type": "stream_relay_error",
+                        "events": stream_stats.get("events"),
+                        "bytes": stream_stats.get("bytes")
+                    }, character_chat_info=character_chat_info)
+                metrics.request_finished(character_chat_info, plan.source, "stream_error" if stream_error else "200",
+                                         stream_end_time - start_time)
+                if admission_ticket:
+                    admission_ticket.release()
+
+            streaming_handoff = True
+            return SSEStreamRelay(upstream_response, request_id, on_complete=on_stream_complete,
+                                  start_time=start_time)
 
         # Check if this is an error response (dict with _proxy_error flag)
         if isinstance(response_data, dict) and response_data.get('_proxy_error'):
             status_code = response_data.pop('_status_code')
             response_data.pop('_proxy_error')
+            metrics_status = str(status_code)
             print("=" * 80, flush=True)
             print(f"OUTGOING RESPONSE [{request_id}] - Client Error {status_code}", flush=True)
             print(f"Error Response: {json.dumps(response_data, indent=2)}", flush=True)
@@ -338,13 +561,13 @@ def forward_request(request_data: Dict[str, Any], headers: Optional[Dict[str, st
             response.status_code = status_code
             return response
 
+        if cache_key and cache_store and is_cacheable_reply(response_data):
+            response_cache.put(cache_key, operation, response_data)
+
         # Log successful response to console
-        print("=" * 80, flush=True)
-        print(f"OUTGOING RESPONSE [{request_id}] - Success", flush=True)
-        print(f"Response Data: {json.dumps(response_data, indent=2)}", flush=True)
-        print(f"Duration: {time.time() - start_time:.3f}s", flush=True)
-        print("=" * 80, flush=True)
+        print_outgoing_response(request_id, "Success", response_data, time.time() - start_time)
 
+        metrics_status = "200"
         return response_data
 
     except Exception as e:
@@ -373,17 +596,25 @@ def forward_request(request_data: Dict[str, Any], headers: Optional[Dict[str, st
         end_time = time.time()
         # Calculate duration for the current attempt (not total duration across all retries)
         attempt_duration = end_time - log_state.get("attempt_start_time", start_time)
+        if not streaming_handoff:
+            # Streams are recorded and release their slot when they end (on_stream_complete)
+            metrics.request_finished(character_chat_info, plan.source, metrics_status, end_time - start_time)
+            if admission_ticket:
+                admission_ticket.release()
 
-        if active_request_logger and log_filepath:
-            try:
-                active_request_logger.complete_request_log(
-                    filepath=log_filepath,
-                    response_data=response_data,
-                    response_headers={},
-                    end_time=end_time,
-                    duration=attempt_duration,
-                    error=error
-                )
+        if active_request_logger and log_filepath and not streaming_handoff:
+            try:
+                trace_summary = tracer.summary()
+                with tracer.span("log_complete"):
+                    active_request_logger.complete_request_log(
+                        filepath=log_filepath,
+                        response_data=response_data,
+                        response_headers={"X-Proxy-Cache": "HIT"} if cached_response is not None else {},
+                        end_time=end_time,
+                        duration=attempt_duration,
+                        error=error,
+                        trace_summary=trace_summary
+                    )
             except Exception as log_error:
                 logger.error(f"Failed to complete request log: {log_error}")
 
@@ -399,19 +630,68 @@ def detailed_health_check():
     """Detailed health check endpoint with retry configuration"""
     try:
         error_config = config.get_error_handling_config()
+        message_cache = get_message_cache()
+        log_writer = get_log_writer()
+        log_index = get_log_index()
+        admission = get_admission_controller()
+        breakers = get_circuit_breakers()
+        rate_limiter = get_rate_limiter()
+        concurrency_limits = get_concurrency_limits()
+        hedger = get_hedger()
+        singleflight = get_singleflight()
+        response_cache = get_response_cache()
+        default_plan = get_execution_plan(config)
+        upstream_pool = default_plan.upstream_pool
+        models_cache = default_plan.models_cache
         return jsonify({
             "status": "healthy",
             "retry_config": {
                 "max_retries": error_config.get("max_retries", 10),
                 "base_delay": error_config.get("base_delay", 1.0),
                 "max_delay": error_config.get("max_delay", 60.0)
-            }
+            },
+            "connection_pool": get_session_pool().get_stats(),
+            "execution_plans": get_plan_cache().get_stats(),
+            "preprocessing_cache": message_cache.get_stats() if message_cache else {"enabled": False},
+            "log_writer": log_writer.get_stats() if log_writer else {"enabled": False},
+            "log_sequence": get_log_sequence().get_stats(),
+            "log_index": log_index.get_stats() if log_index else {"enabled": False},
+            "tracing": get_tracer().get_stats(),
+            "admission": admission.get_stats() if admission else {"enabled": False},
+            "circuit_breakers": breakers.get_stats() if breakers else {"enabled": False},
+            "rate_limit": rate_limiter.get_stats() if rate_limiter else {"enabled": False},
+            "concurrency_limit": concurrency_limits.get_stats() if concurrency_limits else {"enabled": False},
+            "hedging": hedger.get_stats() if hedger else {"enabled": False},
+            "singleflight": singleflight.get_stats() if singleflight else {"enabled": False},
+            "response_cache": response_cache.get_stats() if response_cache else {"enabled": False},
+            "upstream_pool": upstream_pool.get_stats() if upstream_pool else {"enabled": False},
+            "models_cache": models_cache.get_stats() if models_cache else {"enabled": False}
         })
     except Exception as e:
         logger.error(f"Error in detailed health check: {e}")
         return jsonify({"status": "unhealthy", "error": str(e)}), 500
 
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Request, upstream, retry and traffic metrics in Prometheus text format"""
+    metrics = get_metrics()
+    if not metrics.enabled:
+        return jsonify({"error": {"message": "Metrics are disabled", "type": "metrics_disabled"}}), 404
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
+
+@app.route('/logs/query', methods=['GET'])
+def logs_query():
+    """Filter or aggregate indexed request logs (see log_index.run_log_query)"""
+    try:
+        return jsonify(run_log_query(request.args))
+    except LookupError as e:
+        return jsonify({"error": {"message": str(e), "type": "log_index_disabled"}}), 404
+    except ValueError as e:
+        return jsonify({"error": {"message": str(e), "type": "invalid_query"}}), 400
+
+
 @app.route('/models', methods=['GET'], defaults={'config_path': None})
 @app.route('/<path:config_path>/models', methods=['GET'])
 def models_endpoint(config_path):
@@ -441,51 +721,43 @@ def models_endpoint(config_path):
         active_config = request_config if request_config is not None else config
         _request_logger_for_models, active_error_logger = get_loggers_for_config(active_config)
 
-        # Get target proxy configuration
-        proxy_config = active_config.get_target_proxy_config()
-        target_url = proxy_config.get("url")
-        if not target_url:
+        plan = get_execution_plan(active_config)
+        upstream_pool = plan.upstream_pool
+
+        # Get target proxy configuration
+        proxy_config = active_config.get_target_proxy_config()
+        target_url = proxy_config.get("url")
+        if not target_url and upstream_pool is None:
             raise ValueError("target_proxy.url is not configured")
 
-        # Extract base URL by removing /chat/completions from the end
-        base_url = target_url.replace("/chat/completions", "")
-        models_url = f"{base_url}/models"
-
-        # Create proxy client for models endpoint with error logger
-        proxy_client = ProxyClient(models_url, error_logger=active_error_logger, config=active_config)
-
-        # Create error handler for models request
-        error_config = active_config.get_error_handling_config()
-        max_retries = error_config.get("max_retries", 10)
-        base_delay = error_config.get("base_delay", 1.0)
-        max_delay = error_config.get("max_delay", 60.0)
-        retry_codes = error_config.get("retry_codes", [429, 502, 503, 504])
-        fail_codes = error_config.get("fail_codes", [400, 401, 403])
-        conditional_retry_codes = error_config.get("conditional_retry_codes", [404, 411, 412])
-
-        # Get hard stop configuration
-        hard_stop_config = error_config.get("hard_stop_conditions", {})
-
-        models_error_handler = ErrorHandler(
-            max_retries=max_retries,
-            base_delay=base_delay,
-            max_delay=max_delay,
-            error_logger=active_error_logger,
-            hard_stop_config=hard_stop_config,
-            retry_codes=retry_codes,
-            fail_codes=fail_codes,
-            conditional_retry_codes=conditional_retry_codes
-        )
+        # With an upstream pool each listing request goes to the upstream the pool picks
+        models_url = models_url_for(target_url) if upstream_pool is None else "upstream_pool"
 
-        # Define the models request function
-        def make_models_request():
+        # Reuse the plan's error handler for models requests
+        models_error_handler = plan.get_error_handler(active_error_logger)
+        # Captured here: background refreshes run outside the request context
+        models_headers = dict(request.headers)
+
+        def send_models(proxy_client: ProxyClient):
             return proxy_client.forward_request(
                 request_data={},  # Empty for GET request
-                headers=dict(request.headers),
+                headers=models_headers,
                 method="GET",
                 endpoint=""  # Use empty endpoint since models_url already includes /models
             )
 
+        # Define the models request function
+        def make_models_request():
+            if upstream_pool is None:
+                return send_models(plan.get_proxy_client(models_url, active_error_logger))
+            # A listing says nothing about chat health: counted in flight only
+            upstream = upstream_pool.acquire(set())
+            try:
+                return send_models(plan.get_proxy_client(models_url_for(upstream.url), active_error_logger,
+                                                         upstream.apikey))
+            finally:
+                upstream_pool.release(upstream, None)
+
         # Forward the request with error handling and context
         context = {
             "request_type": "models_request",
@@ -494,16 +766,36 @@ def models_endpoint(config_path):
             "character_chat_info": character_chat_info
         }
 
-        response_data = models_error_handler.retry_with_backoff(make_models_request, context)
-
-        return jsonify(response_data)
+        models_cache = plan.models_cache
+        if models_cache is None:
+            response_data = models_error_handler.retry_with_backoff(make_models_request, context)
+            return jsonify(response_data)
+
+        # Short retries: a cold cache falls back to DEFAULT_MODELS soon when upstream is down
+        listing_error_handler = plan.get_models_error_handler(active_error_logger)
+
+        def fetch_models():
+            data = listing_error_handler.retry_with_backoff(make_models_request, context)
+            if not isinstance(data, dict) or data.get("_proxy_error"):
+                raise ValueError(f"Upstream did not return a models listing: {data}")
+            return data
+
+        # Answer from the config's listing; stale listings are refreshed in the background
+        entry, cache_state = models_cache.get(models_cache.key_for(models_url, models_headers), fetch_models,
+                                              {"object": "list", "data": DEFAULT_MODELS})
+        cache_headers = {"ETag": entry.etag, "X-Proxy-Cache": cache_state.upper()}
+        if etag_matches(request.headers.get("If-None-Match"), entry.etag):
+            models_cache.record_not_modified()
+            return Response(status=304, headers=cache_headers)
+        response = jsonify(entry.data)
+        response.headers.update(cache_headers)
+        return response
 
     except Exception as e:
         logger.error(f"Error in models endpoint: {e}")
         error = e
 
         # Return fallback models if target proxy fails
-        from .constants import DEFAULT_MODELS
         return jsonify({
             "object": "list",
             "data": DEFAULT_MODELS
@@ -515,6 +807,13 @@ def models_endpoint(config_path):
 @app.route('/<path:config_path>/chat/completions', methods=['POST'])
 def chat_completions(config_path):
     """Chat completions endpoint with optional config path parameter"""
+    # Root span of the request's trace; stages below it become child spans
+    with get_tracer().span("chat_completions", config_path=config_path or "default"):
+        return _chat_completions(config_path)
+
+
+def _chat_completions(config_path):
+    """Handle a chat completions request (see chat_completions)"""
     try:
         # Load config based on path parameter
         request_config = None
@@ -536,59 +835,23 @@ def chat_completions(config_path):
             return jsonify({"error": {"message": "Content-Type must be application/json"}}), 400
 
         try:
-            request_data = request.get_json()
+            with get_tracer().span("parse_json"):
+                request_data = request.get_json()
         except Exception as e:
             return jsonify({"error": {"message": "Invalid JSON in request body"}}), 400
 
         if not request_data:
             return jsonify({"error": {"message": "No JSON data provided"}}), 400
 
-        # Save original request data for logging (before any modifications)
-        # Use deep copy to ensure original is completely isolated from any modifications
-        original_request_data = copy.deepcopy(request_data)
-
         # Validate required fields
         if "messages" not in request_data:
             return jsonify({"error": {"message": "Missing required field: messages"}}), 400
 
-        # Process messages with regex if configured
-        if "messages" in request_data:
-            regex_config = active_config.get_regex_replacement_config()
-            if regex_config.get("enabled", False):
-                rules = regex_config.get("rules", [])
-                if rules:
-                    request_data = request_data.copy()
-                    request_data["messages"] = process_messages_with_regex(request_data["messages"], rules)
-
-        # Extract lorebook entries from messages before stripping (use original_request_data)
-        lorebook_entries = None
-        if "messages" in original_request_data:
-            lorebook_entries = extract_lorebook_entries_from_messages(original_request_data["messages"])
-            if lorebook_entries:
-                logger.info(f"Extracted {len(lorebook_entries)} lorebook entries")
-
-        # Strip ST_METADATA from messages before forwarding
-        # IMPORTANT: Extract from original_request_data to avoid regex interference
-        stripped_metadata = None
-        if "messages" in original_request_data:
-            all_metadata, cleaned_messages = extract_st_metadata_from_messages(original_request_data["messages"])
-            if all_metadata:
-                # Store all metadata for logging
-                stripped_metadata = all_metadata
-                # Log that we found and stripped metadata (show all blocks)
-                for i, metadata in enumerate(all_metadata):
-                    logger.info(f"Stripped ST_METADATA block {i+1} - Chat: {metadata.get('chat')}, Operation: {metadata.get('operation')}")
-                # Apply stripping to current request_data (which may have had regex applied)
-                request_data = request_data.copy()
-                # Extract again from current request_data to get cleaned messages
-                _, request_cleaned_messages = extract_st_metadata_from_messages(request_data["messages"])
-                request_data["messages"] = request_cleaned_messages
-
-        # Strip lorebook attributes from messages before forwarding
-        if lorebook_entries and "messages" in request_data:
-            logger.info(f"Stripping lorebook attributes from {len(lorebook_entries)} entries")
-            request_data = request_data.copy()
-            request_data["messages"] = strip_lorebook_attributes_from_messages(request_data["messages"])
+        # Apply regex rules and strip ST_METADATA/lorebook markup
+        with get_tracer().span("preprocess"):
+            request_data, original_request_data, stripped_metadata, lorebook_entries = prepare_chat_request(
+                request_data, active_config
+            )
 
         # Forward the request with the appropriate config
         # Pass both original and cleaned data for logging
@@ -600,8 +863,25 @@ def chat_completions(config_path):
             stripped_metadata=stripped_metadata,
             lorebook_entries=lorebook_entries
         )
+        if isinstance(result, SSEStreamRelay):
+            return Response(result, content_type=result.content_type, headers=SSE_RESPONSE_HEADERS)
         return jsonify(result)
 
+    except AdmissionRejected as e:
+        response = jsonify(overloaded_error(e))
+        response.status_code = 503
+        response.headers["Retry-After"] = retry_after_header(e)
+        return response
+    except CircuitOpenError as e:
+        response = jsonify(upstream_unavailable_error(e))
+        response.status_code = 503
+        response.headers["Retry-After"] = retry_after_header(e)
+        return response
+    except RateLimitExceeded as e:
+        response = jsonify(rate_limited_error(e))
+        response.status_code = 429
+        response.headers["Retry-After"] = retry_after_header(e)
+        return response
     except ValueError as e:
         # Malformed ST_METADATA or validation errors - return 400 Bad Request
         logger.error(f"Validation error in chat completions: {e}")
@@ -612,18 +892,81 @@ def chat_completions(config_path):
         return jsonify({"error": {"message": str(e)}}), 500
 
 
-def main():
-    """Main entry point for the application"""
-    try:
-        # Initialize loggers honoring configured folders (supports overrides)
-        global request_logger, error_logger
-        request_logger, error_logger = get_loggers_for_config(config)
-        
-        # Get server configuration
-        server_config = config.get_server_config()
+# Whether configure_process has run in this process (uvicorn may also load the ASGI app directly)
+_process_configured = False
+
+
+def process_configured() -> bool:
+    """Return whether configure_process has run in this process"""
+    return _process_configured
+
+
+def configure_process(multi_process: bool = False) -> None:
+    """Set up the process-wide pools, caches, log writer and metrics from the server config
+
+    Called once in the serving process, or in each worker after it is forked.
+
+    Args:
+        multi_process: Whether other worker processes serve the same port and log folders
+    """
+    global _process_configured
+    # Share keep-alive upstream sessions across all requests and retries
+    configure_session_pool(config.get_connection_pool_config())
+    # Memoize per-message preprocessing across requests
+    configure_message_cache(config.get_preprocessing_cache_config())
+    # Render and write request logs off the request thread (drained at exit)
+    configure_log_writer(config.get_log_writer_config())
+    # Number log files from per-folder counters instead of directory scans
+    sequence_config = config.get_log_sequence_config()
+    if multi_process and not sequence_config.get("cross_process", False):
+        # Workers log into the same folders, so numbers must come from the shared counter files
+        sequence_config = dict(sequence_config, cross_process=True)
+    configure_log_sequence(sequence_config)
+    # Index request attempts and errors in SQLite for /logs/query
+    configure_log_index(config.get_log_index_config())
+    # Bound in-flight upstream work and queue the overflow
+    configure_admission(config.get_admission_config())
+    # Fail fast against upstream origins that keep failing
+    configure_circuit_breakers(config.get_circuit_breaker_config())
+    # Pace upstream calls per origin and API key, with one shared cooldown per 429
+    configure_rate_limiter(config.get_rate_limit_config())
+    # Find each upstream origin's workable concurrency (AIMD on overload replies and latency)
+    configure_concurrency_limits(config.get_concurrency_limit_config())
+    # Race a second copy of slow attempts for latency-critical operations
+    configure_hedging(config.get_hedging_config())
+    # Let identical in-flight requests of allowlisted operations share one upstream call
+    configure_singleflight(config.get_singleflight_config())
+    # Answer repeated deterministic requests from memory or the on-disk cache
+    configure_response_cache(config.get_response_cache_config())
+    # Latency histograms and counters served on /metrics (summed over workers)
+    configure_metrics(config.get_metrics_config(), multi_process=multi_process)
+    # Per-stage request traces (JSONL or OTLP/JSON)
+    configure_tracer(config.get_tracing_config())
+    _process_configured = True
+
+
+def shutdown_process() -> None:
+    """Drain the log writer and write a final metrics snapshot (pre-forked workers exit without atexit)"""
+    shutdown_log_writer()
+    metrics = get_metrics()
+    if metrics.snapshot_dir:
+        metrics.close()
+
+
+def main():
+    """Main entry point for the application"""
+    try:
+        # Initialize loggers honoring configured folders (supports overrides)
+        global request_logger, error_logger
+        request_logger, error_logger = get_loggers_for_config(config)
+
+        # Get server configuration
+        server_config = config.get_server_config()
         host = server_config.get("host", "0.0.0.0")
         port = server_config.get("port", 5000)
         debug = server_config.get("debug", False)
+        engine = resolve_engine(server_config)
+        workers = resolve_worker_count(server_config)
 
         # Get proxy configuration
         proxy_config = config.get_target_proxy_config()
@@ -638,13 +981,17 @@ def main():
         print(f"Request Logging: {'Enabled' if request_logger.enabled else 'Disabled'}", flush=True)
         print(f"Error Logging: {'Enabled' if error_logger.enabled else 'Disabled'}", flush=True)
         print(f"Debug Mode: {'Enabled' if debug else 'Disabled'}", flush=True)
+        print(f"Server Engine: {engine}", flush=True)
+        print(f"Worker Processes: {workers}", flush=True)
         print("=" * 80, flush=True)
         print("Ready to accept requests. Press Ctrl+C to stop.", flush=True)
         print("=" * 80, flush=True)
 
-        # Start Flask server
         print(f"\nServing on http://{host}:{port}\n", flush=True)
-        app.run(host=host, port=port, debug=False, use_reloader=False, threaded=True)
+        if workers > 1:
+            # Totals from a previous run's workers would otherwise be summed into this one's
+            clear_snapshots(config.get_metrics_config().get("worker_snapshot_dir"))
+        run_server(app, server_config, configure_process, shutdown_process)
         
     except Exception as e:
         logger.error(f"Failed to start server: {e}")
@@ -0,0 +1,590 @@
+"""
+In-process metrics exposed on /metrics in Prometheus text format
+
+Counters, gauges and histograms are keyed by label values. Each label
+combination (series) has its own small lock, so recording takes one
+uncontended lock per update; the registry-wide lock is only taken the first
+time a series is seen and while rendering.
+
+When the server pre-forks workers, each worker's values only cover the
+requests it handled. With snapshot_dir set every worker writes its values
+to <snapshot_dir>/metrics-<pid>.json once per snapshot_interval, and
+/metrics (served by whichever worker accepts the scrape) sums the
+snapshots of all workers. Counters and histograms of workers that have
+exited are kept so totals never go backwards; their gauges are dropped.
+"""
+import os
+import json
+import glob
+import bisect
+import threading
+import logging
+from typing import Dict, Any, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Chat completions take anywhere from under a second to several minutes
+DEFAULT_LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0)
+
+# Where pre-forked workers share their values (see module docstring)
+DEFAULT_SNAPSHOT_DIR = os.path.join("logs", ".metrics")
+SNAPSHOT_PATTERN = "metrics-*.json"
+
+
+def _format_value(value: float) -> str:
+    """Format a sample value for the text exposition format"""
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape_label_value(value: Any) -> str:
+    """Escape a label value (backslash, double quote and newline)"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[Any], extra: Optional[Tuple[str, str]] = None) -> str:
+    """Render {name="value",...} (empty string when there are no labels)"""
+    pairs = [f'{name}="{_escape_label_value(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _ValueSeries:
+    """One counter or gauge series"""
+
+    __slots__ = ("_lock", "value")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float) -> None:
+        with self._lock:
+            self.value = value
+
+
+class _HistogramSeries:
+    """One histogram series (per-bucket counts are made cumulative when rendered)"""
+
+    __slots__ = ("_lock", "_bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self._lock = threading.Lock()
+        self._bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self._bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self) -> Tuple[List[int], float, int]:
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+
+class _Metric:
+    """Base class for a named metric with a fixed set of label names"""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+
+    def _new_series(self):
+        raise NotImplementedError
+
+    def labels(self, *values: Any):
+        """
+        Return the series for a combination of label values, creating it on first use.
+
+        Args:
+            *values: One value per label name, in order
+
+        Returns:
+            Series object with inc/dec/set (counters, gauges) or observe (histograms)
+        """
+        key = tuple(str(value) for value in values)
+        series = self._series.get(key)
+        if series is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {key}")
+            with self._lock:
+                series = self._series.setdefault(key, self._new_series())
+        return series
+
+    def _items(self) -> List[Tuple[Tuple[str, ...], Any]]:
+        with self._lock:
+            return sorted(self._series.items())
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, series in self._items():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(series.value)}")
+        return lines
+
+    def dump(self) -> List[List[Any]]:
+        """Return [label values, value] per series (for worker snapshots)"""
+        return [[list(key), series.value] for key, series in self._items()]
+
+    def load(self, samples: List[List[Any]]) -> None:
+        """Add dumped series values into this metric"""
+        for key, value in samples:
+            self.labels(*key).inc(value)
+
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+
+    kind = "counter"
+
+    def _new_series(self) -> _ValueSeries:
+        return _ValueSeries()
+
+
+class Gauge(_Metric):
+    """Value that goes up and down"""
+
+    kind = "gauge"
+
+    def _new_series(self) -> _ValueSeries:
+        return _ValueSeries()
+
+
+class Histogram(_Metric):
+    """Distribution of observed values over fixed buckets"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Iterable[float] = DEFAULT_LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(float(bound) for bound in buckets))
+
+    def _new_series(self) -> _HistogramSeries:
+        return _HistogramSeries(self.buckets)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, series in self._items():
+            counts, total, count = series.snapshot()
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+    def dump(self) -> List[List[Any]]:
+        """Return [label values, bucket counts, sum, count] per series (for worker snapshots)"""
+        return [[list(key), *series.snapshot()] for key, series in self._items()]
+
+    def load(self, samples: List[List[Any]]) -> None:
+        """Add dumped series values into this histogram (series with other buckets are skipped)"""
+        for key, counts, total, count in samples:
+            if len(counts) != len(self.buckets) + 1:
+                continue
+            series = self.labels(*key)
+            with series._lock:
+                series.counts = [a + b for a, b in zip(series.counts, counts)]
+                series.sum += total
+                series.count += count
+
+
+class MetricsRegistry:
+    """Collection of metrics rendered together"""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        """Add a metric to the registry and return it"""
+        with self._lock:
+            if any(existing.name == metric.name for existing in self._metrics):
+                raise ValueError(f"Duplicate metric {metric.name}")
+            self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """Render every metric in the text exposition format"""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def dump(self) -> Dict[str, List[List[Any]]]:
+        """Return every metric's series values by metric name"""
+        with self._lock:
+            metrics = list(self._metrics)
+        return {metric.name: metric.dump() for metric in metrics}
+
+    def load(self, snapshot: Dict[str, List[List[Any]]], include_gauges: bool = True) -> None:
+        """
+        Add a dumped registry's values into this one.
+
+        Args:
+            snapshot: Result of dump() on a registry with the same metrics
+            include_gauges: Whether to add gauge values (False for exited workers)
+        """
+        with self._lock:
+            metrics = list(self._metrics)
+        for metric in metrics:
+            if metric.kind == "gauge" and not include_gauges:
+                continue
+            metric.load(snapshot.get(metric.name, []))
+
+
+def retry_reason(exception: Exception) -> str:
+    """
+    Label describing why a failed attempt is retried.
+
+    Args:
+        exception: Exception raised by the attempt
+
+    Returns:
+        "recategorized:<rule description>" when a status recategorization rule
+        turned the reply into an error, "status_<code>" for HTTP errors, or the
+        exception type name
+    """
+    response = getattr(exception, "response", None)
+    rule = getattr(response, "recategorized_by", None)
+    if rule:
+        return f"recategorized:{rule}"
+    status_code = getattr(response, "status_code", None)
+    if status_code:
+        return f"status_{status_code}"
+    return type(exception).__name__
+
+
+def operation_label(character_chat_info: Optional[Tuple[str, str, str]]) -> str:
+    """ST_METADATA operation of a request ("none" for requests without metadata)"""
+    return character_chat_info[2] if character_chat_info else "none"
+
+
+def config_label(config_path: Optional[str]) -> str:
+    """Config file name of a request ("default" for the server's own config)"""
+    return os.path.basename(config_path) if config_path else "default"
+
+
+class ProxyMetrics:
+    """The proxy's request, upstream, retry and traffic metrics"""
+
+    def __init__(self, enabled: bool = True, latency_buckets: Iterable[float] = DEFAULT_LATENCY_BUCKETS,
+                 snapshot_dir: Optional[str] = None, snapshot_interval: float = 1.0):
+        """
+        Initialize metrics.
+
+        Args:
+            enabled: Record metrics (when False every record call is a no-op)
+            latency_buckets: Histogram bucket upper bounds in seconds
+            snapshot_dir: Folder shared with the other pre-forked workers (None for a single process)
+            snapshot_interval: Seconds between snapshot writes
+        """
+        self.enabled = enabled
+        self.latency_buckets = tuple(latency_buckets)
+        self.snapshot_dir = snapshot_dir if enabled else None
+        self.snapshot_interval = snapshot_interval
+        self.registry = MetricsRegistry()
+        request_labels = ("operation", "config", "status")
+        self.requests_total = self.registry.register(Counter(
+            "proxy_requests_total", "Chat completion requests by ST_METADATA operation, config and final status",
+            request_labels))
+        self.request_duration = self.registry.register(Histogram(
+            "proxy_request_duration_seconds", "Chat completion latency including retries", request_labels,
+            latency_buckets))
+        self.requests_in_flight = self.registry.register(Gauge(
+            "proxy_requests_in_flight", "Chat completion requests being handled"))
+        self.upstream_duration = self.registry.register(Histogram(
+            "proxy_upstream_attempt_duration_seconds", "Latency of single upstream attempts by response status",
+            ("status",), latency_buckets))
+        self.upstream_in_flight = self.registry.register(Gauge(
+            "proxy_upstream_in_flight", "Upstream attempts waiting for a response"))
+        self.retries_total = self.registry.register(Counter(
+            "proxy_retries_total", "Retried attempts by reason", ("reason",)))
+        self.bytes_total = self.registry.register(Counter(
+            "proxy_bytes_total", "Body bytes received from (in) and sent to (out) clients", ("direction",)))
+        self.admission_rejections_total = self.registry.register(Counter(
+            "proxy_admission_rejections_total", "Requests answered 503 by admission control, by reason",
+            ("reason",)))
+        self.circuit_state = self.registry.register(Gauge(
+            "proxy_circuit_state", "Upstream circuit breaker state by origin (0 closed, 1 half-open, 2 open)",
+            ("origin",)))
+        self.circuit_rejections_total = self.registry.register(Counter(
+            "proxy_circuit_rejections_total", "Upstream attempts failed fast by an open circuit breaker",
+            ("origin",)))
+        self.concurrency_limit = self.registry.register(Gauge(
+            "proxy_upstream_concurrency_limit", "Adaptive limit on in-flight upstream attempts by origin",
+            ("origin",)))
+        self.hedges_total = self.registry.register(Counter(
+            "proxy_hedges_total", "Hedged upstream attempts by hedging policy and result", ("policy", "result")))
+        self.response_cache_total = self.registry.register(Counter(
+            "proxy_response_cache_total", "Response cache lookups by result (memory_hit, disk_hit, miss, bypass)",
+            ("result",)))
+        self.coalesced_total = self.registry.register(Counter(
+            "proxy_coalesced_requests_total", "Requests answered by an identical in-flight request's upstream call",
+            ("operation",)))
+
+        self._stop = threading.Event()
+        self._snapshot_thread = None
+        if self.snapshot_dir:
+            os.makedirs(self.snapshot_dir, exist_ok=True)
+            self._snapshot_thread = threading.Thread(target=self._snapshot_loop, name="metrics-snapshot",
+                                                     daemon=True)
+            self._snapshot_thread.start()
+
+    @classmethod
+    def from_config(cls, metrics_config: Optional[Dict[str, Any]], multi_process: bool = False) -> "ProxyMetrics":
+        """
+        Build metrics from the metrics configuration section.
+
+        Args:
+            metrics_config: metrics configuration section
+            multi_process: Whether this is one of several pre-forked workers
+                           (enables snapshots in worker_snapshot_dir)
+        """
+        metrics_config = metrics_config or {}
+        return cls(
+            enabled=metrics_config.get("enabled", True),
+            latency_buckets=metrics_config.get("latency_buckets") or DEFAULT_LATENCY_BUCKETS,
+            snapshot_dir=metrics_config.get("worker_snapshot_dir", DEFAULT_SNAPSHOT_DIR) if multi_process else None,
+            snapshot_interval=metrics_config.get("snapshot_interval", 1.0),
+        )
+
+    def request_started(self) -> None:
+        """Count a chat completion request as in flight"""
+        if self.enabled:
+            self.requests_in_flight.labels().inc()
+
+    def request_finished(self, character_chat_info: Optional[Tuple[str, str, str]], config_path: Optional[str],
+                         status: str, duration: float) -> None:
+        """
+        Record a finished chat completion request.
+
+        Args:
+            character_chat_info: Optional tuple of (character, chat, operation)
+            config_path: Config file used for the request (None for the default config)
+            status: Final status ("200", the upstream client error code, "error" or "stream_error")
+            duration: Seconds from receipt to completion
+        """
+        if not self.enabled:
+            return
+        labels = (operation_label(character_chat_info), config_label(config_path), status)
+        self.requests_in_flight.labels().dec()
+        self.requests_total.labels(*labels).inc()
+        self.request_duration.labels(*labels).observe(duration)
+
+    def upstream_started(self) -> None:
+        """Count an upstream attempt as in flight"""
+        if self.enabled:
+            self.upstream_in_flight.labels().inc()
+
+    def upstream_finished(self, status: str, duration: float) -> None:
+        """Record a finished upstream attempt ("error" status when no response arrived)"""
+        if not self.enabled:
+            return
+        self.upstream_in_flight.labels().dec()
+        self.upstream_duration.labels(status).observe(duration)
+
+    def record_retry(self, reason: str) -> None:
+        """Count a retried attempt (see retry_reason)"""
+        if self.enabled:
+            self.retries_total.labels(reason).inc()
+
+    def record_admission_rejection(self, reason: str) -> None:
+        """Count a request rejected by admission control ("queue_full", "queue_timeout" or "upstream_limit")"""
+        if self.enabled:
+            self.admission_rejections_total.labels(reason).inc()
+
+    def set_circuit_state(self, origin: str, state: int) -> None:
+        """Publish an origin's circuit breaker state (0 closed, 1 half-open, 2 open)"""
+        if self.enabled:
+            self.circuit_state.labels(origin).set(state)
+
+    def record_circuit_rejection(self, origin: str) -> None:
+        """Count an upstream attempt failed fast by an open circuit breaker"""
+        if self.enabled:
+            self.circuit_rejections_total.labels(origin).inc()
+
+    def set_concurrency_limit(self, origin: str, limit: int) -> None:
+        """Publish an origin's adaptive concurrency limit"""
+        if self.enabled:
+            self.concurrency_limit.labels(origin).set(limit)
+
+    def record_hedge(self, policy: str, result: str) -> None:
+        """Count a hedging race result ("primary_won", "hedge_won", "both_failed" or "budget_exhausted")"""
+        if self.enabled:
+            self.hedges_total.labels(policy, result).inc()
+
+    def record_response_cache(self, result: str) -> None:
+        """Count a response cache lookup ("memory_hit", "disk_hit", "miss" or "bypass")"""
+        if self.enabled:
+            self.response_cache_total.labels(result).inc()
+
+    def record_coalesced(self, operation: str) -> None:
+        """Count a request that shared an identical in-flight request's upstream call"""
+        if self.enabled:
+            self.coalesced_total.labels(operation).inc()
+
+    def record_bytes(self, direction: str, count: int) -> None:
+        """Count client body bytes ("in" or "out")"""
+        if self.enabled and count:
+            self.bytes_total.labels(direction).inc(count)
+
+    def render(self) -> str:
+        """Render all metrics in the text exposition format (summed over workers when sharing snapshots)"""
+        if not self.snapshot_dir:
+            return self.registry.render()
+
+        self.write_snapshot()
+        merged = ProxyMetrics(enabled=True, latency_buckets=self.latency_buckets)
+        for path in glob.glob(os.path.join(self.snapshot_dir, SNAPSHOT_PATTERN)):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Skipping unreadable metrics snapshot {path}: {e}")
+                continue
+            merged.registry.load(snapshot.get("metrics", {}), include_gauges=_process_alive(snapshot.get("pid")))
+        return merged.registry.render()
+
+    @property
+    def snapshot_path(self) -> Optional[str]:
+        """This process's snapshot file"""
+        if not self.snapshot_dir:
+            return None
+        return os.path.join(self.snapshot_dir, f"metrics-{os.getpid()}.json")
+
+    def write_snapshot(self) -> None:
+        """Atomically replace this process's snapshot file"""
+        path = self.snapshot_path
+        if not path:
+            return
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({"pid": os.getpid(), "metrics": self.registry.dump()}, f)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logger.error(f"Failed to write metrics snapshot {path}: {e}")
+
+    def _snapshot_loop(self) -> None:
+        while not self._stop.wait(self.snapshot_interval):
+            self.write_snapshot()
+
+    def close(self) -> None:
+        """Stop the snapshot thread after writing a final snapshot"""
+        self._stop.set()
+        if self._snapshot_thread is not None:
+            self._snapshot_thread.join(timeout=self.snapshot_interval + 1)
+        self.write_snapshot()
+
+
+def _process_alive(pid: Any) -> bool:
+    """Whether a worker process is still running"""
+    if not isinstance(pid, int):
+        return False
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # Exists but belongs to another user
+        return True
+    return True
+
+
+def clear_snapshots(snapshot_dir: Optional[str] = None) -> None:
+    """Remove worker snapshots left by a previous run (called before forking workers)"""
+    snapshot_dir = snapshot_dir or DEFAULT_SNAPSHOT_DIR
+    for path in glob.glob(os.path.join(snapshot_dir, SNAPSHOT_PATTERN)):
+        try:
+            os.remove(path)
+        except OSError as e:
+            logger.warning(f"Failed to remove metrics snapshot {path}: {e}")
+
+
+class WSGIByteCounter:
+    """WSGI middleware counting request and response body bytes into ProxyMetrics"""
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        metrics = get_metrics()
+        try:
+            metrics.record_bytes("in", int(environ.get("CONTENT_LENGTH") or 0))
+        except ValueError:
+            pass
+        return self._count(self.wsgi_app(environ, start_response), metrics)
+
+    @staticmethod
+    def _count(body, metrics: "ProxyMetrics"):
+        # Streamed responses are counted chunk by chunk as they are sent
+        try:
+            for chunk in body:
+                metrics.record_bytes("out", len(chunk))
+                yield chunk
+        finally:
+            close = getattr(body, "close", None)
+            if close:
+                close()
+
+
+# Process-wide metrics shared by both serving engines
+_metrics_lock = threading.Lock()
+_metrics: Optional[ProxyMetrics] = None
+
+
+def get_metrics() -> ProxyMetrics:
+    """Return the process-wide metrics, creating them with defaults if needed"""
+    global _metrics
+    metrics = _metrics
+    if metrics is not None:
+        # Called on every request and upstream attempt, so skip the lock once created
+        return metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = ProxyMetrics()
+        return _metrics
+
+
+def configure_metrics(metrics_config: Optional[Dict[str, Any]], multi_process: bool = False) -> ProxyMetrics:
+    """Replace the process-wide metrics with ones built from configuration (see ProxyMetrics.from_config)"""
+    global _metrics
+    new_metrics = ProxyMetrics.from_config(metrics_config, multi_process=multi_process)
+    with _metrics_lock:
+        old_metrics = _metrics
+        _metrics = new_metrics
+    if old_metrics is not None and old_metrics.snapshot_dir:
+        old_metrics.close()
+    return new_metrics
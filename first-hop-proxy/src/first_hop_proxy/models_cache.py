@@ -0,0 +1,258 @@
+"""
+Cached /models listings
+
+SillyTavern asks for /models on every page load and connection-profile
+switch. When models_cache is enabled, each config's execution plan keeps the
+upstream listing per models URL and Authorization header:
+
+- Within ttl seconds of a fetch the cached listing is returned as is.
+- For stale_ttl seconds after that it is still returned at once while one
+  background refresh fetches a new listing (stale-while-revalidate).
+- Older or missing listings are fetched before answering; concurrent
+  requests for the same listing share that fetch.
+
+Fetches are retried only max_retries times, so a cold cache answers quickly
+when upstream is down. If a fetch fails, the previous listing keeps being
+served and the next refresh is attempted after error_ttl seconds. Without a
+previous listing the fallback (DEFAULT_MODELS) is served, also for error_ttl
+seconds. Every
+listing carries an ETag, so clients that send If-None-Match get a 304.
+"""
+import json
+import time
+import asyncio
+import hashlib
+import threading
+import logging
+from typing import Dict, Any, Awaitable, Callable, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+MODELS_HIT = "hit"
+MODELS_STALE = "stale"
+MODELS_MISS = "miss"
+
+
+def models_etag(data: Dict[str, Any]) -> str:
+    """Strong ETag of a models listing"""
+    digest = hashlib.sha256(json.dumps(data, sort_keys=True, separators=(",", ":")).encode("utf-8")).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether an If-None-Match header matches etag (weak comparison, as for GET)"""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.replace("W/", "", 1) == etag:
+            return True
+    return False
+
+
+class ModelsEntry:
+    """One cached listing and how long it may be served"""
+
+    def __init__(self, data: Dict[str, Any], expires: float, stale_until: float, fallback: bool = False):
+        self.data = data
+        self.etag = models_etag(data)
+        self.expires = expires
+        self.stale_until = stale_until
+        self.fallback = fallback
+
+
+class ModelsCache:
+    """Models listings of one config with stale-while-revalidate refreshes"""
+
+    def __init__(self, ttl: float = 300.0, stale_ttl: float = 3600.0, error_ttl: float = 30.0,
+                 max_retries: int = 1):
+        """
+        Initialize cache.
+
+        Args:
+            ttl: Seconds a fetched listing is fresh
+            stale_ttl: Further seconds it is served while a background refresh runs
+            error_ttl: Seconds before a failed fetch is retried (the previous listing or the fallback is served)
+            max_retries: Retries within one fetch (instead of error_handling.max_retries)
+        """
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.error_ttl = error_ttl
+        self.max_retries = max_retries
+        self._entries: Dict[str, ModelsEntry] = {}
+        self._lock = threading.Lock()
+        # Keys with a fetch in flight, set when it ends
+        self._refreshing: Dict[str, threading.Event] = {}
+        self._async_refreshing: Dict[str, asyncio.Event] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self.counts: Dict[str, int] = {}
+
+    @classmethod
+    def from_config(cls, cache_config: Optional[Dict[str, Any]]) -> Optional["ModelsCache"]:
+        """Build a cache from the models_cache configuration section (None when disabled)"""
+        cache_config = cache_config or {}
+        if not cache_config.get("enabled", False):
+            return None
+        return cls(
+            ttl=cache_config.get("ttl", 300.0),
+            stale_ttl=cache_config.get("stale_ttl", 3600.0),
+            error_ttl=cache_config.get("error_ttl", 30.0),
+            max_retries=cache_config.get("max_retries", 1),
+        )
+
+    @staticmethod
+    def key_for(models_url: str, headers: Optional[Dict[str, str]]) -> str:
+        """Cache key of a listing: the models URL and the client's Authorization header"""
+        authorization = next((value for name, value in (headers or {}).items()
+                              if name.lower() == "authorization"), "")
+        return hashlib.sha256(f"{models_url}\n{authorization}".encode("utf-8")).hexdigest()
+
+    def _count(self, result: str) -> None:
+        """Count a lookup or refresh result (lock held)"""
+        self.counts[result] = self.counts.get(result, 0) + 1
+
+    def record_not_modified(self) -> None:
+        """Count a listing answered 304 Not Modified"""
+        with self._lock:
+            self._count("not_modified")
+
+    def _lookup(self, key: str, refreshing: Dict[str, Any],
+                new_event: Callable[[], Any]) -> Tuple[Optional[ModelsEntry], str, bool]:
+        """
+        Find a servable entry for key.
+
+        Returns:
+            Tuple of (entry, MODELS_HIT or MODELS_STALE, whether the caller starts the background
+            refresh); entry is None when the listing must be fetched first
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now < entry.expires:
+                self._count(MODELS_HIT)
+                return entry, MODELS_HIT, False
+            if entry is not None and now < entry.stale_until:
+                self._count(MODELS_STALE)
+                if key in refreshing:
+                    return entry, MODELS_STALE, False
+                refreshing[key] = new_event()
+                return entry, MODELS_STALE, True
+            return None, MODELS_MISS, False
+
+    def _store(self, key: str, data: Optional[Dict[str, Any]], fallback: Dict[str, Any],
+               error: Optional[Exception]) -> None:
+        """Record a fetch result; failures keep the previous listing (or the fallback) for error_ttl"""
+        now = time.monotonic()
+        with self._lock:
+            if error is None:
+                self._count("refreshes")
+                self._entries[key] = ModelsEntry(data, now + self.ttl, now + self.ttl + self.stale_ttl)
+                return
+            self._count("refresh_errors")
+            previous = self._entries.get(key)
+            if previous is not None:
+                previous.expires = now + self.error_ttl
+                previous.stale_until = max(previous.stale_until, previous.expires)
+            else:
+                self._entries[key] = ModelsEntry(fallback, now + self.error_ttl, now + self.error_ttl, fallback=True)
+        logger.warning(f"Models refresh failed, serving {'the previous listing' if previous else 'fallback models'}: "
+                       f"{error}")
+
+    def _refresh(self, key: str, fetch: Callable[[], Dict[str, Any]], fallback: Dict[str, Any]) -> None:
+        """Fetch a listing and wake the requests waiting for it"""
+        try:
+            try:
+                data, error = fetch(), None
+            except Exception as e:
+                data, error = None, e
+            self._store(key, data, fallback, error)
+        finally:
+            with self._lock:
+                done = self._refreshing.pop(key, None)
+            if done is not None:
+                done.set()
+
+    def get(self, key: str, fetch: Callable[[], Dict[str, Any]],
+            fallback: Dict[str, Any]) -> Tuple[ModelsEntry, str]:
+        """
+        Return the listing for key, fetching or refreshing it as needed.
+
+        Args:
+            key: Value of key_for()
+            fetch: Fetches the listing from upstream (with its retries)
+            fallback: Listing served when there is no previous one and fetching fails
+
+        Returns:
+            Tuple of (entry, MODELS_HIT, MODELS_STALE or MODELS_MISS)
+        """
+        entry, state, start_refresh = self._lookup(key, self._refreshing, threading.Event)
+        if entry is not None:
+            if start_refresh:
+                threading.Thread(target=self._refresh, args=(key, fetch, fallback), name="models-refresh",
+                                 daemon=True).start()
+            return entry, state
+
+        with self._lock:
+            self._count(MODELS_MISS)
+            done = self._refreshing.get(key)
+            owner = done is None
+            if owner:
+                done = self._refreshing[key] = threading.Event()
+        if owner:
+            self._refresh(key, fetch, fallback)
+        else:
+            done.wait()
+        with self._lock:
+            return self._entries[key], MODELS_MISS
+
+    async def _refresh_async(self, key: str, fetch: Callable[[], Awaitable[Dict[str, Any]]],
+                             fallback: Dict[str, Any]) -> None:
+        """Coroutine variant of _refresh()"""
+        try:
+            try:
+                data, error = await fetch(), None
+            except Exception as e:
+                data, error = None, e
+            self._store(key, data, fallback, error)
+        finally:
+            with self._lock:
+                done = self._async_refreshing.pop(key, None)
+            if done is not None:
+                done.set()
+
+    async def get_async(self, key: str, fetch: Callable[[], Awaitable[Dict[str, Any]]],
+                        fallback: Dict[str, Any]) -> Tuple[ModelsEntry, str]:
+        """Coroutine variant of get()"""
+        entry, state, start_refresh = self._lookup(key, self._async_refreshing, asyncio.Event)
+        if entry is not None:
+            if start_refresh:
+                task = asyncio.ensure_future(self._refresh_async(key, fetch, fallback))
+                # Keep a reference until the background refresh ends
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            return entry, state
+
+        with self._lock:
+            self._count(MODELS_MISS)
+            done = self._async_refreshing.get(key)
+            owner = done is None
+            if owner:
+                done = self._async_refreshing[key] = asyncio.Event()
+        if owner:
+            await self._refresh_async(key, fetch, fallback)
+        else:
+            await done.wait()
+        with self._lock:
+            return self._entries[key], MODELS_MISS
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return cached listings and lookup counters for health reporting"""
+        with self._lock:
+            return {
+                "enabled": True,
+                "ttl": self.ttl,
+                "stale_ttl": self.stale_ttl,
+                "listings": len(self._entries),
+                "refreshing": len(self._refreshing) + len(self._async_refreshing),
+                **self.counts,
+            }
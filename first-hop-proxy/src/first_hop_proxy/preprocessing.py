@@ -0,0 +1,274 @@
+"""
+Single-pass preprocessing of outgoing chat messages
+
+The proxy used to walk the message list once per concern (deep copy, regex
+rules, lorebook extraction, ST_METADATA extraction twice, lorebook attribute
+stripping). preprocess_messages scans each message's content once and
+produces the same forwarded messages, metadata and lorebook entries as the
+old sequence, copying only the messages whose content actually changes.
+Per-message results can be memoized across requests in a
+MessageTransformCache, since each request of a chat repeats its history.
+"""
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, NamedTuple, Sequence, Tuple, Union
+
+from .utils import (
+    CompiledRegexRule,
+    RegexRuleSet,
+    RewriteProgram,
+    extract_lorebook_entries_from_content,
+    parse_st_metadata,
+    strip_st_metadata,
+    strip_lorebook_attributes
+)
+
+logger = logging.getLogger(__name__)
+
+# Literal prefixes of the ST_METADATA / setting_lore patterns; content without
+# them cannot match, so the regexes are skipped entirely
+ST_METADATA_MARKER = "<ST_METADATA>"
+SETTING_LORE_MARKER = "<setting_lore"
+
+
+class PreprocessedMessages(NamedTuple):
+    """Result of preprocess_messages (metadata and lorebook dicts may be shared; treat as read-only)"""
+    messages: List[Dict[str, Any]]
+    metadata: Optional[List[Dict[str, Any]]]
+    lorebook_entries: List[Dict[str, Any]]
+
+
+class MessageTransform:
+    """Everything derived from one message's content under one rule set"""
+
+    __slots__ = ("metadata", "lorebook_entries", "processed", "rewritten_chars", "_final")
+
+    def __init__(self, content: str, program: Optional[RewriteProgram] = None):
+        """
+        Scan and rewrite one message's content.
+
+        Args:
+            content: Original message content
+            program: Regex rules applicable to the message's role
+        """
+        self.metadata = parse_st_metadata(content) if ST_METADATA_MARKER in content else None
+        self.lorebook_entries = (extract_lorebook_entries_from_content(content)
+                                 if SETTING_LORE_MARKER in content else [])
+        self.processed = program.apply(content) if program is not None and program.steps else content
+        self.rewritten_chars = len(self.processed) if self.processed is not content else 0
+        self._final: Dict[Tuple[bool, bool], str] = {}
+
+    def final_content(self, strip_metadata: bool, strip_lore: bool) -> str:
+        """
+        Return the forwarded content; an empty string means the message is dropped.
+
+        Args:
+            strip_metadata: Whether the request contained ST_METADATA (strip it everywhere)
+            strip_lore: Whether the request contained lorebook entries (strip their attributes)
+        """
+        key = (strip_metadata, strip_lore)
+        content = self._final.get(key)
+        if content is not None:
+            return content
+
+        content = self.processed
+        if strip_metadata and content:
+            if ST_METADATA_MARKER in content:
+                content = strip_st_metadata(content)
+            else:
+                content = content.strip()
+        if strip_lore and content and SETTING_LORE_MARKER in content:
+            content = strip_lorebook_attributes(content)
+        self._final[key] = content
+        return content
+
+
+class MessageTransformCache:
+    """
+    Bounded LRU of MessageTransform results keyed by (rule-set fingerprint, role, content).
+
+    SillyTavern resends almost the whole history on every request of a chat,
+    so caching per message makes preprocessing proportional to new messages.
+    Keys hold the content string itself (Python hashes it once per request);
+    that is collision-free, unlike keying on a digest.
+    """
+
+    def __init__(self, max_entries: int = 4096, max_chars: int = 32_000_000):
+        """
+        Initialize empty cache.
+
+        Args:
+            max_entries: Maximum number of cached messages
+            max_chars: Approximate bound on cached text (original plus rewritten content)
+        """
+        self.max_entries = max_entries
+        self.max_chars = max_chars
+        self._entries: "OrderedDict[Tuple[str, str, str], MessageTransform]" = OrderedDict()
+        self._chars = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @classmethod
+    def from_config(cls, cache_config: Optional[Dict[str, Any]]) -> Optional["MessageTransformCache"]:
+        """Build a cache from the preprocessing_cache config section (None when disabled)"""
+        cache_config = cache_config or {}
+        if not cache_config.get("enabled", True):
+            return None
+        return cls(
+            max_entries=cache_config.get("max_entries", 4096),
+            max_chars=cache_config.get("max_chars", 32_000_000),
+        )
+
+    def get(self, key: Tuple[str, str, str]) -> Optional[MessageTransform]:
+        """Return the cached transform for key, or None"""
+        with self._lock:
+            transform = self._entries.get(key)
+            if transform is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return transform
+
+    def put(self, key: Tuple[str, str, str], transform: MessageTransform) -> None:
+        """Store a transform, evicting least recently used entries beyond the bounds"""
+        size = len(key[2]) + transform.rewritten_chars
+        if size > self.max_chars:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._chars -= len(key[2]) + previous.rewritten_chars
+            self._entries[key] = transform
+            self._chars += size
+            while self._entries and (len(self._entries) > self.max_entries or self._chars > self.max_chars):
+                old_key, old_transform = self._entries.popitem(last=False)
+                self._chars -= len(old_key[2]) + old_transform.rewritten_chars
+                self.evictions += 1
+
+    def clear(self) -> None:
+        """Drop every cached transform"""
+        with self._lock:
+            self._entries.clear()
+            self._chars = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return cache counters for health reporting"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "chars": self._chars,
+                "max_entries": self.max_entries,
+                "max_chars": self.max_chars,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+def preprocess_messages(messages: List[Dict[str, Any]],
+                        rules: Union[Sequence[CompiledRegexRule], RegexRuleSet] = (),
+                        cache: Optional[MessageTransformCache] = None) -> PreprocessedMessages:
+    """
+    Apply regex rules and strip ST_METADATA/lorebook markup in one pass.
+
+    Metadata and lorebook entries are read from the original content (so
+    regex rules cannot interfere with them); stripping is applied to the
+    regex-processed content. The input messages are never modified.
+
+    Args:
+        messages: Messages as received from the client
+        rules: Pre-compiled regex rules (see compile_regex_rules), or a RegexRuleSet
+               whose per-role programs are reused across requests
+        cache: Optional MessageTransformCache for content seen in earlier requests
+
+    Returns:
+        PreprocessedMessages with the forwarded messages, the list of
+        ST_METADATA dicts (None if there were none) and the lorebook entries
+    """
+    all_metadata = []
+    lorebook_entries = []
+    transforms: List[Optional[MessageTransform]] = []
+    if rules and not isinstance(rules, RegexRuleSet):
+        rules = RegexRuleSet(rules)
+    fingerprint = rules.fingerprint if rules else ""
+
+    if rules:
+        logger.info(f"Applying {len(rules)} regex rules to {len(messages)} messages")
+
+    for message in messages:
+        content = message.get("content", "")
+        if not content or not isinstance(content, str):
+            transforms.append(None)
+            continue
+
+        program = None
+        role = ""
+        if rules:
+            role = message.get("role", "").lower()
+            program = rules.program_for(role)
+            if not program.steps:
+                # Content is role-independent without applicable rules
+                program, role = None, ""
+
+        transform = None
+        if cache is not None:
+            key = (fingerprint, role, content)
+            transform = cache.get(key)
+        if transform is None:
+            transform = MessageTransform(content, program)
+            if cache is not None:
+                cache.put(key, transform)
+
+        if transform.metadata:
+            all_metadata.append(transform.metadata)
+        lorebook_entries.extend(transform.lorebook_entries)
+        transforms.append(transform)
+
+    # Stripping depends on whether anything was found in the whole request,
+    # which is only known once every message has been scanned
+    strip_metadata = bool(all_metadata)
+    strip_lore = bool(lorebook_entries)
+
+    forwarded = []
+    for message, transform in zip(messages, transforms):
+        if transform is None:
+            forwarded.append(message)
+            continue
+
+        content = transform.final_content(strip_metadata, strip_lore)
+        # Drop messages that were only metadata
+        if strip_metadata and not content and transform.processed:
+            continue
+
+        if content == message["content"]:
+            forwarded.append(message)
+        else:
+            forwarded_message = message.copy()
+            forwarded_message["content"] = content
+            forwarded.append(forwarded_message)
+
+    return PreprocessedMessages(forwarded, all_metadata or None, lorebook_entries)
+
+
+# Process-wide cache shared by all serving engines (None when disabled)
+_message_cache_lock = threading.Lock()
+_message_cache: Optional[MessageTransformCache] = MessageTransformCache()
+
+
+def get_message_cache() -> Optional[MessageTransformCache]:
+    """Return the process-wide message transform cache, or None if disabled"""
+    return _message_cache
+
+
+def configure_message_cache(cache_config: Optional[Dict[str, Any]]) -> Optional[MessageTransformCache]:
+    """Replace the process-wide message transform cache with one built from configuration"""
+    global _message_cache
+    with _message_cache_lock:
+        _message_cache = MessageTransformCache.from_config(cache_config)
+        return _message_cache
@@ -1,39 +1,77 @@
 import requests
 import json
+import time
 import logging
-import re
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Tuple
 from urllib.parse import urljoin
 
 logger = logging.getLogger(__name__)
 
 
-from .utils import sanitize_headers_for_logging, process_response_with_regex
+from .utils import sanitize_headers_for_logging, process_response_with_regex, RewriteProgram
 from .constants import SKIP_HEADERS, BLANK_RESPONSE_PATTERNS
 from .response_parser import ResponseParser
+from .error_handler import compile_hard_stop_rules, match_hard_stop_rule
+from .session_pool import get_session_pool
+from .metrics import get_metrics
+from .tracing import get_tracer
+from .circuit_breaker import get_circuit_breakers, is_failure_exception
+from .rate_limit import get_rate_limiter
+from .concurrency_limit import get_concurrency_limits
+from .admission import AdmissionRejected
+
+# Client errors that are transient and should go through retry logic
+# Common retryable 4xx codes: 408 (timeout), 429 (rate limit), 423 (locked), etc.
+RETRYABLE_4XX_CODES = frozenset([408, 423, 429])
+
+
+class BlankResponseRetry:
+    """Marker returned by handle_response when a blank reply should be re-requested"""
+
+    def __init__(self, retry_count: int):
+        self.retry_count = retry_count
 
 
 class ProxyClient:
     """Client for forwarding requests to target proxy"""
     
-    def __init__(self, target_url: str, error_logger=None, config=None):
-        """Initialize proxy client with target URL and optional error logger"""
+    def __init__(self, target_url: str, error_logger=None, config=None, session_pool=None, response_parser=None,
+                 api_key: Optional[str] = None):
+        """Initialize proxy client with target URL, optional error logger, session pool and response parser
+
+        api_key, when given, is sent instead of target_proxy.apikey (upstream pool members have their own keys)
+        """
         self.target_url = target_url.rstrip('/')
+        self.api_key = api_key
         self.error_logger = error_logger
         self.config = config
+        # Keep-alive sessions are shared process-wide unless a pool is injected
+        self.session_pool = session_pool if session_pool is not None else get_session_pool()
+
+        # Compile hard stop and response processing rules once per client
+        self.hard_stop_patterns = []
+        self.response_processing_rules = None
+        if config and hasattr(config, 'get_error_handling_config'):
+            hard_stop_config = config.get_error_handling_config().get("hard_stop_conditions", {})
+            if hard_stop_config.get("enabled", False):
+                self.hard_stop_patterns = compile_hard_stop_rules(hard_stop_config.get("rules", []))
+        if config and hasattr(config, 'get_response_processing_config'):
+            response_processing_config = config.get_response_processing_config()
+            if response_processing_config.get("enabled", False):
+                self.response_processing_rules = RewriteProgram(response_processing_config.get("rules", []) or [])
 
         # Initialize response parser with error handling
-        if config:
+        if response_parser is not None:
+            self.response_parser = response_parser
+        elif config:
             try:
                 self.response_parser = ResponseParser(config)
-                logger.warning(f"DEBUG: ResponseParser initialized successfully")
             except Exception as e:
                 logger.error(f"Failed to initialize ResponseParser: {e}")
                 logger.error(f"Config type: {type(config)}")
                 logger.error(f"Config has get_response_parsing_config? {hasattr(config, 'get_response_parsing_config')}")
                 self.response_parser = None
         else:
-            logger.warning(f"DEBUG: Config is None, ResponseParser will be None")
             self.response_parser = None
     
     def forward_request(self, request_data: Dict[str, Any], 
@@ -46,7 +84,96 @@ class ProxyClient:
                        request_logger: Optional[Any] = None,
                        request_id: Optional[str] = None) -> Any:
         """Forward request to target proxy"""
-        
+        target_url, request_params, is_streaming = self.prepare_request(
+            request_data, headers=headers, timeout=timeout, retry_count=retry_count,
+            endpoint=endpoint, method=method
+        )
+
+        tracer = get_tracer()
+        # Wait out the shared pace and 429 cooldown of this origin and API key
+        rate_limiter = get_rate_limiter()
+        gate = rate_limiter.gate_for(target_url, request_params["headers"]) if rate_limiter else None
+        if gate:
+            with tracer.span("rate_limit_wait"):
+                gate.wait()
+
+        # Fail fast (CircuitOpenError) while the origin's breaker is open
+        breakers = get_circuit_breakers()
+        breaker = breakers.for_url(target_url) if breakers else None
+        probe = breaker.before_request() if breaker else False
+
+        # Wait for a slot under the origin's adaptive concurrency limit
+        limits = get_concurrency_limits()
+        limit = limits.for_url(target_url) if limits else None
+        if limit:
+            try:
+                with tracer.span("concurrency_wait"):
+                    slot = limit.acquire()
+            except AdmissionRejected:
+                if breaker:
+                    breaker.abandon(probe)
+                raise
+
+        metrics = get_metrics()
+        metrics.upstream_started()
+        attempt_start = time.time()
+        response = None
+        upstream_error = None
+        try:
+            # Make the request over a pooled keep-alive session for this origin
+            with tracer.span("upstream_request", url=target_url) as span:
+                try:
+                    response = self.session_pool.request(**request_params)
+                except Exception as e:
+                    upstream_error = e
+                    if breaker:
+                        breaker.record(is_failure_exception(e), probe)
+                    raise
+                span.set_attribute("status", response.status_code)
+
+            with tracer.span("handle_response"):
+                result = self.handle_response(
+                    response, target_url, is_streaming=is_streaming, retry_count=retry_count,
+                    log_filepath=log_filepath, request_logger=request_logger, request_id=request_id
+                )
+        finally:
+            # Status after recategorization; "error" when no response arrived
+            metrics.upstream_finished(str(response.status_code) if response is not None else "error",
+                                      time.time() - attempt_start)
+            if breaker and response is not None:
+                breaker.record(breakers.is_failure_status(response.status_code), probe)
+            if gate and response is not None:
+                # Read by ErrorHandler: a held cooldown replaces the retry backoff
+                response.rate_limit_cooldown = gate.observe(response.status_code, response.headers)
+            if limit:
+                limit.release(slot, response.status_code if response is not None else None, upstream_error)
+        if isinstance(result, BlankResponseRetry):
+            logger.info(f"Retrying request due to blank content (attempt {result.retry_count})")
+            return self.forward_request(
+                request_data, 
+                headers=headers, 
+                timeout=timeout, 
+                retry_count=result.retry_count,
+                endpoint=endpoint,
+                method=method,
+                log_filepath=log_filepath,
+                request_logger=request_logger,
+                request_id=request_id
+            )
+        return result
+
+    def prepare_request(self, request_data: Dict[str, Any],
+                        headers: Optional[Dict[str, str]] = None,
+                        timeout: Optional[int] = None,
+                        retry_count: Optional[int] = None,
+                        endpoint: str = "/chat/completions",
+                        method: str = "POST") -> Tuple[str, Dict[str, Any], bool]:
+        """Build the upstream URL, headers and request parameters
+
+        Returns:
+            Tuple of (target_url, request_params, is_streaming); request_params uses
+            requests-style keys (method, url, headers, json, timeout, stream)
+        """
         # Construct the full URL with endpoint
         if endpoint:
             target_url = urljoin(self.target_url, endpoint)
@@ -68,13 +195,13 @@ class ProxyClient:
                 if key.lower() not in SKIP_HEADERS:
                     request_headers[key] = value
 
-        # Override with config's API key if provided
-        if self.config:
-            proxy_config = self.config.get_target_proxy_config()
-            config_apikey = proxy_config.get("apikey")
-            if config_apikey:
-                request_headers["Authorization"] = f"Bearer {config_apikey}"
-                logger.info("Using API key from config file (overriding incoming authorization)")
+        # Override with the upstream's or config's API key if provided
+        config_apikey = self.api_key
+        if not config_apikey and self.config:
+            config_apikey = self.config.get_target_proxy_config().get("apikey")
+        if config_apikey:
+            request_headers["Authorization"] = f"Bearer {config_apikey}"
+            logger.info("Using API key from config file (overriding incoming authorization)")
         
         # Add retry count header if provided
         if retry_count is not None:
@@ -96,65 +223,75 @@ class ProxyClient:
         logger.info(f"Request timeout: {timeout}")
         logger.info(f"Making HTTP request to: {target_url}")
         
-        # Make the request
-        response = requests.request(**request_params)
-        
+        # Stream the upstream body instead of buffering it when the client asked for SSE
+        is_streaming = bool(request_data.get("stream", False))
+        if is_streaming:
+            request_params["stream"] = True
+
+        return target_url, request_params, is_streaming
+
+    def handle_response(self, response, target_url: str,
+                        is_streaming: bool = False,
+                        retry_count: Optional[int] = None,
+                        log_filepath: Optional[str] = None,
+                        request_logger: Optional[Any] = None,
+                        request_id: Optional[str] = None) -> Any:
+        """Apply status recategorization, response processing and blank detection to an upstream reply
+
+        Args:
+            response: requests.Response (or compatible object) from the target proxy
+            target_url: URL the request was sent to (for error context)
+            is_streaming: Whether the request asked for an event stream
+
+        Returns:
+            Parsed response data, the unread response for event streams, or
+            BlankResponseRetry when the caller should re-send the request
+        """
         # Log response details
         logger.info(f"=== HTTP RESPONSE ===")
         logger.info(f"Status code: {response.status_code}")
         logger.info(f"Response headers: {sanitize_headers_for_logging(dict(response.headers))}")
-        logger.info(f"Response size: {len(response.content)} bytes")
         
-        # Handle streaming responses
-        if request_data.get("stream", False):
-            logger.info("Handling streaming response")
-            return response
+        # Handle streaming responses - return unread so chunks can be relayed as they arrive
+        # Error statuses and JSON bodies fall through to the regular (buffered) handling below
+        if is_streaming and response.status_code == 200:
+            content_type = response.headers.get("Content-Type", "") or ""
+            if "application/json" not in content_type.lower():
+                logger.info("Handling streaming response")
+                return response
+
+        logger.info(f"Response size: {len(response.content)} bytes")
         
         # Handle non-streaming responses
         if response.status_code == 200:
             try:
-                response_json = response.json()
+                with get_tracer().span("decode_response", bytes=len(response.content)):
+                    response_json = response.json()
                 logger.info(f"Successfully parsed JSON response")
                 logger.info(f"Response content preview: {str(response.text)[:500]}...")
 
-                # DEBUG: Check if this is an error response
-                if isinstance(response_json, dict) and 'error' in response_json:
-                    logger.warning(f"DEBUG: Response contains error object: {response_json.get('error')}")
-                
                 # Parse response and recategorize status if needed
-                logger.warning(f"DEBUG: response_parser exists? {self.response_parser is not None}")
                 if self.response_parser:
                     new_status, parsing_info = self.response_parser.parse_and_recategorize(response.text, response.status_code)
-                    logger.warning(f"DEBUG: parsing_info = {parsing_info}")
                     if parsing_info.get("recategorized", False):
                         logger.info(f"Response status recategorized: {response.status_code} → {new_status}")
                         # Update response status code
                         response.status_code = new_status
+                        response.recategorized_by = parsing_info.get("description")
                         # If it's now an error status, manually raise HTTPError to trigger retry logic
-                        logger.warning(f"DEBUG: About to raise HTTPError for status {new_status}")
                         if new_status >= 400:
                             # Manually raise HTTPError instead of calling raise_for_status()
                             # because modifying response.status_code doesn't update internal state
                             from requests.exceptions import HTTPError as RequestsHTTPError
                             error_msg = f"{new_status} Error: {parsing_info.get('description', 'Rate limit or server error')}"
                             raise RequestsHTTPError(error_msg, response=response)
-                else:
-                    logger.warning("DEBUG: response_parser is None! Not checking for rate limits.")
                 
-                # Apply response processing rules if enabled
-                if self.config and hasattr(self.config, 'get_response_processing_config'):
-                    response_processing_config = self.config.get_response_processing_config()
-                    logger.info(f"Response processing config: {response_processing_config}")
-                    if response_processing_config.get("enabled", False):
-                        rules = response_processing_config.get("rules", [])
-                        logger.info(f"Response processing rules: {rules}")
-                        if rules:
-                            logger.info(f"Applying response processing rules ({len(rules)} rules)")
-                            original_response = response_json.copy()
-                            response_json = process_response_with_regex(response_json, rules)
-                            logger.info(f"Response processing completed")
-                else:
-                    logger.info("Response processing config not available or config object missing")
+                # Apply response processing rules if enabled (compiled in __init__)
+                if self.response_processing_rules:
+                    logger.info(f"Applying response processing rules ({len(self.response_processing_rules)} rules)")
+                    with get_tracer().span("response_processing", rules=len(self.response_processing_rules)):
+                        response_json = process_response_with_regex(response_json, self.response_processing_rules)
+                    logger.info(f"Response processing completed")
                 
                 # Check for blank content in chat completions
                 blank_response_details = self._is_blank_response(response_json)
@@ -193,19 +330,8 @@ class ProxyClient:
                             logger.error(f"Failed to append blank response retry note: {log_error}")
 
                     if will_retry:  # Max 3 retries for blank content
-                        new_retry_count = next_retry_attempt
-                        logger.info(f"Retrying request due to blank content (attempt {new_retry_count})")
-                        return self.forward_request(
-                            request_data, 
-                            headers=headers, 
-                            timeout=timeout, 
-                            retry_count=new_retry_count,
-                            endpoint=endpoint,
-                            method=method,
-                            log_filepath=log_filepath,
-                            request_logger=request_logger,
-                            request_id=request_id
-                        )
+                        get_metrics().record_retry("blank_response")
+                        return BlankResponseRetry(next_retry_attempt)
                     else:
                         logger.error("Max retries for blank content reached, returning blank response")
                 
@@ -220,6 +346,7 @@ class ProxyClient:
                     if parsing_info.get("recategorized", False):
                         logger.info(f"Response status recategorized: {response.status_code} → {new_status}")
                         response.status_code = new_status
+                        response.recategorized_by = parsing_info.get("description")
                         if new_status >= 400:
                             from requests.exceptions import HTTPError as RequestsHTTPError
                             error_msg = f"{new_status} Error: {parsing_info.get('description', 'Rate limit or server error')}"
@@ -239,17 +366,11 @@ class ProxyClient:
             logger.error(f"Error response text: {response.text}")
             
             # Check for hard stop conditions before recategorization
-            if self.config and hasattr(self.config, 'get_error_handling_config'):
-                error_config = self.config.get_error_handling_config()
-                hard_stop_config = error_config.get("hard_stop_conditions", {})
-                if hard_stop_config.get("enabled", False):
-                    hard_stop_rules = hard_stop_config.get("rules", [])
-                    for rule in hard_stop_rules:
-                        pattern = rule.get('pattern', '')
-                        if pattern and re.search(pattern, response.text, re.IGNORECASE):
-                            logger.warning(f"Hard stop condition matched in proxy client: {rule.get('description', 'Unknown')}")
-                            # Return formatted response instead of raising error
-                            return self._format_hard_stop_response(response, rule)
+            rule = match_hard_stop_rule(self.hard_stop_patterns, response.text)
+            if rule:
+                logger.warning(f"Hard stop condition matched in proxy client: {rule.get('description', 'Unknown')}")
+                # Return formatted response instead of raising error
+                return self._format_hard_stop_response(response, rule)
             
             # Parse response and recategorize status for non-200 responses too
             if self.response_parser:
@@ -257,11 +378,10 @@ class ProxyClient:
                 if parsing_info.get("recategorized", False):
                     logger.info(f"Response status recategorized: {response.status_code} → {new_status}")
                     response.status_code = new_status
+                    response.recategorized_by = parsing_info.get("description")
 
             # For retryable 4xx errors (like 429 rate limit), raise HTTPError to trigger retry logic
-            # Common retryable 4xx codes: 408 (timeout), 429 (rate limit), 423 (locked), etc.
-            retryable_4xx_codes = [408, 423, 429]
-            if response.status_code in retryable_4xx_codes:
+            if response.status_code in RETRYABLE_4XX_CODES:
                 logger.warning(f"Retryable client error {response.status_code}, raising HTTPError to trigger retry")
                 from requests.exceptions import HTTPError as RequestsHTTPError
                 error_msg = f"{response.status_code} Error: Retryable client error"
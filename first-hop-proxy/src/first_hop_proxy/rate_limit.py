@@ -0,0 +1,335 @@
+"""
+Shared rate-limit gates for upstream calls
+
+Requests to the same upstream origin with the same API key share one gate.
+Every attempt waits at its gate before it is sent, and the gate learns from
+every reply:
+
+- A 429, including a 200 that ResponseParser recategorized to 429, starts a
+  cooldown for the whole gate. Its length comes from Retry-After, else from
+  the rate-limit reset header, else default_cooldown, doubling for each
+  consecutive 429 up to max_cooldown. Every request waiting at the gate
+  resumes when it ends, resume_interval apart, instead of each one running
+  its own exponential backoff. ErrorHandler therefore skips its own backoff
+  for 429s while gates are enabled.
+- x-ratelimit-remaining / x-ratelimit-reset headers (also the OpenAI
+  *-requests variants and the IETF RateLimit-* names) set the pace: the
+  remaining requests are spread evenly over the time until the reset. A
+  remaining count of 0 starts a cooldown until the reset.
+
+Pacing is a token bucket with burst tokens, kept as the time the next
+request may start so that concurrent waiters are staggered. A configured
+requests_per_second applies whenever nothing has been learned. Gates are
+kept per process.
+"""
+import re
+import time
+import asyncio
+import hashlib
+import threading
+import logging
+from email.utils import parsedate_to_datetime
+from typing import Dict, Any, Mapping, Optional, Tuple
+
+from .session_pool import get_origin
+
+logger = logging.getLogger(__name__)
+
+RETRY_AFTER_HEADER = "Retry-After"
+REMAINING_HEADERS = ("x-ratelimit-remaining-requests", "x-ratelimit-remaining", "ratelimit-remaining")
+RESET_HEADERS = ("x-ratelimit-reset-requests", "x-ratelimit-reset", "ratelimit-reset")
+
+# OpenAI-style durations such as "1m30s", "6m0s" or "120ms"
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"h": 3600.0, "m": 60.0, "s": 1.0, "ms": 0.001}
+
+# Reset values above this are absolute Unix timestamps rather than seconds from now
+_EPOCH_THRESHOLD = 1_000_000_000
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a request would have to wait at its gate longer than max_wait"""
+
+    def __init__(self, gate: str, retry_after: float):
+        super().__init__(f"Upstream rate limit for {gate} (retry in {retry_after:.0f}s)")
+        self.gate = gate
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds from a Retry-After header (delay seconds or HTTP date)"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError, IndexError, OverflowError):
+        return None
+
+
+def parse_reset(value: Optional[str]) -> Optional[float]:
+    """Seconds until a rate-limit reset header value (duration, seconds or Unix timestamp)"""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        number = float(value)
+    except ValueError:
+        parts = _DURATION_PART.findall(value)
+        if not parts or "".join(amount + unit for amount, unit in parts) != value:
+            return None
+        return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+    if number > _EPOCH_THRESHOLD:
+        return max(0.0, number - time.time())
+    return max(0.0, number)
+
+
+def _first_header(headers: Mapping[str, str], names: Tuple[str, ...]) -> Optional[str]:
+    for name in names:
+        value = headers.get(name)
+        if value is not None:
+            return value
+    return None
+
+
+class RateLimitGate:
+    """Token-bucket pacing and shared 429 cooldown for one upstream origin and API key"""
+
+    def __init__(self, name: str, requests_per_second: Optional[float] = None, burst: int = 1,
+                 default_cooldown: float = 5.0, max_cooldown: float = 60.0, resume_interval: float = 0.25,
+                 max_wait: float = 120.0):
+        """
+        Initialize gate.
+
+        Args:
+            name: Label for logs and stats (origin and API key fingerprint)
+            requests_per_second: Pace used while none has been learned from headers (None for no limit)
+            burst: Requests that may start back to back before pacing applies
+            default_cooldown: Cooldown after a 429 without Retry-After or reset information
+            max_cooldown: Longest cooldown a run of consecutive 429s can grow to
+            resume_interval: Spacing between requests released when a cooldown ends
+            max_wait: Longest a request waits at the gate before RateLimitExceeded is raised
+        """
+        self.name = name
+        self.requests_per_second = requests_per_second
+        self.burst = max(1, burst)
+        self.default_cooldown = default_cooldown
+        self.max_cooldown = max_cooldown
+        self.resume_interval = resume_interval
+        self.max_wait = max_wait
+
+        self._lock = threading.Lock()
+        self._cooldown_until = 0.0
+        self._resume_at = 0.0
+        # Earliest start of the next request at the current pace
+        self._next_start = 0.0
+        self._learned_rate: Optional[float] = None
+        self._learned_until = 0.0
+        self._consecutive_429 = 0
+        self.rate_limited = 0
+        self.waited = 0
+        self.total_wait = 0.0
+
+    def _rate(self, now: float) -> Optional[float]:
+        """Requests per second currently allowed (lock held)"""
+        if self._learned_rate is not None and now < self._learned_until:
+            return self._learned_rate
+        return self.requests_per_second
+
+    def reserve(self) -> float:
+        """
+        Claim the next start time at this gate.
+
+        Returns:
+            Seconds to wait before sending
+
+        Raises:
+            RateLimitExceeded: If the wait would exceed max_wait (nothing is claimed)
+        """
+        with self._lock:
+            now = time.monotonic()
+            start = now
+            if self._cooldown_until > now:
+                # Release the cohort one by one when the cooldown ends
+                start = max(self._cooldown_until, self._resume_at)
+            rate = self._rate(now)
+            if rate:
+                interval = 1.0 / rate
+                start = max(start, self._next_start - (self.burst - 1) * interval)
+            wait = start - now
+            if wait > self.max_wait:
+                raise RateLimitExceeded(self.name, wait)
+            if self._cooldown_until > now:
+                self._resume_at = start + self.resume_interval
+            if rate:
+                self._next_start = max(self._next_start, start) + interval
+            if wait > 0:
+                self.waited += 1
+                self.total_wait += wait
+            return wait
+
+    def wait(self) -> float:
+        """Block the calling thread until this request may be sent; returns the seconds waited"""
+        waited = 0.0
+        while True:
+            cooldown_until = self._cooldown_until
+            delay = self.reserve()
+            if delay <= 0:
+                return waited
+            time.sleep(delay)
+            waited += delay
+            # Unless a 429 started a new cooldown meanwhile, which holds this request too
+            if self._cooldown_until == cooldown_until:
+                return waited
+
+    async def wait_async(self) -> float:
+        """Coroutine variant of wait()"""
+        waited = 0.0
+        while True:
+            cooldown_until = self._cooldown_until
+            delay = self.reserve()
+            if delay <= 0:
+                return waited
+            await asyncio.sleep(delay)
+            waited += delay
+            if self._cooldown_until == cooldown_until:
+                return waited
+
+    def observe(self, status_code: int, headers: Mapping[str, str]) -> float:
+        """
+        Learn from an upstream reply (status after recategorization).
+
+        Returns the seconds the gate now holds requests for; 0.0 when no
+        cooldown is in effect (e.g. Retry-After: 0 or a reset in the past).
+        """
+        remaining_value = _first_header(headers, REMAINING_HEADERS)
+        reset = parse_reset(_first_header(headers, RESET_HEADERS))
+        try:
+            remaining = int(float(remaining_value)) if remaining_value is not None else None
+        except ValueError:
+            remaining = None
+
+        with self._lock:
+            now = time.monotonic()
+            if reset is not None and remaining is not None:
+                if remaining > 0 and reset > 0:
+                    # Spread what is left of the quota evenly until it resets
+                    self._learned_rate = remaining / reset
+                    self._learned_until = now + reset
+                elif remaining <= 0:
+                    self._start_cooldown(now, reset)
+
+            if status_code == 429:
+                self.rate_limited += 1
+                self._consecutive_429 += 1
+                cooldown = parse_retry_after(headers.get(RETRY_AFTER_HEADER))
+                if cooldown is None:
+                    cooldown = reset
+                if cooldown is None:
+                    cooldown = min(self.default_cooldown * 2 ** (self._consecutive_429 - 1), self.max_cooldown)
+                self._start_cooldown(now, cooldown)
+            elif status_code < 400:
+                self._consecutive_429 = 0
+            return max(0.0, self._cooldown_until - now)
+
+    def _start_cooldown(self, now: float, seconds: float) -> None:
+        """Hold every request at the gate for seconds (lock held)"""
+        until = now + seconds
+        if until > self._cooldown_until:
+            logger.warning(f"Rate limited by {self.name}: holding requests for {seconds:.1f}s")
+            self._cooldown_until = until
+            self._resume_at = until
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return cooldown, pace and wait counts for health reporting"""
+        with self._lock:
+            now = time.monotonic()
+            rate = self._rate(now)
+            return {
+                "cooldown_remaining": round(max(0.0, self._cooldown_until - now), 3),
+                "requests_per_second": round(rate, 3) if rate else None,
+                "rate_limited": self.rate_limited,
+                "waited": self.waited,
+                "avg_wait": round(self.total_wait / self.waited, 3) if self.waited else 0.0,
+            }
+
+
+def api_key_fingerprint(headers: Optional[Mapping[str, str]]) -> str:
+    """Short, non-reversible label for the API key a request is sent with"""
+    authorization = None
+    for name, value in (headers or {}).items():
+        if name.lower() in ("authorization", "x-api-key"):
+            authorization = value
+            break
+    if not authorization:
+        return "anonymous"
+    return hashlib.sha256(authorization.encode("utf-8")).hexdigest()[:8]
+
+
+class RateLimiter:
+    """Rate-limit gates created on first use for each upstream origin and API key"""
+
+    def __init__(self, **gate_settings: Any):
+        """
+        Initialize limiter.
+
+        Args:
+            **gate_settings: RateLimitGate keyword arguments applied to every gate
+        """
+        self.gate_settings = gate_settings
+        self._lock = threading.Lock()
+        self._gates: Dict[Tuple[str, str], RateLimitGate] = {}
+
+    @classmethod
+    def from_config(cls, rate_limit_config: Optional[Dict[str, Any]]) -> "RateLimiter":
+        """Build a limiter from the rate_limit configuration section"""
+        rate_limit_config = rate_limit_config or {}
+        return cls(
+            requests_per_second=rate_limit_config.get("requests_per_second"),
+            burst=rate_limit_config.get("burst", 1),
+            default_cooldown=rate_limit_config.get("default_cooldown", 5.0),
+            max_cooldown=rate_limit_config.get("max_cooldown", 60.0),
+            resume_interval=rate_limit_config.get("resume_interval", 0.25),
+            max_wait=rate_limit_config.get("max_wait", 120.0),
+        )
+
+    def gate_for(self, url: str, headers: Optional[Mapping[str, str]] = None) -> RateLimitGate:
+        """Return the gate for url's origin and the API key in headers"""
+        key = (get_origin(url), api_key_fingerprint(headers))
+        gate = self._gates.get(key)
+        if gate is None:
+            with self._lock:
+                gate = self._gates.get(key)
+                if gate is None:
+                    gate = self._gates[key] = RateLimitGate(f"{key[0]} key {key[1]}", **self.gate_settings)
+        return gate
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return every gate's state"""
+        with self._lock:
+            gates = list(self._gates.values())
+        return {"enabled": True, "gates": {gate.name: gate.get_stats() for gate in gates}}
+
+
+# Process-wide limiter shared by both serving engines (None when disabled)
+_limiter_lock = threading.Lock()
+_limiter: Optional[RateLimiter] = None
+
+
+def get_rate_limiter() -> Optional[RateLimiter]:
+    """Return the process-wide rate limiter, or None if rate-limit gates are disabled"""
+    return _limiter
+
+
+def configure_rate_limiter(rate_limit_config: Optional[Dict[str, Any]]) -> Optional[RateLimiter]:
+    """Replace the process-wide rate limiter (None when rate_limit.enabled is false)"""
+    global _limiter
+    rate_limit_config = rate_limit_config or {}
+    new_limiter = RateLimiter.from_config(rate_limit_config) if rate_limit_config.get("enabled") else None
+    with _limiter_lock:
+        _limiter = new_limiter
+    return new_limiter
@@ -2,20 +2,42 @@ import os
 import json
 import time
 import re
-import threading
 from datetime import datetime
 from typing import Dict, Any, Optional, Tuple, List
 import logging
 from .utils import sanitize_headers_for_logging
+from .log_writer import AsyncLogWriter, LogEvent, get_log_writer
+from .log_sequence import get_log_sequence
+from .log_index import get_log_index, STATUS_SUCCESS
 
 logger = logging.getLogger(__name__)
 
+# Written in place of request/response bodies the log writer shed under backpressure
+PAYLOAD_DROPPED_NOTE = "*Omitted - the request log writer was under backpressure*"
+
+# "markdown" rewrites one .md file per attempt; "records" appends JSON lines
+# to one .jsonl file per request (rendered to markdown by log_records)
+LOG_FORMATS = ("markdown", "records")
+LOG_RECORDS_EXTENSION = ".jsonl"
+
+# Proxy retries are logged as "<request_id>-retry<n>"
+RETRY_REQUEST_ID_PATTERN = re.compile(r'-retry(\d+)$')
+
+
+def format_log_record(existing: Optional[str], **record: Any) -> str:
+    """Serialize one log record as a JSON line (existing content is ignored; records are appended)"""
+    return json.dumps(record, ensure_ascii=False, default=str) + "\n"
+
 
 class RequestLogger:
     """Handles logging of requests and responses to individual files"""
 
-    def __init__(self, config: Dict[str, Any], error_logger=None):
-        """Initialize request logger with configuration and optional error logger"""
+    def __init__(self, config: Dict[str, Any], error_logger=None, writer: Optional[AsyncLogWriter] = None):
+        """Initialize request logger with configuration, optional error logger and optional log writer
+
+        Without a writer of its own the logger uses the process-wide one
+        (see configure_log_writer), or writes on the calling thread if there is none.
+        """
         self.config = config.get("logging", {})
         self.enabled = self.config.get("enabled", False)
         self.folder = self.config.get("folder", "logs")
@@ -25,10 +47,12 @@ class RequestLogger:
         self.include_response_data = self.config.get("include_response_data", True)
         self.include_headers = self.config.get("include_headers", True)
         self.include_timing = self.config.get("include_timing", True)
+        self.format = self.config.get("format", "markdown")
+        if self.format not in LOG_FORMATS:
+            logger.warning(f"Unknown logging.format {self.format!r}, using markdown")
+            self.format = "markdown"
         self.error_logger = error_logger
-
-        # Thread-safe log number generation
-        self._log_number_lock = threading.Lock()
+        self.writer = writer
 
         # Create base logs directory if it doesn't exist
         if self.enabled:
@@ -56,10 +80,10 @@ class RequestLogger:
 
     def _get_next_log_number(self, folder: str, operation: str) -> int:
         """
-        Get the next sequential log number for the given folder.
+        Get the next sequential log number for the given folder without reserving it.
 
-        Scans ALL log files regardless of operation type to maintain
-        sequential numbering across all operations.
+        Numbering is shared by ALL operation types in a folder. The folder is
+        scanned once, the first time it is seen (see LogSequenceAllocator).
 
         Args:
             folder: Log folder path
@@ -68,38 +92,20 @@ class RequestLogger:
         Returns:
             Next sequential log number (1-based)
         """
-        if not os.path.exists(folder):
-            return 1
-
-        # Find all log files matching the pattern: <number>-<any_operation>.md
-        # We need to scan ALL operation types to maintain sequential numbering
-        # Operation names can contain hyphens, underscores, alphanumeric chars
-        max_num = 0
-        pattern = re.compile(r'^(\d+)-.+\.md$')
-
-        try:
-            for filename in os.listdir(folder):
-                match = pattern.match(filename)
-                if match:
-                    num = int(match.group(1))
-                    max_num = max(max_num, num)
-        except Exception as e:
-            logger.error(f"Error scanning log folder {folder}: {e}")
-
-        return max_num + 1
+        return get_log_sequence().peek(folder)
 
     def _get_sequenced_filename(self, operation: str, folder: str, error: Exception = None,
-                                is_proxy_retry: bool = False) -> Tuple[str, str]:
+                                is_proxy_retry: bool = False, extension: str = ".md") -> Tuple[str, str]:
         """
         Generate filename with sequential numbering, operation type, and optional suffixes.
-        Thread-safe: Uses lock to prevent race conditions in log numbering.
-        Creates an empty file immediately to claim the number.
+        Thread-safe: the number is reserved by the process-wide LogSequenceAllocator.
 
         Args:
             operation: Operation type (e.g., 'chat', 'lorebook')
             folder: Log folder path to check for existing logs
             error: Exception if request failed (determines error suffix)
             is_proxy_retry: True if this is a proxy-initiated retry (adds -PROXY suffix)
+            extension: File extension (.jsonl for the records format)
 
         Returns:
             Tuple of (filename, full_filepath)
@@ -110,59 +116,102 @@ class RequestLogger:
                 00003-summary-PROXY-TIMEOUT.md (proxy retry that timed out)
                 00004-chat-RATELIMIT.md (upstream request that was rate limited, no retry)
         """
-        with self._log_number_lock:
-            log_number = self._get_next_log_number(folder, operation)
-
-            # Build suffix components
-            proxy_suffix = "-PROXY" if is_proxy_retry else ""
-
-            # Determine error status suffix based on error type
-            error_suffix = ""
-            if error:
-                error_str = str(error).lower()
-                error_type = type(error).__name__
+        log_number = get_log_sequence().allocate(folder)
 
-                # Check for rate limit errors (429)
-                if "429" in error_str or "rate limit" in error_str or "quota" in error_str:
-                    error_suffix = "-RATELIMIT"
-                else:
-                    error_suffix = "-FAILED"
+        # Build suffix components
+        proxy_suffix = "-PROXY" if is_proxy_retry else ""
 
-            # Combine suffixes: operation + proxy + error
-            filename = f"{log_number:05d}-{operation}{proxy_suffix}{error_suffix}.md"
-            filepath = os.path.join(folder, filename)
+        # Determine error status suffix based on error type
+        error_suffix = ""
+        if error:
+            error_str = str(error).lower()
 
-            # Create empty file immediately to claim this log number
-            # This prevents race conditions where multiple threads get the same number
-            try:
-                with open(filepath, 'w', encoding='utf-8') as f:
-                    f.write(f"# Request Log - {datetime.now().isoformat()}\n\n")
-                    f.write("**Status:** In Progress...\n\n")
-            except Exception as e:
-                logger.error(f"Failed to create initial log file {filepath}: {e}")
+            # Check for rate limit errors (429)
+            if "429" in error_str or "rate limit" in error_str or "quota" in error_str:
+                error_suffix = "-RATELIMIT"
+            else:
+                error_suffix = "-FAILED"
 
-            return filename, filepath
+        # Combine suffixes: operation + proxy + error
+        filename = f"{log_number:05d}-{operation}{proxy_suffix}{error_suffix}{extension}"
+        filepath = os.path.join(folder, filename)
+        return filename, filepath
 
-    def _get_timestamp_filename(self, request_id: str = None) -> str:
+    def _get_timestamp_filename(self, request_id: str = None, extension: str = ".md") -> str:
         """Generate filename with timestamp and optional request ID (legacy/unsorted)"""
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")[:-3]  # Include milliseconds
         if request_id:
-            return f"{timestamp}_{request_id}.md"
-        return f"{timestamp}.md"
+            return f"{timestamp}_{request_id}{extension}"
+        return f"{timestamp}{extension}"
     
     def _sanitize_headers(self, headers: Dict[str, str]) -> Dict[str, str]:
         """Sanitize headers for logging by obfuscating sensitive values"""
         return sanitize_headers_for_logging(headers)
 
+    def _index_start(self, filepath: str, request_id: str, endpoint: str, start_time: float,
+                     character_chat_info: Optional[Tuple[str, str, str]], config_path: Optional[str]) -> None:
+        """Add the attempt to the log index, if one is configured"""
+        index = get_log_index()
+        if index is None or not filepath:
+            return
+        retry_count = 0
+        match = RETRY_REQUEST_ID_PATTERN.search(request_id or "")
+        if match:
+            request_id, retry_count = request_id[:match.start()], int(match.group(1))
+        index.record_start(filepath, request_id, start_time, character_chat_info=character_chat_info,
+                           config_path=config_path, endpoint=endpoint, retry_count=retry_count)
+
+    def _index_end(self, filepath: str, response_data: Any, end_time: Optional[float], duration: Optional[float],
+                   error: Optional[Exception], new_filepath: Optional[str] = None) -> None:
+        """Complete the attempt's row in the log index, if one is configured"""
+        index = get_log_index()
+        if index is None:
+            return
+        status = self._error_status_suffix(error).lstrip("-").lower() if error else STATUS_SUCCESS
+        index.record_end(filepath, status, end_time=end_time, duration=duration,
+                         usage=response_data.get('usage') if isinstance(response_data, dict) else None,
+                         error=error, new_file_path=new_filepath)
+
+    def _get_writer(self) -> Optional[AsyncLogWriter]:
+        """Return the writer for this logger: its own, else the process-wide one (None writes inline)"""
+        return self.writer if self.writer is not None else get_log_writer()
+
+    def _append_record(self, filepath: str, record: Dict[str, Any], payload_fields: Tuple[str, ...] = (),
+                       context: str = "request_logger_write_error") -> bool:
+        """Append one record to a records-format log (through the log writer when there is one)"""
+        writer = self._get_writer()
+        if writer is not None:
+            return writer.submit(LogEvent(filepath, format_log_record, record, payload_fields=payload_fields,
+                                          append=True, error_logger=self.error_logger, context=context))
+
+        try:
+            with open(filepath, 'a', encoding='utf-8') as f:
+                f.write(format_log_record(None, **record))
+            return True
+        except Exception as e:
+            logger.error(f"Failed to append log record to {filepath}: {e}")
+            if hasattr(self, 'error_logger') and self.error_logger:
+                self.error_logger.log_error(e, {
+                    "context": context,
+                    "filepath": filepath,
+                    "log_type": record.get("type")
+                })
+            return False
+
     def start_request_log(self, request_id: str, endpoint: str, request_data: Dict[str, Any],
                           headers: Dict[str, str], start_time: float,
                           character_chat_info: Optional[Tuple[str, str, str]] = None,
                           original_request_data: Optional[Dict[str, Any]] = None,
                           stripped_metadata: Optional[List[Dict[str, Any]]] = None,
                           lorebook_entries: Optional[List[Dict[str, Any]]] = None,
-                          is_proxy_retry: bool = False) -> str:
+                          is_proxy_retry: bool = False, previous_filepath: Optional[str] = None,
+                          config_path: Optional[str] = None) -> str:
         """Create initial log file when request is received
 
+        With a log writer the file is rendered and written in the background;
+        the returned path is valid immediately. In the records format a proxy
+        retry is appended to the first attempt's file (previous_filepath).
+
         Args:
             request_id: Unique request identifier
             endpoint: API endpoint
@@ -174,6 +223,8 @@ class RequestLogger:
             stripped_metadata: List of ST_METADATA dicts that were stripped
             lorebook_entries: List of lorebook entry dicts extracted from messages
             is_proxy_retry: True if this is a proxy-initiated retry attempt
+            previous_filepath: Log of the failed attempt being retried
+            config_path: Config file used for the request, recorded in the log index
 
         Returns:
             Path to log file if successful, empty string otherwise
@@ -181,6 +232,13 @@ class RequestLogger:
         if not self.enabled:
             return ""
 
+        if self.format == "records":
+            filepath = self._start_request_records(request_id, endpoint, request_data, headers, start_time,
+                                                   character_chat_info, original_request_data, stripped_metadata,
+                                                   lorebook_entries, is_proxy_retry, previous_filepath)
+            self._index_start(filepath, request_id, endpoint, start_time, character_chat_info, config_path)
+            return filepath
+
         folder = self._get_log_folder(character_chat_info)
 
         # Use sequenced filename if we have character_chat_info, otherwise use timestamp
@@ -192,16 +250,108 @@ class RequestLogger:
             filename = self._get_timestamp_filename(request_id)
             filepath = os.path.join(folder, filename)
 
+        self._index_start(filepath, request_id, endpoint, start_time, character_chat_info, config_path)
+
+        fields = {
+            "request_id": request_id,
+            "endpoint": endpoint,
+            "request_data": request_data,
+            "headers": headers,
+            "start_time": start_time,
+            "original_request_data": original_request_data,
+            "stripped_metadata": stripped_metadata,
+            "lorebook_entries": lorebook_entries,
+            "logged_at": datetime.now().isoformat(),
+        }
+
+        writer = self._get_writer()
+        if writer is not None:
+            writer.submit(LogEvent(filepath, self._render_start_log, fields,
+                                   payload_fields=("request_data", "original_request_data"),
+                                   error_logger=self.error_logger, context="request_logger_start_error"))
+            logger.info(f"Started request log: {filepath}")
+            return filepath
+
+        try:
+            with open(filepath, 'w', encoding='utf-8') as f:
+                f.write(self._render_start_log(None, **fields))
+            logger.info(f"Started request log: {filepath}")
+            return filepath
+        except Exception as e:
+            logger.error(f"Failed to create initial log {filepath}: {e}")
+            if hasattr(self, 'error_logger') and self.error_logger:
+                self.error_logger.log_error(e, {
+                    "context": "request_logger_start_error",
+                    "filepath": filepath,
+                    "log_type": "start_request"
+                })
+            return ""
+
+    def _start_request_records(self, request_id: str, endpoint: str, request_data: Dict[str, Any],
+                               headers: Dict[str, str], start_time: float,
+                               character_chat_info: Optional[Tuple[str, str, str]],
+                               original_request_data: Optional[Dict[str, Any]],
+                               stripped_metadata: Optional[List[Dict[str, Any]]],
+                               lorebook_entries: Optional[List[Dict[str, Any]]],
+                               is_proxy_retry: bool, previous_filepath: Optional[str]) -> str:
+        """Start a records-format log, or add an attempt to the log of the request being retried"""
+        logged_at = datetime.now().isoformat()
+
+        if is_proxy_retry and previous_filepath:
+            # The request body is unchanged, so later attempts only record when they started
+            record = {
+                "type": "attempt",
+                "request_id": request_id,
+                "endpoint": endpoint,
+                "start_time": start_time,
+                "logged_at": logged_at,
+            }
+            return previous_filepath if self._append_record(previous_filepath, record) else ""
+
+        folder = self._get_log_folder(character_chat_info)
+        if character_chat_info:
+            character, timestamp, operation = character_chat_info
+            filename, filepath = self._get_sequenced_filename(operation, folder, is_proxy_retry=is_proxy_retry,
+                                                             extension=LOG_RECORDS_EXTENSION)
+        else:
+            filepath = os.path.join(folder, self._get_timestamp_filename(request_id, extension=LOG_RECORDS_EXTENSION))
+
+        record = {
+            "type": "start",
+            "request_id": request_id,
+            "endpoint": endpoint,
+            "start_time": start_time,
+            "logged_at": logged_at,
+            "headers": self._sanitize_headers(headers) if self.include_headers and headers else None,
+            "lorebook_entries": lorebook_entries or None,
+            "stripped_metadata": stripped_metadata,
+            "original_request_data": (original_request_data
+                                      if self.include_request_data and stripped_metadata else None),
+            "request_data": request_data if self.include_request_data else None,
+        }
+        if self._append_record(filepath, record, payload_fields=("request_data", "original_request_data"),
+                               context="request_logger_start_error"):
+            logger.info(f"Started request log: {filepath}")
+            return filepath
+        return ""
+
+    def _render_start_log(self, existing: Optional[str], request_id: str, endpoint: str,
+                          request_data: Optional[Dict[str, Any]], headers: Dict[str, str], start_time: float,
+                          original_request_data: Optional[Dict[str, Any]],
+                          stripped_metadata: Optional[List[Dict[str, Any]]],
+                          lorebook_entries: Optional[List[Dict[str, Any]]],
+                          logged_at: str, payload_dropped: bool = False) -> str:
+        """Render the in-progress log for a request (existing content is replaced)"""
         log_content = []
 
         # Title and metadata
-        log_content.append(f"# Request Log - {datetime.now().isoformat()}")
+        log_content.append(f"# Request Log - {logged_at}")
         log_content.append("")
         log_content.append("**Status:** In Progress...")
         log_content.append("")
         log_content.append(f"**Request ID:** `{request_id}`  ")
         log_content.append(f"**Endpoint:** `{endpoint}`  ")
-        log_content.append(f"**Timestamp:** {datetime.now().isoformat()}  ")
+        log_content.append(f"**Timestamp:** {logged_at}  ")
         if start_time and self.include_timing:
             log_content.append(f"**Start Time:** {start_time}  ")
         log_content.append("")
@@ -256,12 +406,13 @@ class RequestLogger:
             log_content.append("```")
             log_content.append("")
 
-        # Original Request Data (as received)
+        # Original Request Data (as received); serialized once for both sections
         if self.include_request_data and original_request_data and stripped_metadata:
+            original_json = json.dumps(original_request_data, indent=2)
             log_content.append("## Original Request Data (As Received)")
             log_content.append("")
             log_content.append("```json")
-            log_content.append(json.dumps(original_request_data, indent=2))
+            log_content.append(original_json)
             log_content.append("```")
             log_content.append("")
 
@@ -270,8 +421,7 @@ class RequestLogger:
             log_content.append("*Logging only - not sent like this*")
             log_content.append("")
             log_content.append("```json")
-            cleaned_json = json.dumps(original_request_data, indent=2).replace('\\n', '\n')
-            log_content.append(cleaned_json)
+            log_content.append(original_json.replace('\\n', '\n'))
             log_content.append("```")
             log_content.append("")
 
@@ -288,69 +438,50 @@ class RequestLogger:
             log_content.append(json.dumps(request_data, indent=2))
             log_content.append("```")
             log_content.append("")
+        elif self.include_request_data and payload_dropped:
+            log_content.append("## Request Data")
+            log_content.append("")
+            log_content.append(PAYLOAD_DROPPED_NOTE)
+            log_content.append("")
 
         log_content.append("---")
         log_content.append("")
         log_content.append("*Waiting for response...*")
-
-        try:
-            with open(filepath, 'w', encoding='utf-8') as f:
-                f.write('\n'.join(log_content))
-            logger.info(f"Started request log: {filepath}")
-            return filepath
-        except Exception as e:
-            logger.error(f"Failed to create initial log {filepath}: {e}")
-            if hasattr(self, 'error_logger') and self.error_logger:
-                self.error_logger.log_error(e, {
-                    "context": "request_logger_start_error",
-                    "filepath": filepath,
-                    "log_type": "start_request"
-                })
-            return ""
+        return '\n'.join(log_content)
 
     def append_retry_note(self, filepath: str, reason: str, retry_attempt: Optional[int] = None,
                           matched_pattern: Optional[str] = None, content_preview: Optional[str] = None,
                           request_id: Optional[str] = None) -> bool:
         """Append a retry note (e.g., refusal-triggered retry) to an in-progress log file"""
-        if not self.enabled or not filepath or not os.path.exists(filepath):
+        writer = self._get_writer()
+        if not self.enabled or not filepath or (writer is None and not os.path.exists(filepath)):
             return False
 
+        fields = {
+            "reason": reason,
+            "retry_attempt": retry_attempt,
+            "matched_pattern": matched_pattern,
+            "content_preview": content_preview,
+            "request_id": request_id,
+            "logged_at": datetime.now().isoformat(),
+        }
+
+        if self.format == "records":
+            return self._append_record(filepath, {"type": "retry_note", **fields},
+                                       context="request_logger_retry_note_error")
+
+        if writer is not None:
+            writer.submit(LogEvent(filepath, self._render_retry_note, fields, update=True,
+                                   error_logger=self.error_logger, context="request_logger_retry_note_error"))
+            logger.info(f"Appended retry note to log: {filepath}")
+            return True
+
         try:
             with open(filepath, 'r', encoding='utf-8') as f:
                 existing_content = f.read()
 
-            note_lines = []
-            note_lines.append("## Proxy Retry Note")
-            note_lines.append("")
-            note_lines.append(f"**Reason:** {reason}  ")
-            if retry_attempt is not None:
-                note_lines.append(f"**Retry Attempt:** #{retry_attempt}  ")
-            if request_id:
-                note_lines.append(f"**Request ID:** `{request_id}`  ")
-            if matched_pattern:
-                note_lines.append(f"**Matched Pattern:** `{matched_pattern}`  ")
-            if content_preview is not None:
-                note_lines.append("")
-                note_lines.append("**Content Preview:**")
-                note_lines.append("")
-                note_lines.append("```text")
-                note_lines.append(content_preview)
-                note_lines.append("```")
-                note_lines.append("")
-
-            note_lines.append(f"*Logged at {datetime.now().isoformat()}*")
-            note_lines.append("")
-
-            placeholder = "---\n\n*Waiting for response...*"
-            note_block = '\n'.join(note_lines)
-
-            if placeholder in existing_content:
-                updated_content = existing_content.replace(placeholder, f"{note_block}\n{placeholder}", 1)
-            else:
-                updated_content = existing_content + "\n\n" + note_block
-
             with open(filepath, 'w', encoding='utf-8') as f:
-                f.write(updated_content)
+                f.write(self._render_retry_note(existing_content, **fields))
 
             logger.info(f"Appended retry note to log: {filepath}")
             return True
@@ -366,6 +497,55 @@ class RequestLogger:
                 })
             return False
 
+    def _render_retry_note(self, existing_content: Optional[str], reason: str, retry_attempt: Optional[int],
+                           matched_pattern: Optional[str], content_preview: Optional[str],
+                           request_id: Optional[str], logged_at: str) -> Optional[str]:
+        """Insert a retry note before the in-progress footer of existing content"""
+        if existing_content is None:
+            return None
+
+        note_lines = []
+        note_lines.append("## Proxy Retry Note")
+        note_lines.append("")
+        note_lines.append(f"**Reason:** {reason}  ")
+        if retry_attempt is not None:
+            note_lines.append(f"**Retry Attempt:** #{retry_attempt}  ")
+        if request_id:
+            note_lines.append(f"**Request ID:** `{request_id}`  ")
+        if matched_pattern:
+            note_lines.append(f"**Matched Pattern:** `{matched_pattern}`  ")
+        if content_preview is not None:
+            note_lines.append("")
+            note_lines.append("**Content Preview:**")
+            note_lines.append("")
+            note_lines.append("```text")
+            note_lines.append(content_preview)
+            note_lines.append("```")
+            note_lines.append("")
+
+        note_lines.append(f"*Logged at {logged_at}*")
+        note_lines.append("")
+
+        placeholder = "---\n\n*Waiting for response...*"
+        note_block = '\n'.join(note_lines)
+
+        if placeholder in existing_content:
+            return existing_content.replace(placeholder, f"{note_block}\n{placeholder}", 1)
+        return existing_content + "\n\n" + note_block
+
+    def _error_status_suffix(self, error: Exception) -> str:
+        """Filename suffix describing why an attempt failed"""
+        error_str = str(error).lower()
+
+        # Check for rate limit errors (429, 504, 503)
+        if "429" in error_str or "rate limit" in error_str or "quota" in error_str:
+            return "-RATELIMIT"
+        elif "504" in error_str or "gateway timeout" in error_str or "timeout" in error_str:
+            return "-TIMEOUT"
+        elif "503" in error_str or "service unavailable" in error_str:
+            return "-UNAVAILABLE"
+        return "-FAILED"
+
     def finalize_log_with_error(self, filepath: str, error: Exception,
                                 end_time: float = None, duration: float = None) -> str:
         """Finalize log file with error information and rename with error suffix
@@ -382,23 +562,19 @@ class RequestLogger:
         Returns:
             Path to renamed log file if successful, original filepath otherwise
         """
-        if not self.enabled or not filepath or not os.path.exists(filepath):
+        writer = self._get_writer()
+        if not self.enabled or not filepath or (writer is None and not os.path.exists(filepath)):
             return filepath
 
-        try:
-            # Determine error suffix based on error type
-            error_str = str(error).lower()
-            error_type = type(error).__name__
+        if self.format == "records":
+            # All attempts share one file; the failure is recorded instead of renaming it
+            self._index_end(filepath, None, end_time, duration, error)
+            self._append_record(filepath, self._end_record(None, None, end_time, duration, error),
+                                context="request_logger_complete_error")
+            return filepath
 
-            # Check for rate limit errors (429, 504, 503)
-            if "429" in error_str or "rate limit" in error_str or "quota" in error_str:
-                status_suffix = "-RATELIMIT"
-            elif "504" in error_str or "gateway timeout" in error_str or "timeout" in error_str:
-                status_suffix = "-TIMEOUT"
-            elif "503" in error_str or "service unavailable" in error_str:
-                status_suffix = "-UNAVAILABLE"
-            else:
-                status_suffix = "-FAILED"
+        try:
+            status_suffix = self._error_status_suffix(error)
 
             # Determine new filename by adding suffix before .md extension
             # Handle both formats: 00001-operation.md -> 00001-operation-RATELIMIT.md
@@ -414,6 +590,18 @@ class RequestLogger:
                 new_filename = f"{base_name}{status_suffix}.md"
                 new_filepath = os.path.join(directory, new_filename)
 
+            self._index_end(filepath, None, end_time, duration, error, new_filepath=new_filepath)
+
+            if writer is not None:
+                # Complete and rename in one background step
+                writer.submit(self._completion_event(
+                    filepath, response_data=None, response_headers=None, end_time=end_time,
+                    duration=duration, error=error, rename_to=new_filepath
+                ))
+                if new_filepath != filepath:
+                    logger.info(f"Renamed log file for retry: {filename} -> {os.path.basename(new_filepath)}")
+                return new_filepath
+
             # Complete the log with error information
             self.complete_request_log(
                 filepath=filepath,
@@ -436,9 +624,50 @@ class RequestLogger:
             logger.error(f"Failed to finalize log with error: {e}")
             return filepath
 
+    def _completion_fields(self, response_data: Any, response_headers: Optional[Dict[str, str]],
+                           end_time: Optional[float], duration: Optional[float],
+                           error: Optional[Exception],
+                           trace_summary: Optional[Dict[str, Dict[str, float]]] = None) -> Dict[str, Any]:
+        """Structured outcome of an attempt, as passed to _render_completion"""
+        return {
+            "response_data": response_data,
+            "response_headers": response_headers,
+            "end_time": end_time,
+            "duration": duration,
+            "error_type": type(error).__name__ if error else None,
+            "error_message": str(error) if error else None,
+            "usage": response_data.get('usage') if isinstance(response_data, dict) else None,
+            "completed_at": datetime.now().isoformat(),
+            "trace_summary": trace_summary,
+        }
+
+    def _end_record(self, response_data: Any, response_headers: Optional[Dict[str, str]],
+                    end_time: Optional[float], duration: Optional[float],
+                    error: Optional[Exception],
+                    trace_summary: Optional[Dict[str, Dict[str, float]]] = None) -> Dict[str, Any]:
+        """Records-format entry for the outcome of an attempt (include_* settings applied)"""
+        record = {"type": "end", **self._completion_fields(response_data, response_headers, end_time, duration, error,
+                                                           trace_summary)}
+        if not self.include_response_data:
+            record["response_data"] = None
+        record["response_headers"] = (self._sanitize_headers(response_headers)
+                                      if self.include_headers and response_headers else None)
+        return record
+
+    def _completion_event(self, filepath: str, response_data: Any, response_headers: Optional[Dict[str, str]],
+                          end_time: Optional[float], duration: Optional[float], error: Optional[Exception],
+                          rename_to: Optional[str] = None,
+                          trace_summary: Optional[Dict[str, Dict[str, float]]] = None) -> LogEvent:
+        """Build the writer event that completes (and optionally renames) a log"""
+        fields = self._completion_fields(response_data, response_headers, end_time, duration, error, trace_summary)
+        return LogEvent(filepath, self._render_completion, fields, payload_fields=("response_data",),
+                        update=True, rename_to=rename_to, final=True,
+                        error_logger=self.error_logger, context="request_logger_complete_error")
+
     def complete_request_log(self, filepath: str, response_data: Any = None,
                             response_headers: Dict[str, str] = None, end_time: float = None,
-                            duration: float = None, error: Exception = None) -> bool:
+                            duration: float = None, error: Exception = None,
+                            trace_summary: Optional[Dict[str, Dict[str, float]]] = None) -> bool:
         """Append response data to an existing log file
 
         Args:
@@ -448,11 +677,28 @@ class RequestLogger:
             end_time: Request end timestamp
             duration: Request duration in seconds
             error: Exception if request failed
+            trace_summary: Per-stage timing from the request's trace (see Tracer.summary)
 
         Returns:
-            True if successful, False otherwise
+            True if successful (or queued to the log writer), False otherwise
         """
-        if not self.enabled or not filepath or not os.path.exists(filepath):
+        writer = self._get_writer()
+        if not self.enabled or not filepath or (writer is None and not os.path.exists(filepath)):
+            return False
+
+        self._index_end(filepath, response_data, end_time, duration, error)
+
+        if self.format == "records":
+            return self._append_record(filepath, self._end_record(response_data, response_headers, end_time,
+                                                                  duration, error, trace_summary),
+                                       payload_fields=("response_data",), context="request_logger_complete_error")
+
+        event = self._completion_event(filepath, response_data, response_headers, end_time, duration, error,
+                                       trace_summary=trace_summary)
+        if writer is not None:
+            if writer.submit(event):
+                logger.info(f"Completed request log: {filepath}")
+                return True
             return False
 
         try:
@@ -460,122 +706,147 @@ class RequestLogger:
             with open(filepath, 'r', encoding='utf-8') as f:
                 existing_content = f.read()
 
-            # Replace status line
-            if error:
-                existing_content = existing_content.replace(
-                    "**Status:** In Progress...",
-                    f"**Status:** ❌ Failed - {type(error).__name__}"
-                )
-            else:
-                existing_content = existing_content.replace(
-                    "**Status:** In Progress...",
-                    "**Status:** ✅ Success"
-                )
+            # Write updated content
+            with open(filepath, 'w', encoding='utf-8') as f:
+                f.write(self._render_completion(existing_content, **event.fields))
 
-            # Build response sections
-            response_content = []
-            response_content.append("")
+            logger.info(f"Completed request log: {filepath}")
+            return True
+
+        except Exception as e:
+            logger.error(f"Failed to complete log {filepath}: {e}")
+            if hasattr(self, 'error_logger') and self.error_logger:
+                self.error_logger.log_error(e, {
+                    "context": "request_logger_complete_error",
+                    "filepath": filepath,
+                    "log_type": "complete_request"
+                })
+            return False
+
+    def _render_completion(self, existing_content: Optional[str], response_data: Any,
+                           response_headers: Optional[Dict[str, str]], end_time: Optional[float],
+                           duration: Optional[float], error_type: Optional[str], error_message: Optional[str],
+                           usage: Optional[Dict[str, Any]], completed_at: str,
+                           trace_summary: Optional[Dict[str, Dict[str, float]]] = None,
+                           payload_dropped: bool = False) -> Optional[str]:
+        """Replace the status line and in-progress footer of existing content with the outcome"""
+        if existing_content is None:
+            return None
+
+        # Replace status line
+        if error_type:
+            existing_content = existing_content.replace(
+                "**Status:** In Progress...",
+                f"**Status:** ❌ Failed - {error_type}"
+            )
+        else:
+            existing_content = existing_content.replace(
+                "**Status:** In Progress...",
+                "**Status:** ✅ Success"
+            )
 
-            # Error Response or Response Data
-            if error:
-                response_content.append("## Error Response")
+        # Build response sections
+        response_content = []
+        response_content.append("")
+
+        # Error Response or Response Data
+        if error_type:
+            response_content.append("## Error Response")
+            response_content.append("")
+            response_content.append(f"**Error Type:** `{error_type}`  ")
+            response_content.append(f"**Error Message:** {error_message}  ")
+            response_content.append("")
+        else:
+            if self.include_response_data and response_data:
+                response_content.append("## Response Data")
                 response_content.append("")
-                response_content.append(f"**Error Type:** `{type(error).__name__}`  ")
-                response_content.append(f"**Error Message:** {str(error)}  ")
+                if isinstance(response_data, dict):
+                    # Serialized once for both the raw and cleaned sections
+                    response_json = json.dumps(response_data, indent=2)
+                    response_content.append("```json")
+                    response_content.append(response_json)
+                    response_content.append("```")
+                else:
+                    response_content.append("```text")
+                    response_content.append(str(response_data))
+                    response_content.append("```")
                 response_content.append("")
-            else:
-                if self.include_response_data and response_data:
-                    response_content.append("## Response Data")
-                    response_content.append("")
-                    if isinstance(response_data, dict):
-                        response_content.append("```json")
-                        response_content.append(json.dumps(response_data, indent=2))
-                        response_content.append("```")
-                    else:
-                        response_content.append("```text")
-                        response_content.append(str(response_data))
-                        response_content.append("```")
-                    response_content.append("")
 
-                    if isinstance(response_data, dict):
-                        response_content.append("## Response Data (Cleaned)")
-                        response_content.append("")
-                        response_content.append("*For readability - actual response uses escaped newlines*")
-                        response_content.append("")
-                        response_content.append("```json")
-                        cleaned_json = json.dumps(response_data, indent=2).replace('\\n', '\n')
-                        response_content.append(cleaned_json)
-                        response_content.append("```")
-                        response_content.append("")
-
-                        parsed_section = self._format_parsed_response_data(response_data)
-                        if parsed_section:
-                            response_content.extend(parsed_section)
-
-                if self.include_headers and response_headers:
-                    response_content.append("## Response Headers")
+                if isinstance(response_data, dict):
+                    response_content.append("## Response Data (Cleaned)")
                     response_content.append("")
-                    response_content.append("```text")
-                    sanitized_headers = self._sanitize_headers(response_headers)
-                    for key, value in sanitized_headers.items():
-                        response_content.append(f"{key}: {value}")
+                    response_content.append("*For readability - actual response uses escaped newlines*")
+                    response_content.append("")
+                    response_content.append("```json")
+                    response_content.append(response_json.replace('\\n', '\n'))
                     response_content.append("```")
                     response_content.append("")
 
-            # Timing Information
-            if self.include_timing:
-                response_content.append("## Timing Information")
+                    parsed_section = self._format_parsed_response_data(response_data)
+                    if parsed_section:
+                        response_content.extend(parsed_section)
+            elif self.include_response_data and payload_dropped:
+                response_content.append("## Response Data")
                 response_content.append("")
-                if end_time:
-                    response_content.append(f"**End Time:** {end_time}  ")
-                if duration:
-                    response_content.append(f"**Total Duration:** {duration:.3f} seconds  ")
+                response_content.append(PAYLOAD_DROPPED_NOTE)
                 response_content.append("")
 
-                # Add token usage if available in response
-                if response_data and isinstance(response_data, dict):
-                    usage = response_data.get('usage')
-                    if usage and isinstance(usage, dict):
-                        prompt_tokens = usage.get('prompt_tokens')
-                        completion_tokens = usage.get('completion_tokens')
-                        total_tokens = usage.get('total_tokens')
-
-                        if prompt_tokens is not None:
-                            response_content.append(f"**Prompt Tokens:** {prompt_tokens:,}  ")
-                        if completion_tokens is not None:
-                            response_content.append(f"**Completion Tokens:** {completion_tokens:,}  ")
-                        if total_tokens is not None:
-                            response_content.append(f"**Total Tokens:** {total_tokens:,}  ")
-
+            if self.include_headers and response_headers:
+                response_content.append("## Response Headers")
+                response_content.append("")
+                response_content.append("```text")
+                sanitized_headers = self._sanitize_headers(response_headers)
+                for key, value in sanitized_headers.items():
+                    response_content.append(f"{key}: {value}")
+                response_content.append("```")
                 response_content.append("")
 
-            # Footer
-            response_content.append("---")
+        # Timing Information
+        if self.include_timing:
+            response_content.append("## Timing Information")
+            response_content.append("")
+            if end_time:
+                response_content.append(f"**End Time:** {end_time}  ")
+            if duration:
+                response_content.append(f"**Total Duration:** {duration:.3f} seconds  ")
             response_content.append("")
-            response_content.append(f"*Log completed at {datetime.now().isoformat()}*")
 
-            # Replace the "Waiting for response..." footer with response data
-            final_content = existing_content.replace(
-                "---\n\n*Waiting for response...*",
-                '\n'.join(response_content)
-            )
+            # Add token usage if available in response
+            if usage and isinstance(usage, dict):
+                prompt_tokens = usage.get('prompt_tokens')
+                completion_tokens = usage.get('completion_tokens')
+                total_tokens = usage.get('total_tokens')
+
+                if prompt_tokens is not None:
+                    response_content.append(f"**Prompt Tokens:** {prompt_tokens:,}  ")
+                if completion_tokens is not None:
+                    response_content.append(f"**Completion Tokens:** {completion_tokens:,}  ")
+                if total_tokens is not None:
+                    response_content.append(f"**Total Tokens:** {total_tokens:,}  ")
 
-            # Write updated content
-            with open(filepath, 'w', encoding='utf-8') as f:
-                f.write(final_content)
+            response_content.append("")
 
-            logger.info(f"Completed request log: {filepath}")
-            return True
+            # Per-stage timing from the request's trace
+            if trace_summary:
+                response_content.append("## Stage Timing")
+                response_content.append("")
+                response_content.append("```text")
+                for stage, timing in trace_summary.items():
+                    count = f" x{timing['count']}" if timing.get('count', 1) > 1 else ""
+                    response_content.append(f"{stage:<24} {timing['total_ms']:>12.3f} ms{count}")
+                response_content.append("```")
+                response_content.append("")
 
-        except Exception as e:
-            logger.error(f"Failed to complete log {filepath}: {e}")
-            if hasattr(self, 'error_logger') and self.error_logger:
-                self.error_logger.log_error(e, {
-                    "context": "request_logger_complete_error",
-                    "filepath": filepath,
-                    "log_type": "complete_request"
-                })
-            return False
+        # Footer
+        response_content.append("---")
+        response_content.append("")
+        response_content.append(f"*Log completed at {completed_at}*")
+
+        # Replace the "Waiting for response..." footer with response data
+        return existing_content.replace(
+            "---\n\n*Waiting for response...*",
+            '\n'.join(response_content)
+        )
 
     def _get_entity_field(self, entry: Dict[str, Any], field_variants: List[str], default: Any = None) -> Any:
         """
@@ -0,0 +1,371 @@
+"""
+Response cache for deterministic requests
+
+Background operations such as validate_recap, lorebook_entry_lookup,
+resolve_lorebook_entry and detect_scene_break run at temperature 0 with the
+same prompts whenever a scene is re-run or a registry rebuilt. For the
+ST_METADATA operations listed in response_cache.operations (exact names or
+glob patterns), successful non-streaming replies are cached, keyed by a
+SHA-256 of the normalized forwarded request (model, messages and sampling
+parameters, with transport-only fields dropped), the config and the client's
+Authorization header. Only real completions are stored: hard-stop errors and
+replies that stayed blank after the blank-response retries are not. With deterministic_only (the default) only requests
+sent with temperature 0 are cached.
+
+Two tiers are kept: a bounded in-memory LRU per process and, when path is
+set, a SQLite database shared by all workers. Entries older than ttl seconds
+are ignored and removed; the database is trimmed to max_disk_bytes by least
+recent use. Disk hits are promoted to memory.
+
+Callers control the cache with the request's Cache-Control header:
+"no-cache" (or max-age=0) skips the lookup but stores the fresh reply,
+"no-store" neither reads nor writes the cache.
+"""
+import os
+import json
+import time
+import fnmatch
+import hashlib
+import sqlite3
+import threading
+import logging
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+
+from .metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_PATH = os.path.join("logs", "response_cache.sqlite3")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    operation TEXT,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL,
+    size INTEGER NOT NULL,
+    body TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_responses_accessed ON responses (accessed);
+CREATE INDEX IF NOT EXISTS idx_responses_created ON responses (created);
+"""
+
+# Forwarded fields that do not change the reply
+IGNORED_FIELDS = ("stream", "stream_options", "user")
+
+# Disk stores between expiry and size trims
+TRIM_EVERY = 64
+
+# Operations whose allowlist lookups are remembered before the cache is reset
+MAX_CACHED_OPERATIONS = 1024
+
+CACHE_MEMORY_HIT = "memory_hit"
+CACHE_DISK_HIT = "disk_hit"
+CACHE_MISS = "miss"
+CACHE_BYPASS = "bypass"
+
+
+def cache_control(headers: Optional[Dict[str, str]]) -> Tuple[bool, bool]:
+    """
+    Read the request's Cache-Control header.
+
+    Returns:
+        Tuple of (may answer from the cache, may store the reply)
+    """
+    value = next((value for name, value in (headers or {}).items() if name.lower() == "cache-control"), "")
+    directives = {directive.strip().lower().replace(" ", "") for directive in (value or "").split(",")}
+    if "no-store" in directives:
+        return False, False
+    if "no-cache" in directives or "max-age=0" in directives:
+        return False, True
+    return True, True
+
+
+def is_cacheable_reply(response_data: Any) -> bool:
+    """Whether a reply is a completion worth replaying: no error and non-empty content in every choice"""
+    if not isinstance(response_data, dict) or "error" in response_data:
+        return False
+    choices = response_data.get("choices")
+    if not isinstance(choices, list) or not choices:
+        return False
+    for choice in choices:
+        message = choice.get("message") if isinstance(choice, dict) else None
+        content = message.get("content") if isinstance(message, dict) else None
+        if not isinstance(content, str) or not content.strip():
+            return False
+    return True
+
+
+class ResponseCache:
+    """In-memory LRU in front of an optional SQLite tier of cached replies"""
+
+    def __init__(self, operations: Optional[List[str]] = None, deterministic_only: bool = True,
+                 ttl: float = 86400.0, max_entries: int = 1024, max_bytes: int = 64_000_000,
+                 path: Optional[str] = None, max_disk_bytes: int = 512_000_000, busy_timeout: float = 5.0):
+        """
+        Initialize cache.
+
+        Args:
+            operations: ST_METADATA operation names or glob patterns whose replies are cached
+            deterministic_only: Only cache requests sent with temperature 0
+            ttl: Seconds a reply stays valid (0 keeps replies until evicted)
+            max_entries: Replies kept in memory
+            max_bytes: Approximate bound on the serialized replies kept in memory
+            path: SQLite database of the disk tier (None keeps replies in memory only)
+            max_disk_bytes: Approximate bound on the serialized replies kept on disk
+            busy_timeout: Seconds to wait for another process's write lock
+        """
+        self.operations = list(operations or [])
+        self.deterministic_only = deterministic_only
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._operation_matches: Dict[str, bool] = {}
+        # key -> (created, serialized reply)
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.counts: Dict[str, int] = {}
+        self.stores = 0
+        self.evictions = 0
+        self.disk_errors = 0
+        self._disk_stores = 0
+
+        self.path = os.path.abspath(path) if path else None
+        self._conn = None
+        if self.path:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            # One connection shared by all threads, serialized by _lock
+            self._conn = sqlite3.connect(self.path, timeout=busy_timeout, check_same_thread=False,
+                                         isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+            self._trim_disk()
+
+    @classmethod
+    def from_config(cls, cache_config: Optional[Dict[str, Any]]) -> "ResponseCache":
+        """Build a cache from the response_cache configuration section"""
+        cache_config = cache_config or {}
+        return cls(
+            operations=cache_config.get("operations") or [],
+            deterministic_only=cache_config.get("deterministic_only", True),
+            ttl=cache_config.get("ttl", 86400.0),
+            max_entries=cache_config.get("max_entries", 1024),
+            max_bytes=cache_config.get("max_bytes", 64_000_000),
+            path=cache_config.get("path", DEFAULT_CACHE_PATH),
+            max_disk_bytes=cache_config.get("max_disk_bytes", 512_000_000),
+            busy_timeout=cache_config.get("busy_timeout", 5.0),
+        )
+
+    def applies_to(self, operation: Optional[str]) -> bool:
+        """Whether replies of an ST_METADATA operation may be cached"""
+        if not operation:
+            return False
+        try:
+            return self._operation_matches[operation]
+        except KeyError:
+            pass
+        matches = any(operation == pattern or fnmatch.fnmatchcase(operation, pattern) for pattern in self.operations)
+        if len(self._operation_matches) >= MAX_CACHED_OPERATIONS:
+            self._operation_matches.clear()
+        self._operation_matches[operation] = matches
+        return matches
+
+    def key_for(self, operation: Optional[str], request_data: Dict[str, Any],
+                headers: Optional[Dict[str, str]], scope: str) -> Optional[str]:
+        """
+        Cache key of a request.
+
+        Args:
+            operation: ST_METADATA operation of the request
+            request_data: Body forwarded upstream
+            headers: Client headers (only Authorization is part of the key)
+            scope: Identifies the config, e.g. its execution plan's fingerprint
+
+        Returns:
+            Hex digest of the normalized request, or None if its reply is not cached
+        """
+        if request_data.get("stream") or not self.applies_to(operation):
+            return None
+        if self.deterministic_only and request_data.get("temperature") != 0:
+            return None
+        normalized = {name: value for name, value in request_data.items()
+                      if name not in IGNORED_FIELDS and value is not None}
+        authorization = next((value for name, value in (headers or {}).items()
+                              if name.lower() == "authorization"), None)
+        canonical = json.dumps([scope, authorization, normalized], sort_keys=True,
+                               separators=(",", ":"), ensure_ascii=False, default=repr)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def _count(self, result: str) -> None:
+        with self._lock:
+            self.counts[result] = self.counts.get(result, 0) + 1
+        get_metrics().record_response_cache(result)
+
+    def bypass(self) -> None:
+        """Count a cacheable request whose Cache-Control skipped the lookup"""
+        self._count(CACHE_BYPASS)
+
+    def _expired(self, created: float, now: float) -> bool:
+        return bool(self.ttl) and now - created > self.ttl
+
+    def _remember(self, key: str, created: float, body: str) -> None:
+        """Add a reply to the memory tier, evicting least recently used replies (lock held)"""
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= len(previous[1])
+        if len(body) > self.max_bytes:
+            return
+        self._entries[key] = (created, body)
+        self._bytes += len(body)
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            _, (_, old_body) = self._entries.popitem(last=False)
+            self._bytes -= len(old_body)
+            self.evictions += 1
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Look up a cached reply.
+
+        Args:
+            key: Value of key_for()
+
+        Returns:
+            A private copy of the reply, or None on a miss
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry[0], now):
+                self._bytes -= len(self._entries.pop(key)[1])
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is not None:
+            self._count(CACHE_MEMORY_HIT)
+            return json.loads(entry[1])
+
+        row = None
+        if self._conn is not None:
+            try:
+                with self._lock:
+                    row = self._conn.execute("SELECT created, body FROM responses WHERE key = ?", (key,)).fetchone()
+                    if row is not None and self._expired(row[0], now):
+                        self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                        row = None
+                    if row is not None:
+                        self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+                        self._remember(key, row[0], row[1])
+            except sqlite3.Error as e:
+                row = None
+                self._disk_error("read", e)
+        if row is None:
+            self._count(CACHE_MISS)
+            return None
+        self._count(CACHE_DISK_HIT)
+        return json.loads(row[1])
+
+    def put(self, key: str, operation: Optional[str], response_data: Dict[str, Any]) -> None:
+        """Store a successful reply in both tiers"""
+        body = json.dumps(response_data, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, body)
+            self.stores += 1
+        if self._conn is None:
+            return
+        try:
+            with self._lock:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, operation, created, accessed, size, body) "
+                    "VALUES (?, ?, ?, ?, ?, ?)", (key, operation, now, now, len(body), body))
+                self._disk_stores += 1
+                trim = self._disk_stores % TRIM_EVERY == 0
+            if trim:
+                self._trim_disk()
+        except sqlite3.Error as e:
+            self._disk_error("write", e)
+
+    def _trim_disk(self) -> None:
+        """Delete expired replies, then the least recently used ones beyond max_disk_bytes"""
+        try:
+            with self._lock:
+                if self.ttl:
+                    self._conn.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.ttl,))
+                total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+                if total <= self.max_disk_bytes:
+                    return
+                doomed = []
+                for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY accessed"):
+                    if total <= self.max_disk_bytes:
+                        break
+                    doomed.append((key,))
+                    total -= size
+                self._conn.executemany("DELETE FROM responses WHERE key = ?", doomed)
+                self.evictions += len(doomed)
+        except sqlite3.Error as e:
+            self._disk_error("trim", e)
+
+    def _disk_error(self, action: str, error: Exception) -> None:
+        """Cache failures are logged, never raised to the request"""
+        with self._lock:
+            self.disk_errors += 1
+        logger.error(f"Response cache {action} failed ({self.path}): {error}")
+
+    def clear(self) -> None:
+        """Drop every cached reply from both tiers"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM responses")
+
+    def close(self) -> None:
+        """Close the disk tier's database connection"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return tier sizes and lookup counters for health reporting"""
+        with self._lock:
+            hits = self.counts.get(CACHE_MEMORY_HIT, 0) + self.counts.get(CACHE_DISK_HIT, 0)
+            lookups = hits + self.counts.get(CACHE_MISS, 0)
+            return {
+                "enabled": True,
+                "operations": self.operations,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "path": self.path,
+                "stores": self.stores,
+                "evictions": self.evictions,
+                "disk_errors": self.disk_errors,
+                "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+                **self.counts,
+            }
+
+
+# Process-wide response cache shared by both serving engines (None when disabled)
+_response_cache_lock = threading.Lock()
+_response_cache: Optional[ResponseCache] = None
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """Return the process-wide response cache, or None if caching is disabled"""
+    return _response_cache
+
+
+def configure_response_cache(cache_config: Optional[Dict[str, Any]]) -> Optional[ResponseCache]:
+    """Replace the process-wide response cache (None when response_cache.enabled is false)"""
+    global _response_cache
+    cache_config = cache_config or {}
+    new_cache = ResponseCache.from_config(cache_config) if cache_config.get("enabled") else None
+    with _response_cache_lock:
+        old_cache, _response_cache = _response_cache, new_cache
+    if old_cache is not None:
+        old_cache.close()
+    return new_cache
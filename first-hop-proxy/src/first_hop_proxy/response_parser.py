@@ -1,11 +1,20 @@
 import json
 import logging
 import re
-from typing import Dict, Any, Optional, Tuple
+from typing import Dict, Any, Optional, Tuple, List, Pattern
 from .config import Config
+from .tracing import get_tracer
 
 logger = logging.getLogger(__name__)
 
+# Matches path segments like "error", "choices[0]" in dot-notation JSON paths
+_JSON_PATH_SEGMENT = re.compile(r'(\w+)(?:\[(\d+)\])?')
+
+
+def parse_json_path(path: str) -> List[Tuple[str, Optional[int]]]:
+    """Split a dot-notation path (e.g. "error.details[0].message") into (key, index) segments"""
+    return [(key, int(index) if index else None) for key, index in _JSON_PATH_SEGMENT.findall(path)]
+
 
 class ResponseParser:
     """Parse response bodies and recategorize status codes based on error messages"""
@@ -14,6 +23,26 @@ class ResponseParser:
         """Initialize response parser with configuration"""
         self.config = config
         self.parsing_config = config.get_response_parsing_config()
+
+        # Compile rule patterns and parse extraction paths once per parser
+        self._pattern_cache: Dict[str, Optional[Pattern]] = {}
+        self._json_path_cache: Dict[str, List[Tuple[str, Optional[int]]]] = {}
+        for rule in self.parsing_config.get("status_recategorization", {}).get("rules", []) or []:
+            if rule.get("pattern"):
+                self._compile_pattern(rule["pattern"])
+        for path in self.parsing_config.get("json_extraction", {}).get("paths", []) or []:
+            if path:
+                self._json_path_cache[path] = parse_json_path(path)
+
+    def _compile_pattern(self, pattern: str) -> Optional[Pattern]:
+        """Return the case-insensitive compiled pattern, or None if it is invalid"""
+        if pattern not in self._pattern_cache:
+            try:
+                self._pattern_cache[pattern] = re.compile(pattern, re.IGNORECASE)
+            except re.error as e:
+                logger.warning(f"Invalid recategorization pattern {pattern!r}: {e}")
+                self._pattern_cache[pattern] = None
+        return self._pattern_cache[pattern]
         
     def parse_and_recategorize(self, response_text: str, original_status: int) -> Tuple[int, Dict[str, Any]]:
         """
@@ -28,39 +57,39 @@ class ResponseParser:
         """
         if not self.parsing_config.get("enabled", False):
             return original_status, {"recategorized": False, "reason": "parsing_disabled"}
-        
-        try:
-            # Try to parse as JSON first
-            response_json = json.loads(response_text)
-            return self._parse_json_response(response_json, original_status)
-        except json.JSONDecodeError:
-            # If not JSON, try plain text parsing
-            return self._parse_text_response(response_text, original_status)
+
+        with get_tracer().span("response_parser", original_status=original_status) as span:
+            try:
+                # Try to parse as JSON first
+                response_json = json.loads(response_text)
+                new_status, parsing_info = self._parse_json_response(response_json, original_status)
+            except json.JSONDecodeError:
+                # If not JSON, try plain text parsing
+                new_status, parsing_info = self._parse_text_response(response_text, original_status)
+            span.set_attribute("recategorized", parsing_info.get("recategorized", False))
+            if parsing_info.get("recategorized"):
+                span.set_attribute("new_status", new_status)
+                span.set_attribute("matched_pattern", parsing_info.get("matched_pattern"))
+            return new_status, parsing_info
     
     def _parse_json_response(self, response_json: Dict[str, Any], original_status: int) -> Tuple[int, Dict[str, Any]]:
         """Parse JSON response and recategorize status if needed"""
         recategorization_config = self.parsing_config.get("status_recategorization", {})
 
         if not recategorization_config.get("enabled", False):
-            logger.warning("DEBUG: Recategorization is disabled in config")
             return original_status, {"recategorized": False, "reason": "recategorization_disabled"}
 
         # Extract error messages from JSON paths
         error_messages = self._extract_error_messages(response_json)
-        logger.warning(f"DEBUG: Extracted error messages: {error_messages}")
         
         # Check each recategorization rule
         rules = recategorization_config.get("rules", [])
-        logger.warning(f"DEBUG: Checking {len(rules)} recategorization rules")
-        for idx, rule in enumerate(rules):
-            logger.warning(f"DEBUG: Rule {idx}: pattern={rule.get('pattern')}, original_status={rule.get('original_status')}, new_status={rule.get('new_status')}")
+        for rule in rules:
             if self._should_apply_rule(rule, original_status, error_messages):
                 new_status = rule.get("new_status")
                 pattern = rule.get("pattern")
                 description = rule.get("description", "No description")
 
-                logger.warning(f"DEBUG: RULE MATCHED! Recategorizing {original_status} → {new_status}")
-
                 # Log the recategorization
                 self._log_recategorization(original_status, new_status, pattern, description)
 
@@ -73,7 +102,6 @@ class ResponseParser:
                     "error_messages": error_messages
                 }
 
-        logger.warning(f"DEBUG: No rules matched. Returning original status {original_status}")
         return original_status, {"recategorized": False, "reason": "no_matching_rules", "error_messages": error_messages}
     
     def _parse_text_response(self, response_text: str, original_status: int) -> Tuple[int, Dict[str, Any]]:
@@ -130,18 +158,15 @@ class ResponseParser:
         if not path:
             return obj
         
-        # Simple regex-based approach to handle array indexing
-        import re
-        
-        # Split the path into parts, handling array indexing
-        # This regex matches: word characters, array indices [number], and dots
-        pattern = r'(\w+)(?:\[(\d+)\])?'
-        matches = re.findall(pattern, path)
+        # Split the path into (key, index) parts; parsed paths are cached per parser
+        segments = self._json_path_cache.get(path)
+        if segments is None:
+            segments = parse_json_path(path)
+            self._json_path_cache[path] = segments
         
         current = obj
         
-        for match in matches:
-            key, index = match
+        for key, index in segments:
             
             if isinstance(current, dict):
                 if key in current:
@@ -152,16 +177,9 @@ class ResponseParser:
                 return None
             
             # Handle array indexing if present
-            if index:
-                if isinstance(current, list):
-                    try:
-                        idx = int(index)
-                        if 0 <= idx < len(current):
-                            current = current[idx]
-                        else:
-                            return None
-                    except (ValueError, IndexError):
-                        return None
+            if index is not None:
+                if isinstance(current, list) and 0 <= index < len(current):
+                    current = current[index]
                 else:
                     return None
         
@@ -178,8 +196,11 @@ class ResponseParser:
         
         # Check if pattern matches any error message
         if pattern:
+            compiled = self._compile_pattern(pattern)
+            if compiled is None:
+                return False
             for message in error_messages:
-                if isinstance(message, str) and re.search(pattern, message, re.IGNORECASE):
+                if isinstance(message, str) and compiled.search(message):
                     return True
         
         return False
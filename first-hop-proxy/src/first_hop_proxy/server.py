@@ -0,0 +1,244 @@
+"""
+Serving engines and the pre-fork worker supervisor
+
+server.engine selects how the proxy is served:
+
+    flask (or dev)  Flask's development server, one new thread per connection
+    waitress        waitress with a fixed pool of worker threads; connections
+                    beyond connection_limit wait in the listen backlog and
+                    requests beyond the thread count wait in its task queue
+    asyncio         the ASGI app on uvicorn (see asgi.py)
+
+With server.workers above 1 (waitress and asyncio, POSIX only) the
+listening socket is bound once and that many worker processes are forked
+to serve it. The parent only supervises: it restarts workers that exit
+unexpectedly and stops them all on SIGINT/SIGTERM. Each worker sets up its
+own pools, log writer and metrics after the fork; state that has to agree
+across workers goes through files (log numbers through the log_sequence
+counter files, metrics through per-worker snapshots).
+"""
+import os
+import sys
+import time
+import socket
+import signal
+import logging
+from typing import Dict, Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+SERVER_ENGINES = ("flask", "dev", "waitress", "asyncio")
+PREFORK_ENGINES = ("waitress", "asyncio")
+
+# Waitress defaults tuned for long-running upstream calls
+DEFAULT_THREADS = 32
+DEFAULT_CONNECTION_LIMIT = 100
+DEFAULT_CHANNEL_TIMEOUT = 120
+DEFAULT_BACKLOG = 1024
+
+# Workers that die within this many seconds of starting are restarted after a delay
+MIN_WORKER_LIFETIME = 5.0
+RESTART_DELAY = 1.0
+
+
+def resolve_engine(server_config: Dict[str, Any]) -> str:
+    """
+    Return the configured serving engine ("dev" is an alias for "flask").
+
+    Raises:
+        ValueError: If server.engine is not one of SERVER_ENGINES
+    """
+    engine = server_config.get("engine", "flask")
+    if engine not in SERVER_ENGINES:
+        raise ValueError(f"server.engine must be one of {SERVER_ENGINES}, got {engine!r}")
+    return "flask" if engine == "dev" else engine
+
+
+def resolve_worker_count(server_config: Dict[str, Any]) -> int:
+    """
+    Return how many serving processes to run.
+
+    Falls back to 1 (with a warning) where pre-forking is not possible: the
+    flask engine, or platforms without os.fork.
+    """
+    workers = int(server_config.get("workers", 1) or 1)
+    if workers <= 1:
+        return 1
+    engine = resolve_engine(server_config)
+    if engine not in PREFORK_ENGINES:
+        logger.warning(f"server.workers is ignored with the {engine} engine; running one process")
+        return 1
+    if not hasattr(os, "fork"):
+        logger.warning("server.workers needs os.fork, which this platform lacks; running one process")
+        return 1
+    return workers
+
+
+def waitress_options(server_config: Dict[str, Any]) -> Dict[str, Any]:
+    """Build waitress.serve keyword arguments from the server configuration section"""
+    return {
+        "threads": server_config.get("threads", DEFAULT_THREADS),
+        "connection_limit": server_config.get("connection_limit", DEFAULT_CONNECTION_LIMIT),
+        "channel_timeout": server_config.get("channel_timeout", DEFAULT_CHANNEL_TIMEOUT),
+        "backlog": server_config.get("backlog", DEFAULT_BACKLOG),
+        "ident": "first-hop-proxy",
+    }
+
+
+def bind_socket(host: str, port: int, backlog: int = DEFAULT_BACKLOG) -> socket.socket:
+    """Bind and listen on host:port (shared by all forked workers)"""
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def serve(wsgi_app, server_config: Dict[str, Any], sock: Optional[socket.socket] = None) -> None:
+    """
+    Serve the proxy in this process until interrupted.
+
+    Args:
+        wsgi_app: Flask application (the asyncio engine serves the ASGI app instead)
+        server_config: Server configuration section
+        sock: Already-bound listening socket (pre-fork workers); None binds host:port
+    """
+    engine = resolve_engine(server_config)
+    host = server_config.get("host", "0.0.0.0")
+    port = server_config.get("port", 5000)
+
+    if engine == "asyncio":
+        # Serve the same routes on an event loop instead of a thread per request
+        import uvicorn
+        from .asgi import app as asgi_app
+        if sock is not None:
+            uvicorn.run(asgi_app, fd=sock.fileno(), log_level="info")
+        else:
+            uvicorn.run(asgi_app, host=host, port=port, log_level="info")
+    elif engine == "waitress":
+        import waitress
+        options = waitress_options(server_config)
+        if sock is not None:
+            waitress.serve(wsgi_app, sockets=[sock], **options)
+        else:
+            waitress.serve(wsgi_app, host=host, port=port, **options)
+    else:
+        # Start Flask server
+        wsgi_app.run(host=host, port=port, debug=False, use_reloader=False, threaded=True)
+
+
+class PreforkSupervisor:
+    """Forks worker processes serving one shared socket and keeps them running"""
+
+    def __init__(self, worker_count: int, run_worker: Callable[[socket.socket], None], sock: socket.socket):
+        """
+        Initialize supervisor.
+
+        Args:
+            worker_count: Number of worker processes
+            run_worker: Called in each forked worker with the listening socket; serves until stopped
+            sock: Listening socket bound by the parent
+        """
+        self.worker_count = worker_count
+        self.run_worker = run_worker
+        self.sock = sock
+        self.workers: Dict[int, float] = {}  # pid -> start time
+        self._stopping = False
+
+    def _spawn(self) -> int:
+        """Fork one worker; returns its pid in the parent and never returns in the worker"""
+        pid = os.fork()
+        if pid:
+            self.workers[pid] = time.monotonic()
+            return pid
+
+        # Worker: stop on SIGTERM the way the engines stop on Ctrl+C
+        signal.signal(signal.SIGTERM, _raise_keyboard_interrupt)
+        signal.signal(signal.SIGINT, _raise_keyboard_interrupt)
+        code = 0
+        try:
+            self.run_worker(self.sock)
+        except KeyboardInterrupt:
+            pass
+        except BaseException as e:
+            logger.error(f"Worker {os.getpid()} failed: {e}")
+            code = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            # Skip the parent's exit handlers and finally blocks inherited through fork
+            os._exit(code)
+
+    def _stop(self, signum, frame) -> None:
+        """Signal handler: forward the stop to every worker"""
+        self._stopping = True
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self) -> None:
+        """Start the workers and supervise them until stopped"""
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        for _ in range(self.worker_count):
+            self._spawn()
+        logger.info(f"Started {self.worker_count} workers: {sorted(self.workers)}")
+
+        while self.workers:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            started = self.workers.pop(pid, None)
+            if started is None or self._stopping:
+                continue
+
+            logger.warning(f"Worker {pid} exited with status {status}; restarting")
+            if time.monotonic() - started < MIN_WORKER_LIFETIME:
+                # Don't spin if workers crash on start
+                time.sleep(RESTART_DELAY)
+            if not self._stopping:
+                self._spawn()
+        self.sock.close()
+
+
+def _raise_keyboard_interrupt(signum, frame) -> None:
+    raise KeyboardInterrupt
+
+
+def run_server(wsgi_app, server_config: Dict[str, Any], configure_process: Callable[[bool], None],
+               shutdown_process: Optional[Callable[[], None]] = None) -> None:
+    """
+    Serve the proxy with the configured engine, pre-forking workers if configured.
+
+    Args:
+        wsgi_app: Flask application
+        server_config: Server configuration section
+        configure_process: Sets up per-process state; called with True in
+                           pre-forked workers and False in a single server process
+        shutdown_process: Drains per-process state when a worker stops
+    """
+    workers = resolve_worker_count(server_config)
+    if workers == 1:
+        configure_process(False)
+        serve(wsgi_app, server_config)
+        return
+
+    sock = bind_socket(server_config.get("host", "0.0.0.0"), server_config.get("port", 5000),
+                       server_config.get("backlog", DEFAULT_BACKLOG))
+
+    def run_worker(worker_sock: socket.socket) -> None:
+        configure_process(True)
+        try:
+            serve(wsgi_app, server_config, sock=worker_sock)
+        finally:
+            if shutdown_process:
+                shutdown_process()
+
+    PreforkSupervisor(workers, run_worker, sock).run()
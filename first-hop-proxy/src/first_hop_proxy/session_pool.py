@@ -0,0 +1,243 @@
+"""
+Process-wide pool of keep-alive HTTP sessions for upstream requests
+"""
+import socket
+import threading
+import time
+import weakref
+import logging
+from typing import Dict, Any, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+
+logger = logging.getLogger(__name__)
+
+
+def get_origin(url: str) -> str:
+    """
+    Reduce a URL to its origin (scheme://host[:port]).
+
+    Args:
+        url: Full URL (e.g., "https://proxy.example.com/v1/chat/completions")
+
+    Returns:
+        Origin string used as the session pool key (e.g., "https://proxy.example.com")
+    """
+    parts = urlsplit(url)
+    scheme = (parts.scheme or "http").lower()
+    netloc = (parts.netloc or parts.path).lower()
+    return f"{scheme}://{netloc}"
+
+
+class UpstreamSessionPool:
+    """Keep-alive requests sessions shared by every upstream call, keyed by target origin"""
+
+    def __init__(self, pool_connections: int = 10, pool_maxsize: int = 32,
+                 keep_alive: bool = True, tcp_keepalive: bool = True,
+                 idle_timeout: float = 300.0):
+        """Initialize session pool with connection pool sizing and eviction settings
+
+        Args:
+            pool_connections: Number of per-host connection pools each session caches
+            pool_maxsize: Maximum number of pooled connections kept per host
+            keep_alive: Reuse connections between requests (sends Connection: close when False)
+            tcp_keepalive: Enable SO_KEEPALIVE on upstream sockets
+            idle_timeout: Seconds a session may go unused before it is closed and evicted
+        """
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.keep_alive = keep_alive
+        self.tcp_keepalive = tcp_keepalive
+        self.idle_timeout = idle_timeout
+
+        self._lock = threading.Lock()
+        self._sessions: Dict[str, requests.Session] = {}
+        self._last_used: Dict[str, float] = {}
+        # Requests in flight per origin; their sessions are never evicted
+        self._in_use: Dict[str, int] = {}
+        self._last_sweep = time.monotonic()
+        self._created = 0
+        self._evicted = 0
+
+    @classmethod
+    def from_config(cls, pool_config: Optional[Dict[str, Any]]) -> "UpstreamSessionPool":
+        """Build a session pool from the connection_pool configuration section"""
+        pool_config = pool_config or {}
+        return cls(
+            pool_connections=pool_config.get("pool_connections", 10),
+            pool_maxsize=pool_config.get("pool_maxsize", 32),
+            keep_alive=pool_config.get("keep_alive", True),
+            tcp_keepalive=pool_config.get("tcp_keepalive", True),
+            idle_timeout=pool_config.get("idle_timeout", 300.0),
+        )
+
+    def _create_session(self) -> requests.Session:
+        """Create a session with a sized connection pool and no transport-level retries"""
+        session = requests.Session()
+
+        adapter_kwargs = {
+            "pool_connections": self.pool_connections,
+            "pool_maxsize": self.pool_maxsize,
+            "max_retries": 0,  # Retries are owned by ErrorHandler
+        }
+        adapter = HTTPAdapter(**adapter_kwargs)
+        if self.tcp_keepalive:
+            socket_options = HTTPConnection.default_socket_options + [
+                (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            ]
+            adapter.init_poolmanager(
+                self.pool_connections, self.pool_maxsize, socket_options=socket_options
+            )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+
+        if not self.keep_alive:
+            session.headers["Connection"] = "close"
+
+        return session
+
+    def get_session(self, url: str) -> requests.Session:
+        """Return the shared session for the URL's origin, creating it on first use"""
+        with self._lock:
+            return self._get_session_locked(get_origin(url))
+
+    def _get_session_locked(self, origin: str) -> requests.Session:
+        """Return the origin's session, sweeping idle ones first (caller must hold the lock)"""
+        now = time.monotonic()
+        if self.idle_timeout and now - self._last_sweep >= self.idle_timeout / 2:
+            self._evict_idle_locked(now)
+
+        session = self._sessions.get(origin)
+        if session is None:
+            session = self._create_session()
+            self._sessions[origin] = session
+            self._created += 1
+            logger.info(f"Opened upstream session for {origin}")
+        self._last_used[origin] = now
+        return session
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Issue a request through the pooled session for the URL's origin
+
+        The session counts as in use, and is not evicted, until the response has
+        been received, or for streamed responses until they are closed.
+        """
+        origin = get_origin(url)
+        with self._lock:
+            session = self._get_session_locked(origin)
+            self._in_use[origin] = self._in_use.get(origin, 0) + 1
+        try:
+            response = session.request(method=method, url=url, **kwargs)
+        except BaseException:
+            self._release(origin)
+            raise
+        if not kwargs.get("stream"):
+            self._release(origin)
+            return response
+
+        # The body is relayed after this returns; release on close, or when an unclosed response is dropped
+        release = weakref.finalize(response, self._release, origin)
+        close = response.close
+
+        def close_and_release():
+            try:
+                close()
+            finally:
+                release()
+
+        response.close = close_and_release
+        return response
+
+    def _release(self, origin: str) -> None:
+        """End one in-flight request on the origin's session; its idle time starts now"""
+        with self._lock:
+            remaining = self._in_use.get(origin, 0) - 1
+            if remaining > 0:
+                self._in_use[origin] = remaining
+            else:
+                self._in_use.pop(origin, None)
+            if origin in self._sessions:
+                self._last_used[origin] = time.monotonic()
+
+    def _evict_idle_locked(self, now: float) -> int:
+        """Close sessions idle longer than idle_timeout (caller must hold the lock)"""
+        self._last_sweep = now
+        expired = [origin for origin, last_used in self._last_used.items()
+                   if now - last_used >= self.idle_timeout and origin not in self._in_use]
+        for origin in expired:
+            session = self._sessions.pop(origin, None)
+            self._last_used.pop(origin, None)
+            if session is not None:
+                try:
+                    session.close()
+                except Exception as e:
+                    logger.error(f"Failed to close idle session for {origin}: {e}")
+                self._evicted += 1
+                logger.info(f"Evicted idle upstream session for {origin}")
+        return len(expired)
+
+    def evict_idle(self) -> int:
+        """Close and drop sessions that have been idle longer than idle_timeout
+
+        Returns:
+            Number of sessions evicted
+        """
+        with self._lock:
+            return self._evict_idle_locked(time.monotonic())
+
+    def close_all(self) -> None:
+        """Close every pooled session"""
+        with self._lock:
+            for origin, session in self._sessions.items():
+                try:
+                    session.close()
+                except Exception as e:
+                    logger.error(f"Failed to close session for {origin}: {e}")
+            self._sessions.clear()
+            self._last_used.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return pool statistics for health reporting"""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "sessions_created": self._created,
+                "sessions_evicted": self._evicted,
+                "pool_maxsize": self.pool_maxsize,
+                "keep_alive": self.keep_alive,
+                "idle_timeout": self.idle_timeout,
+                "origins": {
+                    origin: {"idle_seconds": round(now - last_used, 3), "in_use": self._in_use.get(origin, 0)}
+                    for origin, last_used in self._last_used.items()
+                },
+            }
+
+
+# Process-wide pool shared by every ProxyClient
+_session_pool_lock = threading.Lock()
+_session_pool: Optional[UpstreamSessionPool] = None
+
+
+def get_session_pool() -> UpstreamSessionPool:
+    """Return the process-wide session pool, creating one with defaults if needed"""
+    global _session_pool
+    with _session_pool_lock:
+        if _session_pool is None:
+            _session_pool = UpstreamSessionPool()
+        return _session_pool
+
+
+def configure_session_pool(pool_config: Optional[Dict[str, Any]]) -> UpstreamSessionPool:
+    """Replace the process-wide session pool with one built from configuration"""
+    global _session_pool
+    new_pool = UpstreamSessionPool.from_config(pool_config)
+    with _session_pool_lock:
+        old_pool = _session_pool
+        _session_pool = new_pool
+    if old_pool is not None:
+        old_pool.close_all()
+    return new_pool
@@ -0,0 +1,254 @@
+"""
+Singleflight coalescing of identical in-flight requests
+
+SillyTavern sometimes re-sends an operation while the proxy is still working
+on the first copy (a queue retry after a client-side timeout, or duplicate
+lorebook_entry_lookup calls for the same entity). For the ST_METADATA
+operations listed in singleflight.operations (exact names or glob patterns),
+requests are keyed by a canonical hash of the forwarded body, the config and
+the client's Authorization header. While a request with a given key is in
+flight (including its retries), identical requests wait for it instead of
+calling upstream themselves, and all of them receive its result or error.
+
+Each waiter gets its own copy of the result. Streaming requests are never
+coalesced, since an event stream can only be relayed to one client. If the
+request that owns the upstream call is cancelled (client disconnect on the
+asyncio engine), its waiters start over, one of them taking over the call.
+Waiters do not hold admission slots: the endpoints take the slot of a
+coalesced request inside the shared call, so only its owner holds one.
+"""
+import copy
+import json
+import asyncio
+import fnmatch
+import hashlib
+import threading
+import logging
+from typing import Dict, Any, Awaitable, Callable, List, Optional
+
+from .metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+# Operations whose allowlist lookups are remembered before the cache is reset
+MAX_CACHED_OPERATIONS = 1024
+
+
+class _Call:
+    """One in-flight upstream call and the requests waiting for it"""
+
+    def __init__(self, done):
+        self.done = done
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.completed = False
+        self.waiting = 0
+
+
+class Singleflight:
+    """Shares one upstream call among identical concurrent requests of allowlisted operations"""
+
+    def __init__(self, operations: Optional[List[str]] = None):
+        """
+        Initialize singleflight.
+
+        Args:
+            operations: ST_METADATA operation names or glob patterns whose requests may be coalesced
+        """
+        self.operations = list(operations or [])
+        self._operation_matches: Dict[str, bool] = {}
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self._async_calls: Dict[str, _Call] = {}
+        self.leaders = 0
+        self.coalesced: Dict[str, int] = {}
+
+    @classmethod
+    def from_config(cls, singleflight_config: Optional[Dict[str, Any]]) -> "Singleflight":
+        """Build a singleflight from the singleflight configuration section"""
+        singleflight_config = singleflight_config or {}
+        return cls(operations=singleflight_config.get("operations") or [])
+
+    def applies_to(self, operation: Optional[str]) -> bool:
+        """Whether requests of an ST_METADATA operation may be coalesced"""
+        if not operation:
+            return False
+        try:
+            return self._operation_matches[operation]
+        except KeyError:
+            pass
+        matches = any(operation == pattern or fnmatch.fnmatchcase(operation, pattern) for pattern in self.operations)
+        if len(self._operation_matches) >= MAX_CACHED_OPERATIONS:
+            self._operation_matches.clear()
+        self._operation_matches[operation] = matches
+        return matches
+
+    def key_for(self, operation: Optional[str], request_data: Dict[str, Any],
+                headers: Optional[Dict[str, str]], scope: str) -> Optional[str]:
+        """
+        Coalescing key of a request.
+
+        Args:
+            operation: ST_METADATA operation of the request
+            request_data: Body forwarded upstream
+            headers: Client headers (only Authorization is part of the key)
+            scope: Identifies the config, e.g. its execution plan's fingerprint
+
+        Returns:
+            Hex digest shared by identical requests, or None if the request is not coalesced
+        """
+        if request_data.get("stream") or not self.applies_to(operation):
+            return None
+        authorization = next((value for name, value in (headers or {}).items()
+                              if name.lower() == "authorization"), None)
+        canonical = json.dumps([scope, authorization, request_data], sort_keys=True,
+                               separators=(",", ":"), ensure_ascii=False, default=repr)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def _finish(self, calls: Dict[str, _Call], key: str, call: _Call, result: Any = None,
+                error: Optional[BaseException] = None, completed: bool = True) -> None:
+        """Publish the owner's outcome and let the waiters go"""
+        with self._lock:
+            calls.pop(key, None)
+        # No one can join once the call is unlisted; waiters copy from a snapshot the owner cannot modify
+        call.result = copy.deepcopy(result) if completed and error is None and call.waiting else None
+        call.error = error
+        call.completed = completed
+        call.done.set()
+
+    @staticmethod
+    def _outcome(call: _Call) -> Any:
+        """A waiter's own copy of the shared result, or the shared error"""
+        if call.error is not None:
+            raise call.error
+        return copy.deepcopy(call.result)
+
+    def do(self, key: str, operation: Optional[str], func: Callable[[], Any]) -> Any:
+        """
+        Run func once for all identical concurrent requests.
+
+        Args:
+            key: Value of key_for()
+            operation: ST_METADATA operation, for the coalesced request counts
+            func: Performs the upstream call (with its retries)
+
+        Returns:
+            func's result (a private copy for requests that waited)
+
+        Raises:
+            Exception: Whatever func raised, in every request that shared the call
+        """
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                if call is None:
+                    call = self._calls[key] = _Call(threading.Event())
+                    self.leaders += 1
+                    owner = True
+                else:
+                    call.waiting += 1
+                    owner = False
+            if owner:
+                return self._run(key, call, func)
+            try:
+                call.done.wait()
+            finally:
+                self._leave(call)
+            if call.completed:
+                self._count(operation)
+                return self._outcome(call)
+
+    async def do_async(self, key: str, operation: Optional[str], func: Callable[[], Awaitable[Any]]) -> Any:
+        """Coroutine variant of do()"""
+        while True:
+            with self._lock:
+                call = self._async_calls.get(key)
+                if call is None:
+                    call = self._async_calls[key] = _Call(asyncio.Event())
+                    self.leaders += 1
+                    owner = True
+                else:
+                    call.waiting += 1
+                    owner = False
+            if owner:
+                return await self._run_async(key, call, func)
+            try:
+                await call.done.wait()
+            finally:
+                # Also when this waiter is cancelled, so the owner does not copy its result for nobody
+                self._leave(call)
+            if call.completed:
+                self._count(operation)
+                return self._outcome(call)
+
+    def _run(self, key: str, call: _Call, func: Callable[[], Any]) -> Any:
+        """Make the owner's call and publish its outcome"""
+        try:
+            result = func()
+        except Exception as e:
+            self._finish(self._calls, key, call, error=e)
+            raise
+        except BaseException:
+            self._finish(self._calls, key, call, completed=False)
+            raise
+        self._finish(self._calls, key, call, result)
+        return result
+
+    async def _run_async(self, key: str, call: _Call, func: Callable[[], Awaitable[Any]]) -> Any:
+        """Coroutine variant of _run()"""
+        try:
+            result = await func()
+        except Exception as e:
+            self._finish(self._async_calls, key, call, error=e)
+            raise
+        except BaseException:
+            # Cancelled: the waiters start over
+            self._finish(self._async_calls, key, call, completed=False)
+            raise
+        self._finish(self._async_calls, key, call, result)
+        return result
+
+    def _leave(self, call: _Call) -> None:
+        """Stop counting a request as waiting for call"""
+        with self._lock:
+            call.waiting -= 1
+
+    def _count(self, operation: Optional[str]) -> None:
+        """Count a request that was served by an identical one's call"""
+        operation = operation or "unknown"
+        with self._lock:
+            self.coalesced[operation] = self.coalesced.get(operation, 0) + 1
+        get_metrics().record_coalesced(operation)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return in-flight calls, waiting requests and coalesced counts by operation"""
+        with self._lock:
+            calls = list(self._calls.values()) + list(self._async_calls.values())
+            return {
+                "enabled": True,
+                "operations": self.operations,
+                "in_flight": len(calls),
+                "waiting": sum(call.waiting for call in calls),
+                "leaders": self.leaders,
+                "coalesced": dict(self.coalesced),
+            }
+
+
+# Process-wide singleflight shared by both serving engines (None when disabled)
+_singleflight_lock = threading.Lock()
+_singleflight: Optional[Singleflight] = None
+
+
+def get_singleflight() -> Optional[Singleflight]:
+    """Return the process-wide singleflight, or None if coalescing is disabled"""
+    return _singleflight
+
+
+def configure_singleflight(singleflight_config: Optional[Dict[str, Any]]) -> Optional[Singleflight]:
+    """Replace the process-wide singleflight (None when singleflight.enabled is false)"""
+    global _singleflight
+    singleflight_config = singleflight_config or {}
+    new_singleflight = Singleflight.from_config(singleflight_config) if singleflight_config.get("enabled") else None
+    with _singleflight_lock:
+        _singleflight = new_singleflight
+    return new_singleflight
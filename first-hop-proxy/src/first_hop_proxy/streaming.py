@@ -0,0 +1,262 @@
+"""
+Server-sent events passthrough for streaming chat completions
+"""
+import json
+import time
+import codecs
+import asyncio
+import logging
+from typing import Dict, Any, Optional, Callable, Iterator, AsyncIterator, List
+
+logger = logging.getLogger(__name__)
+
+# Response headers that keep intermediaries from buffering the event stream
+SSE_RESPONSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",
+}
+
+
+class StreamAssembler:
+    """Rebuild a chat.completion body from SSE chunks as they pass through"""
+
+    def __init__(self):
+        """Initialize empty assembly state"""
+        self._buffer = ""
+        # Keeps multi-byte characters split across chunks until their last byte arrives
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._choices: Dict[int, Dict[str, Any]] = {}
+        self.response_id: Optional[str] = None
+        self.model: Optional[str] = None
+        self.created: Optional[int] = None
+        self.usage: Optional[Dict[str, Any]] = None
+        self.event_count = 0
+        self.errors: List[Any] = []
+        self.done = False
+
+    def feed(self, chunk: bytes) -> None:
+        """Consume raw bytes from the upstream stream"""
+        self._buffer += self._decoder.decode(chunk)
+        while "\n" in self._buffer:
+            line, self._buffer = self._buffer.split("\n", 1)
+            self._handle_line(line.rstrip("\r"))
+
+    def _handle_line(self, line: str) -> None:
+        """Process a single SSE line (only data: fields carry completion payloads)"""
+        if not line.startswith("data:"):
+            return
+
+        payload = line[5:].strip()
+        if not payload:
+            return
+        if payload == "[DONE]":
+            self.done = True
+            return
+
+        try:
+            event = json.loads(payload)
+        except json.JSONDecodeError:
+            logger.debug(f"Skipping non-JSON SSE payload: {payload[:200]}")
+            return
+
+        if not isinstance(event, dict):
+            return
+
+        self.event_count += 1
+
+        if "error" in event:
+            self.errors.append(event["error"])
+
+        self.response_id = self.response_id or event.get("id")
+        self.model = self.model or event.get("model")
+        self.created = self.created or event.get("created")
+        if isinstance(event.get("usage"), dict):
+            self.usage = event["usage"]
+
+        for choice in event.get("choices") or []:
+            if not isinstance(choice, dict):
+                continue
+            index = choice.get("index", 0)
+            assembled = self._choices.setdefault(index, {"role": None, "content": [], "finish_reason": None})
+            delta = choice.get("delta") or {}
+            if delta.get("role"):
+                assembled["role"] = delta["role"]
+            if isinstance(delta.get("content"), str):
+                assembled["content"].append(delta["content"])
+            if choice.get("finish_reason"):
+                assembled["finish_reason"] = choice["finish_reason"]
+
+    def build_response(self) -> Dict[str, Any]:
+        """Return the assembled response in non-streaming chat.completion form"""
+        self._buffer += self._decoder.decode(b"", final=True)
+        if self._buffer:
+            self._handle_line(self._buffer.rstrip("\r"))
+            self._buffer = ""
+
+        response = {
+            "id": self.response_id,
+            "object": "chat.completion",
+            "created": self.created,
+            "model": self.model,
+            "choices": [
+                {
+                    "index": index,
+                    "message": {
+                        "role": choice["role"] or "assistant",
+                        "content": "".join(choice["content"]),
+                    },
+                    "finish_reason": choice["finish_reason"],
+                }
+                for index, choice in sorted(self._choices.items())
+            ],
+        }
+        if self.usage:
+            response["usage"] = self.usage
+        if self.errors:
+            response["error"] = self.errors[-1]
+        return response
+
+
+class SSEStreamRelay:
+    """Relay upstream SSE bytes to the client as they arrive and assemble a log copy"""
+
+    def __init__(self, upstream_response, request_id: str,
+                 on_complete: Optional[Callable[[Optional[Dict[str, Any]], Optional[Exception], Dict[str, Any]], None]] = None,
+                 start_time: Optional[float] = None):
+        """Initialize relay for an unconsumed requests.Response opened with stream=True
+
+        Args:
+            upstream_response: Upstream response whose body has not been read yet
+            request_id: Request identifier for console/log output
+            on_complete: Called once with (assembled_response, error, stream_stats) when the stream ends
+            start_time: Request start timestamp used for time-to-first-token
+        """
+        self.upstream_response = upstream_response
+        self.request_id = request_id
+        self.on_complete = on_complete
+        self.start_time = start_time if start_time is not None else time.time()
+        self.assembler = StreamAssembler()
+        self.first_chunk_time: Optional[float] = None
+        self.bytes_relayed = 0
+        self._completed = False
+
+    @property
+    def content_type(self) -> str:
+        """Content type reported by upstream (defaults to text/event-stream)"""
+        headers = getattr(self.upstream_response, "headers", None) or {}
+        return headers.get("Content-Type", "text/event-stream")
+
+    def __iter__(self) -> Iterator[bytes]:
+        """Yield upstream chunks unchanged while feeding the assembler"""
+        error = None
+        try:
+            for chunk in self.upstream_response.iter_content(chunk_size=None):
+                if not chunk:
+                    continue
+                if self.first_chunk_time is None:
+                    self.first_chunk_time = time.time()
+                    logger.info(f"[{self.request_id}] First stream chunk after "
+                                f"{self.first_chunk_time - self.start_time:.3f}s")
+                self.bytes_relayed += len(chunk)
+                try:
+                    self.assembler.feed(chunk)
+                except Exception as assemble_error:
+                    logger.error(f"Failed to assemble stream chunk for logging: {assemble_error}")
+                yield chunk
+        except GeneratorExit:
+            error = ConnectionAbortedError("Client disconnected before stream completed")
+            raise
+        except Exception as e:
+            error = e
+            logger.error(f"[{self.request_id}] Upstream stream failed: {e}")
+            raise
+        finally:
+            self._finish(error)
+
+    def _finish(self, error: Optional[Exception]) -> None:
+        """Close upstream and report the assembled response exactly once"""
+        if self._completed:
+            return
+        self._completed = True
+
+        try:
+            self.upstream_response.close()
+        except Exception as close_error:
+            logger.debug(f"Failed to close upstream stream: {close_error}")
+
+        self._report(error)
+
+    def _report(self, error: Optional[Exception]) -> None:
+        """Print the stream summary and hand the assembled response to on_complete"""
+        end_time = time.time()
+        stats = {
+            "events": self.assembler.event_count,
+            "bytes": self.bytes_relayed,
+            "done": self.assembler.done,
+            "time_to_first_chunk": (self.first_chunk_time - self.start_time) if self.first_chunk_time else None,
+            "end_time": end_time,
+        }
+
+        print("=" * 80, flush=True)
+        print(f"OUTGOING RESPONSE [{self.request_id}] - Stream {'ERROR' if error else 'Complete'}", flush=True)
+        print(f"Events: {stats['events']}, Bytes: {stats['bytes']}", flush=True)
+        print(f"Duration: {end_time - self.start_time:.3f}s", flush=True)
+        print("=" * 80, flush=True)
+
+        if self.on_complete:
+            try:
+                self.on_complete(self.assembler.build_response(), error, stats)
+            except Exception as callback_error:
+                logger.error(f"Error in stream completion callback: {callback_error}")
+
+    def close(self) -> None:
+        """Close the relay without streaming (e.g., when the response is never sent)"""
+        self._finish(ConnectionAbortedError("Stream closed before relay"))
+
+
+class AsyncSSEStreamRelay(SSEStreamRelay):
+    """SSEStreamRelay for httpx responses served by the asyncio engine"""
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        """Yield upstream chunks unchanged while feeding the assembler"""
+        error = None
+        try:
+            async for chunk in self.upstream_response.aiter_bytes():
+                if not chunk:
+                    continue
+                if self.first_chunk_time is None:
+                    self.first_chunk_time = time.time()
+                    logger.info(f"[{self.request_id}] First stream chunk after "
+                                f"{self.first_chunk_time - self.start_time:.3f}s")
+                self.bytes_relayed += len(chunk)
+                try:
+                    self.assembler.feed(chunk)
+                except Exception as assemble_error:
+                    logger.error(f"Failed to assemble stream chunk for logging: {assemble_error}")
+                yield chunk
+        except GeneratorExit:
+            error = ConnectionAbortedError("Client disconnected before stream completed")
+            raise
+        except Exception as e:
+            error = e
+            logger.error(f"[{self.request_id}] Upstream stream failed: {e}")
+            raise
+        finally:
+            await self._afinish(error)
+
+    async def _afinish(self, error: Optional[Exception]) -> None:
+        """Close upstream and report once; log writes run off the event loop"""
+        if self._completed:
+            return
+        self._completed = True
+
+        try:
+            await self.upstream_response.aclose()
+        except Exception as close_error:
+            logger.debug(f"Failed to close upstream stream: {close_error}")
+
+        await asyncio.get_running_loop().run_in_executor(None, self._report, error)
+
+    async def aclose(self) -> None:
+        """Close the relay without streaming (e.g., when the response is never sent)"""
+        await self._afinish(ConnectionAbortedError("Stream closed before relay"))
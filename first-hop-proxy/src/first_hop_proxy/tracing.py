@@ -0,0 +1,340 @@
+"""
+Stage-level tracing for proxied requests
+
+A trace is started by the outermost span of a request (chat_completions) and
+collects a span for each stage below it: JSON parsing, preprocessing, log
+writes, each retry attempt and backoff sleep, the upstream wait, response
+parsing and response processing. The current span is kept in a context
+variable, so nesting follows the call stack in request threads and asyncio
+tasks alike.
+
+When the outermost span ends the trace is appended to a JSONL file, either
+as one compact object per request or as OTLP/JSON (one
+ExportTraceServiceRequest per line, as read by the OpenTelemetry
+collector's file receiver). A per-stage summary is attached to the request
+log. With tracing disabled (the default) span() returns a shared no-op.
+"""
+import os
+import json
+import time
+import random
+import threading
+import contextvars
+import logging
+from typing import Dict, Any, List, Optional
+
+from .log_writer import LogEvent, get_log_writer
+
+logger = logging.getLogger(__name__)
+
+TRACE_FORMATS = ("jsonl", "otlp")
+DEFAULT_TRACE_PATH = os.path.join("logs", "traces.jsonl")
+
+# OTLP span kind and status codes
+_OTLP_SPAN_KIND_INTERNAL = 1
+_OTLP_STATUS_ERROR = 2
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("first_hop_proxy_span", default=None)
+
+
+class _NoopSpan:
+    """Span returned when tracing is disabled or the trace was not sampled"""
+
+    __slots__ = ()
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        return False
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class _UnsampledRoot(_NoopSpan):
+    """Outermost span of a trace left out by sampling; marks its children as no-ops"""
+
+    __slots__ = ("_token",)
+
+    def __enter__(self) -> "_UnsampledRoot":
+        self._token = _current_span.set(NOOP_SPAN)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        _current_span.reset(self._token)
+        return False
+
+
+class _Trace:
+    """Spans of one request, exported together when the outermost span ends"""
+
+    __slots__ = ("tracer", "trace_id", "finished", "_lock")
+
+    def __init__(self, tracer: "Tracer"):
+        self.tracer = tracer
+        self.trace_id = f"{random.getrandbits(128):032x}"
+        self.finished: List["Span"] = []
+        self._lock = threading.Lock()
+
+    def add(self, span: "Span") -> None:
+        with self._lock:
+            self.finished.append(span)
+
+
+class Span:
+    """One timed stage of a request"""
+
+    __slots__ = ("trace", "name", "span_id", "parent", "attributes", "start_ns", "end_ns", "error", "_token")
+
+    def __init__(self, trace: _Trace, name: str, parent: Optional["Span"], attributes: Dict[str, Any]):
+        self.trace = trace
+        self.name = name
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent = parent
+        self.attributes = attributes
+        self.start_ns = 0
+        self.end_ns = 0
+        self.error: Optional[str] = None
+        self._token = None
+
+    def __enter__(self) -> "Span":
+        self.start_ns = time.time_ns()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        self.end_ns = time.time_ns()
+        if exc is not None:
+            self.error = f"{exc_type.__name__}: {exc}"
+        _current_span.reset(self._token)
+        self.trace.add(self)
+        if self.parent is None:
+            self.trace.tracer.export(self.trace)
+        return False
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        """Attach a value to the span (strings, numbers and booleans)"""
+        self.attributes[key] = value
+
+    @property
+    def duration_ms(self) -> float:
+        return (self.end_ns - self.start_ns) / 1e6
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    """Encode an attribute value as an OTLP AnyValue"""
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items() if value is not None]
+
+
+def _render_trace(existing: Optional[str], **trace: Any) -> str:
+    """Serialize one exported trace as a JSON line (appended by the log writer)"""
+    return json.dumps(trace, ensure_ascii=False, default=str) + "\n"
+
+
+class Tracer:
+    """Creates spans and exports finished traces to a JSONL file"""
+
+    def __init__(self, enabled: bool = False, path: str = DEFAULT_TRACE_PATH, format: str = "jsonl",
+                 sample_rate: float = 1.0, service_name: str = "first-hop-proxy"):
+        """
+        Initialize tracer.
+
+        Args:
+            enabled: Record spans (when False span() returns a no-op)
+            path: JSONL file traces are appended to
+            format: "jsonl" (one compact object per trace) or "otlp" (OTLP/JSON)
+            sample_rate: Fraction of requests traced (0.0-1.0)
+            service_name: service.name resource attribute in OTLP output
+        """
+        if format not in TRACE_FORMATS:
+            raise ValueError(f"tracing.format must be one of {TRACE_FORMATS}, got {format!r}")
+        self.enabled = enabled
+        self.path = path
+        self.format = format
+        self.sample_rate = sample_rate
+        self.service_name = service_name
+
+        self._lock = threading.Lock()
+        self._exported = 0
+        self._export_errors = 0
+        if enabled:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    @classmethod
+    def from_config(cls, tracing_config: Optional[Dict[str, Any]]) -> "Tracer":
+        """Build a tracer from the tracing configuration section"""
+        tracing_config = tracing_config or {}
+        return cls(
+            enabled=tracing_config.get("enabled", False),
+            path=tracing_config.get("path", DEFAULT_TRACE_PATH),
+            format=tracing_config.get("format", "jsonl"),
+            sample_rate=tracing_config.get("sample_rate", 1.0),
+            service_name=tracing_config.get("service_name", "first-hop-proxy"),
+        )
+
+    def span(self, name: str, **attributes: Any):
+        """
+        Return a context manager timing one stage.
+
+        The first span of a request starts a new trace; spans opened while it
+        is active become its children.
+
+        Args:
+            name: Stage name (e.g. "preprocess", "upstream_request")
+            **attributes: Values recorded with the span
+
+        Returns:
+            Span, or a no-op with the same interface when not tracing
+        """
+        if not self.enabled:
+            return NOOP_SPAN
+        parent = _current_span.get()
+        if parent is NOOP_SPAN:
+            return NOOP_SPAN
+        if parent is None:
+            if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+                return _UnsampledRoot()
+            return Span(_Trace(self), name, None, attributes)
+        return Span(parent.trace, name, parent, attributes)
+
+    def summary(self) -> Optional[Dict[str, Dict[str, float]]]:
+        """
+        Summarize the finished stages of the current request's trace.
+
+        Returns:
+            {stage: {"count": n, "total_ms": ms}} in the order stages first
+            finished, or None when the current request is not traced
+        """
+        current = _current_span.get()
+        if not isinstance(current, Span):
+            return None
+        with current.trace._lock:
+            finished = list(current.trace.finished)
+        summary: Dict[str, Dict[str, float]] = {}
+        for span in finished:
+            stage = summary.setdefault(span.name, {"count": 0, "total_ms": 0.0})
+            stage["count"] += 1
+            stage["total_ms"] = round(stage["total_ms"] + span.duration_ms, 3)
+        return summary
+
+    def _as_jsonl(self, trace: _Trace, root: Span) -> Dict[str, Any]:
+        """Compact trace: root timing plus each span's offset and duration in milliseconds"""
+        return {
+            "trace_id": trace.trace_id,
+            "name": root.name,
+            "start_time": root.start_ns / 1e9,
+            "duration_ms": round(root.duration_ms, 3),
+            "attributes": root.attributes,
+            "error": root.error,
+            "spans": [
+                {
+                    "span_id": span.span_id,
+                    "parent_id": span.parent.span_id if span.parent else None,
+                    "name": span.name,
+                    "offset_ms": round((span.start_ns - root.start_ns) / 1e6, 3),
+                    "duration_ms": round(span.duration_ms, 3),
+                    "attributes": span.attributes,
+                    "error": span.error,
+                }
+                for span in sorted(trace.finished, key=lambda span: span.start_ns)
+            ],
+        }
+
+    def _as_otlp(self, trace: _Trace) -> Dict[str, Any]:
+        """Trace as an OTLP/JSON ExportTraceServiceRequest"""
+        spans = []
+        for span in trace.finished:
+            otlp_span = {
+                "traceId": trace.trace_id,
+                "spanId": span.span_id,
+                "parentSpanId": span.parent.span_id if span.parent else "",
+                "name": span.name,
+                "kind": _OTLP_SPAN_KIND_INTERNAL,
+                "startTimeUnixNano": str(span.start_ns),
+                "endTimeUnixNano": str(span.end_ns),
+                "attributes": _otlp_attributes(span.attributes),
+            }
+            if span.error:
+                otlp_span["status"] = {"code": _OTLP_STATUS_ERROR, "message": span.error}
+            spans.append(otlp_span)
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": _otlp_attributes({"service.name": self.service_name})},
+                "scopeSpans": [{"scope": {"name": "first_hop_proxy"}, "spans": spans}],
+            }]
+        }
+
+    def export(self, trace: _Trace) -> None:
+        """Append a finished trace to the trace file (through the log writer when there is one)"""
+        root = trace.finished[-1]
+        record = self._as_otlp(trace) if self.format == "otlp" else self._as_jsonl(trace, root)
+
+        writer = get_log_writer()
+        if writer is not None:
+            if writer.submit(LogEvent(self.path, _render_trace, record, append=True, context="trace_export_error")):
+                with self._lock:
+                    self._exported += 1
+            return
+
+        try:
+            line = _render_trace(None, **record)
+            with self._lock:
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(line)
+                self._exported += 1
+        except Exception as e:
+            with self._lock:
+                self._export_errors += 1
+            logger.error(f"Failed to write trace to {self.path}: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return tracer counters for health reporting"""
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "path": self.path,
+                "format": self.format,
+                "sample_rate": self.sample_rate,
+                "exported": self._exported,
+                "export_errors": self._export_errors,
+            }
+
+
+# Process-wide tracer shared by both serving engines
+_tracer_lock = threading.Lock()
+_tracer: Optional[Tracer] = None
+
+
+def get_tracer() -> Tracer:
+    """Return the process-wide tracer, creating a disabled one if needed"""
+    global _tracer
+    tracer = _tracer
+    if tracer is not None:
+        return tracer
+    with _tracer_lock:
+        if _tracer is None:
+            _tracer = Tracer()
+        return _tracer
+
+
+def configure_tracer(tracing_config: Optional[Dict[str, Any]]) -> Tracer:
+    """Replace the process-wide tracer with one built from configuration"""
+    global _tracer
+    new_tracer = Tracer.from_config(tracing_config)
+    with _tracer_lock:
+        _tracer = new_tracer
+    return new_tracer
@@ -0,0 +1,329 @@
+"""
+Pool of interchangeable upstreams with health-weighted balancing and failover
+
+A config's upstream_pool section lists several upstreams, each with a url,
+an optional apikey, a weight and a priority tier. Each chat completion
+attempt is sent to one of them:
+
+- Only upstreams of the lowest priority tier that still has a healthy member
+  are considered, so higher tiers act as fallbacks.
+- Within the tier the strategy decides: least_outstanding (fewest in-flight
+  attempts per unit of weight), ewma_latency (lowest moving-average latency
+  scaled by in-flight attempts and weight) or weighted_round_robin (smooth
+  weighted round robin).
+
+Health is scored passively from real traffic. Errors that
+ErrorHandler.should_retry_exception treats as retryable (timeouts,
+connection errors, retry_codes statuses such as 429/502/503) lower an
+upstream's score; successes raise it. An upstream whose score falls below
+unhealthy_score is ejected for ejection_time seconds. Other errors (e.g.
+400s) say nothing about the upstream and are ignored.
+
+Each request keeps an UpstreamSelection. After a retryable failure it
+excludes the upstream that failed, and ErrorHandler retries immediately
+against the next healthy upstream instead of backing off against the same
+one. Backoff resumes only once every healthy upstream has failed for this
+request.
+"""
+import time
+import threading
+import logging
+from typing import Dict, Any, Awaitable, Callable, List, Optional, Set
+
+from .circuit_breaker import CircuitOpenError
+
+logger = logging.getLogger(__name__)
+
+STRATEGY_LEAST_OUTSTANDING = "least_outstanding"
+STRATEGY_EWMA_LATENCY = "ewma_latency"
+STRATEGY_WEIGHTED_ROUND_ROBIN = "weighted_round_robin"
+STRATEGIES = (STRATEGY_LEAST_OUTSTANDING, STRATEGY_EWMA_LATENCY, STRATEGY_WEIGHTED_ROUND_ROBIN)
+
+# Weight of each attempt in an upstream's moving-average latency
+LATENCY_SMOOTHING = 0.3
+
+
+class Upstream:
+    """One upstream of a pool and its passive health state"""
+
+    def __init__(self, url: str, apikey: Optional[str] = None, weight: float = 1.0, priority: int = 0,
+                 name: Optional[str] = None):
+        """
+        Initialize upstream.
+
+        Args:
+            url: Chat completions URL, as in target_proxy.url
+            apikey: API key sent to this upstream (None keeps target_proxy.apikey or the client's key)
+            weight: Relative share of traffic within its priority tier
+            priority: Tier; lower tiers are used while they have a healthy upstream
+            name: Label for logs and stats (defaults to the url)
+        """
+        if weight <= 0:
+            raise ValueError(f"Upstream {url!r} needs a positive weight, got {weight!r}")
+        self.url = url
+        self.apikey = apikey
+        self.weight = float(weight)
+        self.priority = priority
+        self.name = name or url
+        self.in_flight = 0
+        self.latency: Optional[float] = None
+        self.score = 1.0
+        self.ejected_until = 0.0
+        self.current_weight = 0.0
+        self.last_pick = 0
+        self.requests = 0
+        self.failures = 0
+        self.ejections = 0
+
+
+class UpstreamPool:
+    """Upstreams of one config with their balancing strategy and health scores"""
+
+    def __init__(self, upstreams: List[Upstream], strategy: str = STRATEGY_LEAST_OUTSTANDING,
+                 health_smoothing: float = 0.3, unhealthy_score: float = 0.5, ejection_time: float = 30.0):
+        """
+        Initialize pool.
+
+        Args:
+            upstreams: Upstreams to balance over (at least one)
+            strategy: One of STRATEGIES
+            health_smoothing: Weight of each outcome in an upstream's health score
+            unhealthy_score: Score below which an upstream is ejected
+            ejection_time: Seconds an ejected upstream is skipped
+        """
+        if not upstreams:
+            raise ValueError("upstream_pool needs at least one upstream")
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown upstream_pool strategy {strategy!r}; expected one of {', '.join(STRATEGIES)}")
+        self.upstreams = upstreams
+        self.strategy = strategy
+        self.health_smoothing = health_smoothing
+        self.unhealthy_score = unhealthy_score
+        self.ejection_time = ejection_time
+        self._lock = threading.Lock()
+        self._picks = 0
+
+    @classmethod
+    def from_config(cls, pool_config: Optional[Dict[str, Any]]) -> Optional["UpstreamPool"]:
+        """Build a pool from the upstream_pool configuration section (None when disabled or empty)"""
+        pool_config = pool_config or {}
+        if not pool_config.get("enabled") or not pool_config.get("upstreams"):
+            return None
+        upstreams = [
+            Upstream(entry["url"], apikey=entry.get("apikey"), weight=entry.get("weight", 1.0),
+                     priority=entry.get("priority", 0), name=entry.get("name"))
+            for entry in pool_config["upstreams"]
+        ]
+        return cls(
+            upstreams,
+            strategy=pool_config.get("strategy", STRATEGY_LEAST_OUTSTANDING),
+            health_smoothing=pool_config.get("health_smoothing", 0.3),
+            unhealthy_score=pool_config.get("unhealthy_score", 0.5),
+            ejection_time=pool_config.get("ejection_time", 30.0),
+        )
+
+    def _healthy(self, exclude: Set[Upstream], now: float) -> List[Upstream]:
+        """Upstreams neither ejected nor excluded (lock held)"""
+        return [upstream for upstream in self.upstreams
+                if upstream not in exclude and upstream.ejected_until <= now]
+
+    def has_healthy(self, exclude: Set[Upstream]) -> bool:
+        """Whether a healthy upstream outside exclude is left"""
+        with self._lock:
+            return bool(self._healthy(exclude, time.monotonic()))
+
+    def acquire(self, exclude: Set[Upstream]) -> Upstream:
+        """
+        Pick the upstream for the next attempt and count it in flight.
+
+        Args:
+            exclude: Upstreams that already failed for this request
+
+        Returns:
+            The healthy upstream the strategy prefers; if none is healthy, the one
+            whose ejection ends first
+        """
+        with self._lock:
+            now = time.monotonic()
+            candidates = self._healthy(exclude, now)
+            if candidates:
+                tier = min(upstream.priority for upstream in candidates)
+                upstream = self._pick([upstream for upstream in candidates if upstream.priority == tier])
+            else:
+                remaining = [upstream for upstream in self.upstreams if upstream not in exclude] or self.upstreams
+                upstream = min(remaining, key=lambda candidate: candidate.ejected_until)
+            self._picks += 1
+            upstream.last_pick = self._picks
+            upstream.in_flight += 1
+            upstream.requests += 1
+            return upstream
+
+    def _pick(self, tier: List[Upstream]) -> Upstream:
+        """Choose within one priority tier by strategy (lock held)"""
+        if self.strategy == STRATEGY_WEIGHTED_ROUND_ROBIN:
+            total = sum(upstream.weight for upstream in tier)
+            for upstream in tier:
+                upstream.current_weight += upstream.weight
+            chosen = max(tier, key=lambda upstream: upstream.current_weight)
+            chosen.current_weight -= total
+            return chosen
+        if self.strategy == STRATEGY_EWMA_LATENCY:
+            # Untried upstreams (no latency yet) go first; ties rotate by least recent pick
+            return min(tier, key=lambda upstream: ((upstream.latency or 0.0) * (upstream.in_flight + 1)
+                                                   / upstream.weight, upstream.last_pick))
+        return min(tier, key=lambda upstream: (upstream.in_flight / upstream.weight, upstream.last_pick))
+
+    def release(self, upstream: Upstream, failed: Optional[bool], latency: Optional[float] = None) -> None:
+        """
+        Record the end of an attempt.
+
+        Args:
+            upstream: Value acquire() returned
+            failed: True for a retryable failure, False for a success, None for no verdict
+            latency: Seconds the attempt took (successes only)
+        """
+        with self._lock:
+            upstream.in_flight -= 1
+            if failed is None:
+                return
+            if failed:
+                upstream.failures += 1
+                upstream.score -= self.health_smoothing * upstream.score
+                if upstream.score < self.unhealthy_score:
+                    now = time.monotonic()
+                    if upstream.ejected_until <= now:
+                        upstream.ejections += 1
+                        logger.warning(f"Ejecting upstream {upstream.name} for {self.ejection_time:.0f}s "
+                                       f"(health {upstream.score:.2f})")
+                    upstream.ejected_until = now + self.ejection_time
+            else:
+                upstream.score += self.health_smoothing * (1.0 - upstream.score)
+                if latency is not None:
+                    upstream.latency = (latency if upstream.latency is None
+                                        else upstream.latency + LATENCY_SMOOTHING * (latency - upstream.latency))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Return every upstream's health, latency and traffic"""
+        with self._lock:
+            now = time.monotonic()
+            return {
+                "enabled": True,
+                "strategy": self.strategy,
+                "upstreams": {
+                    upstream.name: {
+                        "priority": upstream.priority,
+                        "weight": upstream.weight,
+                        "healthy": upstream.ejected_until <= now,
+                        "health": round(upstream.score, 3),
+                        "in_flight": upstream.in_flight,
+                        "latency": round(upstream.latency, 3) if upstream.latency is not None else None,
+                        "requests": upstream.requests,
+                        "failures": upstream.failures,
+                        "ejections": upstream.ejections,
+                    }
+                    for upstream in self.upstreams
+                },
+            }
+
+
+class UpstreamSelection:
+    """Upstream choices of one request; upstreams that failed it are skipped by its retries"""
+
+    def __init__(self, pool: UpstreamPool, is_failure: Callable[[Exception], bool]):
+        """
+        Initialize selection.
+
+        Args:
+            pool: Pool of the request's config
+            is_failure: Whether an error counts against the upstream (ErrorHandler.should_retry_exception)
+        """
+        self.pool = pool
+        self.is_failure = is_failure
+        self.failed: Set[Upstream] = set()
+        # Hedged attempts of the request run on other threads
+        self._lock = threading.Lock()
+
+    def _failed(self) -> Set[Upstream]:
+        """Snapshot of the upstreams that failed this request"""
+        with self._lock:
+            return set(self.failed)
+
+    def failover_available(self) -> bool:
+        """Whether a healthy upstream that has not failed this request is left"""
+        return self.pool.has_healthy(self._failed())
+
+    def _exclude(self, upstream: Upstream) -> None:
+        with self._lock:
+            self.failed.add(upstream)
+            if len(self.failed) >= len(self.pool.upstreams):
+                # Every upstream failed: later retries start over (after backoff)
+                self.failed.clear()
+
+    def _verdict(self, error: Exception) -> Optional[bool]:
+        """Outcome of a failed attempt for health scoring (True counts against the upstream)"""
+        return True if self.is_failure(error) else None
+
+    def call(self, send: Callable[[Upstream], Any]) -> Any:
+        """
+        Send one attempt through the pool.
+
+        Args:
+            send: Sends the attempt to the given upstream and returns its result
+
+        Returns:
+            The attempt's result
+
+        Raises:
+            CircuitOpenError: If every upstream's circuit breaker is open
+            Exception: Whatever send raised; the upstream is excluded if it was a retryable failure
+        """
+        while True:
+            upstream = self.pool.acquire(self._failed())
+            started = time.monotonic()
+            try:
+                result = send(upstream)
+            except CircuitOpenError:
+                # Never reached the upstream; try the next one without waiting
+                self.pool.release(upstream, None)
+                self._exclude(upstream)
+                failed = self._failed()
+                if failed and self.pool.has_healthy(failed):
+                    continue
+                raise
+            except Exception as e:
+                verdict = self._verdict(e)
+                self.pool.release(upstream, verdict)
+                if verdict:
+                    self._exclude(upstream)
+                raise
+            except BaseException:
+                self.pool.release(upstream, None)
+                raise
+            self.pool.release(upstream, False, time.monotonic() - started)
+            return result
+
+    async def call_async(self, send: Callable[[Upstream], Awaitable[Any]]) -> Any:
+        """Coroutine variant of call()"""
+        while True:
+            upstream = self.pool.acquire(self._failed())
+            started = time.monotonic()
+            try:
+                result = await send(upstream)
+            except CircuitOpenError:
+                self.pool.release(upstream, None)
+                self._exclude(upstream)
+                failed = self._failed()
+                if failed and self.pool.has_healthy(failed):
+                    continue
+                raise
+            except Exception as e:
+                verdict = self._verdict(e)
+                self.pool.release(upstream, verdict)
+                if verdict:
+                    self._exclude(upstream)
+                raise
+            except BaseException:
+                self.pool.release(upstream, None)
+                raise
+            self.pool.release(upstream, False, time.monotonic() - started)
+            return result
@@ -3,8 +3,9 @@ Utility functions for the seaking-proxy middleware
 """
 import re
 import json
+import hashlib
 import logging
-from typing import Dict, Any, List, Optional, Tuple
+from typing import Dict, Any, List, Optional, Tuple, NamedTuple, Pattern, Sequence, Union
 from .constants import SENSITIVE_HEADERS
 
 logger = logging.getLogger(__name__)
@@ -90,13 +91,72 @@ def safe_json_dumps(obj: Any, default: str = "Unable to serialize") -> str:
         return default
 
 
-def apply_regex_replacements(text: str, rules: List[Dict[str, Any]]) -> str:
+class CompiledRegexRule(NamedTuple):
+    """Regex replacement rule with its pattern compiled once"""
+    regex: Pattern
+    replacement: Any
+    apply_to: str
+    rule: Dict[str, Any]
+
+
+def regex_flags_from_string(flags_str: str) -> int:
+    """Convert a rule's flags string (e.g. "im") to re flags"""
+    flags = 0
+    if "i" in flags_str:
+        flags |= re.IGNORECASE
+    if "m" in flags_str:
+        flags |= re.MULTILINE
+    if "s" in flags_str:
+        flags |= re.DOTALL
+    if "x" in flags_str:
+        flags |= re.VERBOSE
+    return flags
+
+
+def compile_regex_rules(rules: Sequence[Union[Dict[str, Any], CompiledRegexRule]]) -> List[CompiledRegexRule]:
+    """
+    Compile regex replacement rules, skipping rules without a pattern
+    
+    Args:
+        rules: Replacement rules (dicts with pattern, replacement, flags, apply_to);
+               already compiled rules are passed through unchanged
+        
+    Returns:
+        List of CompiledRegexRule in the original order
+    """
+    compiled_rules = []
+    
+    for rule in rules or []:
+        if isinstance(rule, CompiledRegexRule):
+            compiled_rules.append(rule)
+            continue
+        try:
+            pattern = rule.get("pattern")
+            if not pattern:
+                continue
+            
+            compiled_rules.append(CompiledRegexRule(
+                regex=re.compile(pattern, regex_flags_from_string(rule.get("flags", ""))),
+                replacement=rule.get("replacement", ""),
+                apply_to=str(rule.get("apply_to", "all")).lower(),
+                rule=rule
+            ))
+        except (re.error, TypeError, ValueError) as e:
+            # Log error but continue with other rules
+            logger.warning(f"Invalid regex rule: {rule}, error: {e}")
+            continue
+    
+    return compiled_rules
+
+
+def apply_regex_replacements(text: str, rules: Union[Sequence[Union[Dict[str, Any], CompiledRegexRule]], "RewriteProgram"]) -> str:
     """
     Apply regex replacement rules to text
     
     Args:
         text: Text to apply replacements to
         rules: List of replacement rules with pattern, replacement, flags, and apply_to
+               (or rules pre-compiled with compile_regex_rules, or a RewriteProgram)
         
     Returns:
         Text with replacements applied
@@ -104,49 +164,262 @@ def apply_regex_replacements(text: str, rules: List[Dict[str, Any]]) -> str:
     if not text or not rules:
         return text
     
+    if isinstance(rules, RewriteProgram):
+        return rules.apply(text)
+    
     result = text
     
-    for rule in rules:
+    for compiled in compile_regex_rules(rules):
         try:
-            pattern = rule.get("pattern")
-            replacement = rule.get("replacement", "")
-            flags_str = rule.get("flags", "")
-            apply_to = rule.get("apply_to", "all")
-            
-            if not pattern:
-                continue
-            
-            # Convert flags string to re flags
-            flags = 0
-            if "i" in flags_str:
-                flags |= re.IGNORECASE
-            if "m" in flags_str:
-                flags |= re.MULTILINE
-            if "s" in flags_str:
-                flags |= re.DOTALL
-            if "x" in flags_str:
-                flags |= re.VERBOSE
-            
             # Apply the replacement
-            result = re.sub(pattern, replacement, result, flags=flags)
-            
+            result = compiled.regex.sub(compiled.replacement, result)
         except (re.error, TypeError, ValueError) as e:
             # Log error but continue with other rules
-            import logging
-            logger = logging.getLogger(__name__)
-            logger.warning(f"Invalid regex rule: {rule}, error: {e}")
+            logger.warning(f"Invalid regex rule: {compiled.rule}, error: {e}")
             continue
     
     return result
 
 
-def process_messages_with_regex(messages: List[Dict[str, Any]], rules: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+# Escapes that re accepts in a pattern and that stand for a single literal character
+_SIMPLE_ESCAPES = {"a": "\a", "f": "\f", "n": "\n", "r": "\r", "t": "\t", "v": "\v"}
+_HEX_ESCAPE_LENGTHS = {"x": 2, "u": 4, "U": 8}
+_REGEX_METACHARACTERS = frozenset(".^$*+?{}[]|()")
+
+
+def regex_pattern_literal(pattern: str, flags: int = 0) -> Optional[str]:
+    """
+    Return the literal string a regex pattern matches, or None if it is a real regex.
+
+    Recognizes plain characters and escapes for single characters (\\\\, \\[,
+    \\n, \\xhh, \\uXXXX, ...). Anything else, including IGNORECASE or VERBOSE
+    flags, is treated as a regex.
+
+    Args:
+        pattern: Regex pattern string
+        flags: re flags the pattern is compiled with
+
+    Returns:
+        The matched literal text, or None
+    """
+    if not isinstance(pattern, str) or not pattern or flags & (re.IGNORECASE | re.VERBOSE):
+        return None
+
+    literal = []
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char in _REGEX_METACHARACTERS:
+            return None
+        if char != "\\":
+            literal.append(char)
+            i += 1
+            continue
+
+        if i + 1 >= len(pattern):
+            return None
+        escaped = pattern[i + 1]
+        if escaped in _SIMPLE_ESCAPES:
+            literal.append(_SIMPLE_ESCAPES[escaped])
+            i += 2
+        elif escaped in _HEX_ESCAPE_LENGTHS:
+            digits = pattern[i + 2:i + 2 + _HEX_ESCAPE_LENGTHS[escaped]]
+            if len(digits) != _HEX_ESCAPE_LENGTHS[escaped] or not all(c in "0123456789abcdefABCDEF" for c in digits):
+                return None
+            try:
+                literal.append(chr(int(digits, 16)))
+            except ValueError:
+                return None
+            i += 2 + len(digits)
+        elif escaped.isascii() and escaped.isalnum():
+            # Character classes, anchors, group references, octal and named escapes
+            return None
+        else:
+            literal.append(escaped)
+            i += 2
+
+    return "".join(literal)
+
+
+class _LiteralRule(NamedTuple):
+    """Literal rule: every occurrence of text becomes replacement"""
+    text: str
+    replacement: str
+
+
+def _literal_rule(compiled: CompiledRegexRule) -> Optional[_LiteralRule]:
+    """Classify a compiled rule as a literal rewrite, or None if it must stay a regex"""
+    text = regex_pattern_literal(compiled.regex.pattern, compiled.regex.flags)
+    if text is None:
+        return None
+    match = compiled.regex.fullmatch(text)
+    if match is None:
+        return None
+    try:
+        # Expand the template once (backslash escapes, group 0) exactly as re.sub would
+        replacement = match.expand(compiled.replacement)
+    except (re.error, TypeError, ValueError, IndexError):
+        return None
+    return _LiteralRule(text, replacement)
+
+
+def _literals_can_overlap(a: str, b: str) -> bool:
+    """True if occurrences of a and b can share characters in some text"""
+    if a in b or b in a:
+        return True
+    for k in range(1, min(len(a), len(b))):
+        if a.endswith(b[:k]) or b.endswith(a[:k]):
+            return True
+    return False
+
+
+def _literals_commute(a: _LiteralRule, b: _LiteralRule) -> bool:
+    """
+    True if applying a and b one after the other equals applying them simultaneously.
+
+    That holds when their matches can never overlap and neither replacement
+    contains a character of the other's pattern (a non-empty replacement can
+    then never take part in a new match of the other rule).
+    """
+    if not a.replacement or not b.replacement:
+        return False
+    if _literals_can_overlap(a.text, b.text):
+        return False
+    return not (set(a.replacement) & set(b.text) or set(b.replacement) & set(a.text))
+
+
+class RewriteProgram:
+    """
+    Ordered regex replacement rules compiled into as few passes as possible.
+
+    Consecutive literal rules that commute are grouped: longer literals become
+    alternation regexes (one per leading character), single characters a str.translate table (or plain
+    str.replace calls when translate would be slower). Real regexes are applied
+    one by one in their original position, so the result is identical to
+    applying each rule in order.
+    """
+
+    def __init__(self, rules: Sequence[Union[Dict[str, Any], CompiledRegexRule]]):
+        """
+        Compile rules into steps.
+
+        Args:
+            rules: Replacement rules (dicts or pre-compiled), in application order
+        """
+        self.rules = compile_regex_rules(rules)
+        self.steps: List[Tuple[str, Any]] = []
+
+        group: List[_LiteralRule] = []
+        for compiled in self.rules:
+            literal = _literal_rule(compiled)
+            if literal is not None and all(_literals_commute(literal, other) for other in group):
+                group.append(literal)
+                continue
+            self._add_literal_group(group)
+            group = []
+            if literal is not None:
+                group.append(literal)
+            else:
+                self.steps.append(("regex", compiled))
+        self._add_literal_group(group)
+
+    def _add_literal_group(self, group: List[_LiteralRule]) -> None:
+        """Turn a group of commuting literal rules into translate/replace/alternation steps"""
+        if not group:
+            return
+        single_chars = [literal for literal in group if len(literal.text) == 1]
+        longer = [literal for literal in group if len(literal.text) > 1]
+
+        # str.translate only has a fast path for ASCII text and ASCII to single
+        # ASCII character tables; otherwise (e.g. "—" -> "\\u2014") it is several
+        # times slower than one str.replace per character, a memchr-speed scan
+        if len(single_chars) > 1 and all(literal.text.isascii() and len(literal.replacement) == 1
+                                         and literal.replacement.isascii() for literal in single_chars):
+            table = {ord(literal.text): literal.replacement for literal in single_chars}
+            self.steps.append(("translate", (table, single_chars)))
+        else:
+            self.steps.extend(("replace", literal) for literal in single_chars)
+
+        # One alternation per leading character: re searches alternatives with a
+        # common prefix as fast as a single literal, but falls back to testing
+        # every position when their first characters differ
+        by_first_char: Dict[str, List[_LiteralRule]] = {}
+        for literal in longer:
+            by_first_char.setdefault(literal.text[0], []).append(literal)
+        for bucket in by_first_char.values():
+            if len(bucket) == 1:
+                self.steps.append(("replace", bucket[0]))
+                continue
+            alternation = re.compile("|".join(re.escape(literal.text) for literal in bucket))
+            replacements = {literal.text: literal.replacement for literal in bucket}
+            if len(set(replacements.values())) == 1:
+                # One shared replacement needs no per-match lookup; escape it as a template
+                replacement = bucket[0].replacement.replace("\\", "\\\\")
+            else:
+                replacement = lambda match, replacements=replacements: replacements[match.group(0)]
+            self.steps.append(("alternation", (alternation, replacement)))
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+    def apply(self, text: str) -> str:
+        """Apply all rules to text"""
+        if not text:
+            return text
+        result = text
+        for kind, step in self.steps:
+            if kind == "translate":
+                table, single_chars = step
+                if result.isascii():
+                    result = result.translate(table)
+                else:
+                    for literal in single_chars:
+                        result = result.replace(literal.text, literal.replacement)
+            elif kind == "replace":
+                result = result.replace(step.text, step.replacement)
+            elif kind == "alternation":
+                alternation, replacement = step
+                result = alternation.sub(replacement, result)
+            else:
+                try:
+                    result = step.regex.sub(step.replacement, result)
+                except (re.error, TypeError, ValueError) as e:
+                    # Log error but continue with other rules
+                    logger.warning(f"Invalid regex rule: {step.rule}, error: {e}")
+        return result
+
+
+class RegexRuleSet:
+    """Compiled rules plus one RewriteProgram per message role (built on first use)"""
+
+    def __init__(self, rules: Sequence[Union[Dict[str, Any], CompiledRegexRule]]):
+        """Compile rules (dicts or pre-compiled), keeping their order"""
+        self.rules = tuple(compile_regex_rules(rules))
+        self._programs: Dict[str, RewriteProgram] = {}
+        # Identifies the rule semantics, e.g. for caching transformed content
+        self.fingerprint = hashlib.sha256(json.dumps([
+            [rule.regex.pattern, rule.regex.flags, rule.replacement, rule.apply_to] for rule in self.rules
+        ], default=repr).encode("utf-8")).hexdigest()
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+    def program_for(self, role: str) -> RewriteProgram:
+        """Return the program for rules whose apply_to is "all" or role"""
+        program = self._programs.get(role)
+        if program is None:
+            program = RewriteProgram([rule for rule in self.rules if rule.apply_to == "all" or rule.apply_to == role])
+            self._programs[role] = program
+        return program
+
+
+def process_messages_with_regex(messages: List[Dict[str, Any]], rules: Union[Sequence[Union[Dict[str, Any], CompiledRegexRule]], RegexRuleSet]) -> List[Dict[str, Any]]:
     """
     Process messages with regex replacement rules
     
     Args:
         messages: List of message dictionaries with 'role' and 'content' keys
-        rules: List of replacement rules
+        rules: List of replacement rules (dicts or pre-compiled) or a RegexRuleSet
         
     Returns:
         List of messages with replacements applied
@@ -154,8 +427,7 @@ def process_messages_with_regex(messages: List[Dict[str, Any]], rules: List[Dict
     if not messages or not rules:
         return messages
     
-    import logging
-    logger = logging.getLogger(__name__)
+    rule_set = rules if isinstance(rules, RegexRuleSet) else RegexRuleSet(rules)
     logger.info(f"=== OUTGOING REGEX PROCESSING ===")
     logger.info(f"Applying {len(rules)} rules to {len(messages)} messages")
     logger.info(f"TEST LOG MESSAGE - OUTGOING REGEX PROCESSING IS WORKING")
@@ -170,12 +442,8 @@ def process_messages_with_regex(messages: List[Dict[str, Any]], rules: List[Dict
             processed_messages.append(message)
             continue
         
-        # Filter rules based on apply_to
-        applicable_rules = []
-        for rule in rules:
-            apply_to = rule.get("apply_to", "all").lower()
-            if apply_to == "all" or apply_to == role:
-                applicable_rules.append(rule)
+        # Filter rules based on apply_to (fused into one program per role)
+        applicable_rules = rule_set.program_for(role)
         
         # Log before processing
         logger.info(f"Message {i+1} ({role}) BEFORE regex: {content[:200]}...")
@@ -195,13 +463,13 @@ def process_messages_with_regex(messages: List[Dict[str, Any]], rules: List[Dict
     return processed_messages
 
 
-def process_response_with_regex(response_data: Dict[str, Any], rules: List[Dict[str, Any]]) -> Dict[str, Any]:
+def process_response_with_regex(response_data: Dict[str, Any], rules: Union[Sequence[Union[Dict[str, Any], CompiledRegexRule]], RewriteProgram]) -> Dict[str, Any]:
     """
     Process response data with regex replacement rules
     
     Args:
         response_data: Response dictionary (typically OpenAI format)
-        rules: List of replacement rules
+        rules: List of replacement rules (dicts or pre-compiled) or a RewriteProgram
         
     Returns:
         Response data with replacements applied
@@ -209,8 +477,7 @@ def process_response_with_regex(response_data: Dict[str, Any], rules: List[Dict[
     if not response_data or not rules:
         return response_data
     
-    import logging
-    logger = logging.getLogger(__name__)
+    program = rules if isinstance(rules, RewriteProgram) else RewriteProgram(rules)
     logger.info(f"=== INCOMING REGEX PROCESSING ===")
     logger.info(f"Applying {len(rules)} rules to response")
     logger.info(f"TEST LOG MESSAGE - INCOMING REGEX PROCESSING IS WORKING")
@@ -232,7 +499,7 @@ def process_response_with_regex(response_data: Dict[str, Any], rules: List[Dict[
                     logger.info(f"Choice {i+1} BEFORE regex: {message['content'][:200]}...")
                     
                     # Apply regex replacements to content
-                    processed_content = apply_regex_replacements(message['content'], rules)
+                    processed_content = program.apply(message['content'])
                     message['content'] = processed_content
                     
                     # Log after processing
@@ -437,6 +704,25 @@ def extract_character_chat_info(headers: Dict[str, Any], request_data: Dict[str,
         return None
 
     all_metadata, _ = extract_st_metadata_from_messages(messages)
+    return resolve_character_chat_info(all_metadata)
+
+
+def resolve_character_chat_info(all_metadata: Optional[List[Dict[str, Any]]]) -> Optional[Tuple[str, str, str]]:
+    """
+    Resolve character, chat timestamp, and operation from extracted ST_METADATA blocks.
+
+    See extract_character_chat_info for the rules; this variant takes metadata
+    that was already extracted (e.g. by preprocess_messages).
+
+    Args:
+        all_metadata: List of ST_METADATA dicts, or None
+
+    Returns:
+        Tuple of (character, timestamp, operation) if found, None otherwise
+
+    Raises:
+        ValueError: If ST_METADATA is malformed or has conflicting operation types
+    """
     if not all_metadata:
         return None
 
@@ -559,8 +845,10 @@ def extract_lorebook_entries_from_content(content: str) -> List[Dict[str, Any]]:
     entries = []
 
     # Pattern to match <setting_lore ...>content</setting_lore>
-    # Captures attributes and content separately
-    pattern = r'<setting_lore\s+([^>]+)>\s*([^<]*?)\s*</setting_lore>'
+    # Captures attributes and content separately. The content group is greedy
+    # (surrounding whitespace is stripped below); a lazy group followed by \s*
+    # backtracks on every character of large entries.
+    pattern = r'<setting_lore\s+([^>]+)>([^<]*)</setting_lore>'
 
     matches = re.finditer(pattern, content, re.DOTALL)
 
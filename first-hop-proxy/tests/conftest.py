@@ -1,11 +1,48 @@
 import pytest
 import os
 import sys
+import json
 from unittest.mock import patch
 
 # Add src directory to path for imports
 sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
 
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "clock(module): module whose time import the clock fixture replaces")
+
+
+def st_metadata(operation):
+    """Build an ST_METADATA block as SillyTavern sends it"""
+    return "<ST_METADATA>\n" + json.dumps(
+        {"version": "1.0", "chat": "Senta - 2025-11-01@20h29m24s", "operation": operation}) + "\n</ST_METADATA>\n"
+
+
+class FakeClock:
+    """Stand-in for a module's time import; monotonic() and time() both return now"""
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def monotonic(self):
+        return self.now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(request):
+    """Control the clock of the module named by the test's clock marker, e.g.
+    pytestmark = pytest.mark.clock("first_hop_proxy.circuit_breaker")"""
+    marker = request.node.get_closest_marker("clock")
+    if marker is None:
+        pytest.fail("the clock fixture needs a clock marker naming the module to patch")
+    fake = FakeClock()
+    with patch(f"{marker.args[0]}.time", fake):
+        yield fake
+
+
 @pytest.fixture(autouse=True)
 def test_environment():
     """Automatically apply test environment overrides to prevent freezing"""
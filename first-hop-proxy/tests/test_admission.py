@@ -0,0 +1,249 @@
+"""
+Tests for admission control of upstream calls
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import threading
+import pytest
+import requests
+from unittest.mock import patch
+
+# Add src directory to path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from first_hop_proxy.admission import (
+    AdmissionController, AdmissionRejected, configure_admission, get_admission_controller
+)
+from first_hop_proxy.main import app, config as default_config
+
+
+def _acquire_in_thread(controller, results, name, scope=None, scope_limit=None, operation=None, chat=None):
+    """Start a thread that acquires a slot and appends (name, ticket or rejection) to results"""
+    def run():
+        try:
+            results.append((name, controller.acquire(scope, scope_limit, operation, chat)))
+        except AdmissionRejected as e:
+            results.append((name, e))
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def _wait_for_queue(controller, depth):
+    """Wait until the controller has depth queued requests"""
+    deadline = time.monotonic() + 5
+    while controller.get_stats()["queue_depth"] < depth:
+        assert time.monotonic() < deadline
+        time.sleep(0.005)
+
+
+def _release_as_granted(results, count):
+    """Release each queued request as soon as it is granted until count requests have run"""
+    for granted in range(count):
+        deadline = time.monotonic() + 5
+        while len(results) == granted:
+            assert time.monotonic() < deadline
+            time.sleep(0.005)
+        results[-1][1].release()
+
+
+class TestAdmission:
+    """Test cases for AdmissionController and the 503 responses"""
+
+    def test_queue_full_rejects_immediately(self):
+        """Test that requests beyond the slots and queue are rejected with a retry hint"""
+        controller = AdmissionController(max_in_flight=1, max_queue=0, retry_after=7)
+        ticket = controller.acquire()
+        with pytest.raises(AdmissionRejected) as exc_info:
+            controller.acquire()
+        assert exc_info.value.reason == "queue_full" and exc_info.value.retry_after == 7
+
+        ticket.release()
+        ticket.release()
+        controller.acquire().release()
+        stats = controller.get_stats()
+        assert (stats["in_flight"], stats["admitted"], stats["rejected"]["queue_full"]) == (0, 2, 1)
+
+    def test_queued_requests_are_admitted_in_order(self):
+        """Test that freed slots go to waiting requests in arrival order"""
+        controller = AdmissionController(max_in_flight=1, max_queue=5, max_queue_time=5)
+        first = controller.acquire()
+        results = []
+        threads = []
+        for index, name in enumerate(("second", "third")):
+            threads.append(_acquire_in_thread(controller, results, name))
+            _wait_for_queue(controller, index + 1)
+
+        first.release()
+        threads[0].join(timeout=5)
+        assert [name for name, _ in results] == ["second"]
+        assert controller.get_stats()["queue_depth"] == 1
+
+        results[0][1].release()
+        threads[1].join(timeout=5)
+        assert [name for name, _ in results] == ["second", "third"]
+        assert results[1][1].waited > 0
+        results[1][1].release()
+        assert controller.get_stats()["in_flight"] == 0
+
+    def test_queue_timeout(self):
+        """Test that a request waiting longer than max_queue_time is rejected"""
+        controller = AdmissionController(max_in_flight=1, max_queue=5, max_queue_time=0.05)
+        ticket = controller.acquire()
+        with pytest.raises(AdmissionRejected) as exc_info:
+            controller.acquire()
+        assert exc_info.value.reason == "queue_timeout"
+        stats = controller.get_stats()
+        assert (stats["queue_depth"], stats["rejected"]["queue_timeout"]) == (0, 1)
+        ticket.release()
+
+    def test_per_config_limit(self):
+        """Test that a config at its limit waits without holding back other configs"""
+        controller = AdmissionController(max_in_flight=3, max_queue=5, max_queue_time=5)
+        a1 = controller.acquire("/cfg/a.yaml", 1)
+        results = []
+        thread = _acquire_in_thread(controller, results, "a2", "/cfg/a.yaml", 1)
+        _wait_for_queue(controller, 1)
+
+        b1 = controller.acquire("/cfg/b.yaml", 1)
+        assert controller.get_stats()["in_flight_by_config"] == {"a.yaml": 1, "b.yaml": 1}
+
+        a1.release()
+        thread.join(timeout=5)
+        assert results[0][0] == "a2" and not isinstance(results[0][1], AdmissionRejected)
+        results[0][1].release()
+        b1.release()
+
+    def test_operation_classes(self):
+        """Test that ST_METADATA operations map to the configured priority classes"""
+        controller = AdmissionController()
+        assert controller.class_for("chat") == "interactive"
+        assert controller.class_for("detect_scene_break_FORCED") == "background"
+        assert controller.class_for("merge_lorebook_entry") == "background"
+        assert controller.class_for("some_new_operation") == "standard"
+        assert controller.class_for(None) == "standard"
+
+        custom = AdmissionController(priority_classes={"fast": {"weight": 2, "operations": ["chat"]}},
+                                     default_priority_class="slow")
+        assert (custom.class_for("chat"), custom.class_for("generate_scene_recap")) == ("fast", "slow")
+        with pytest.raises(ValueError):
+            AdmissionController(priority_classes={"broken": {"weight": 0}})
+
+    def test_chat_jumps_queued_background_work(self):
+        """Test that a chat request queued behind background work gets the next free slot"""
+        controller = AdmissionController(max_in_flight=1, max_queue=10, max_queue_time=5)
+        held = controller.acquire(operation="generate_scene_recap")
+        results = []
+        threads = []
+        for index, (name, operation) in enumerate((("recap1", "generate_scene_recap"),
+                                                   ("recap2", "lorebook_entry_lookup"),
+                                                   ("chat", "chat"))):
+            threads.append(_acquire_in_thread(controller, results, name, operation=operation))
+            _wait_for_queue(controller, index + 1)
+        assert controller.get_stats()["priority_classes"]["background"]["queue_depth"] == 2
+
+        held.release()
+        _release_as_granted(results, len(threads))
+        assert [name for name, _ in results] == ["chat", "recap1", "recap2"]
+        assert results[0][1].priority_class == "interactive"
+
+    def test_weighted_share_and_starvation(self):
+        """Test that busy classes share slots by weight and that long waits are served first"""
+        controller = AdmissionController(max_in_flight=1, max_queue=20, max_queue_time=5,
+                                         priority_classes={"high": {"weight": 3, "operations": ["chat"]},
+                                                           "low": {"weight": 1, "operations": ["recap"]}},
+                                         default_priority_class="low", starvation_timeout=60)
+        controller.acquire()
+        waiters = [controller._enqueue(None, None, operation) for operation in ["chat"] * 6 + ["recap"] * 2]
+
+        # Release the single slot repeatedly, noting which class each freed slot went to
+        order = []
+        pending = set(waiters)
+        for _ in waiters:
+            controller._release(None)
+            (granted,) = [waiter for waiter in pending if waiter.granted]
+            pending.discard(granted)
+            order.append(granted.priority_class.name)
+        controller._release(None)
+        assert order == ["high", "low", "high", "high", "high", "low", "high", "high"]
+
+        # A background request that has waited past the starvation timeout goes first
+        controller.starvation_timeout = 5
+        held = controller.acquire()
+        old = controller._enqueue(None, None, "recap")
+        old.enqueued_at -= 6
+        new = controller._enqueue(None, None, "chat")
+        held.release()
+        assert old.granted and not new.granted
+        assert controller.get_stats()["priority_classes"]["low"]["queue_depth"] == 0
+
+    def test_chats_take_turns(self):
+        """Test that a chat with a long backlog alternates with other chats and respects its cap"""
+        controller = AdmissionController(max_in_flight=1, max_queue=10, max_queue_time=5)
+        held = controller.acquire(operation="generate_scene_recap", chat=("Ona", "chat3"))
+        results = []
+        threads = []
+        for index, (name, chat) in enumerate([("Senta", ("Senta", "chat1"))] * 3 + [("Mira", ("Mira", "chat2"))] * 2):
+            threads.append(_acquire_in_thread(controller, results, name, operation="generate_scene_recap", chat=chat))
+            _wait_for_queue(controller, index + 1)
+        assert controller.get_stats()["priority_classes"]["background"]["chats_waiting"] == 2
+
+        held.release()
+        _release_as_granted(results, len(threads))
+        assert [name for name, _ in results] == ["Senta", "Mira", "Senta", "Mira", "Senta"]
+
+        capped = AdmissionController(max_in_flight=4, per_chat_max_in_flight=1)
+        first = capped.acquire(chat=("Senta", "chat1"))
+        assert type(capped._enqueue(None, None, None, ("Senta", "chat1"))).__name__ == "_Waiter"
+        capped.acquire(chat=("Mira", "chat2"))
+        capped.acquire()
+        assert capped.get_stats()["chats_in_flight"] == 2
+        first.release()
+        assert capped._chat_in_flight[("Senta", "chat1")] == 1
+
+    def test_async_waiters(self):
+        """Test that coroutines wait without blocking the loop and are woken by releases from threads"""
+        controller = AdmissionController(max_in_flight=1, max_queue=5, max_queue_time=5)
+        ticket = controller.acquire()
+
+        async def scenario():
+            waiter = asyncio.ensure_future(controller.acquire_async())
+            await asyncio.sleep(0.01)
+            assert not waiter.done()
+            threading.Timer(0.01, ticket.release).start()
+            granted = await asyncio.wait_for(waiter, 5)
+            granted.release()
+
+        asyncio.run(scenario())
+        assert controller.get_stats()["in_flight"] == 0
+
+    def test_endpoint_returns_503(self):
+        """Test the 503 response with Retry-After and the health report"""
+        upstream = requests.Response()
+        upstream.status_code = 200
+        upstream.headers["Content-Type"] = "application/json"
+        upstream._content = json.dumps({"choices": [{"message": {"content": "Hello there, how are you today?"}}]}).encode()
+        body = {"model": "m", "messages": [{"role": "user", "content": "Hi"}]}
+        client = app.test_client()
+
+        configure_admission({"enabled": True, "max_in_flight": 1, "max_queue": 0, "retry_after": 2.5})
+        try:
+            with patch.dict(default_config._config, {"target_proxy": {"url": "https://proxy.example.com/v1/chat/completions"}}), \
+                    patch("requests.Session.request", return_value=upstream):
+                assert client.post("/chat/completions", json=body).status_code == 200
+
+                held = get_admission_controller().acquire()
+                response = client.post("/chat/completions", json=body)
+                held.release()
+
+            assert response.status_code == 503
+            assert response.headers["Retry-After"] == "3"
+            assert response.get_json()["error"]["type"] == "overloaded"
+            stats = client.get("/health/detailed").get_json()["admission"]
+            assert (stats["in_flight"], stats["admitted"], stats["rejected"]["queue_full"]) == (0, 2, 1)
+        finally:
+            configure_admission(None)
+        assert get_admission_controller() is None
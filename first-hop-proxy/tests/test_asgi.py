@@ -0,0 +1,262 @@
+import pytest
+import json
+import asyncio
+from unittest.mock import AsyncMock, patch
+import sys
+import os
+
+# Add src directory to path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+httpx = pytest.importorskip("httpx")
+
+from first_hop_proxy.config import Config
+from first_hop_proxy.asgi import ProxyASGIApp
+from first_hop_proxy.error_handler import ErrorHandler
+
+
+TARGET_URL = "https://proxy.example.com/v1/chat/completions"
+
+COMPLETION = {
+    "id": "chatcmpl-1",
+    "object": "chat.completion",
+    "choices": [{"index": 0, "message": {"role": "assistant", "content": "Hello"}, "finish_reason": "stop"}]
+}
+
+
+def _config(tmp_path, **target_proxy):
+    """Build a config pointing at the mock upstream with logs under tmp_path"""
+    config_file = tmp_path / "config.yaml"
+    config_file.write_text(json.dumps({
+        "target_proxy": {"url": TARGET_URL, **target_proxy},
+        "logging": {"enabled": True, "folder": str(tmp_path / "logs")},
+        "error_logging": {"enabled": True, "folder": str(tmp_path / "logs" / "errors")},
+    }))
+    config = Config()
+    config.load_from_file(str(config_file))
+    return config
+
+
+def _call(app, method, path, **kwargs):
+    """Send one request to the ASGI app and return the buffered response"""
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://testserver") as client:
+            response = await client.request(method, path, **kwargs)
+            await response.aread()
+            return response
+    return asyncio.run(run())
+
+
+class TestProxyASGIApp:
+    """Test suite for the asyncio/ASGI serving engine"""
+
+    def test_health_check(self, tmp_path):
+        """Test that /health responds without touching upstream"""
+        app = ProxyASGIApp(config=_config(tmp_path), http_client=httpx.AsyncClient())
+        response = _call(app, "GET", "/health")
+        assert response.status_code == 200
+        assert response.json() == {"status": "healthy"}
+
+    def test_lifespan_configures_process_when_run_directly(self, tmp_path):
+        """Test that lifespan startup sets up the process unless run_server already did"""
+        async def run_lifespan(app):
+            messages = [{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}]
+            sent = []
+
+            async def receive():
+                return messages.pop(0)
+
+            async def send(message):
+                sent.append(message["type"])
+
+            await app({"type": "lifespan"}, receive, send)
+            return sent
+
+        for configured in (False, True):
+            app = ProxyASGIApp(config=_config(tmp_path), http_client=httpx.AsyncClient())
+            with patch("first_hop_proxy.asgi.process_configured", return_value=configured), \
+                    patch("first_hop_proxy.asgi.configure_process") as configure_process, \
+                    patch("first_hop_proxy.asgi.shutdown_process") as shutdown_process:
+                sent = asyncio.run(run_lifespan(app))
+            assert sent == ["lifespan.startup.complete", "lifespan.shutdown.complete"]
+            assert configure_process.call_count == shutdown_process.call_count == (0 if configured else 1)
+
+    def test_chat_completion_is_forwarded_and_logged(self, tmp_path):
+        """Test that a chat request is forwarded with the same body and logged"""
+        seen = {}
+
+        def upstream(request):
+            seen["url"] = str(request.url)
+            seen["body"] = json.loads(request.content)
+            return httpx.Response(200, json=COMPLETION)
+
+        app = ProxyASGIApp(config=_config(tmp_path), http_client=httpx.AsyncClient(transport=httpx.MockTransport(upstream)))
+        response = _call(app, "POST", "/chat/completions", json={"model": "m", "messages": [{"role": "user", "content": "Hi"}]})
+
+        assert response.status_code == 200
+        assert response.json()["choices"][0]["message"]["content"] == "Hello"
+        assert seen["url"] == TARGET_URL
+        assert seen["body"]["messages"] == [{"role": "user", "content": "Hi"}]
+
+        logs = list((tmp_path / "logs" / "unsorted").glob("*.md"))
+        assert len(logs) == 1
+        assert "**Status:** ✅ Success" in logs[0].read_text(encoding="utf-8")
+
+    def test_metrics_endpoint(self, tmp_path):
+        """Test that requests, upstream attempts and body bytes are exposed on /metrics"""
+        from first_hop_proxy.metrics import configure_metrics
+        configure_metrics({})
+        app = ProxyASGIApp(config=_config(tmp_path), http_client=httpx.AsyncClient(
+            transport=httpx.MockTransport(lambda request: httpx.Response(200, json=COMPLETION))))
+        _call(app, "POST", "/chat/completions", json={"model": "m", "messages": [{"role": "user", "content": "Hi"}]})
+
+        response = _call(app, "GET", "/metrics")
+        assert response.status_code == 200
+        assert 'proxy_requests_total{operation="none",config="default",status="200"} 1' in response.text
+        assert 'proxy_upstream_attempt_duration_seconds_count{status="200"} 1' in response.text
+        assert 'proxy_bytes_total{direction="in"}' in response.text
+
+    def test_chat_completion_is_indexed_and_queryable(self, tmp_path):
+        """Test that attempts land in the log index and /logs/query reads them back"""
+        from first_hop_proxy.log_index import configure_log_index
+        configure_log_index({"enabled": True, "path": str(tmp_path / "index.sqlite3")})
+        try:
+            app = ProxyASGIApp(config=_config(tmp_path), http_client=httpx.AsyncClient(
+                transport=httpx.MockTransport(lambda request: httpx.Response(200, json=COMPLETION))))
+            _call(app, "POST", "/chat/completions", json={"model": "m", "messages": [{"role": "user", "content": "Hi"}]})
+
+            response = _call(app, "GET", "/logs/query?status=success&endpoint=/chat/completions")
+            assert response.status_code == 200
+            (row,) = response.json()["rows"]
+            assert row["file_path"].endswith(".md") and row["duration"] is not None
+        finally:
+            configure_log_index(None)
+        assert _call(app, "GET", "/logs/query").status_code == 404
+
+    def test_retryable_status_backs_off_with_asyncio_sleep(self, tmp_path):
+        """Test that 503s are retried through retry_with_backoff_async without blocking sleeps"""
+        replies = [httpx.Response(503, text="busy"), httpx.Response(200, json=COMPLETION)]
+        app = ProxyASGIApp(config=_config(tmp_path),
+                           http_client=httpx.AsyncClient(transport=httpx.MockTransport(lambda request: replies.pop(0))))
+
+        with patch('first_hop_proxy.error_handler.asyncio.sleep', new_callable=AsyncMock) as mock_sleep:
+            response = _call(app, "POST", "/chat/completions", json={"messages": [{"role": "user", "content": "Hi"}]})
+
+        assert response.status_code == 200
+        mock_sleep.assert_awaited_once()
+        assert len(list((tmp_path / "logs" / "unsorted").glob("*.md"))) == 2
+
+    def test_client_error_status_is_passed_through(self, tmp_path):
+        """Test that permanent 4xx replies keep their status and body"""
+        app = ProxyASGIApp(config=_config(tmp_path), http_client=httpx.AsyncClient(
+            transport=httpx.MockTransport(lambda request: httpx.Response(400, json={"error": {"message": "bad"}}))))
+
+        response = _call(app, "POST", "/chat/completions", json={"messages": [{"role": "user", "content": "Hi"}]})
+
+        assert response.status_code == 400
+        assert response.json() == {"error": {"message": "bad"}}
+
+    def test_streaming_reply_is_relayed(self, tmp_path):
+        """Test that stream:true replies are relayed as event-stream bytes"""
+        chunks = [
+            b'data: {"id": "c1", "choices": [{"index": 0, "delta": {"content": "Hel"}}]}\n\n',
+            b'data: {"id": "c1", "choices": [{"index": 0, "delta": {"content": "lo"}}]}\n\ndata: [DONE]\n\n',
+        ]
+        app = ProxyASGIApp(config=_config(tmp_path), http_client=httpx.AsyncClient(transport=httpx.MockTransport(
+            lambda request: httpx.Response(200, headers={"Content-Type": "text/event-stream"}, content=b"".join(chunks)))))
+
+        response = _call(app, "POST", "/chat/completions",
+                         json={"messages": [{"role": "user", "content": "Hi"}], "stream": True})
+
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        assert response.content == b"".join(chunks)
+        log = list((tmp_path / "logs" / "unsorted").glob("*.md"))[0].read_text(encoding="utf-8")
+        assert '"content": "Hello"' in log
+
+    def test_missing_config_path_returns_404(self, tmp_path, monkeypatch):
+        """Test that an unknown config path is reported like the Flask app"""
+        monkeypatch.chdir(tmp_path)
+        app = ProxyASGIApp(config=_config(tmp_path), http_client=httpx.AsyncClient())
+        response = _call(app, "POST", "/nope/chat/completions", json={"messages": []})
+
+        assert response.status_code == 404
+        assert response.json()["error"]["type"] == "config_not_found"
+
+    def test_invalid_requests_are_rejected(self, tmp_path):
+        """Test content-type, JSON and messages validation"""
+        app = ProxyASGIApp(config=_config(tmp_path), http_client=httpx.AsyncClient())
+
+        assert _call(app, "POST", "/chat/completions", content=b"{}", headers={"Content-Type": "text/plain"}).status_code == 400
+        assert _call(app, "POST", "/chat/completions", content=b"{bad", headers={"Content-Type": "application/json"}).status_code == 400
+        assert _call(app, "POST", "/chat/completions", json={"model": "m"}).json()["error"]["message"] == "Missing required field: messages"
+
+    def test_models_falls_back_to_default_list(self, tmp_path):
+        """Test that upstream failures on /models return DEFAULT_MODELS"""
+        def upstream(request):
+            raise httpx.ConnectError("refused")
+
+        app = ProxyASGIApp(config=_config(tmp_path), http_client=httpx.AsyncClient(transport=httpx.MockTransport(upstream)))
+        with patch('first_hop_proxy.error_handler.asyncio.sleep', new_callable=AsyncMock):
+            response = _call(app, "GET", "/models")
+
+        assert response.status_code == 200
+        assert response.json()["object"] == "list"
+        assert len(response.json()["data"]) > 0
+
+    def test_models_are_cached_with_etag(self, tmp_path):
+        """Test that cached /models listings skip upstream and answer 304 to a matching If-None-Match"""
+        calls = []
+
+        def upstream(request):
+            calls.append(str(request.url))
+            return httpx.Response(200, json={"object": "list", "data": [{"id": "gemini-2.5-pro", "object": "model"}]})
+
+        config = _config(tmp_path)
+        config._config["models_cache"] = {"enabled": True}
+        app = ProxyASGIApp(config=config, http_client=httpx.AsyncClient(transport=httpx.MockTransport(upstream)))
+        first = _call(app, "GET", "/models")
+        second = _call(app, "GET", "/models")
+        not_modified = _call(app, "GET", "/models", headers={"If-None-Match": first.headers["etag"]})
+
+        assert calls == ["https://proxy.example.com/v1/models"]
+        assert first.json() == second.json() and first.json()["data"][0]["id"] == "gemini-2.5-pro"
+        assert second.headers["x-proxy-cache"] == "HIT"
+        assert not_modified.status_code == 304 and not_modified.content == b""
+
+
+class TestRetryWithBackoffAsync:
+    """Test suite for ErrorHandler.retry_with_backoff_async"""
+
+    def test_awaits_async_retry_callback(self):
+        """Test that coroutine on_retry callbacks are awaited before retrying"""
+        import requests
+        handler = ErrorHandler(max_retries=2, base_delay=0)
+        attempts = []
+        callbacks = []
+
+        async def flaky():
+            attempts.append(1)
+            if len(attempts) == 1:
+                raise requests.exceptions.ConnectionError("reset")
+            return "ok"
+
+        async def on_retry(attempt, exception, delay):
+            callbacks.append(attempt)
+
+        with patch('first_hop_proxy.error_handler.asyncio.sleep', new_callable=AsyncMock):
+            result = asyncio.run(handler.retry_with_backoff_async(flaky, {}, on_retry=on_retry))
+
+        assert result == "ok"
+        assert callbacks == [1]
+
+    def test_non_retryable_error_is_raised(self):
+        """Test that non-retryable errors are raised immediately"""
+        handler = ErrorHandler(max_retries=2, base_delay=0)
+
+        async def broken():
+            raise ValueError("bad input")
+
+        with pytest.raises(ValueError):
+            asyncio.run(handler.retry_with_backoff_async(broken, {}))
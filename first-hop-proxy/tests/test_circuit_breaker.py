@@ -0,0 +1,128 @@
+"""
+Tests for per-origin upstream circuit breakers
+"""
+import os
+import sys
+import json
+import pytest
+import requests
+from unittest.mock import patch
+from requests.exceptions import ConnectionError, Timeout, InvalidURL
+
+# Add src directory to path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from first_hop_proxy.circuit_breaker import (
+    CircuitBreaker, CircuitBreakers, CircuitOpenError, is_failure_exception,
+    configure_circuit_breakers, get_circuit_breakers
+)
+from first_hop_proxy.main import app, config as default_config
+
+pytestmark = pytest.mark.clock("first_hop_proxy.circuit_breaker")
+
+
+class TestCircuitBreaker:
+    """Test cases for CircuitBreaker state transitions and the 503 responses"""
+
+    def test_opens_on_failure_rate(self, clock):
+        """Test that the breaker opens once the window's failure rate reaches the threshold"""
+        breaker = CircuitBreaker("https://up.example", failure_rate_threshold=0.5, min_requests=4, open_duration=10)
+        for failed in (False, True, False):
+            breaker.record(failed, breaker.before_request())
+        assert breaker.state == "closed"
+        breaker.record(True, breaker.before_request())
+        assert breaker.state == "open"
+
+        clock.now += 4
+        with pytest.raises(CircuitOpenError) as exc_info:
+            breaker.before_request()
+        assert exc_info.value.retry_after == pytest.approx(6)
+        stats = breaker.get_stats()
+        assert (stats["state"], stats["rejected"], stats["retry_in"]) == ("open", 1, 6.0)
+
+    def test_failures_leave_the_window(self, clock):
+        """Test that failures older than the window no longer count"""
+        breaker = CircuitBreaker("https://up.example", min_requests=2, window=30)
+        breaker.record(True)
+        clock.now += 31
+        breaker.record(True)
+        breaker.record(False)
+        assert breaker.state == "closed"
+        assert breaker.get_stats()["window_requests"] == 2
+
+    def test_half_open_probe(self, clock):
+        """Test that one probe is let through after open_duration and decides the next state"""
+        breaker = CircuitBreaker("https://up.example", min_requests=1, open_duration=10)
+        breaker.record(True)
+        assert breaker.state == "open"
+
+        clock.now += 10
+        probe = breaker.before_request()
+        assert probe and breaker.state == "half_open"
+        with pytest.raises(CircuitOpenError):
+            breaker.before_request()
+        breaker.record(True, probe)
+        assert breaker.state == "open"
+
+        clock.now += 10
+        probe = breaker.before_request()
+        breaker.abandon(probe)
+        probe = breaker.before_request()
+        breaker.record(False, probe)
+        assert breaker.state == "closed"
+        assert breaker.get_stats()["window_requests"] == 0
+        assert breaker.opened == 2
+
+    def test_failure_classification(self):
+        """Test which exceptions and statuses count against an origin"""
+        assert is_failure_exception(ConnectionError("refused"))
+        assert is_failure_exception(Timeout("slow"))
+        assert not is_failure_exception(InvalidURL("bad"))
+
+        breakers = CircuitBreakers(failure_codes=[502])
+        assert breakers.is_failure_status(502) and not breakers.is_failure_status(429)
+        first = breakers.for_url("https://up.example/v1/chat/completions")
+        assert breakers.for_url("https://up.example/v1/models") is first
+        assert breakers.for_url("https://other.example/v1/models") is not first
+
+    def test_open_circuit_stops_retries(self):
+        """Test that a dead upstream trips the breaker mid-retry and the client gets 503"""
+        body = {"model": "m", "messages": [{"role": "user", "content": "Hi"}]}
+        client = app.test_client()
+        configure_circuit_breakers({"enabled": True, "min_requests": 3, "open_duration": 30})
+        try:
+            with patch.dict(default_config._config, {"target_proxy": {"url": "https://proxy.example.com/v1/chat/completions"}}), \
+                    patch("requests.Session.request", side_effect=ConnectionError("refused")) as upstream:
+                response = client.post("/chat/completions", json=body)
+                assert upstream.call_count == 3
+
+                again = client.post("/chat/completions", json=body)
+                assert upstream.call_count == 3
+
+            for result in (response, again):
+                assert result.status_code == 503
+                assert result.get_json()["error"]["type"] == "upstream_unavailable"
+                assert int(result.headers["Retry-After"]) >= 29
+            origins = client.get("/health/detailed").get_json()["circuit_breakers"]["origins"]
+            assert origins["https://proxy.example.com"]["state"] == "open"
+        finally:
+            configure_circuit_breakers(None)
+        assert get_circuit_breakers() is None
+
+    def test_recategorized_reply_counts_as_failure(self):
+        """Test that a 200 reply recategorized to 429 counts as a failure when 429 is a failure code"""
+        def upstream(*args, **kwargs):
+            response = requests.Response()
+            response.status_code = 200
+            response.headers["Content-Type"] = "application/json"
+            response._content = json.dumps({"error": {"message": "The model is overloaded"}}).encode()
+            return response
+
+        configure_circuit_breakers({"enabled": True, "min_requests": 2, "open_duration": 30, "failure_codes": [429]})
+        try:
+            with patch.dict(default_config._config, {"target_proxy": {"url": "https://proxy.example.com/v1/chat/completions"}}), \
+                    patch("requests.Session.request", side_effect=upstream):
+                app.test_client().post("/chat/completions", json={"model": "m", "messages": [{"role": "user", "content": "Hi"}]})
+            assert get_circuit_breakers().for_url("https://proxy.example.com").state == "open"
+        finally:
+            configure_circuit_breakers(None)
@@ -0,0 +1,135 @@
+"""
+Tests for adaptive (AIMD) upstream concurrency limits
+"""
+import os
+import sys
+import json
+import threading
+import pytest
+import requests
+from unittest.mock import patch
+from requests.exceptions import ConnectionError, Timeout
+
+# Add src directory to path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from first_hop_proxy.admission import AdmissionRejected
+from first_hop_proxy.concurrency_limit import (
+    AdaptiveLimit, ConcurrencyLimits, configure_concurrency_limits, get_concurrency_limits
+)
+from first_hop_proxy.metrics import configure_metrics
+from first_hop_proxy.main import app, config as default_config
+
+pytestmark = pytest.mark.clock("first_hop_proxy.concurrency_limit")
+
+
+def _upstream(status, body):
+    """Build an upstream reply"""
+    response = requests.Response()
+    response.status_code = status
+    response.headers["Content-Type"] = "application/json"
+    response._content = json.dumps(body).encode()
+    return response
+
+
+class TestConcurrencyLimit:
+    """Test cases for AdaptiveLimit adjustments and their use by the proxy client"""
+
+    def test_additive_increase_while_saturated(self, clock):
+        """Test that healthy successes grow the limit only while at least half of it is in use"""
+        limit = AdaptiveLimit("https://up.example", initial_limit=4, max_limit=5)
+        slot = limit.acquire()
+        clock.now += 1
+        limit.release(slot, 200)
+        assert limit.limit == 4 and limit.increased == 0
+
+        limits = []
+        for _ in range(3):
+            slots = [limit.acquire() for _ in range(4)]
+            clock.now += 1
+            for slot in slots:
+                limit.release(slot, 200)
+            limits.append(limit.limit)
+        # About +1 per round of full use, capped at max_limit
+        assert limits == [4, 4, 5]
+        assert limit.increased == 5
+        assert limit.get_stats()["latency"] == 1.0
+
+    def test_multiplicative_decrease_once_per_cohort(self, clock):
+        """Test that overload cuts the limit once for attempts sent before the cut"""
+        limit = AdaptiveLimit("https://up.example", initial_limit=8, min_limit=2)
+        slots = [limit.acquire() for _ in range(4)]
+        clock.now += 1
+        limit.release(slots[0], 429)
+        limit.release(slots[1], 503)
+        limit.release(slots[2], None, Timeout("slow"))
+        assert limit.limit == 4 and limit.decreased == 1
+
+        # An attempt sent after the cut may cut again, down to min_limit
+        clock.now += 1
+        limit.release(limit.acquire(), None, Timeout("slow"))
+        clock.now += 1
+        limit.release(limit.acquire(), 429)
+        assert limit.limit == 2
+        limit.release(slots[3], 200)
+        assert limit.get_stats()["in_flight"] == 0
+
+    def test_unhealthy_outcomes_do_not_grow(self, clock):
+        """Test that slow successes and non-overload failures leave the limit alone"""
+        limit = AdaptiveLimit("https://up.example", initial_limit=1, latency_tolerance=2.0)
+        slot = limit.acquire()
+        clock.now += 1
+        limit.release(slot, 200)
+        assert limit.limit == 2
+
+        for outcome in ((500, None), (None, ConnectionError("refused")), (200, None)):
+            slots = [limit.acquire(), limit.acquire()]
+            clock.now += 5
+            for slot in slots:
+                limit.release(slot, *outcome)
+        assert limit.limit == 2
+        assert (limit.increased, limit.decreased) == (1, 0)
+
+    def test_waiters_and_timeout(self):
+        """Test that attempts over the limit wait for a release and are rejected after max_wait"""
+        limit = AdaptiveLimit("https://up.example", initial_limit=1, max_wait=0.05)
+        slot = limit.acquire()
+        with pytest.raises(AdmissionRejected) as exc_info:
+            limit.acquire()
+        assert exc_info.value.reason == "upstream_limit"
+
+        limit.max_wait = 5
+        granted = []
+        waiter = threading.Thread(target=lambda: granted.append(limit.acquire()))
+        waiter.start()
+        while not limit.get_stats()["waiting"]:
+            pass
+        limit.release(slot, 500)
+        waiter.join(timeout=5)
+        assert len(granted) == 1
+        assert limit.get_stats()["in_flight"] == 1
+        assert ConcurrencyLimits().for_url("https://up.example/v1/models").origin == "https://up.example"
+
+    def test_recategorized_overload_cuts_limit(self):
+        """Test that an overload message recategorized to 429 halves the origin's limit and shows on /metrics"""
+        replies = [_upstream(200, {"error": {"message": "The model is overloaded. Please try again later."}}),
+                   _upstream(200, {"choices": [{"message": {"content": "Hello there, how are you today?"}}]})]
+        client = app.test_client()
+        configure_metrics({})
+        configure_concurrency_limits({"enabled": True, "initial_limit": 8})
+        try:
+            with patch.dict(default_config._config, {"target_proxy": {"url": "https://proxy.example.com/v1/chat/completions"}}), \
+                    patch("requests.Session.request", side_effect=replies) as upstream:
+                response = client.post(
+                    "/chat/completions", json={"model": "m", "messages": [{"role": "user", "content": "Hi"}]})
+
+            assert response.status_code == 200
+            assert upstream.call_count == 2
+            origin = client.get("/health/detailed").get_json()["concurrency_limit"]["origins"]["https://proxy.example.com"]
+            assert (origin["limit"], origin["decreased"], origin["in_flight"]) == (4, 1, 0)
+            text = client.get("/metrics").get_data(as_text=True)
+            assert 'proxy_upstream_concurrency_limit{origin="https://proxy.example.com"} 4' in text
+        finally:
+            configure_concurrency_limits(None)
+            configure_metrics({})
+        assert get_concurrency_limits() is None
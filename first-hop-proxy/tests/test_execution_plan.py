@@ -0,0 +1,161 @@
+import pytest
+import os
+import sys
+
+# Add src directory to path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from first_hop_proxy.config import Config
+from first_hop_proxy.execution_plan import ExecutionPlanCache
+from first_hop_proxy.error_handler import ErrorHandler
+from first_hop_proxy.response_parser import ResponseParser, parse_json_path
+from first_hop_proxy.utils import compile_regex_rules, apply_regex_replacements
+
+
+CONFIG_YAML = """
+target_proxy:
+  url: "https://proxy.example.com/chat/completions"
+regex_replacement:
+  enabled: true
+  rules:
+    - pattern: "foo"
+      replacement: "bar"
+      flags: "i"
+      apply_to: "User"
+"""
+
+
+class TestExecutionPlanCache:
+    """Test suite for compiled per-config execution plans"""
+
+    @pytest.fixture
+    def config_file(self, tmp_path):
+        """Write a config file with one regex rule"""
+        path = tmp_path / "config-test.yaml"
+        path.write_text(CONFIG_YAML)
+        return path
+
+    def test_repeated_lookups_reuse_the_plan(self, config_file):
+        """Test that an unchanged file is parsed once"""
+        cache = ExecutionPlanCache()
+        first = cache.get_for_file(str(config_file))
+        second = cache.get_for_file(str(config_file))
+
+        assert first is second
+        assert cache.get_stats()["builds"] == 1
+        assert cache.get_stats()["hits"] == 1
+
+    def test_changed_file_rebuilds_plan(self, config_file):
+        """Test that editing the file invalidates the cached plan"""
+        cache = ExecutionPlanCache()
+        first = cache.get_for_file(str(config_file))
+
+        config_file.write_text(CONFIG_YAML.replace("proxy.example.com", "other.example.com"))
+        stat = os.stat(config_file)
+        os.utime(config_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+        second = cache.get_for_file(str(config_file))
+        assert second is not first
+        assert second.config.get_target_proxy_config()["url"] == "https://other.example.com/chat/completions"
+
+    def test_touched_but_unchanged_file_keeps_plan(self, config_file):
+        """Test that an mtime change with identical content reuses the plan via the hash"""
+        cache = ExecutionPlanCache()
+        first = cache.get_for_file(str(config_file))
+
+        stat = os.stat(config_file)
+        os.utime(config_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+        assert cache.get_for_file(str(config_file)) is first
+        assert cache.get_stats()["builds"] == 1
+
+    def test_missing_file_raises(self, tmp_path):
+        """Test that missing config files raise FileNotFoundError"""
+        with pytest.raises(FileNotFoundError):
+            ExecutionPlanCache().get_for_file(str(tmp_path / "config-missing.yaml"))
+
+    def test_plan_compiles_request_rules(self, config_file):
+        """Test that regex rules are compiled once with flags and lowercased apply_to"""
+        plan = ExecutionPlanCache().get_for_file(str(config_file))
+
+        assert len(plan.request_rules) == 1
+        rule = plan.request_rules[0]
+        assert rule.regex.pattern == "foo"
+        assert rule.apply_to == "user"
+        assert apply_regex_replacements("FOO", plan.request_rules) == "bar"
+
+    def test_plan_is_found_from_its_config(self, config_file):
+        """Test that get_for_config resolves file plans through their Config"""
+        cache = ExecutionPlanCache()
+        plan = cache.get_for_file(str(config_file))
+        assert cache.get_for_config(plan.config) is plan
+
+    def test_clients_are_cached_per_target_url(self, config_file):
+        """Test that ProxyClient/ErrorHandler objects are built once and share the parser"""
+        plan = ExecutionPlanCache().get_for_file(str(config_file))
+
+        chat = plan.get_proxy_client("https://proxy.example.com/chat/completions")
+        assert plan.get_proxy_client("https://proxy.example.com/chat/completions") is chat
+        assert plan.get_proxy_client("https://proxy.example.com/models") is not chat
+        assert chat.response_parser is plan.response_parser
+        assert plan.get_error_handler() is plan.get_error_handler()
+
+    def test_in_memory_config_plans_are_bounded(self):
+        """Test that plans for ad-hoc Config objects do not grow without bound"""
+        cache = ExecutionPlanCache(max_config_plans=2)
+        configs = [Config() for _ in range(3)]
+        for config in configs:
+            cache.get_for_config(config)
+        assert cache.get_stats()["config_plans"] == 2
+
+    def test_in_memory_config_fingerprint_is_stable(self):
+        """Test that equal in-memory configs get the same fingerprint, so cache keys survive restarts"""
+        first, second = Config(), Config()
+        first.load_from_string(CONFIG_YAML)
+        second.load_from_string(CONFIG_YAML)
+        fingerprint = ExecutionPlanCache().get_for_config(first).fingerprint
+        assert fingerprint and fingerprint == ExecutionPlanCache().get_for_config(second).fingerprint
+        assert ExecutionPlanCache().get_for_config(Config()).fingerprint != fingerprint
+
+
+class TestPrecompiledRules:
+    """Test suite for rules compiled ahead of use"""
+
+    def test_compile_regex_rules_skips_invalid_patterns(self):
+        """Test that invalid and empty patterns are dropped at compile time"""
+        compiled = compile_regex_rules([{"pattern": "("}, {"pattern": ""}, {"pattern": "a", "replacement": "b"}])
+        assert [rule.regex.pattern for rule in compiled] == ["a"]
+
+    def test_parse_json_path(self):
+        """Test dot-notation path parsing with array indices"""
+        assert parse_json_path("error.details[0].message") == [("error", None), ("details", 0), ("message", None)]
+
+    def test_response_parser_uses_precompiled_paths(self):
+        """Test that configured JSON paths are parsed at construction and still resolve"""
+        config = Config()
+        config._config["response_parsing"] = {
+            "enabled": True,
+            "json_extraction": {"enabled": True, "paths": ["error.details[0].message"]},
+            "status_recategorization": {"enabled": True, "rules": [
+                {"pattern": "quota", "original_status": 200, "new_status": 429}
+            ]}
+        }
+        parser = ResponseParser(config)
+
+        assert "error.details[0].message" in parser._json_path_cache
+        status, info = parser.parse_and_recategorize('{"error": {"details": [{"message": "Quota exceeded"}]}}', 200)
+        assert status == 429
+        assert info["recategorized"] is True
+
+    def test_error_handler_skips_invalid_hard_stop_patterns(self):
+        """Test that hard stop rules are compiled once and invalid patterns ignored"""
+        handler = ErrorHandler(hard_stop_config={"enabled": True, "rules": [
+            {"pattern": "(", "description": "broken"},
+            {"pattern": "policy violation", "description": "policy"}
+        ]})
+
+        class Response:
+            text = "Upstream POLICY VIOLATION"
+
+        assert len(handler.hard_stop_patterns) == 1
+        assert handler.check_hard_stop_conditions(Response())["description"] == "policy"
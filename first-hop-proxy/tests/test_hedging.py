@@ -0,0 +1,170 @@
+"""
+Tests for request hedging of latency-critical operations
+"""
+import os
+import sys
+import json
+import asyncio
+import threading
+import pytest
+import requests
+from unittest.mock import patch
+
+# Add src directory to path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from first_hop_proxy.hedging import HedgePolicy, HedgeBudget, Hedger, configure_hedging, get_hedger
+from first_hop_proxy.main import app, config as default_config
+from conftest import st_metadata
+
+
+class _Reply:
+    """Attempt result that records whether the losing copy was closed"""
+
+    def __init__(self, name):
+        self.name = name
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class TestHedging:
+    """Test cases for hedging policies, the budget and hedged requests"""
+
+    def test_policy_delay(self):
+        """Test fixed delays, percentile delays and the sample threshold"""
+        assert HedgePolicy("chat", delay=2.5).current_delay() == 2.5
+        with pytest.raises(ValueError):
+            HedgePolicy("chat")
+
+        policy = HedgePolicy("chat", percentile=0.9, min_delay=0.5, min_samples=10, window=10)
+        for latency in range(1, 10):
+            policy.record_latency(float(latency))
+        assert policy.current_delay() is None
+        policy.record_latency(10.0)
+        assert policy.current_delay() == 9.0
+        for _ in range(10):
+            policy.record_latency(0.1)
+        assert policy.current_delay() == 0.5
+
+        hedger = Hedger({"chat": {"delay": 1}, "detect_scene_break*": {"delay": 3}})
+        assert hedger.policy_for("detect_scene_break_FORCED").name == "detect_scene_break*"
+        assert hedger.policy_for("lorebook") is None and hedger.policy_for(None) is None
+
+    def test_budget(self):
+        """Test that hedges are limited to the budget ratio of attempts"""
+        budget = HedgeBudget(ratio=0.25, burst=1)
+        for _ in range(3):
+            budget.record_attempt()
+        assert not budget.try_spend()
+        for _ in range(5):
+            budget.record_attempt()
+        assert budget.try_spend()
+        assert not budget.try_spend()
+
+    def test_slow_attempt_is_hedged(self):
+        """Test that the hedge wins over a straggler, which is closed once it finishes"""
+        hedger = Hedger({"chat": {"delay": 0.01, "target_url": "https://backup.example"}}, budget_ratio=1.0)
+        policy = hedger.policy_for("chat")
+        release = threading.Event()
+        primary = _Reply("primary")
+        targets = []
+
+        def attempt(target_url):
+            targets.append(target_url)
+            if target_url is None:
+                release.wait(5)
+                return primary
+            return _Reply("hedge")
+
+        assert hedger.run(policy, attempt).name == "hedge"
+        assert targets == [None, "https://backup.example"]
+        release.set()
+        for _ in range(500):
+            if primary.closed:
+                break
+            threading.Event().wait(0.01)
+        assert primary.closed
+        assert policy.get_stats()["hedge_won"] == 1
+
+    def test_fast_or_failed_attempts_are_not_hedged(self):
+        """Test that fast attempts, early failures and an empty budget send no hedge"""
+        hedger = Hedger({"chat": {"delay": 5}}, budget_ratio=1.0)
+        policy = hedger.policy_for("chat")
+        calls = []
+
+        def fast(target_url):
+            calls.append(target_url)
+            return "ok"
+
+        def broken(target_url):
+            calls.append(target_url)
+            raise requests.exceptions.ConnectionError("refused")
+
+        assert hedger.run(policy, fast) == "ok"
+        with pytest.raises(requests.exceptions.ConnectionError):
+            hedger.run(policy, broken)
+        assert calls == [None, None]
+
+        def slow(target_url):
+            threading.Event().wait(0.05)
+            return "slow"
+
+        starved = Hedger({"chat": {"delay": 0.01}}, budget_ratio=0.0)
+        assert starved.run(starved.policy_for("chat"), slow) == "slow"
+        assert starved.policy_for("chat").get_stats()["budget_exhausted"] == 1
+
+    def test_async_loser_is_cancelled(self):
+        """Test that the asyncio variant cancels the slower copy"""
+        hedger = Hedger({"chat": {"delay": 0.01}}, budget_ratio=1.0)
+        policy = hedger.policy_for("chat")
+        cancelled = []
+
+        async def attempt(target_url):
+            if not cancelled:
+                cancelled.append(False)
+                try:
+                    await asyncio.sleep(5)
+                except asyncio.CancelledError:
+                    cancelled[0] = True
+                    raise
+                return "primary"
+            return "hedge"
+
+        assert asyncio.run(hedger.run_async(policy, attempt)) == "hedge"
+        assert cancelled == [True]
+        assert policy.get_stats()["hedge_won"] == 1
+
+    def test_endpoint_hedges_chat(self):
+        """Test that a stalled chat request is answered by a hedge sent to the alternate target"""
+        release = threading.Event()
+
+        def upstream(*args, **kwargs):
+            url = kwargs.get("url") or args[1]
+            if "backup" not in url:
+                release.wait(5)
+            response = requests.Response()
+            response.status_code = 200
+            response.headers["Content-Type"] = "application/json"
+            response._content = json.dumps(
+                {"choices": [{"message": {"content": f"Hello there from {url}"}}]}).encode()
+            return response
+
+        configure_hedging({"enabled": True, "budget_ratio": 1.0,
+                           "operations": {"chat": {"delay": 0.05, "target_url": "https://backup.example.com/v1/chat/completions"}}})
+        try:
+            with patch.dict(default_config._config, {"target_proxy": {"url": "https://proxy.example.com/v1/chat/completions"}}), \
+                    patch("requests.Session.request", side_effect=upstream):
+                response = app.test_client().post("/chat/completions", json={
+                    "model": "m", "messages": [{"role": "user", "content": st_metadata("chat") + "Hi"}]})
+                release.set()
+
+            assert response.status_code == 200
+            assert "backup.example.com" in response.get_json()["choices"][0]["message"]["content"]
+            stats = app.test_client().get("/health/detailed").get_json()["hedging"]
+            assert stats["operations"]["chat"]["hedge_won"] == 1
+        finally:
+            release.set()
+            configure_hedging(None)
+        assert get_hedger() is None
@@ -0,0 +1,129 @@
+"""
+Tests for the SQLite request log index
+"""
+import os
+import json
+import pytest
+import tempfile
+import shutil
+import sys
+
+# Add src directory to path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from first_hop_proxy.log_index import LogIndex, configure_log_index, get_log_index, main as log_index_main
+from first_hop_proxy.request_logger import RequestLogger
+from first_hop_proxy.error_logger import ErrorLogger
+from first_hop_proxy.main import app
+
+CHAT_INFO = ("Senta", "2025-11-01@20h29m24s", "chat")
+REQUEST = {"model": "m", "messages": [{"role": "user", "content": "Hi"}]}
+RESPONSE = {"choices": [{"message": {"content": "Hello"}}], "usage": {"prompt_tokens": 30, "completion_tokens": 7}}
+
+
+class TestLogIndex:
+    """Test cases for LogIndex and the loggers that feed it"""
+
+    @pytest.fixture
+    def temp_dir(self):
+        """Create a temporary directory for test logs"""
+        temp_dir = tempfile.mkdtemp()
+        yield temp_dir
+        if os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir)
+
+    @pytest.fixture
+    def index(self, temp_dir):
+        """Enable the process-wide index for one test"""
+        index = configure_log_index({"enabled": True, "path": os.path.join(temp_dir, "index.sqlite3")})
+        yield index
+        configure_log_index(None)
+
+    def _log_retried_request(self, temp_dir, log_format="markdown"):
+        """Log a request whose first attempt is rate limited and whose retry succeeds"""
+        request_logger = RequestLogger({"logging": {"enabled": True, "folder": os.path.join(temp_dir, "logs"),
+                                                    "format": log_format}})
+        path = request_logger.start_request_log("abc", "/chat/completions", REQUEST, {}, 100.0,
+                                                character_chat_info=CHAT_INFO, config_path="/cfg/config-a.yaml")
+        path = request_logger.finalize_log_with_error(path, Exception("429 rate limit"), end_time=101.0, duration=1.0)
+        path = request_logger.start_request_log("abc-retry1", "/chat/completions", REQUEST, {}, 102.0,
+                                                character_chat_info=CHAT_INFO, is_proxy_retry=True,
+                                                previous_filepath=path, config_path="/cfg/config-a.yaml")
+        request_logger.complete_request_log(path, response_data=RESPONSE, end_time=105.0, duration=3.0)
+        return path
+
+    def test_one_row_per_attempt(self, temp_dir, index):
+        """Test that each attempt is indexed with its outcome, tokens and final file path"""
+        final_path = self._log_retried_request(temp_dir)
+        first, second = index.query(order="start_time")
+
+        assert (first["request_id"], first["character"], first["chat"], first["operation"]) == (
+            "abc", "Senta", "2025-11-01@20h29m24s", "chat")
+        assert first["config_path"] == "/cfg/config-a.yaml"
+        assert first["status"] == "ratelimit" and first["retry_count"] == 0
+        assert first["file_path"].endswith("00001-chat-RATELIMIT.md") and os.path.exists(first["file_path"])
+        assert first["error_message"] == "429 rate limit"
+
+        assert second["request_id"] == "abc" and second["retry_count"] == 1
+        assert (second["status"], second["duration"], second["end_time"]) == ("success", 3.0, 105.0)
+        assert (second["prompt_tokens"], second["completion_tokens"]) == (30, 7)
+        assert second["file_path"] == final_path
+        assert index.get_stats()["open_attempts"] == 0
+
+    def test_records_format_attempts_share_a_file(self, temp_dir, index):
+        """Test that records-format attempts get separate rows pointing at the same file"""
+        path = self._log_retried_request(temp_dir, log_format="records")
+        rows = index.query(order="start_time")
+        assert [row["status"] for row in rows] == ["ratelimit", "success"]
+        assert {row["file_path"] for row in rows} == {path}
+
+    def test_filters_and_aggregates(self, temp_dir, index):
+        """Test filtering by column, time and duration, and grouping"""
+        self._log_retried_request(temp_dir)
+        error_logger = ErrorLogger({"error_logging": {"enabled": True, "folder": os.path.join(temp_dir, "errors")}})
+        error_logger.log_error(Exception("boom"), {"request_id": "abc"}, character_chat_info=CHAT_INFO)
+
+        assert [row["status"] for row in index.query({"status": "success"})] == ["success"]
+        assert len(index.query({"min_duration": 2})) == 1
+        assert index.query({"since": 102.0, "until": 200}) == index.query({"status": "success"})
+        errors = index.query({"kind": "error"})
+        assert len(errors) == 1 and errors[0]["error_type"] == "Exception"
+
+        (group,) = index.aggregate("operation")
+        assert (group["operation"], group["count"], group["failures"], group["retries"]) == ("chat", 2, 1, 1)
+        assert (group["prompt_tokens"], group["max_duration"]) == (30, 3.0)
+        with pytest.raises(ValueError):
+            index.aggregate("file_path; DROP TABLE log_entries")
+        with pytest.raises(ValueError):
+            index.query(order="nope")
+
+    def test_query_endpoint(self, temp_dir, index):
+        """Test /logs/query rows, groups and invalid parameters"""
+        self._log_retried_request(temp_dir)
+        client = app.test_client()
+
+        rows = client.get("/logs/query?character=Senta&status=ratelimit").get_json()["rows"]
+        assert len(rows) == 1 and rows[0]["retry_count"] == 0
+        groups = client.get("/logs/query?group_by=status").get_json()["groups"]
+        assert {group["status"]: group["count"] for group in groups} == {"ratelimit": 1, "success": 1}
+        assert client.get("/logs/query?group_by=file_path").status_code == 400
+
+    def test_disabled_by_default(self, temp_dir):
+        """Test that no index is written unless enabled"""
+        assert get_log_index() is None
+        self._log_retried_request(temp_dir)
+        assert not os.path.exists(os.path.join(temp_dir, "index.sqlite3"))
+        assert app.test_client().get("/logs/query").status_code == 404
+
+    def test_cli(self, temp_dir, index, capsys):
+        """Test querying the index from the command line"""
+        self._log_retried_request(temp_dir)
+        assert log_index_main(["--db", index.path, "--group-by", "character"]) == 0
+        (group,) = json.loads(capsys.readouterr().out)
+        assert (group["character"], group["count"]) == ("Senta", 2)
+
+        reader = LogIndex(index.path)
+        try:
+            assert len(reader.query({"character": "Senta"})) == 2
+        finally:
+            reader.close()
@@ -0,0 +1,133 @@
+"""
+Tests for the append-only records log format
+"""
+import os
+import re
+import json
+import pytest
+import tempfile
+import shutil
+import sys
+
+# Add src directory to path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from first_hop_proxy.log_records import read_log_records, render_log_records, main as log_records_main
+from first_hop_proxy.log_writer import AsyncLogWriter
+from first_hop_proxy.request_logger import RequestLogger, PAYLOAD_DROPPED_NOTE
+
+CHAT_INFO = ("Senta", "2025-11-01@20h29m24s", "chat")
+REQUEST = {"model": "m", "messages": [{"role": "user", "content": "Hi\nthere"}]}
+RESPONSE = {"choices": [{"message": {"content": "Hello"}}], "usage": {"prompt_tokens": 3, "completion_tokens": 1, "total_tokens": 4}}
+
+
+def _without_timestamps(text):
+    """Blank out ISO timestamps so logs written at different times can be compared"""
+    return re.sub(r"\d{4}-\d{2}-\d{2}T[\d:.]+", "<ts>", text)
+
+
+def _read(path):
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+class TestLogRecords:
+    """Test cases for records-format request logs and their markdown rendering"""
+
+    @pytest.fixture
+    def temp_dir(self):
+        """Create a temporary directory for test logs"""
+        temp_dir = tempfile.mkdtemp()
+        yield temp_dir
+        if os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir)
+
+    def _logger(self, temp_dir, subfolder, log_format="records", writer=None):
+        return RequestLogger({"logging": {"enabled": True, "folder": os.path.join(temp_dir, subfolder),
+                                          "format": log_format}}, writer=writer)
+
+    def _log_retried_request(self, request_logger):
+        """Log a request whose first attempt is rate limited and whose second succeeds"""
+        path = request_logger.start_request_log("abc", "/chat/completions", REQUEST, {"Authorization": "Bearer secret"},
+                                                1.0, character_chat_info=CHAT_INFO)
+        path = request_logger.finalize_log_with_error(path, Exception("429 rate limit"), end_time=2.0, duration=1.0)
+        path = request_logger.start_request_log("abc", "/chat/completions", REQUEST, {}, 3.0,
+                                                character_chat_info=CHAT_INFO, is_proxy_retry=True,
+                                                previous_filepath=path)
+        request_logger.append_retry_note(path, "refusal", retry_attempt=1, content_preview="I cannot")
+        request_logger.complete_request_log(path, response_data=RESPONSE, response_headers={}, end_time=5.0, duration=2.0)
+        return path
+
+    def test_retries_append_to_one_file(self, temp_dir):
+        """Test that every attempt of a request is appended to one .jsonl file without renames"""
+        path = self._log_retried_request(self._logger(temp_dir, "logs"))
+
+        assert os.path.basename(path) == "00001-chat.jsonl"
+        assert os.listdir(os.path.dirname(path)) == ["00001-chat.jsonl"]
+        records = read_log_records(path)
+        assert [record["type"] for record in records] == ["start", "end", "attempt", "retry_note", "end"]
+        assert records[0]["headers"]["Authorization"] != "Bearer secret"
+        assert records[1]["error_message"] == "429 rate limit"
+        assert records[4]["usage"]["total_tokens"] == 4
+
+    def test_rendered_markdown_matches_markdown_format(self, temp_dir):
+        """Test that a rendered single attempt equals the markdown format's log"""
+        markdown_logger = self._logger(temp_dir, "md", log_format="markdown")
+        records_logger = self._logger(temp_dir, "records")
+        paths = []
+        for request_logger in (markdown_logger, records_logger):
+            path = request_logger.start_request_log("abc", "/chat/completions", REQUEST, {}, 1.0, character_chat_info=CHAT_INFO)
+            request_logger.append_retry_note(path, "refusal", retry_attempt=1)
+            request_logger.complete_request_log(path, response_data=RESPONSE, response_headers={}, end_time=2.0, duration=1.0)
+            paths.append(path)
+
+        rendered = render_log_records(read_log_records(paths[1]))
+        assert _without_timestamps(rendered) == _without_timestamps(_read(paths[0]))
+
+    def test_rendered_retries_keep_analysis_fields(self, temp_dir):
+        """Test that each rendered attempt has the fields the analysis scripts parse"""
+        path = self._log_retried_request(self._logger(temp_dir, "logs"))
+        rendered = render_log_records(read_log_records(path))
+
+        assert rendered.count("# Request Log - ") == 2
+        assert "**Status:** ❌ Failed - Exception" in rendered
+        assert "**Status:** ✅ Success" in rendered
+        assert "**Start Time:** 3.0" in rendered
+        assert "**Total Duration:** 2.000 seconds" in rendered
+        assert "**Prompt Tokens:** 3" in rendered
+        assert "## Proxy Retry Note" in rendered
+
+    def test_async_writer_matches_synchronous(self, temp_dir):
+        """Test that appending through the log writer produces the same records"""
+        sync_path = self._log_retried_request(self._logger(temp_dir, "sync"))
+        writer = AsyncLogWriter()
+        try:
+            async_path = self._log_retried_request(self._logger(temp_dir, "async", writer=writer))
+            assert writer.flush(5)
+        finally:
+            writer.close()
+
+        assert _without_timestamps(_read(async_path)) == _without_timestamps(_read(sync_path))
+
+    def test_dropped_payload_and_partial_lines(self, temp_dir):
+        """Test rendering a shed request body and skipping a truncated last line"""
+        path = os.path.join(temp_dir, "00001-chat.jsonl")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"type": "start", "request_id": "abc", "endpoint": "/chat/completions",
+                                "start_time": 1.0, "logged_at": "now", "payload_dropped": True}) + "\n")
+            f.write('{"type": "end", "respon')
+
+        records = read_log_records(path)
+        assert len(records) == 1
+        rendered = render_log_records(records)
+        assert PAYLOAD_DROPPED_NOTE in rendered
+        assert "*Waiting for response...*" in rendered
+
+    def test_cli_writes_markdown(self, temp_dir, capsys):
+        """Test that the command line renders a folder of logs next to the originals"""
+        path = self._log_retried_request(self._logger(temp_dir, "logs"))
+
+        assert log_records_main([temp_dir, "--write"]) == 0
+        md_path = path[:-len(".jsonl")] + ".md"
+        assert capsys.readouterr().out.strip() == md_path
+        assert "**Total Duration:** 2.000 seconds" in _read(md_path)
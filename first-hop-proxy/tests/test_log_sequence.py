@@ -0,0 +1,119 @@
+"""
+Tests for per-folder log sequence numbering
+"""
+import os
+import time
+import threading
+import multiprocessing
+import pytest
+import tempfile
+import shutil
+import sys
+from unittest.mock import patch
+
+# Add src directory to path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from first_hop_proxy.log_sequence import LogSequenceAllocator, SEQUENCE_LOCK_FILENAME, configure_log_sequence, get_log_sequence
+from first_hop_proxy.request_logger import RequestLogger
+from first_hop_proxy.error_logger import ErrorLogger
+
+
+def _allocate_many(folder, count, results):
+    """Allocate numbers from a separate process"""
+    allocator = LogSequenceAllocator(cross_process=True)
+    results.extend([allocator.allocate(folder) for _ in range(count)])
+
+
+class TestLogSequenceAllocator:
+    """Test cases for LogSequenceAllocator"""
+
+    @pytest.fixture
+    def temp_dir(self):
+        """Create a temporary directory for test logs"""
+        temp_dir = tempfile.mkdtemp()
+        yield temp_dir
+        if os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir)
+
+    def _touch(self, folder, *names):
+        """Create placeholder files"""
+        for name in names:
+            with open(os.path.join(folder, name), 'w') as f:
+                f.write("test")
+
+    def test_seeded_from_one_scan(self, temp_dir):
+        """Test that numbering continues after existing logs of any operation and scans only once"""
+        self._touch(temp_dir, "00001-chat.md", "00007-lorebook_entry_lookup-character-A-PROXY-RATELIMIT.md",
+                    "00003-chat-ERROR.md", "notes.txt", "99-x.log")
+        allocator = LogSequenceAllocator()
+
+        assert allocator.peek(temp_dir) == 8
+        assert [allocator.allocate(temp_dir) for _ in range(3)] == [8, 9, 10]
+        with patch("first_hop_proxy.log_sequence.os.scandir") as scandir:
+            assert allocator.allocate(temp_dir) == 11
+            scandir.assert_not_called()
+        assert allocator.get_stats()["folder_scans"] == 1
+
+    def test_folders_are_independent(self, temp_dir):
+        """Test that each folder has its own sequence starting at 1"""
+        allocator = LogSequenceAllocator()
+        other = os.path.join(temp_dir, "other")
+        assert allocator.allocate(temp_dir) == 1
+        assert allocator.allocate(other) == 1
+        assert allocator.allocate(os.path.join(temp_dir, ".")) == 2
+
+    def test_concurrent_threads_get_unique_numbers(self, temp_dir):
+        """Test that threads never receive the same number"""
+        allocator = LogSequenceAllocator()
+        results = []
+        lock = threading.Lock()
+
+        def worker():
+            numbers = [allocator.allocate(temp_dir) for _ in range(200)]
+            with lock:
+                results.extend(numbers)
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert sorted(results) == list(range(1, 1601))
+
+    def test_cross_process_numbers_are_unique(self, temp_dir):
+        """Test that processes sharing a folder do not reuse numbers"""
+        self._touch(temp_dir, "00004-chat.md")
+        with multiprocessing.Manager() as manager:
+            results = manager.list()
+            processes = [multiprocessing.Process(target=_allocate_many, args=(temp_dir, 50, results)) for _ in range(3)]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join(30)
+            numbers = sorted(results)
+        assert numbers == list(range(5, 155))
+        assert not os.path.exists(os.path.join(temp_dir, SEQUENCE_LOCK_FILENAME))
+
+    def test_stale_lock_is_removed(self, temp_dir):
+        """Test that a lock file left by a crashed process does not block allocation"""
+        lock_path = os.path.join(temp_dir, SEQUENCE_LOCK_FILENAME)
+        self._touch(temp_dir, SEQUENCE_LOCK_FILENAME)
+        os.utime(lock_path, (time.time() - 120, time.time() - 120))
+
+        allocator = LogSequenceAllocator(cross_process=True, stale_lock_seconds=30)
+        assert allocator.allocate(temp_dir) == 1
+        assert allocator.get_stats()["lock_timeouts"] == 0
+
+    def test_loggers_share_the_process_wide_sequence(self, temp_dir):
+        """Test that request and error logs in the same folder are numbered together"""
+        configure_log_sequence({})
+        request_logger = RequestLogger({"logging": {"enabled": True, "folder": temp_dir}})
+        error_logger = ErrorLogger({"error_logging": {"enabled": True, "folder": temp_dir}})
+        folder = os.path.join(temp_dir, "characters", "Senta", "chat1")
+
+        first, _ = request_logger._get_sequenced_filename("chat", folder)
+        second, _ = error_logger._get_sequenced_error_filename("chat", folder)
+        assert (first, second) == ("00001-chat.md", "00002-chat-ERROR.md")
+        assert request_logger._get_next_log_number(folder, "chat") == 3
+        assert get_log_sequence().get_stats()["allocated"] == 2
@@ -0,0 +1,126 @@
+"""
+Tests for the background request log writer
+"""
+import os
+import re
+import threading
+import pytest
+import tempfile
+import shutil
+import sys
+
+# Add src directory to path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from first_hop_proxy.log_writer import AsyncLogWriter, LogEvent, configure_log_writer, get_log_writer, shutdown_log_writer
+from first_hop_proxy.request_logger import RequestLogger, PAYLOAD_DROPPED_NOTE
+
+CHAT_INFO = ("Senta", "2025-11-01@20h29m24s", "chat")
+REQUEST = {"model": "m", "messages": [{"role": "user", "content": "Hi\nthere"}]}
+RESPONSE = {"choices": [{"message": {"content": "Hello"}}], "usage": {"prompt_tokens": 3, "completion_tokens": 1, "total_tokens": 4}}
+
+
+def _without_timestamps(text):
+    """Blank out ISO timestamps so sync and async logs can be compared"""
+    return re.sub(r"\d{4}-\d{2}-\d{2}T[\d:.]+", "<ts>", text)
+
+
+def _read(path):
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+class TestAsyncLogWriter:
+    """Test cases for AsyncLogWriter and RequestLogger's use of it"""
+
+    @pytest.fixture
+    def temp_dir(self):
+        """Create a temporary directory for test logs"""
+        temp_dir = tempfile.mkdtemp()
+        yield temp_dir
+        if os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir)
+
+    @pytest.fixture
+    def writer(self):
+        """A writer that is drained after the test"""
+        writer = AsyncLogWriter()
+        yield writer
+        writer.close()
+
+    def _logger(self, temp_dir, writer, subfolder):
+        return RequestLogger({"logging": {"enabled": True, "folder": os.path.join(temp_dir, subfolder)}}, writer=writer)
+
+    def _log_request(self, request_logger):
+        """Start, annotate and complete one request log"""
+        path = request_logger.start_request_log("abc", "/chat/completions", REQUEST, {"Authorization": "Bearer secret"},
+                                                1.0, character_chat_info=CHAT_INFO)
+        request_logger.append_retry_note(path, "refusal", retry_attempt=1, content_preview="I cannot")
+        request_logger.complete_request_log(path, response_data=RESPONSE, response_headers={}, end_time=2.0, duration=1.0)
+        return path
+
+    def test_async_logs_match_synchronous_logs(self, temp_dir, writer):
+        """Test that the writer produces the same file as writing on the request thread"""
+        sync_path = self._log_request(self._logger(temp_dir, None, "sync"))
+        async_path = self._log_request(self._logger(temp_dir, writer, "async"))
+
+        assert writer.flush(5)
+        assert os.path.basename(async_path) == os.path.basename(sync_path) == "00001-chat.md"
+        assert _without_timestamps(_read(async_path)) == _without_timestamps(_read(sync_path))
+        assert "**Total Tokens:** 4" in _read(async_path)
+        assert writer.get_stats()["open_logs"] == 0
+
+    def test_finalize_with_error_renames_in_background(self, temp_dir, writer):
+        """Test that a failed attempt is completed and renamed with its error suffix"""
+        request_logger = self._logger(temp_dir, writer, "logs")
+        path = request_logger.start_request_log("abc", "/chat/completions", REQUEST, {}, 1.0, character_chat_info=CHAT_INFO)
+        new_path = request_logger.finalize_log_with_error(path, Exception("429 rate limit"), end_time=2.0, duration=1.0)
+
+        assert new_path.endswith("00001-chat-RATELIMIT.md")
+        assert writer.flush(5)
+        assert not os.path.exists(path)
+        assert "**Status:** ❌ Failed - Exception" in _read(new_path)
+
+    def test_drop_payload_under_backpressure(self, temp_dir):
+        """Test that bodies are omitted once the queue passes its high watermark"""
+        release = threading.Event()
+        writer = AsyncLogWriter(max_queue=4, backpressure="drop_payload", high_watermark=0.5)
+        # Keep the writer thread busy so events pile up
+        writer.submit(LogEvent(os.path.join(temp_dir, "blocker.md"), lambda existing: release.wait(5) and "done"))
+        request_logger = self._logger(temp_dir, writer, "logs")
+        paths = [request_logger.start_request_log(str(i), "/chat/completions", REQUEST, {}, 1.0) for i in range(5)]
+
+        stats = writer.get_stats()
+        release.set()
+        writer.close()
+
+        assert stats["payloads_dropped"] > 0
+        assert stats["events_dropped"] > 0
+        written = [_read(path) for path in paths if os.path.exists(path)]
+        assert any(PAYLOAD_DROPPED_NOTE in content for content in written)
+        assert any('"Hi\\nthere"' in content for content in written)
+
+    def test_close_drains_queue(self, temp_dir):
+        """Test that queued logs are written on shutdown and late logs are written inline"""
+        writer = AsyncLogWriter(fsync="interval")
+        request_logger = self._logger(temp_dir, writer, "logs")
+        paths = [request_logger.start_request_log(str(i), "/chat/completions", REQUEST, {}, 1.0) for i in range(20)]
+        assert writer.close(5)
+        assert all("*Waiting for response...*" in _read(path) for path in paths)
+
+        assert request_logger.complete_request_log(paths[0], response_data=RESPONSE, end_time=2.0, duration=1.0)
+        assert "**Status:** ✅ Success" in _read(paths[0])
+
+    def test_configuration(self):
+        """Test enabling, disabling and validating the process-wide writer"""
+        assert AsyncLogWriter.from_config({"enabled": False}) is None
+        with pytest.raises(ValueError):
+            AsyncLogWriter(backpressure="discard")
+
+        writer = configure_log_writer({"max_queue": 8, "fsync": "always"})
+        try:
+            assert get_log_writer() is writer
+            assert writer.get_stats()["max_queue"] == 8
+        finally:
+            assert shutdown_log_writer()
+        assert get_log_writer() is None
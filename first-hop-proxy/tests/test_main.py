@@ -810,7 +810,7 @@ error_logging:
         os.chdir(tmp_path)
 
         try:
-            with patch('first_hop_proxy.proxy_client.requests.request') as mock_request:
+            with patch('requests.Session.request') as mock_request:
                 # Mock successful response
                 mock_response = Mock()
                 mock_response.status_code = 200
@@ -891,7 +891,7 @@ error_logging:
         os.chdir(tmp_path)
 
         try:
-            with patch('first_hop_proxy.proxy_client.requests.request') as mock_request:
+            with patch('requests.Session.request') as mock_request:
                 # Mock successful response
                 mock_response = Mock()
                 mock_response.status_code = 200
@@ -965,7 +965,7 @@ error_logging:
         os.chdir(tmp_path)
 
         try:
-            with patch('first_hop_proxy.proxy_client.requests.request') as mock_request:
+            with patch('requests.Session.request') as mock_request:
                 # Mock successful response
                 mock_response = Mock()
                 mock_response.status_code = 200
@@ -1043,7 +1043,7 @@ error_logging:
 
         try:
             with caplog.at_level(logging.INFO):
-                with patch('first_hop_proxy.proxy_client.requests.request') as mock_request:
+                with patch('requests.Session.request') as mock_request:
                     # Mock successful response
                     mock_response = Mock()
                     mock_response.status_code = 200
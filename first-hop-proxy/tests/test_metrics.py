@@ -0,0 +1,131 @@
+"""
+Tests for the in-process metrics registry and /metrics endpoint
+"""
+import os
+import threading
+import json
+import pytest
+import sys
+import requests
+from unittest.mock import Mock, patch
+from requests.exceptions import HTTPError, ConnectionError
+
+# Add src directory to path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from first_hop_proxy.metrics import (
+    Counter, Gauge, Histogram, MetricsRegistry, ProxyMetrics, configure_metrics, get_metrics, retry_reason
+)
+from first_hop_proxy.error_handler import ErrorHandler
+from first_hop_proxy.main import app, config as default_config
+
+
+def _http_error(status_code, recategorized_by=None):
+    """HTTPError carrying a response with the given status"""
+    response = Mock(spec=["status_code", "recategorized_by"])
+    response.status_code = status_code
+    response.recategorized_by = recategorized_by
+    return HTTPError(f"{status_code} Error", response=response)
+
+
+class TestMetrics:
+    """Test cases for metrics recording and exposition"""
+
+    @pytest.fixture(autouse=True)
+    def fresh_metrics(self):
+        """Start each test with empty process-wide metrics"""
+        yield configure_metrics({})
+        configure_metrics({})
+
+    def test_text_exposition_format(self):
+        """Test counter, gauge and cumulative histogram rendering with escaped labels"""
+        registry = MetricsRegistry()
+        counter = registry.register(Counter("c_total", "A counter", ("op",)))
+        gauge = registry.register(Gauge("g", "A gauge"))
+        histogram = registry.register(Histogram("h_seconds", "A histogram", ("op",), buckets=(1, 5)))
+        counter.labels('say "hi"\n').inc(2)
+        gauge.labels().inc()
+        gauge.labels().dec(3)
+        for value in (0.5, 1, 3, 10):
+            histogram.labels("chat").observe(value)
+
+        lines = registry.render().splitlines()
+        assert lines[:3] == ["# HELP c_total A counter", "# TYPE c_total counter", 'c_total{op="say \\"hi\\"\\n"} 2']
+        assert "g -2" in lines
+        assert 'h_seconds_bucket{op="chat",le="1"} 2' in lines
+        assert 'h_seconds_bucket{op="chat",le="5"} 3' in lines
+        assert 'h_seconds_bucket{op="chat",le="+Inf"} 4' in lines
+        assert 'h_seconds_sum{op="chat"} 14.5' in lines
+        assert 'h_seconds_count{op="chat"} 4' in lines
+        with pytest.raises(ValueError):
+            counter.labels("a", "b")
+
+    def test_concurrent_recording_is_exact(self):
+        """Test that no updates are lost when many threads record into the same series"""
+        metrics = ProxyMetrics()
+
+        def worker():
+            for _ in range(2000):
+                metrics.request_started()
+                metrics.request_finished(("Senta", "chat1", "chat"), "/cfg/config-a.yaml", "200", 0.3)
+
+        threads = [threading.Thread(target=worker) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        text = metrics.render()
+        labels = 'operation="chat",config="config-a.yaml",status="200"'
+        assert f"proxy_requests_total{{{labels}}} 16000" in text
+        assert f"proxy_request_duration_seconds_count{{{labels}}} 16000" in text
+        assert "proxy_requests_in_flight 0" in text
+
+    def test_retry_reasons(self):
+        """Test labels for status codes, recategorization rules, blank replies and network errors"""
+        assert retry_reason(_http_error(429)) == "status_429"
+        assert retry_reason(_http_error(429, "Quota exhausted")) == "recategorized:Quota exhausted"
+        assert retry_reason(ConnectionError("reset")) == "ConnectionError"
+
+        handler = ErrorHandler(max_retries=2, base_delay=0)
+        outcomes = [_http_error(503), _http_error(429, "Quota exhausted"), "ok"]
+
+        def flaky():
+            outcome = outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        assert handler.retry_with_backoff(flaky) == "ok"
+        text = get_metrics().render()
+        assert 'proxy_retries_total{reason="status_503"} 1' in text
+        assert 'proxy_retries_total{reason="recategorized:Quota exhausted"} 1' in text
+
+    def test_metrics_endpoint(self):
+        """Test that a proxied request shows up on /metrics with upstream timing and bytes"""
+        upstream = requests.Response()
+        upstream.status_code = 200
+        upstream.headers["Content-Type"] = "application/json"
+        upstream._content = json.dumps({"choices": [{"message": {"content": "Hello there, how are you today?"}}]}).encode()
+
+        client = app.test_client()
+        with patch.dict(default_config._config, {"target_proxy": {"url": "https://proxy.example.com/v1/chat/completions"}}), \
+                patch("requests.Session.request", return_value=upstream):
+            response = client.post("/chat/completions", json={"model": "m", "messages": [{"role": "user", "content": "Hi"}]})
+        assert response.status_code == 200
+
+        metrics_response = client.get("/metrics")
+        assert metrics_response.content_type.startswith("text/plain; version=0.0.4")
+        text = metrics_response.get_data(as_text=True)
+        assert 'proxy_requests_total{operation="none",config="default",status="200"} 1' in text
+        assert 'proxy_upstream_attempt_duration_seconds_count{status="200"} 1' in text
+        assert 'proxy_bytes_total{direction="in"}' in text
+        assert 'proxy_bytes_total{direction="out"}' in text
+
+    def test_disabled(self):
+        """Test that disabled metrics record nothing and /metrics is not served"""
+        metrics = configure_metrics({"enabled": False})
+        metrics.request_started()
+        metrics.record_retry("status_429")
+        assert "proxy_retries_total{" not in metrics.render()
+        assert app.test_client().get("/metrics").status_code == 404
@@ -0,0 +1,178 @@
+"""
+Tests for cached /models listings
+"""
+import os
+import sys
+import json
+import asyncio
+import threading
+import pytest
+import requests
+from unittest.mock import patch
+
+# Add src directory to path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from first_hop_proxy.constants import DEFAULT_MODELS
+from first_hop_proxy.execution_plan import get_plan_cache
+from first_hop_proxy.models_cache import ModelsCache, etag_matches, MODELS_HIT, MODELS_STALE, MODELS_MISS
+from first_hop_proxy.main import app, config as default_config
+
+pytestmark = pytest.mark.clock("first_hop_proxy.models_cache")
+
+FALLBACK = {"object": "list", "data": DEFAULT_MODELS}
+
+
+def _listing(*names):
+    return {"object": "list", "data": [{"id": name, "object": "model"} for name in names]}
+
+
+def _wait_for(condition):
+    """Spin until condition() holds (bounded)"""
+    for _ in range(500):
+        if condition():
+            return
+        threading.Event().wait(0.01)
+    raise AssertionError("condition not reached")
+
+
+class TestModelsCache:
+    """Test cases for ModelsCache freshness, refreshes, ETags and the /models endpoint"""
+
+    def test_fresh_stale_and_expired(self, clock):
+        """Test that stale listings are served at once while one background refresh runs"""
+        fetched = []
+
+        def fetch():
+            fetched.append(1)
+            return _listing(f"model-{len(fetched)}")
+
+        cache = ModelsCache(ttl=60, stale_ttl=600)
+        entry, state = cache.get("k", fetch, FALLBACK)
+        assert (entry.data, state) == (_listing("model-1"), MODELS_MISS)
+        assert cache.get("k", fetch, FALLBACK)[1] == MODELS_HIT
+
+        clock.now += 61
+        entry, state = cache.get("k", fetch, FALLBACK)
+        assert (entry.data, state) == (_listing("model-1"), MODELS_STALE)
+        _wait_for(lambda: cache.get_stats().get("refreshes") == 2)
+        entry, state = cache.get("k", fetch, FALLBACK)
+        assert (entry.data, state) == (_listing("model-2"), MODELS_HIT)
+
+        clock.now += 700
+        entry, state = cache.get("k", fetch, FALLBACK)
+        assert (entry.data, state) == (_listing("model-3"), MODELS_MISS)
+        assert len(fetched) == 3
+
+    def test_failed_fetches(self, clock):
+        """Test that failures serve the previous listing or the fallback until error_ttl passes"""
+        replies = [requests.exceptions.ConnectionError("refused"), _listing("a"),
+                   requests.exceptions.ConnectionError("refused")]
+
+        def fetch():
+            reply = replies.pop(0)
+            if isinstance(reply, Exception):
+                raise reply
+            return reply
+
+        cache = ModelsCache(ttl=60, stale_ttl=0, error_ttl=30)
+        entry, _ = cache.get("k", fetch, FALLBACK)
+        assert entry.data == FALLBACK and entry.fallback
+        assert cache.get("k", fetch, FALLBACK)[1] == MODELS_HIT
+
+        clock.now += 31
+        assert cache.get("k", fetch, FALLBACK)[0].data == _listing("a")
+
+        clock.now += 61
+        entry, _ = cache.get("k", fetch, FALLBACK)
+        assert entry.data == _listing("a")
+        assert cache.get("k", fetch, FALLBACK)[1] == MODELS_HIT
+        assert cache.get_stats()["refresh_errors"] == 2
+
+    def test_concurrent_misses_share_one_fetch(self):
+        """Test that concurrent requests for a missing listing wait for one fetch, in both engines"""
+        cache = ModelsCache()
+        release = threading.Event()
+        fetched = []
+
+        def fetch():
+            fetched.append(1)
+            release.wait(5)
+            return _listing("a")
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(cache.get("k", fetch, FALLBACK)[0]))
+                   for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        _wait_for(lambda: cache.get_stats().get("miss") == 3)
+        release.set()
+        for thread in threads:
+            thread.join(timeout=5)
+        assert len(fetched) == 1 and len(results) == 3
+
+        async def fetch_async():
+            fetched.append(1)
+            await asyncio.sleep(0.01)
+            return _listing("b")
+
+        async def scenario():
+            return await asyncio.gather(*(cache.get_async("async", fetch_async, FALLBACK) for _ in range(3)))
+
+        assert [entry.data for entry, _ in asyncio.run(scenario())] == [_listing("b")] * 3
+        assert len(fetched) == 2
+
+    def test_etag_matches(self):
+        """Test If-None-Match lists, weak validators and the wildcard"""
+        etag = ModelsCache().get("k", lambda: _listing("a"), FALLBACK)[0].etag
+        assert etag_matches(etag, etag)
+        assert etag_matches(f'"other", W/{etag}', etag)
+        assert etag_matches("*", etag)
+        assert not etag_matches('"other"', etag)
+        assert not etag_matches(None, etag)
+
+    def test_endpoint_caches_listing(self):
+        """Test that /models answers from the cache, with an ETag and 304 for matching requests"""
+        def upstream(*args, **kwargs):
+            response = requests.Response()
+            response.status_code = 200
+            response.headers["Content-Type"] = "application/json"
+            response._content = json.dumps(_listing("gemini-2.5-pro")).encode()
+            return response
+
+        client = app.test_client()
+        get_plan_cache().invalidate()
+        try:
+            with patch.dict(default_config._config, {"target_proxy": {"url": "https://proxy.example.com/v1/chat/completions"},
+                                                     "models_cache": {"enabled": True}}), \
+                    patch("requests.Session.request", side_effect=upstream) as session_request:
+                first = client.get("/models")
+                second = client.get("/models")
+                not_modified = client.get("/models", headers={"If-None-Match": first.headers["ETag"]})
+                stats = client.get("/health/detailed").get_json()["models_cache"]
+        finally:
+            get_plan_cache().invalidate()
+
+        assert session_request.call_count == 1
+        assert session_request.call_args.kwargs["url"] == "https://proxy.example.com/v1/models"
+        assert first.get_json() == second.get_json() == _listing("gemini-2.5-pro")
+        assert (first.headers["X-Proxy-Cache"], second.headers["X-Proxy-Cache"]) == ("MISS", "HIT")
+        assert not_modified.status_code == 304 and not_modified.headers["ETag"] == first.headers["ETag"]
+        assert (stats["hit"], stats["not_modified"]) == (2, 1)
+
+    def test_cold_cache_falls_back_after_short_retries(self):
+        """Test that with upstream down and nothing cached, /models falls back after models_cache.max_retries"""
+        client = app.test_client()
+        get_plan_cache().invalidate()
+        try:
+            with patch.dict(default_config._config, {"target_proxy": {"url": "https://proxy.example.com/v1/chat/completions"},
+                                                     "error_handling": {"max_retries": 10},
+                                                     "models_cache": {"enabled": True, "max_retries": 1}}), \
+                    patch("requests.Session.request",
+                          side_effect=requests.exceptions.ConnectionError("refused")) as session_request:
+                response = client.get("/models")
+        finally:
+            get_plan_cache().invalidate()
+
+        assert session_request.call_count == 2
+        assert response.get_json() == FALLBACK
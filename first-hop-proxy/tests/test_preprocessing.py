@@ -0,0 +1,168 @@
+import pytest
+import copy
+import json
+import os
+import sys
+
+# Add src directory to path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from first_hop_proxy.config import Config
+from first_hop_proxy.main import prepare_chat_request
+from first_hop_proxy.preprocessing import preprocess_messages, MessageTransformCache
+from first_hop_proxy.utils import (
+    compile_regex_rules,
+    RegexRuleSet,
+    process_messages_with_regex,
+    extract_character_chat_info,
+    extract_st_metadata_from_messages,
+    extract_lorebook_entries_from_messages,
+    strip_lorebook_attributes_from_messages,
+    resolve_character_chat_info
+)
+
+
+def _metadata_block(operation, chat="Senta - 2025-11-01@20h29m24s"):
+    """Build an ST_METADATA block as SillyTavern sends it"""
+    return "<ST_METADATA>\n" + json.dumps({"version": "1.0", "chat": chat, "operation": operation}) + "\n</ST_METADATA>\n"
+
+
+LORE = '<setting_lore name="Ship" uid="14" world="w" position="4" order="989">A fast ship</setting_lore>'
+
+RULES = compile_regex_rules([
+    {"pattern": "Senta", "replacement": "S.", "apply_to": "user"},
+    {"pattern": r"\s+$", "replacement": "", "flags": "m", "apply_to": "all"},
+    {"pattern": "ship", "replacement": "vessel", "flags": "i", "apply_to": "system"},
+])
+
+
+def _legacy_preprocess(messages, rules):
+    """The multi-pass sequence prepare_chat_request used before the fused pipeline"""
+    original = copy.deepcopy(messages)
+    forwarded = process_messages_with_regex(messages, rules) if rules else messages
+    lorebook_entries = extract_lorebook_entries_from_messages(original)
+    all_metadata, _ = extract_st_metadata_from_messages(original)
+    if all_metadata:
+        _, forwarded = extract_st_metadata_from_messages(forwarded)
+    if lorebook_entries:
+        forwarded = strip_lorebook_attributes_from_messages(forwarded)
+    return forwarded, all_metadata, lorebook_entries
+
+
+CASES = [
+    [{"role": "user", "content": "Hi"}],
+    [{"role": "system", "content": _metadata_block("chat")}, {"role": "user", "content": "  Senta waves  \n"}],
+    [{"role": "system", "content": "Lore:\n" + LORE + "\n" + _metadata_block("scene_recap")},
+     {"role": "user", "content": _metadata_block("chat") + "Senta boards the ship"},
+     {"role": "assistant", "content": ""}],
+    [{"role": "system", "content": LORE + "\n" + LORE.replace('uid="14"', 'uid="15"')},
+     {"role": "user", "content": "no markup  "}],
+]
+
+
+class TestPreprocessMessages:
+    """Test suite for the fused message preprocessing pass"""
+
+    @pytest.mark.parametrize("messages", CASES)
+    @pytest.mark.parametrize("rules", [(), RULES])
+    def test_matches_legacy_multi_pass_output(self, messages, rules):
+        """Test that forwarded messages, metadata and lorebook entries match the old sequence"""
+        expected = _legacy_preprocess(messages, rules)
+        result = preprocess_messages(messages, rules)
+
+        assert result.messages == expected[0]
+        assert result.metadata == expected[1]
+        assert result.lorebook_entries == expected[2]
+
+    def test_input_messages_are_not_modified(self):
+        """Test that the received body stays intact for logging"""
+        messages = CASES[2]
+        snapshot = copy.deepcopy(messages)
+        preprocess_messages(messages, RULES)
+        assert messages == snapshot
+
+    def test_unchanged_messages_are_not_copied(self):
+        """Test that messages without markup or matching rules are forwarded as-is"""
+        messages = [{"role": "user", "content": "Hi"}, {"role": "assistant", "content": "Hello"}]
+        result = preprocess_messages(messages, RULES)
+        assert all(forwarded is original for forwarded, original in zip(result.messages, messages))
+
+    def test_metadata_only_messages_are_dropped(self):
+        """Test that a message containing only ST_METADATA is not forwarded"""
+        messages = [{"role": "system", "content": _metadata_block("lorebook")}, {"role": "user", "content": "Hi"}]
+        result = preprocess_messages(messages)
+        assert result.messages == [{"role": "user", "content": "Hi"}]
+
+    def test_character_chat_info_from_extracted_metadata(self):
+        """Test that resolving from extracted metadata matches scanning the request"""
+        request_data = {"messages": CASES[2]}
+        result = preprocess_messages(request_data["messages"])
+
+        assert resolve_character_chat_info(result.metadata) == extract_character_chat_info({}, request_data)
+        assert resolve_character_chat_info(result.metadata) == ("Senta", "2025-11-01@20h29m24s", "scene_recap")
+
+    def test_prepare_chat_request_keeps_original_body(self):
+        """Test that prepare_chat_request forwards cleaned messages and returns the original body"""
+        request_data = {"model": "m", "messages": CASES[1]}
+        forwarded, original, metadata, lorebook_entries = prepare_chat_request(request_data, Config())
+
+        assert original is request_data
+        assert forwarded["model"] == "m"
+        assert forwarded["messages"] == [{"role": "user", "content": "Senta waves"}]
+        assert metadata[0]["operation"] == "chat"
+        assert lorebook_entries == []
+
+
+class TestMessageTransformCache:
+    """Test suite for memoizing per-message preprocessing across requests"""
+
+    def test_repeated_history_hits_the_cache(self):
+        """Test that the next request of a chat only processes its new message"""
+        cache = MessageTransformCache()
+        rule_set = RegexRuleSet(RULES)
+        history = CASES[2]
+        preprocess_messages(history, rule_set, cache=cache)
+        misses = cache.misses
+
+        next_turn = history + [{"role": "user", "content": "Senta docks"}]
+        result = preprocess_messages(next_turn, rule_set, cache=cache)
+
+        assert cache.misses == misses + 1
+        assert cache.hits == 2
+        assert result == preprocess_messages(next_turn, rule_set)
+
+    def test_cached_results_match_uncached(self):
+        """Test that cached and uncached preprocessing agree for every case"""
+        cache = MessageTransformCache()
+        for _ in range(2):
+            for messages in CASES:
+                assert preprocess_messages(messages, RULES, cache=cache) == preprocess_messages(messages, RULES)
+        assert cache.get_stats()["hits"] > 0
+
+    def test_rule_set_changes_miss(self):
+        """Test that entries are keyed by the rule-set fingerprint"""
+        cache = MessageTransformCache()
+        messages = [{"role": "user", "content": "Senta waves"}]
+        preprocess_messages(messages, RULES, cache=cache)
+        other = compile_regex_rules([{"pattern": "Senta", "replacement": "Someone", "apply_to": "user"}])
+
+        result = preprocess_messages(messages, other, cache=cache)
+        assert result.messages == [{"role": "user", "content": "Someone waves"}]
+        assert cache.hits == 0
+
+    def test_entries_are_bounded(self):
+        """Test LRU eviction by entry count and by cached characters"""
+        cache = MessageTransformCache(max_entries=2)
+        preprocess_messages([{"role": "user", "content": str(i)} for i in range(3)], cache=cache)
+        assert cache.get_stats()["entries"] == 2
+        assert cache.evictions == 1
+
+        cache = MessageTransformCache(max_chars=10)
+        preprocess_messages([{"role": "user", "content": "x" * 6}, {"role": "user", "content": "y" * 6}], cache=cache)
+        assert cache.get_stats()["entries"] == 1
+        assert cache.get_stats()["chars"] <= 10
+
+    def test_disabled_in_config(self):
+        """Test that enabled: false turns the cache off"""
+        assert MessageTransformCache.from_config({"enabled": False}) is None
+        assert MessageTransformCache.from_config({"max_entries": 10}).max_entries == 10
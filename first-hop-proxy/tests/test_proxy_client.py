@@ -76,7 +76,7 @@ class TestProxyClient:
 
     def test_forward_request_with_headers(self, proxy_client, sample_request):
         """Test request forwarding includes proper headers"""
-        with patch('requests.request') as mock_request:
+        with patch('requests.Session.request') as mock_request:
             mock_response = Mock()
             mock_response.status_code = 200
             mock_response.json.return_value = {"choices": []}
@@ -93,7 +93,7 @@ class TestProxyClient:
 
     def test_forward_request_timeout(self, proxy_client, sample_request):
         """Test request forwarding handles timeouts"""
-        with patch('requests.request') as mock_request:
+        with patch('requests.Session.request') as mock_request:
             mock_response = Mock()
             mock_response.status_code = 200
             mock_response.json.return_value = {"choices": []}
@@ -279,7 +279,7 @@ class TestProxyClient:
 
     def test_forward_request_with_timeout(self, proxy_client, sample_request):
         """Test request forwarding respects timeout settings"""
-        with patch('requests.request') as mock_request:
+        with patch('requests.Session.request') as mock_request:
             mock_response = Mock()
             mock_response.status_code = 200
             mock_response.json.return_value = {"choices": []}
@@ -296,7 +296,7 @@ class TestProxyClient:
 
     def test_forward_request_with_retry_headers(self, proxy_client, sample_request):
         """Test request forwarding includes retry-related headers"""
-        with patch('requests.request') as mock_request:
+        with patch('requests.Session.request') as mock_request:
             mock_response = Mock()
             mock_response.status_code = 200
             mock_response.json.return_value = {"choices": []}
@@ -322,7 +322,7 @@ class TestProxyClient:
 
         def make_request():
             try:
-                with patch('requests.request') as mock_request:
+                with patch('requests.Session.request') as mock_request:
                     mock_response = Mock()
                     mock_response.status_code = 200
                     mock_response.json.return_value = {"choices": []}
@@ -359,7 +359,7 @@ class TestProxyClient:
             process = psutil.Process(os.getpid())
             initial_memory = process.memory_info().rss
 
-            with patch('requests.request') as mock_request:
+            with patch('requests.Session.request') as mock_request:
                 mock_response = Mock()
                 mock_response.status_code = 200
                 mock_response.json.return_value = {"choices": []}
@@ -382,7 +382,7 @@ class TestProxyClient:
 
     def test_forward_request_url_construction(self, proxy_client, sample_request):
         """Test proxy client constructs correct URLs"""
-        with patch('requests.request') as mock_request:
+        with patch('requests.Session.request') as mock_request:
             mock_response = Mock()
             mock_response.status_code = 200
             mock_response.json.return_value = {"choices": []}
@@ -399,7 +399,7 @@ class TestProxyClient:
 
     def test_forward_request_method_override(self, proxy_client, sample_request):
         """Test proxy client can override HTTP method"""
-        with patch('requests.request') as mock_request:
+        with patch('requests.Session.request') as mock_request:
             mock_response = Mock()
             mock_response.status_code = 200
             mock_response.json.return_value = {"choices": []}
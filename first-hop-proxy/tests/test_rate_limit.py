@@ -0,0 +1,133 @@
+"""
+Tests for shared upstream rate-limit gates
+"""
+import os
+import sys
+import json
+import time
+import pytest
+import requests
+from unittest.mock import patch
+
+# Add src directory to path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from first_hop_proxy.rate_limit import (
+    RateLimitGate, RateLimiter, RateLimitExceeded, parse_retry_after, parse_reset,
+    configure_rate_limiter, get_rate_limiter
+)
+from first_hop_proxy.main import app, config as default_config
+
+pytestmark = pytest.mark.clock("first_hop_proxy.rate_limit")
+
+
+def _upstream(status, headers=None, body=None):
+    """Build an upstream reply"""
+    response = requests.Response()
+    response.status_code = status
+    response.headers["Content-Type"] = "application/json"
+    response.headers.update(headers or {})
+    response._content = json.dumps(body or {}).encode()
+    return response
+
+
+class TestRateLimit:
+    """Test cases for RateLimitGate and its use by the proxy client"""
+
+    def test_header_parsing(self):
+        """Test Retry-After and reset header formats"""
+        assert parse_retry_after("7") == 7.0
+        assert 0 < parse_retry_after(time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(time.time() + 30))) <= 30
+        assert parse_retry_after("soon") is None
+        assert parse_reset("1m30s") == 90.0
+        assert parse_reset("120ms") == pytest.approx(0.12)
+        assert parse_reset("12") == 12.0
+        assert 55 < parse_reset(str(int(time.time()) + 60)) <= 60
+        assert parse_reset("tomorrow") is None
+
+    def test_429_starts_one_shared_cooldown(self, clock):
+        """Test that a 429 holds all waiters until Retry-After and releases them staggered"""
+        gate = RateLimitGate("up", resume_interval=0.5, default_cooldown=2, max_cooldown=5)
+        assert gate.reserve() == 0
+
+        gate.observe(429, {"Retry-After": "10"})
+        assert [gate.reserve() for _ in range(3)] == [10.0, 10.5, 11.0]
+
+        # Without Retry-After, consecutive 429s double the default cooldown up to max_cooldown
+        clock.now += 20
+        gate.observe(200, {})
+        waits = []
+        for _ in range(3):
+            gate.observe(429, {})
+            waits.append(gate.get_stats()["cooldown_remaining"])
+        assert waits == [2.0, 4.0, 5.0]
+        gate.observe(200, {})
+        clock.now += 10
+        gate.observe(429, {})
+        assert gate.get_stats()["cooldown_remaining"] == 2.0
+        assert gate.get_stats()["rate_limited"] == 5
+
+    def test_paces_from_remaining_quota(self, clock):
+        """Test that remaining/reset headers spread requests and an exhausted quota waits for the reset"""
+        gate = RateLimitGate("up", max_wait=30)
+        gate.observe(200, {"x-ratelimit-remaining-requests": "5", "x-ratelimit-reset-requests": "10s"})
+        assert [gate.reserve() for _ in range(3)] == [0.0, 2.0, 4.0]
+        assert gate.get_stats()["requests_per_second"] == 0.5
+
+        gate.observe(200, {"x-ratelimit-remaining": "0", "x-ratelimit-reset": "40"})
+        with pytest.raises(RateLimitExceeded) as exc_info:
+            gate.reserve()
+        assert exc_info.value.retry_after == 40
+
+        clock.now += 41
+        assert gate.reserve() == 0.0
+
+    def test_gates_per_origin_and_key(self):
+        """Test that gates are shared per upstream origin and API key"""
+        limiter = RateLimiter()
+        first = limiter.gate_for("https://up.example/v1/chat/completions", {"Authorization": "Bearer a"})
+        assert limiter.gate_for("https://up.example/v1/models", {"authorization": "Bearer a"}) is first
+        assert limiter.gate_for("https://up.example/v1/models", {"Authorization": "Bearer b"}) is not first
+        assert "Bearer" not in first.name
+
+    def test_retry_waits_at_gate(self):
+        """Test that a 429 retry waits the upstream's Retry-After at the gate instead of backing off"""
+        replies = [_upstream(429, {"Retry-After": "3"}, {"error": "slow down"}),
+                   _upstream(200, body={"choices": [{"message": {"content": "Hello there, how are you today?"}}]})]
+        configure_rate_limiter({"enabled": True})
+        try:
+            with patch.dict(default_config._config, {"target_proxy": {"url": "https://proxy.example.com/v1/chat/completions"}}), \
+                    patch("requests.Session.request", side_effect=replies) as upstream:
+                response = app.test_client().post(
+                    "/chat/completions", json={"model": "m", "messages": [{"role": "user", "content": "Hi"}]})
+                sleeps = [call.args[0] for call in time.sleep.call_args_list]
+
+            assert response.status_code == 200
+            assert upstream.call_count == 2
+            # No exponential backoff; one wait of about Retry-After at the gate
+            assert sleeps[0] == 0.0
+            assert 2.5 < sleeps[1] <= 3.0
+            (gate,) = get_rate_limiter().get_stats()["gates"].values()
+            assert gate["rate_limited"] == 1
+        finally:
+            configure_rate_limiter(None)
+        assert get_rate_limiter() is None
+
+    def test_zero_retry_after_keeps_backoff(self):
+        """Test that a 429 which leaves no cooldown at the gate is retried after the usual backoff"""
+        assert RateLimitGate("up").observe(429, {"Retry-After": "0"}) == 0.0
+        replies = [_upstream(429, {"Retry-After": "0"}, {"error": "slow down"}),
+                   _upstream(200, body={"choices": [{"message": {"content": "Hello there, how are you today?"}}]})]
+        configure_rate_limiter({"enabled": True})
+        try:
+            with patch.dict(default_config._config, {"target_proxy": {"url": "https://proxy.example.com/v1/chat/completions"}}), \
+                    patch("requests.Session.request", side_effect=replies) as upstream:
+                response = app.test_client().post(
+                    "/chat/completions", json={"model": "m", "messages": [{"role": "user", "content": "Hi"}]})
+                sleeps = [call.args[0] for call in time.sleep.call_args_list]
+
+            assert response.status_code == 200
+            assert upstream.call_count == 2
+            assert sleeps[0] > 0.0
+        finally:
+            configure_rate_limiter(None)
@@ -0,0 +1,170 @@
+"""
+Tests for the deterministic response cache
+"""
+import os
+import sys
+import json
+import pytest
+import requests
+from unittest.mock import patch
+
+# Add src directory to path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from first_hop_proxy.response_cache import (
+    ResponseCache, cache_control, configure_response_cache, get_response_cache
+)
+from first_hop_proxy.metrics import configure_metrics
+from first_hop_proxy.execution_plan import get_plan_cache
+from first_hop_proxy.main import app, config as default_config
+from conftest import st_metadata
+
+pytestmark = pytest.mark.clock("first_hop_proxy.response_cache")
+
+
+def _reply(text):
+    return {"choices": [{"message": {"role": "assistant", "content": text}}]}
+
+
+class TestResponseCache:
+    """Test cases for ResponseCache keys, tiers and cached proxy requests"""
+
+    def test_keys_and_cache_control(self):
+        """Test key normalization, the allowlist, deterministic_only and Cache-Control directives"""
+        cache = ResponseCache(["validate_recap", "detect_scene_break*"], path=None)
+        body = {"model": "m", "messages": [{"role": "user", "content": "Hi"}], "temperature": 0}
+        key = cache.key_for("validate_recap", body, {}, "plan")
+        same = {"temperature": 0, "user": "someone", "stream": False, "top_p": None,
+                "messages": [{"content": "Hi", "role": "user"}], "model": "m"}
+        assert cache.key_for("detect_scene_break_FORCED", same, {}, "plan") == key
+        assert cache.key_for("validate_recap", dict(body, max_tokens=10), {}, "plan") != key
+        assert cache.key_for("validate_recap", body, {"Authorization": "Bearer b"}, "plan") != key
+        assert cache.key_for("validate_recap", body, {}, "other") != key
+
+        assert cache.key_for("chat", body, {}, "plan") is None
+        assert cache.key_for("validate_recap", dict(body, stream=True), {}, "plan") is None
+        assert cache.key_for("validate_recap", dict(body, temperature=0.7), {}, "plan") is None
+        assert ResponseCache(["*"], deterministic_only=False, path=None).key_for(
+            "chat", dict(body, temperature=0.7), {}, "plan") is not None
+
+        assert cache_control({}) == (True, True)
+        assert cache_control({"cache-control": "No-Cache"}) == (False, True)
+        assert cache_control({"Cache-Control": "max-age=0"}) == (False, True)
+        assert cache_control({"Cache-Control": "private, no-store"}) == (False, False)
+
+    def test_memory_lru_and_ttl(self, clock):
+        """Test least-recently-used eviction, private copies and expiry in the memory tier"""
+        cache = ResponseCache(["*"], ttl=60, max_entries=2, path=None)
+        cache.put("a", "op", _reply("a"))
+        cache.put("b", "op", _reply("b"))
+        hit = cache.get("a")
+        hit["choices"][0]["message"]["content"] = "changed"
+        cache.put("c", "op", _reply("c"))
+        assert cache.get("b") is None
+        assert cache.get("a") == _reply("a")
+
+        clock.now += 61
+        assert cache.get("a") is None
+        stats = cache.get_stats()
+        assert (stats["memory_hit"], stats["miss"], stats["evictions"], stats["entries"]) == (2, 2, 1, 1)
+
+    def test_disk_tier(self, clock, tmp_path):
+        """Test that replies survive a restart, are promoted to memory and are trimmed by size and age"""
+        path = str(tmp_path / "cache.sqlite3")
+        cache = ResponseCache(["*"], ttl=3600, path=path)
+        cache.put("a", "op", _reply("a"))
+        cache.close()
+
+        cache = ResponseCache(["*"], ttl=3600, path=path)
+        assert cache.get("a") == _reply("a")
+        assert cache.get("a") == _reply("a")
+        stats = cache.get_stats()
+        assert (stats["disk_hit"], stats["memory_hit"]) == (1, 1)
+        cache.close()
+
+        size = len(json.dumps(_reply("a")))
+        cache = ResponseCache(["*"], ttl=3600, path=path, max_entries=1, max_disk_bytes=size * 2)
+        for name in "bcd":
+            clock.now += 1
+            cache.put(name, "op", _reply(name))
+        cache._trim_disk()
+        assert cache.get("a") is None and cache.get("b") is None
+        assert cache.get("c") == _reply("c")
+
+        clock.now += 3601
+        cache._trim_disk()
+        cache.clear()
+        assert cache.get("d") is None
+        cache.close()
+
+    def test_endpoint_answers_from_cache(self, tmp_path):
+        """Test that a repeated temperature 0 request is answered without an upstream call unless bypassed"""
+        replies = []
+
+        def upstream(*args, **kwargs):
+            replies.append(1)
+            response = requests.Response()
+            response.status_code = 200
+            response.headers["Content-Type"] = "application/json"
+            response._content = json.dumps(_reply(f"The recap is valid (reply {len(replies)}).")).encode()
+            return response
+
+        body = {"model": "m", "temperature": 0,
+                "messages": [{"role": "user", "content": st_metadata("validate_recap") + "Recap: ..."}]}
+        client = app.test_client()
+        configure_metrics({})
+        configure_response_cache({"enabled": True, "operations": ["validate_recap"],
+                                  "path": str(tmp_path / "cache.sqlite3")})
+        try:
+            with patch.dict(default_config._config, {"target_proxy": {"url": "https://proxy.example.com/v1/chat/completions"}}), \
+                    patch("requests.Session.request", side_effect=upstream):
+                first = client.post("/chat/completions", json=body).get_json()
+                second = client.post("/chat/completions", json=body).get_json()
+                refreshed = client.post("/chat/completions", json=body, headers={"Cache-Control": "no-cache"}).get_json()
+                third = client.post("/chat/completions", json=body).get_json()
+
+            assert len(replies) == 2
+            assert first == second and "reply 1" in json.dumps(first)
+            assert refreshed == third and "reply 2" in json.dumps(third)
+            stats = client.get("/health/detailed").get_json()["response_cache"]
+            assert (stats["memory_hit"], stats["miss"], stats["bypass"]) == (2, 1, 1)
+            text = client.get("/metrics").get_data(as_text=True)
+            assert 'proxy_response_cache_total{result="memory_hit"} 2' in text
+        finally:
+            configure_response_cache(None)
+            configure_metrics({})
+        assert get_response_cache() is None
+
+    def test_hard_stop_reply_is_not_cached(self, tmp_path):
+        """Test that a hard-stop error reply is passed on but not replayed to the next identical request"""
+        replies = []
+
+        def upstream(*args, **kwargs):
+            replies.append(1)
+            response = requests.Response()
+            response.status_code = 500
+            response.headers["Content-Type"] = "application/json"
+            response._content = b'{"error": {"message": "googleAIBlockingResponseHandler failed"}}'
+            return response
+
+        body = {"model": "m", "temperature": 0,
+                "messages": [{"role": "user", "content": st_metadata("validate_recap") + "Recap: ..."}]}
+        client = app.test_client()
+        configure_response_cache({"enabled": True, "operations": ["validate_recap"],
+                                  "path": str(tmp_path / "cache.sqlite3")})
+        get_plan_cache().invalidate()
+        try:
+            with patch.dict(default_config._config, {
+                        "target_proxy": {"url": "https://proxy.example.com/v1/chat/completions"},
+                        "error_handling": {"hard_stop_conditions": {"enabled": True, "rules": [
+                            {"pattern": "googleAIBlockingResponseHandler", "description": "Blocked"}]}}}), \
+                    patch("requests.Session.request", side_effect=upstream):
+                first = client.post("/chat/completions", json=body).get_json()
+                second = client.post("/chat/completions", json=body).get_json()
+
+            assert first["error"]["type"] == second["error"]["type"] == "hard_stop_error"
+            assert len(replies) == 2
+            assert get_response_cache().get_stats()["entries"] == 0
+        finally:
+            get_plan_cache().invalidate()
+            configure_response_cache(None)
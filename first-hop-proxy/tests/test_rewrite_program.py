@@ -0,0 +1,183 @@
+import pytest
+import os
+import random
+import re
+import sys
+
+# Add src directory to path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from first_hop_proxy.utils import (
+    RewriteProgram,
+    RegexRuleSet,
+    compile_regex_rules,
+    regex_pattern_literal,
+    apply_regex_replacements
+)
+
+# Rules in the style of config.yaml.example: outgoing characters to escapes,
+# incoming mojibake and escapes back to characters
+OUTGOING_RULES = [
+    {"pattern": pattern, "replacement": replacement, "apply_to": "user"}
+    for pattern, replacement in [
+        ("\u2019", "\\\\u2019"), ("\u2018", "\\\\u2018"), ("\u201c", "\\\\u201c"), ("\u201d", "\\\\u201d"),
+        ("—", "\\\\u2014"), ("–", "\\\\u2013"), ("-", "\\\\u002d"), ("/", "\\\\u002f"),
+        ("`", "\\\\u0060"), ("\\|", "\\\\u007c"), ("\\[", "\\\\u005b"), ("\\]", "\\\\u005d"),
+    ]
+]
+INCOMING_RULES = [
+    {"pattern": pattern, "replacement": replacement}
+    for pattern, replacement in [
+        ("\\u00e2\\u20ac\\u201d", "—"), ("\\u00e2\\u20ac\\u201c", "–"), ("\\\\u00e2\\\\u20ac\\\\u201d", "—"),
+        ("â€\"", "—"), ("\\u00e2\\u20ac\"", "—"), ("\\\\u2018", "'"), ("\\u2018", "'"), ("\\\\u2019", "'"),
+        ("\\u2019", "'"), ("\\\\u201c", '"'), ("\\u201c", '"'), ("\\\\u2014", "—"), ("\\u2014", "—"),
+        ("\\\\u002d", "-"), ("\\u002d", "-"), ("\\\\u005b", "["), ("\\u005b", "["), ("\\\\'", "'"), ('\\\\"', '"'),
+    ]
+]
+
+
+def _sequential(text, rules):
+    """Reference semantics: one re.sub per rule, in order"""
+    for rule in compile_regex_rules(rules):
+        try:
+            text = rule.regex.sub(rule.replacement, text)
+        except (re.error, TypeError, ValueError):
+            continue
+    return text
+
+
+class TestRegexPatternLiteral:
+    """Test suite for classifying patterns as literals"""
+
+    @pytest.mark.parametrize("pattern,expected", [
+        ("'", "'"),
+        ("\\[", "["),
+        ("\\\\u2018", "\\u2018"),
+        ("\\u00e2\\u20ac\"", "â€\""),
+        ("\\x41\\n", "A\n"),
+        ("abc", "abc"),
+    ])
+    def test_literal_patterns(self, pattern, expected):
+        """Test that plain text and single-character escapes are literals"""
+        assert regex_pattern_literal(pattern) == expected
+
+    @pytest.mark.parametrize("pattern", ["a.b", "model.*capacity", "\\d", "[ab]", "a|b", "\\1", "(x)", "x{2}", ""])
+    def test_regex_patterns(self, pattern):
+        """Test that anything with regex syntax stays a regex"""
+        assert regex_pattern_literal(pattern) is None
+
+    def test_ignorecase_is_not_literal(self):
+        """Test that flags changing literal matching disable the fast path"""
+        assert regex_pattern_literal("abc", re.IGNORECASE) is None
+        assert regex_pattern_literal("abc", re.MULTILINE) == "abc"
+
+
+class TestRewriteProgram:
+    """Test suite for fused literal rewrite programs"""
+
+    def test_ascii_single_characters_become_one_translate_step(self):
+        """Test that commuting ASCII single-character rules share one str.translate pass"""
+        program = RewriteProgram([
+            {"pattern": "`", "replacement": "'"},
+            {"pattern": "\\|", "replacement": "/"},
+            {"pattern": "\\[", "replacement": "("},
+        ])
+        assert [kind for kind, _ in program.steps] == ["translate"]
+        assert program.apply("`a` |b| [c") == "'a' /b/ (c"
+        assert program.apply("`a` — [c") == "'a' — (c"
+
+    def test_escaping_single_characters_use_replace(self):
+        """Test that characters expanding to escapes are replaced without a translate table"""
+        program = RewriteProgram([
+            {"pattern": "—", "replacement": "\\\\u2014"},
+            {"pattern": "–", "replacement": "\\\\u2013"},
+        ])
+        assert [kind for kind, _ in program.steps] == ["replace", "replace"]
+        assert program.apply("a—b–c") == "a\\u2014b\\u2013c"
+
+    def test_multi_character_literals_become_one_alternation(self):
+        """Test that commuting longer literals with the same first character share one alternation pass"""
+        program = RewriteProgram([
+            {"pattern": "foo", "replacement": "1"},
+            {"pattern": "fob", "replacement": "2"},
+            {"pattern": "bar", "replacement": "3"},
+        ])
+        assert [kind for kind, _ in program.steps] == ["alternation", "replace"]
+        assert program.apply("foofobbarfoo") == "1231"
+
+    def test_shared_replacement_alternation(self):
+        """Test that literals sharing a replacement (including backslashes) are expanded once"""
+        program = RewriteProgram([
+            {"pattern": "ab", "replacement": "\\\\x"},
+            {"pattern": "ac", "replacement": "\\\\x"},
+        ])
+        assert [kind for kind, _ in program.steps] == ["alternation"]
+        assert program.apply("abac-ab") == "\\x\\x-\\x"
+
+    def test_regex_rules_keep_their_position(self):
+        """Test that regexes split literal groups and run in order"""
+        program = RewriteProgram([
+            {"pattern": "a", "replacement": "b"},
+            {"pattern": "b+", "replacement": "c"},
+            {"pattern": "c", "replacement": "d"},
+        ])
+        assert [kind for kind, _ in program.steps] == ["replace", "regex", "replace"]
+        assert program.apply("ab") == "d"
+
+    def test_chained_literals_are_not_fused(self):
+        """Test that a rule consuming another rule's output still sees it"""
+        rules = [{"pattern": "a", "replacement": "b"}, {"pattern": "b", "replacement": "c"}]
+        assert RewriteProgram(rules).apply("ab") == _sequential("ab", rules) == "cc"
+
+    def test_overlapping_literals_are_not_fused(self):
+        """Test that earlier rules win over overlapping later ones, as with sequential re.sub"""
+        rules = [{"pattern": "bc", "replacement": "X"}, {"pattern": "ab", "replacement": "Y"}]
+        assert RewriteProgram(rules).apply("abc") == _sequential("abc", rules) == "aX"
+
+    def test_invalid_template_is_skipped(self):
+        """Test that rules whose replacement fails are skipped like before"""
+        rules = [{"pattern": "a", "replacement": "\\9"}, {"pattern": "b", "replacement": "c"}]
+        assert RewriteProgram(rules).apply("ab") == "ac"
+
+    def test_random_rules_match_sequential_semantics(self):
+        """Test byte-identical output against sequential re.sub on random literal rule sets"""
+        rng = random.Random(1234)
+        for round_number in range(400):
+            # Alternate ASCII-only rounds so the translate path is exercised too
+            alphabet = "abc\\-'" if round_number % 2 else "ab\\-—'"
+            rules = []
+            for _ in range(rng.randint(1, 6)):
+                pattern = "".join(rng.choice(alphabet) for _ in range(rng.randint(1, 3)))
+                replacement = "".join(rng.choice(alphabet + "xyz") for _ in range(rng.randint(0, 3)))
+                rules.append({"pattern": re.escape(pattern), "replacement": replacement.replace("\\", "\\\\")})
+            text = "".join(rng.choice(alphabet + " ") for _ in range(rng.randint(0, 40)))
+            assert RewriteProgram(rules).apply(text) == _sequential(text, rules), (rules, text)
+
+    @pytest.mark.parametrize("rules", [OUTGOING_RULES, INCOMING_RULES])
+    def test_example_style_rules_match_sequential_semantics(self, rules):
+        """Test config.yaml.example style rule sets on text full of the characters they rewrite"""
+        program = RewriteProgram(rules)
+        text = ("It\u2019s \u2018quoted\u2019 \u201cso\u201d — and – a-b/c `x` |y| [z] "
+                "â€\" \u00e2\u20ac\u201d \\u00e2\\u20ac\\u201d \\u2019 \\u002d \\' \\\" ") * 20
+
+        assert program.apply(text) == _sequential(text, rules)
+        assert program.apply(text.encode("ascii", "ignore").decode()) == _sequential(text.encode("ascii", "ignore").decode(), rules)
+
+    def test_apply_regex_replacements_accepts_program(self):
+        """Test that a RewriteProgram can be passed where rules are expected"""
+        program = RewriteProgram([{"pattern": "foo", "replacement": "bar"}])
+        assert apply_regex_replacements("foo", program) == "bar"
+
+
+class TestRegexRuleSet:
+    """Test suite for per-role rewrite programs"""
+
+    def test_program_for_filters_by_role(self):
+        """Test that programs only contain rules for the role or "all" and are reused"""
+        rule_set = RegexRuleSet([
+            {"pattern": "a", "replacement": "1", "apply_to": "user"},
+            {"pattern": "b", "replacement": "2", "apply_to": "all"},
+        ])
+        assert rule_set.program_for("user").apply("ab") == "12"
+        assert rule_set.program_for("assistant").apply("ab") == "a2"
+        assert rule_set.program_for("user") is rule_set.program_for("user")
@@ -0,0 +1,121 @@
+"""
+Tests for serving engine selection, pre-forked workers and shared worker metrics
+"""
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import subprocess
+import textwrap
+import pytest
+import tempfile
+import shutil
+import urllib.request
+
+# Add src directory to path for imports
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+sys.path.insert(0, SRC_DIR)
+
+from first_hop_proxy.server import resolve_engine, resolve_worker_count, waitress_options
+from first_hop_proxy.metrics import ProxyMetrics, clear_snapshots
+
+# Serves the worker's pid on every request from two pre-forked waitress workers
+PREFORK_SCRIPT = textwrap.dedent("""
+    import os, sys
+    sys.path.insert(0, {src!r})
+    from first_hop_proxy.server import bind_socket, serve, PreforkSupervisor
+
+    def pid_app(environ, start_response):
+        start_response("200 OK", [("Content-Type", "text/plain")])
+        return [str(os.getpid()).encode()]
+
+    server_config = {{"engine": "waitress", "threads": 2}}
+    sock = bind_socket("127.0.0.1", {port})
+    PreforkSupervisor(2, lambda worker_sock: serve(pid_app, server_config, sock=worker_sock), sock).run()
+""")
+
+
+def _free_port():
+    """Return a port nothing is listening on"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class TestServer:
+    """Test cases for server configuration and the pre-fork supervisor"""
+
+    @pytest.fixture
+    def temp_dir(self):
+        """Create a temporary directory for metrics snapshots"""
+        temp_dir = tempfile.mkdtemp()
+        yield temp_dir
+        if os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir)
+
+    def test_engine_and_worker_resolution(self):
+        """Test engine aliases, validation and when pre-forking is used"""
+        assert resolve_engine({}) == "flask"
+        assert resolve_engine({"engine": "dev"}) == "flask"
+        assert resolve_engine({"engine": "waitress"}) == "waitress"
+        with pytest.raises(ValueError):
+            resolve_engine({"engine": "gunicorn"})
+
+        assert resolve_worker_count({"engine": "flask", "workers": 4}) == 1
+        assert resolve_worker_count({"engine": "waitress"}) == 1
+        expected = 3 if hasattr(os, "fork") else 1
+        assert resolve_worker_count({"engine": "waitress", "workers": 3}) == expected
+
+        options = waitress_options({"threads": 8, "channel_timeout": 30})
+        assert (options["threads"], options["channel_timeout"], options["connection_limit"]) == (8, 30, 100)
+
+    def test_metrics_summed_over_workers(self, temp_dir):
+        """Test that /metrics output sums worker snapshots and drops gauges of exited workers"""
+        metrics = ProxyMetrics(snapshot_dir=temp_dir, snapshot_interval=60)
+        other = ProxyMetrics()
+        try:
+            for recorder in (metrics, other):
+                recorder.request_started()
+                recorder.request_finished(("Senta", "chat1", "chat"), None, "200", 0.3)
+                recorder.upstream_started()
+            # Another live worker (our parent) and one that has exited
+            for pid in (os.getppid(), 2 ** 22 + 12345):
+                with open(os.path.join(temp_dir, f"metrics-{pid}.json"), 'w', encoding='utf-8') as f:
+                    json.dump({"pid": pid, "metrics": other.registry.dump()}, f)
+
+            text = metrics.render()
+            assert 'proxy_requests_total{operation="chat",config="default",status="200"} 3' in text
+            assert 'proxy_request_duration_seconds_count{operation="chat",config="default",status="200"} 3' in text
+            assert "proxy_upstream_in_flight 2" in text
+            assert os.path.exists(metrics.snapshot_path)
+        finally:
+            metrics.close()
+
+        clear_snapshots(temp_dir)
+        assert os.listdir(temp_dir) == []
+
+    @pytest.mark.skipif(not hasattr(os, "fork"), reason="pre-forking needs os.fork")
+    def test_prefork_workers_share_port(self, temp_dir):
+        """Test that forked waitress workers serve one port and stop on SIGTERM"""
+        port = _free_port()
+        script = os.path.join(temp_dir, "prefork.py")
+        with open(script, 'w', encoding='utf-8') as f:
+            f.write(PREFORK_SCRIPT.format(src=SRC_DIR, port=port))
+        supervisor = subprocess.Popen([sys.executable, script])
+        try:
+            pids = []
+            deadline = time.monotonic() + 20
+            while time.monotonic() < deadline and len(pids) < 10:
+                try:
+                    # urllib opens a new connection per request, which either worker may accept
+                    with urllib.request.urlopen(f"http://127.0.0.1:{port}/", timeout=2) as response:
+                        pids.append(response.read().decode())
+                except OSError:
+                    time.sleep(0.1)
+            assert len(pids) == 10 and all(pid.isdigit() for pid in pids)
+            assert str(supervisor.pid) not in pids
+        finally:
+            supervisor.send_signal(signal.SIGTERM)
+            assert supervisor.wait(timeout=20) == 0
@@ -0,0 +1,129 @@
+import pytest
+import time
+import requests
+from unittest.mock import Mock, patch
+import sys
+import os
+
+# Add src directory to path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from first_hop_proxy.session_pool import UpstreamSessionPool, get_origin, get_session_pool, configure_session_pool
+from first_hop_proxy.proxy_client import ProxyClient
+
+
+class TestUpstreamSessionPool:
+    """Test suite for the process-wide upstream session pool"""
+
+    @pytest.fixture
+    def pool(self):
+        """Create an isolated session pool"""
+        pool = UpstreamSessionPool(pool_maxsize=4, idle_timeout=60)
+        yield pool
+        pool.close_all()
+
+    def test_get_origin_strips_path_and_normalizes_case(self):
+        """Test that origins ignore path and are case-insensitive"""
+        assert get_origin("https://Proxy.Example.com/v1/chat/completions") == "https://proxy.example.com"
+        assert get_origin("http://localhost:5000/models") == "http://localhost:5000"
+
+    def test_same_origin_shares_session(self, pool):
+        """Test that URLs on the same origin reuse one session"""
+        chat = pool.get_session("https://proxy.example.com/v1/chat/completions")
+        models = pool.get_session("https://proxy.example.com/v1/models")
+        assert chat is models
+        assert pool.get_stats()["sessions"] == 1
+
+    def test_different_origins_get_separate_sessions(self, pool):
+        """Test that each origin gets its own session"""
+        first = pool.get_session("https://a.example.com/chat/completions")
+        second = pool.get_session("https://b.example.com/chat/completions")
+        assert first is not second
+        assert pool.get_stats()["sessions"] == 2
+
+    def test_adapter_uses_configured_pool_size_without_transport_retries(self, pool):
+        """Test that mounted adapters honor pool_maxsize and leave retries to ErrorHandler"""
+        session = pool.get_session("https://proxy.example.com")
+        adapter = session.get_adapter("https://proxy.example.com/chat/completions")
+        assert adapter._pool_maxsize == 4
+        assert adapter.max_retries.total == 0
+
+    def test_keep_alive_disabled_sends_connection_close(self):
+        """Test that disabling keep-alive sets Connection: close"""
+        pool = UpstreamSessionPool(keep_alive=False)
+        session = pool.get_session("https://proxy.example.com")
+        assert session.headers["Connection"] == "close"
+        pool.close_all()
+
+    def test_idle_sessions_are_evicted(self, pool):
+        """Test that sessions idle past idle_timeout are closed and dropped"""
+        session = pool.get_session("https://proxy.example.com")
+        with patch.object(session, 'close') as mock_close:
+            with patch('first_hop_proxy.session_pool.time.monotonic', return_value=time.monotonic() + 120):
+                assert pool.evict_idle() == 1
+            mock_close.assert_called_once()
+        assert pool.get_stats()["sessions"] == 0
+        assert pool.get_stats()["sessions_evicted"] == 1
+
+    def test_recently_used_sessions_are_kept(self, pool):
+        """Test that active sessions survive eviction sweeps"""
+        pool.get_session("https://proxy.example.com")
+        assert pool.evict_idle() == 0
+        assert pool.get_stats()["sessions"] == 1
+
+    def test_sessions_in_use_are_not_evicted(self, pool):
+        """Test that a session stays pooled while a streamed response is open, and idles from its close"""
+        url = "https://proxy.example.com/v1/chat/completions"
+        response = requests.Response()
+        response.raw = Mock()
+        with patch('requests.Session.request', return_value=response):
+            assert pool.request("POST", url, stream=True) is response
+        later = time.monotonic() + 120
+        with patch('first_hop_proxy.session_pool.time.monotonic', return_value=later):
+            assert pool.evict_idle() == 0
+            assert pool.get_stats()["origins"]["https://proxy.example.com"]["in_use"] == 1
+            response.close()
+            assert pool.evict_idle() == 0
+        with patch('first_hop_proxy.session_pool.time.monotonic', return_value=later + 120):
+            assert pool.evict_idle() == 1
+
+    def test_from_config_reads_connection_pool_section(self):
+        """Test building a pool from configuration"""
+        pool = UpstreamSessionPool.from_config({"pool_maxsize": 8, "idle_timeout": 30, "keep_alive": False})
+        assert pool.pool_maxsize == 8
+        assert pool.idle_timeout == 30
+        assert pool.keep_alive is False
+
+    def test_configure_session_pool_replaces_global_pool(self):
+        """Test that configure_session_pool swaps the process-wide pool"""
+        original = get_session_pool()
+        try:
+            configured = configure_session_pool({"pool_maxsize": 2})
+            assert get_session_pool() is configured
+            assert configured.pool_maxsize == 2
+        finally:
+            configure_session_pool({})
+
+    def test_proxy_client_requests_go_through_pool(self, pool):
+        """Test that ProxyClient sends requests via the pooled session, including blank-response retries"""
+        client = ProxyClient("https://proxy.example.com/chat/completions", session_pool=pool)
+
+        blank = Mock()
+        blank.status_code = 200
+        blank.headers = {}
+        blank.content = b"{}"
+        blank.json.return_value = {"object": "chat.completion", "choices": [{"message": {"content": ""}}]}
+
+        ok = Mock()
+        ok.status_code = 200
+        ok.headers = {}
+        ok.content = b"{}"
+        ok.json.return_value = {"object": "chat.completion", "choices": [{"message": {"content": "Hi"}}]}
+
+        with patch('requests.Session.request', side_effect=[blank, ok]) as mock_request:
+            result = client.forward_request({"messages": []}, endpoint="")
+
+        assert result["choices"][0]["message"]["content"] == "Hi"
+        assert mock_request.call_count == 2
+        assert pool.get_stats()["sessions"] == 1
+        assert pool.get_stats()["sessions_created"] == 1
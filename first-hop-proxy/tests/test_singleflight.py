@@ -0,0 +1,190 @@
+"""
+Tests for singleflight coalescing of identical in-flight requests
+"""
+import os
+import sys
+import json
+import asyncio
+import threading
+import pytest
+import requests
+from unittest.mock import patch
+
+# Add src directory to path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from first_hop_proxy.singleflight import Singleflight, configure_singleflight, get_singleflight
+from first_hop_proxy.admission import configure_admission
+from first_hop_proxy.metrics import configure_metrics
+from first_hop_proxy.main import app, config as default_config
+from conftest import st_metadata
+
+
+def _wait_for(condition):
+    """Spin until condition() holds (bounded)"""
+    for _ in range(500):
+        if condition():
+            return
+        threading.Event().wait(0.01)
+    raise AssertionError("condition not reached")
+
+
+class TestSingleflight:
+    """Test cases for Singleflight keys, shared calls and coalesced proxy requests"""
+
+    def test_keys(self):
+        """Test that keys ignore key order and cover the allowlist, streaming, config and API key"""
+        singleflight = Singleflight(["lorebook_entry_lookup", "detect_scene_break*"])
+        body = {"model": "m", "messages": [{"role": "user", "content": "Hi"}], "temperature": 0.7}
+        key = singleflight.key_for("lorebook_entry_lookup", body, {"Authorization": "Bearer a"}, "plan")
+        reordered = {"temperature": 0.7, "messages": [{"content": "Hi", "role": "user"}], "model": "m"}
+        assert singleflight.key_for("lorebook_entry_lookup", reordered, {"authorization": "Bearer a"}, "plan") == key
+        assert singleflight.key_for("detect_scene_break_FORCED", body, {"Authorization": "Bearer a"}, "plan") == key
+
+        assert singleflight.key_for("lorebook_entry_lookup", body, {"Authorization": "Bearer b"}, "plan") != key
+        assert singleflight.key_for("lorebook_entry_lookup", body, {"Authorization": "Bearer a"}, "other") != key
+        assert singleflight.key_for("chat", body, {}, "plan") is None
+        assert singleflight.key_for(None, body, {}, "plan") is None
+        assert singleflight.key_for("lorebook_entry_lookup", dict(body, stream=True), {}, "plan") is None
+
+    def test_waiters_share_one_call(self):
+        """Test that concurrent callers get private copies of one call's result, or its error"""
+        singleflight = Singleflight(["*"])
+        release = threading.Event()
+        calls = []
+
+        def upstream():
+            calls.append(1)
+            release.wait(5)
+            return {"choices": [{"message": {"content": "shared"}}]}
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(singleflight.do("k", "lookup", upstream)))
+                   for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        _wait_for(lambda: singleflight.get_stats()["waiting"] == 2)
+        release.set()
+        for thread in threads:
+            thread.join(timeout=5)
+
+        assert len(calls) == 1 and len(results) == 3
+        assert all(result == results[0] for result in results)
+        assert len({id(result) for result in results}) == 3
+        stats = singleflight.get_stats()
+        assert (stats["in_flight"], stats["leaders"], stats["coalesced"]) == (0, 1, {"lookup": 2})
+
+        def broken():
+            release.wait(5)
+            raise requests.exceptions.ConnectionError("refused")
+
+        release.clear()
+        errors = []
+
+        def call():
+            try:
+                singleflight.do("k", "lookup", broken)
+            except requests.exceptions.ConnectionError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        _wait_for(lambda: singleflight.get_stats()["waiting"] == 1)
+        release.set()
+        for thread in threads:
+            thread.join(timeout=5)
+        assert len(errors) == 2 and errors[0] is errors[1]
+
+    def test_async_waiters_take_over_after_cancellation(self):
+        """Test that asyncio waiters share a call, start over when its owner is cancelled and are counted once"""
+        singleflight = Singleflight(["*"])
+        calls = []
+
+        async def upstream():
+            calls.append(1)
+            await asyncio.sleep(0.05 if len(calls) > 1 else 5)
+            return {"n": len(calls)}
+
+        async def scenario():
+            owner = asyncio.ensure_future(singleflight.do_async("k", "lookup", upstream))
+            await asyncio.sleep(0)
+            waiters = [asyncio.ensure_future(singleflight.do_async("k", "lookup", upstream)) for _ in range(2)]
+            await asyncio.sleep(0.01)
+            owner.cancel()
+            return await asyncio.gather(*waiters)
+
+        assert asyncio.run(scenario()) == [{"n": 2}, {"n": 2}]
+        assert len(calls) == 2
+        stats = singleflight.get_stats()
+        assert (stats["in_flight"], stats["waiting"], stats["coalesced"]) == (0, 0, {"lookup": 1})
+
+    def test_cancelled_async_waiter_stops_waiting(self):
+        """Test that a cancelled waiter is neither counted as waiting nor as coalesced"""
+        singleflight = Singleflight(["*"])
+
+        async def scenario():
+            done = asyncio.Event()
+
+            async def upstream():
+                await done.wait()
+                return {"n": 1}
+
+            owner = asyncio.ensure_future(singleflight.do_async("k", "lookup", upstream))
+            await asyncio.sleep(0)
+            waiter = asyncio.ensure_future(singleflight.do_async("k", "lookup", upstream))
+            await asyncio.sleep(0)
+            assert singleflight.get_stats()["waiting"] == 1
+            waiter.cancel()
+            await asyncio.sleep(0)
+            waiting = singleflight.get_stats()["waiting"]
+            done.set()
+            return waiting, await owner
+
+        assert asyncio.run(scenario()) == (0, {"n": 1})
+        assert singleflight.get_stats()["coalesced"] == {}
+
+    def test_endpoint_coalesces_duplicate_lookups(self):
+        """Test that a duplicate lorebook lookup waits for the first one's upstream call without an admission slot"""
+        release = threading.Event()
+
+        def upstream(*args, **kwargs):
+            release.wait(5)
+            response = requests.Response()
+            response.status_code = 200
+            response.headers["Content-Type"] = "application/json"
+            response._content = json.dumps(
+                {"choices": [{"message": {"content": "Senta is a knight of the northern marches."}}]}).encode()
+            return response
+
+        body = {"model": "m", "messages": [{"role": "user", "content": st_metadata("lorebook_entry_lookup") + "Senta"}]}
+        responses = []
+        configure_metrics({})
+        configure_singleflight({"enabled": True, "operations": ["lorebook_entry_lookup"]})
+        # With one slot and no queue, the duplicate would be rejected if it needed a slot of its own
+        configure_admission({"enabled": True, "max_in_flight": 1, "max_queue": 0})
+        try:
+            with patch.dict(default_config._config, {"target_proxy": {"url": "https://proxy.example.com/v1/chat/completions"}}), \
+                    patch("requests.Session.request", side_effect=upstream) as session_request:
+                threads = [threading.Thread(target=lambda: responses.append(
+                    app.test_client().post("/chat/completions", json=body))) for _ in range(2)]
+                for thread in threads:
+                    thread.start()
+                _wait_for(lambda: get_singleflight().get_stats()["waiting"] == 1)
+                release.set()
+                for thread in threads:
+                    thread.join(timeout=5)
+
+            assert session_request.call_count == 1
+            assert [response.status_code for response in responses] == [200, 200]
+            assert responses[0].get_json() == responses[1].get_json()
+            stats = app.test_client().get("/health/detailed").get_json()["singleflight"]
+            assert stats["coalesced"] == {"lorebook_entry_lookup": 1}
+            text = app.test_client().get("/metrics").get_data(as_text=True)
+            assert 'proxy_coalesced_requests_total{operation="lorebook_entry_lookup"} 1' in text
+        finally:
+            release.set()
+            configure_singleflight(None)
+            configure_admission(None)
+            configure_metrics({})
+        assert get_singleflight() is None
@@ -0,0 +1,180 @@
+import pytest
+import json
+import requests
+from unittest.mock import Mock, patch
+import sys
+import os
+
+# Add src directory to path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from first_hop_proxy.streaming import StreamAssembler, SSEStreamRelay
+from first_hop_proxy.proxy_client import ProxyClient
+from first_hop_proxy.session_pool import UpstreamSessionPool
+
+
+def _sse(event):
+    """Encode one SSE data event"""
+    return f"data: {json.dumps(event)}\n\n".encode("utf-8")
+
+
+SSE_CHUNKS = [
+    _sse({"id": "chatcmpl-1", "model": "m", "choices": [{"index": 0, "delta": {"role": "assistant"}}]}),
+    _sse({"id": "chatcmpl-1", "choices": [{"index": 0, "delta": {"content": "Hel"}}]})[:20],
+    _sse({"id": "chatcmpl-1", "choices": [{"index": 0, "delta": {"content": "Hel"}}]})[20:],
+    _sse({"id": "chatcmpl-1", "choices": [{"index": 0, "delta": {"content": "lo"}, "finish_reason": "stop"}],
+          "usage": {"prompt_tokens": 3, "completion_tokens": 2, "total_tokens": 5}}),
+    b"data: [DONE]\n\n",
+]
+
+
+def _streaming_response(chunks=SSE_CHUNKS):
+    """Build a mock upstream response that has not been read yet"""
+    response = Mock(spec=requests.Response)
+    response.status_code = 200
+    response.headers = {"Content-Type": "text/event-stream"}
+    response.iter_content.return_value = iter(chunks)
+    type(response).content = property(lambda self: pytest.fail("stream body must not be buffered"))
+    return response
+
+
+class TestStreamAssembler:
+    """Test suite for rebuilding a completion from SSE chunks"""
+
+    def test_assembles_content_across_split_chunks(self):
+        """Test that deltas split mid-line are reassembled in order"""
+        assembler = StreamAssembler()
+        for chunk in SSE_CHUNKS:
+            assembler.feed(chunk)
+
+        response = assembler.build_response()
+        assert assembler.done is True
+        assert response["id"] == "chatcmpl-1"
+        assert response["model"] == "m"
+        assert response["choices"][0]["message"] == {"role": "assistant", "content": "Hello"}
+        assert response["choices"][0]["finish_reason"] == "stop"
+        assert response["usage"]["total_tokens"] == 5
+
+    def test_keeps_multibyte_characters_split_across_chunks(self):
+        """Test that a UTF-8 character split between chunks is decoded once both halves arrive"""
+        text = "héllo — 世界"
+        data = f"data: {json.dumps({'choices': [{'index': 0, 'delta': {'content': text}}]}, ensure_ascii=False)}\n\n"
+        encoded = data.encode("utf-8")
+        split = encoded.index("世".encode("utf-8")) + 1
+
+        assembler = StreamAssembler()
+        assembler.feed(encoded[:split])
+        assembler.feed(encoded[split:])
+        assert assembler.build_response()["choices"][0]["message"]["content"] == text
+
+    def test_ignores_comments_and_non_json_payloads(self):
+        """Test that keep-alive comments and junk payloads are skipped"""
+        assembler = StreamAssembler()
+        assembler.feed(b": keep-alive\n\ndata: not-json\n\n")
+        assert assembler.event_count == 0
+        assert assembler.build_response()["choices"] == []
+
+    def test_records_error_events(self):
+        """Test that in-stream error objects are kept for the log"""
+        assembler = StreamAssembler()
+        assembler.feed(_sse({"error": {"message": "overloaded"}}))
+        assert assembler.build_response()["error"] == {"message": "overloaded"}
+
+
+class TestSSEStreamRelay:
+    """Test suite for relaying upstream SSE bytes"""
+
+    def test_relays_chunks_unchanged_and_reports_completion(self):
+        """Test that bytes pass through untouched and completion fires once"""
+        upstream = _streaming_response()
+        on_complete = Mock()
+        relay = SSEStreamRelay(upstream, "req1", on_complete=on_complete)
+
+        assert b"".join(relay) == b"".join(SSE_CHUNKS)
+        relay.close()
+
+        on_complete.assert_called_once()
+        assembled, error, stats = on_complete.call_args[0]
+        assert error is None
+        assert assembled["choices"][0]["message"]["content"] == "Hello"
+        assert stats["bytes"] == len(b"".join(SSE_CHUNKS))
+        assert stats["time_to_first_chunk"] is not None
+        upstream.close.assert_called_once()
+
+    def test_client_disconnect_reports_error(self):
+        """Test that closing mid-stream completes the log with an error"""
+        on_complete = Mock()
+        relay = SSEStreamRelay(_streaming_response(), "req1", on_complete=on_complete)
+
+        stream = iter(relay)
+        next(stream)
+        stream.close()
+
+        assembled, error, stats = on_complete.call_args[0]
+        assert isinstance(error, ConnectionAbortedError)
+        assert stats["done"] is False
+
+
+class TestProxyClientStreaming:
+    """Test suite for streaming behaviour in ProxyClient"""
+
+    def test_streaming_request_returns_unread_response(self):
+        """Test that stream requests are sent with stream=True and the body is not buffered"""
+        client = ProxyClient("https://proxy.example.com/chat/completions", session_pool=UpstreamSessionPool())
+        upstream = _streaming_response()
+
+        with patch('requests.Session.request', return_value=upstream) as mock_request:
+            result = client.forward_request({"messages": [], "stream": True}, endpoint="")
+
+        assert result is upstream
+        assert mock_request.call_args[1]["stream"] is True
+
+    def test_streaming_error_status_uses_buffered_handling(self):
+        """Test that a non-200 streamed reply is handled like a regular error"""
+        client = ProxyClient("https://proxy.example.com/chat/completions", session_pool=UpstreamSessionPool())
+        upstream = Mock()
+        upstream.status_code = 400
+        upstream.headers = {"Content-Type": "application/json"}
+        upstream.content = b'{"error": {"message": "bad"}}'
+        upstream.text = '{"error": {"message": "bad"}}'
+        upstream.json.return_value = {"error": {"message": "bad"}}
+
+        with patch('requests.Session.request', return_value=upstream):
+            result = client.forward_request({"messages": [], "stream": True}, endpoint="")
+
+        assert result["_proxy_error"] is True
+        assert result["_status_code"] == 400
+
+
+class TestChatCompletionsStreaming:
+    """Test suite for the streaming /chat/completions passthrough"""
+
+    @pytest.fixture
+    def client(self, tmp_path, monkeypatch):
+        """Create a test client logging into a temporary folder"""
+        monkeypatch.chdir(tmp_path)
+        from first_hop_proxy.main import app
+        app.config['TESTING'] = True
+        return app.test_client()
+
+    def test_stream_is_relayed_and_logged(self, client, tmp_path):
+        """Test that SSE chunks reach the client and the log holds the assembled response"""
+        with patch('first_hop_proxy.config.Config.get_target_proxy_config') as mock_config:
+            mock_config.return_value = {"url": "https://proxy.example.com/chat/completions"}
+            with patch('requests.Session.request', return_value=_streaming_response()):
+                response = client.post('/chat/completions', json={
+                    "model": "m",
+                    "messages": [{"role": "user", "content": "Hi"}],
+                    "stream": True
+                })
+                body = response.get_data()
+
+        assert response.status_code == 200
+        assert response.headers["Content-Type"].startswith("text/event-stream")
+        assert body == b"".join(SSE_CHUNKS)
+
+        logs = list((tmp_path / "logs" / "unsorted").glob("*.md"))
+        assert len(logs) == 1
+        content = logs[0].read_text(encoding="utf-8")
+        assert "**Status:** ✅ Success" in content
+        assert '"content": "Hello"' in content
@@ -0,0 +1,150 @@
+"""
+Tests for stage-level request tracing
+"""
+import os
+import json
+import pytest
+import tempfile
+import shutil
+import sys
+import requests
+from unittest.mock import patch
+from requests.exceptions import HTTPError
+
+# Add src directory to path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from first_hop_proxy.tracing import Tracer, NOOP_SPAN, configure_tracer, get_tracer
+from first_hop_proxy.error_handler import ErrorHandler
+from first_hop_proxy.request_logger import RequestLogger
+from first_hop_proxy.main import app, config as default_config
+
+
+def _read_traces(path):
+    """Return the JSON objects appended to a trace file"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class TestTracing:
+    """Test cases for Tracer and request instrumentation"""
+
+    @pytest.fixture
+    def temp_dir(self):
+        """Create a temporary directory for trace files"""
+        temp_dir = tempfile.mkdtemp()
+        yield temp_dir
+        if os.path.exists(temp_dir):
+            shutil.rmtree(temp_dir)
+
+    @pytest.fixture
+    def trace_path(self, temp_dir):
+        """Enable the process-wide tracer for one test"""
+        path = os.path.join(temp_dir, "traces.jsonl")
+        configure_tracer({"enabled": True, "path": path})
+        yield path
+        configure_tracer(None)
+
+    def test_nested_spans_share_a_trace(self, trace_path):
+        """Test that child spans record their parent and the trace is written when the root ends"""
+        tracer = get_tracer()
+        with tracer.span("chat_completions", config_path="default"):
+            with tracer.span("preprocess"):
+                pass
+            with pytest.raises(ValueError):
+                with tracer.span("upstream_request") as span:
+                    span.set_attribute("status", 502)
+                    raise ValueError("bad gateway")
+            summary = tracer.summary()
+            assert not os.path.exists(trace_path)
+
+        assert set(summary) == {"preprocess", "upstream_request"}
+        assert summary["preprocess"]["count"] == 1
+        (trace,) = _read_traces(trace_path)
+        assert trace["name"] == "chat_completions" and trace["attributes"] == {"config_path": "default"}
+        spans = {span["name"]: span for span in trace["spans"]}
+        root_id = spans["chat_completions"]["span_id"]
+        assert spans["chat_completions"]["parent_id"] is None
+        assert spans["preprocess"]["parent_id"] == root_id
+        assert spans["upstream_request"]["attributes"] == {"status": 502}
+        assert spans["upstream_request"]["error"] == "ValueError: bad gateway"
+        assert tracer.summary() is None
+        assert tracer.get_stats()["exported"] == 1
+
+    def test_retry_attempts_and_backoff(self, trace_path):
+        """Test that ErrorHandler records each attempt and backoff as child spans"""
+        response = requests.Response()
+        response.status_code = 503
+        outcomes = [HTTPError("503 Error", response=response), "ok"]
+
+        def flaky():
+            outcome = outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        with get_tracer().span("chat_completions"):
+            assert ErrorHandler(max_retries=2, base_delay=0).retry_with_backoff(flaky) == "ok"
+
+        (trace,) = _read_traces(trace_path)
+        names = [(span["name"], span["attributes"].get("attempt")) for span in trace["spans"]]
+        assert names == [("chat_completions", None), ("attempt", 1), ("backoff", 1), ("attempt", 2)]
+        assert trace["spans"][1]["error"].startswith("HTTPError")
+
+    def test_otlp_format(self, temp_dir):
+        """Test that OTLP output is an ExportTraceServiceRequest with linked spans"""
+        tracer = Tracer(enabled=True, path=os.path.join(temp_dir, "otlp.jsonl"), format="otlp")
+        with tracer.span("chat_completions", retries=2):
+            with tracer.span("attempt", attempt=1):
+                pass
+
+        (request,) = _read_traces(tracer.path)
+        (resource_spans,) = request["resourceSpans"]
+        assert resource_spans["resource"]["attributes"] == [
+            {"key": "service.name", "value": {"stringValue": "first-hop-proxy"}}]
+        child, root = resource_spans["scopeSpans"][0]["spans"]
+        assert child["traceId"] == root["traceId"] and len(root["traceId"]) == 32
+        assert child["parentSpanId"] == root["spanId"] and root["parentSpanId"] == ""
+        assert root["attributes"] == [{"key": "retries", "value": {"intValue": "2"}}]
+        assert int(root["endTimeUnixNano"]) >= int(root["startTimeUnixNano"])
+        with pytest.raises(ValueError):
+            Tracer(format="zipkin")
+
+    def test_disabled_and_unsampled(self, temp_dir):
+        """Test that disabled tracing and unsampled requests record nothing"""
+        path = os.path.join(temp_dir, "traces.jsonl")
+        assert Tracer(enabled=False, path=path).span("chat_completions") is NOOP_SPAN
+
+        tracer = Tracer(enabled=True, path=path, sample_rate=0.0)
+        with tracer.span("chat_completions"):
+            assert tracer.span("preprocess") is NOOP_SPAN
+            assert tracer.summary() is None
+        assert not os.path.exists(path)
+
+    def test_request_is_traced_and_logged(self, temp_dir, trace_path):
+        """Test that a proxied request writes a trace and the request log shows stage timing"""
+        upstream = requests.Response()
+        upstream.status_code = 200
+        upstream.headers["Content-Type"] = "application/json"
+        upstream._content = json.dumps({"choices": [{"message": {"content": "Hello there, how are you today?"}}]}).encode()
+        request_logger = RequestLogger({"logging": {"enabled": True, "folder": os.path.join(temp_dir, "logs")}})
+
+        with patch.dict(default_config._config, {"target_proxy": {"url": "https://proxy.example.com/v1/chat/completions"}}), \
+                patch("first_hop_proxy.main.get_loggers_for_config", return_value=(request_logger, None)), \
+                patch("requests.Session.request", return_value=upstream):
+            response = app.test_client().post("/chat/completions",
+                                              json={"model": "m", "messages": [{"role": "user", "content": "Hi"}]})
+        assert response.status_code == 200
+
+        (trace,) = _read_traces(trace_path)
+        names = {span["name"] for span in trace["spans"]}
+        assert {"chat_completions", "parse_json", "preprocess", "log_start", "attempt", "upstream_request",
+                "handle_response", "decode_response", "log_complete"} <= names
+
+        log_files = [os.path.join(root, name) for root, _dirs, files in os.walk(os.path.join(temp_dir, "logs"))
+                     for name in files if name.endswith(".md")]
+        (log_file,) = log_files
+        with open(log_file, 'r', encoding='utf-8') as f:
+            content = f.read()
+        assert "## Stage Timing" in content
+        assert "upstream_request" in content
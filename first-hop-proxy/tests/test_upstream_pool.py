@@ -0,0 +1,204 @@
+"""
+Tests for the multi-upstream pool: balancing, passive health and failover
+"""
+import os
+import sys
+import json
+import time
+import pytest
+import requests
+from unittest.mock import patch
+from requests.exceptions import ConnectionError, HTTPError
+
+# Add src directory to path for imports
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from first_hop_proxy.circuit_breaker import CircuitOpenError
+from first_hop_proxy.config import Config
+from first_hop_proxy.error_handler import ErrorHandler
+from first_hop_proxy.upstream_pool import Upstream, UpstreamPool, UpstreamSelection
+from first_hop_proxy.execution_plan import get_plan_cache
+from first_hop_proxy.main import app, config as default_config
+
+pytestmark = pytest.mark.clock("first_hop_proxy.upstream_pool")
+
+
+def _pool(strategy="least_outstanding", **settings):
+    """Pool of upstreams a (weight 3), b (weight 1) and fallback c (priority 1)"""
+    return UpstreamPool([Upstream("https://a.example", weight=3), Upstream("https://b.example"),
+                         Upstream("https://c.example", priority=1)], strategy=strategy, **settings)
+
+
+def _names(upstreams):
+    return [upstream.url[8] for upstream in upstreams]
+
+
+class TestUpstreamPool:
+    """Test cases for UpstreamPool, UpstreamSelection and failover in the proxy"""
+
+    def test_strategies(self):
+        """Test weighted round robin, least outstanding and EWMA latency picks"""
+        pool = _pool("weighted_round_robin")
+        picks = []
+        for _ in range(8):
+            upstream = pool.acquire(set())
+            pool.release(upstream, False)
+            picks.append(upstream)
+        assert "".join(_names(picks)) == "aabaaaba"
+
+        pool = _pool("least_outstanding")
+        held = [pool.acquire(set()) for _ in range(4)]
+        # Weight 3 takes three in-flight attempts for each one of b
+        assert sorted(_names(held)) == ["a", "a", "a", "b"]
+
+        pool = _pool("ewma_latency")
+        a, b = pool.upstreams[:2]
+        pool.release(pool.acquire(set()), False, 2.0)
+        pool.release(pool.acquire(set()), False, 0.5)
+        assert (a.latency, b.latency) == (2.0, 0.5)
+        # b's 0.5 beats a's 2.0 / 3 until b has an attempt in flight (0.5 x 2)
+        assert pool.acquire(set()) is b
+        assert pool.acquire(set()) is a
+
+    def test_ejection_and_priority_tiers(self, clock):
+        """Test that failing upstreams are ejected, the fallback tier takes over and ejection ends"""
+        pool = _pool(ejection_time=30)
+        a, b, c = pool.upstreams
+        for upstream in (a, a, b, b):
+            pool.release(upstream, True)
+        assert pool.get_stats()["upstreams"]["https://a.example"]["healthy"] is False
+        assert pool.acquire(set()) is c
+
+        clock.now += 31
+        assert pool.acquire(set()) in (a, b)
+        stats = pool.get_stats()["upstreams"]["https://b.example"]
+        assert (stats["healthy"], stats["failures"], stats["ejections"]) == (True, 2, 1)
+
+    def test_selection_failover(self):
+        """Test that retryable failures and open circuits move a request to the next upstream"""
+        handler = ErrorHandler()
+        pool = _pool()
+        selection = UpstreamSelection(pool, handler.should_retry_exception)
+        sent = []
+
+        def send(upstream):
+            sent.append(upstream)
+            if upstream.url == "https://a.example":
+                raise ConnectionError("refused")
+            if upstream.url == "https://b.example":
+                raise CircuitOpenError(upstream.url, 10)
+            return "ok"
+
+        with pytest.raises(ConnectionError):
+            selection.call(send)
+        assert selection.failover_available()
+        # b's breaker is open, so the same attempt moves on to the fallback tier
+        assert selection.call(send) == "ok"
+        assert _names(sent) == ["a", "b", "c"]
+
+        # A client error says nothing about the upstream
+        rejected = HTTPError("400", response=requests.Response())
+        rejected.response.status_code = 400
+        selection = UpstreamSelection(pool, handler.should_retry_exception)
+        with pytest.raises(HTTPError):
+            selection.call(lambda upstream: (_ for _ in ()).throw(rejected))
+        assert not selection.failed
+        assert sum(upstream.in_flight for upstream in pool.upstreams) == 0
+
+    def test_selection_hands_out_snapshots(self):
+        """Test that the pool only sees copies of the failed set, which hedged attempts update from other threads"""
+        pool = _pool()
+        selection = UpstreamSelection(pool, lambda error: True)
+        with patch.object(pool, "acquire", wraps=pool.acquire) as acquire, \
+                patch.object(pool, "has_healthy", wraps=pool.has_healthy) as has_healthy:
+            with pytest.raises(ConnectionError):
+                selection.call(lambda upstream: (_ for _ in ()).throw(ConnectionError("refused")))
+            assert selection.failover_available()
+        assert len(selection.failed) == 1
+        for call in acquire.call_args_list + has_healthy.call_args_list:
+            assert call.args[0] is not selection.failed
+
+    def test_failover_is_keyword_only(self):
+        """Test that extra positional arguments reach the retried function instead of the failover check"""
+        handler = ErrorHandler()
+        assert handler.retry_with_backoff(lambda value: value, None, None, "ok") == "ok"
+
+        replies = [ConnectionError("refused"), "ok"]
+        delays = []
+
+        def flaky():
+            reply = replies.pop(0)
+            if isinstance(reply, Exception):
+                raise reply
+            return reply
+
+        assert handler.retry_with_backoff(flaky, on_retry=lambda attempt, e, delay: delays.append(delay),
+                                          failover=lambda: True) == "ok"
+        assert delays == [0]
+
+    def test_retry_fails_over_without_backoff(self):
+        """Test that a 502 from one upstream is retried at once on the next, with its own API key"""
+        def upstream(*args, **kwargs):
+            response = requests.Response()
+            response.headers["Content-Type"] = "application/json"
+            if kwargs["url"].startswith("https://a.example"):
+                response.status_code = 502
+                response._content = b'{"error": {"message": "bad gateway"}}'
+            else:
+                response.status_code = 200
+                response._content = json.dumps(
+                    {"choices": [{"message": {"content": "Hello there, how are you today?"}}]}).encode()
+            return response
+
+        pool_config = {"enabled": True, "upstreams": [
+            {"url": "https://a.example/v1/chat/completions", "apikey": "key-a", "weight": 5},
+            {"url": "https://b.example/v1/chat/completions", "apikey": "key-b"},
+        ]}
+        time.sleep.reset_mock()
+        # The pool is part of the config's execution plan
+        get_plan_cache().invalidate()
+        try:
+            with patch.dict(default_config._config, {"target_proxy": {"url": "https://proxy.example.com/v1/chat/completions"},
+                                                     "upstream_pool": pool_config}), \
+                    patch("requests.Session.request", side_effect=upstream) as session_request:
+                client = app.test_client()
+                response = client.post("/chat/completions", json={"model": "m", "messages": [{"role": "user", "content": "Hi"}]})
+                stats = client.get("/health/detailed").get_json()["upstream_pool"]
+        finally:
+            get_plan_cache().invalidate()
+
+        assert response.status_code == 200
+        calls = [(call.kwargs["url"], call.kwargs["headers"]["Authorization"]) for call in session_request.call_args_list]
+        assert calls == [("https://a.example/v1/chat/completions", "Bearer key-a"),
+                         ("https://b.example/v1/chat/completions", "Bearer key-b")]
+        assert [call.args[0] for call in time.sleep.call_args_list] == [0.0]
+        assert stats["upstreams"]["https://a.example/v1/chat/completions"]["failures"] == 1
+
+    def test_pool_replaces_target_url(self):
+        """Test that a pool makes target_proxy.url optional and /models is fetched from a pool upstream"""
+        pool_config = {"enabled": True, "upstreams": [{"url": "https://a.example/v1/chat/completions", "apikey": "key-a"}]}
+        pooled = Config()
+        pooled._config["upstream_pool"] = pool_config
+        assert pooled.validate() is True
+        pooled._config["upstream_pool"] = {"enabled": False}
+        with pytest.raises(ValueError, match="target_proxy.url is required"):
+            pooled.validate()
+
+        def upstream(*args, **kwargs):
+            response = requests.Response()
+            response.status_code = 200
+            response.headers["Content-Type"] = "application/json"
+            response._content = json.dumps({"object": "list", "data": [{"id": "pooled-model"}]}).encode()
+            return response
+
+        get_plan_cache().invalidate()
+        try:
+            with patch.dict(default_config._config, {"target_proxy": {}, "upstream_pool": pool_config}), \
+                    patch("requests.Session.request", side_effect=upstream) as session_request:
+                response = app.test_client().get("/models")
+        finally:
+            get_plan_cache().invalidate()
+
+        assert response.get_json()["data"] == [{"id": "pooled-model"}]
+        calls = [(call.kwargs["url"], call.kwargs["headers"]["Authorization"]) for call in session_request.call_args_list]
+        assert calls == [("https://a.example/v1/models", "Bearer key-a")]